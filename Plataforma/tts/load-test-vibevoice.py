@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Generador de carga para VibeVoice TTS
+=====================================
+
+Lanza muchas sesiones /stream concurrentes (flujo de test-tts-simple.py) y
+reporta latencias y calidad de streaming:
+- Closed-loop: N clientes, cada uno envía la siguiente petición al terminar
+- Open-loop: peticiones a una tasa fija (req/s) sin esperar respuestas
+
+Por cada petición: tiempo al primer chunk (cliente y evento
+`backend_first_chunk_sent`), real-time factor, jitter entre chunks y errores.
+Reporta p50/p95/p99 en una tabla de consola y en JSON. Con --codecs rota los
+codecs de audio por petición y reporta los bytes por segundo de cada uno.
+Con --frame-ms el servidor agrupa el audio en frames de esa duración; el
+reporte incluye frames/s, bytes por frame y el CPU del cliente (y del
+servidor, si expone /frames/stats) por segundo de audio, para comparar
+políticas de framing.
+
+Corpus:
+    - .txt: una frase por línea
+    - .jsonl: {"text": ..., "voice": ..., "cfg": ..., "steps": ...} por línea
+      (los campos que falten se toman de --voices/--cfg/--steps por rotación)
+
+Uso:
+    python load-test-vibevoice.py --corpus frases.txt --mode closed --concurrency 8 --requests 64
+    python load-test-vibevoice.py --corpus frases.jsonl --mode open --rate 2 --duration 60 \\
+        --voices sp-Spk1_man,Carter --steps 2,5 --json resultados.json
+    python load-test-vibevoice.py --codecs pcm16,mulaw,adpcm,opus --requests 64
+    python load-test-vibevoice.py --frame-ms 80 --collect --requests 64
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from vibevoice_client import (  # noqa: E402
+    PCM16_BYTES_PER_SECOND,
+    AudioBuffer,
+    distribution,
+    http_url,
+    stream_tts,
+)
+
+DEFAULT_CORPUS = [
+    "Hola, este es un test del sistema de síntesis de voz. ¿Funciona correctamente?",
+    "Un momento, por favor.",
+    "Hello! This is a test of the VibeVoice text-to-speech system.",
+    "La respuesta está lista. ¿Quieres que la lea en voz alta?",
+]
+
+
+def load_corpus(path):
+    if path is None:
+        return [{"text": text} for text in DEFAULT_CORPUS]
+
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                if item.get("text"):
+                    items.append(item)
+            else:
+                items.append({"text": line})
+    if not items:
+        raise SystemExit(f"Corpus vacío: {path}")
+    return items
+
+
+def request_plan(corpus, voices, cfgs, steps, shuffle, codecs=(None,)):
+    """Generador infinito de peticiones con voz/cfg/steps/codec propios"""
+    order = list(corpus)
+    if shuffle:
+        random.shuffle(order)
+    voice_cycle = itertools.cycle(voices)
+    cfg_cycle = itertools.cycle(cfgs)
+    steps_cycle = itertools.cycle(steps)
+    codec_cycle = itertools.cycle(codecs)
+    for index, item in enumerate(itertools.cycle(order)):
+        yield {
+            "request_id": index,
+            "text": item["text"],
+            "voice": item.get("voice") or next(voice_cycle),
+            "cfg": item.get("cfg") if item.get("cfg") is not None else next(cfg_cycle),
+            "steps": item.get("steps") if item.get("steps") is not None else next(steps_cycle),
+            "codec": next(codec_cycle),
+        }
+
+
+class LoadRunner:
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.client_cpu = 0.0
+
+    async def one(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        buffer = AudioBuffer() if self.args.collect else None
+        try:
+            metrics = await stream_tts(self.args.url, request["text"], request["voice"], request["cfg"],
+                                       request["steps"], timeout=self.args.timeout,
+                                       request_id=request["request_id"],
+                                       extra_params={"steps_min": self.args.steps_min},
+                                       codec=request["codec"], frame_ms=self.args.frame_ms,
+                                       on_chunk=buffer.write if buffer is not None else None)
+        finally:
+            self.in_flight -= 1
+        self.results.append(metrics)
+        if self.args.verbose:
+            status = "OK" if metrics.ok else f"ERROR {metrics.error}"
+            print(f"  #{request['request_id']:<5d} {status:20s} ttfc={_ms(metrics.first_chunk_at)} "
+                  f"rtf={metrics.rtf or 0:.2f}")
+
+    def _should_continue(self, started, issued):
+        if self.args.requests and issued >= self.args.requests:
+            return False
+        if self.args.duration and time.perf_counter() - started >= self.args.duration:
+            return False
+        return True
+
+    async def closed_loop(self, plan):
+        started = time.perf_counter()
+        issued = 0
+        lock = asyncio.Lock()
+
+        async def client():
+            nonlocal issued
+            while True:
+                async with lock:
+                    if not self._should_continue(started, issued):
+                        return
+                    issued += 1
+                    request = next(plan)
+                await self.one(request)
+
+        await asyncio.gather(*(client() for _ in range(self.args.concurrency)))
+
+    async def open_loop(self, plan):
+        started = time.perf_counter()
+        interval = 1.0 / self.args.rate
+        issued = 0
+        tasks = []
+        next_at = started
+        while self._should_continue(started, issued):
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(self.one(next(plan))))
+            issued += 1
+            # Tasa fija o llegadas de Poisson con la misma media
+            next_at += random.expovariate(self.args.rate) if self.args.poisson else interval
+        await asyncio.gather(*tasks)
+
+    async def run(self, plan):
+        started = time.perf_counter()
+        cpu = time.process_time()
+        if self.args.mode == "open":
+            await self.open_loop(plan)
+        else:
+            await self.closed_loop(plan)
+        self.client_cpu = time.process_time() - cpu
+        return time.perf_counter() - started
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.0f}ms" if seconds is not None else "-"
+
+
+def codec_report(results, wall):
+    """Bytes en la red por codec negociado"""
+    by_codec = {}
+    for r in results:
+        if r.ok:
+            by_codec.setdefault(r.codec or "pcm16", []).append(r)
+    report = {}
+    for codec, sessions in sorted(by_codec.items()):
+        wire = sum(r.wire_bytes for r in sessions)
+        audio = sum(r.audio_seconds for r in sessions)
+        report[codec] = {
+            "sessions": len(sessions),
+            "wire_bytes": wire,
+            "wire_bytes_per_audio_s": wire / audio if audio else None,
+            "wire_bytes_per_s": wire / wall if wall > 0 else 0.0,
+            "ratio_vs_pcm16": wire / (audio * PCM16_BYTES_PER_SECOND) if audio else None,
+        }
+    return report
+
+
+def fetch_frame_stats(url):
+    """GET /frames/stats del servidor, o None si no está disponible"""
+    try:
+        with urllib.request.urlopen(f"{http_url(url)}/frames/stats", timeout=5) as response:
+            return json.loads(response.read().decode("utf-8"))
+    except Exception:
+        return None
+
+
+def frame_report(results, wall, client_cpu, server_before=None, server_after=None):
+    """Frames WebSocket recibidos y CPU por segundo de audio"""
+    ok = [r for r in results if r.ok]
+    frames = sum(r.wire_frames for r in ok)
+    wire = sum(r.wire_bytes for r in ok)
+    audio = sum(r.audio_seconds for r in ok)
+    report = {
+        "frames": frames,
+        "frames_per_s": frames / wall if wall > 0 else 0.0,
+        "frames_per_audio_s": frames / audio if audio else None,
+        "avg_frame_bytes": wire / frames if frames else None,
+        "client_cpu_s": client_cpu,
+        "client_cpu_ms_per_audio_s": client_cpu * 1000 / audio if audio else None,
+        "server_cpu_ms_per_audio_s": None,
+    }
+    if server_before and server_after and audio:
+        server_cpu = server_after["process_cpu_s"] - server_before["process_cpu_s"]
+        report["server_cpu_ms_per_audio_s"] = server_cpu * 1000 / audio
+    return report
+
+
+def build_report(args, results, wall, max_in_flight, frames=None):
+    ok = [r for r in results if r.ok]
+    errors = {}
+    for r in results:
+        if not r.ok:
+            errors[r.error] = errors.get(r.error, 0) + 1
+
+    audio_seconds = sum(r.audio_seconds for r in ok)
+    return {
+        "config": {
+            "url": args.url,
+            "mode": args.mode,
+            "concurrency": args.concurrency if args.mode == "closed" else None,
+            "rate": args.rate if args.mode == "open" else None,
+            "poisson": args.poisson if args.mode == "open" else None,
+            "frame_ms": args.frame_ms,
+        },
+        "requests": len(results),
+        "succeeded": len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "errors": errors,
+        "wall_seconds": wall,
+        "max_in_flight": max_in_flight,
+        "throughput_rps": len(ok) / wall if wall > 0 else 0.0,
+        "qos_degraded": sum(1 for r in ok if r.degraded),
+        "audio_seconds_per_second": audio_seconds / wall if wall > 0 else 0.0,
+        "codecs": codec_report(results, wall),
+        "frames": frames,
+        "metrics": {
+            "ttfc_s": distribution(r.first_chunk_at for r in ok),
+            "server_first_chunk_s": distribution(r.server_first_chunk_at for r in ok),
+            "rtf": distribution(r.rtf for r in ok),
+            "jitter_s": distribution(r.jitter for r in ok),
+            "max_gap_s": distribution(r.max_gap for r in ok),
+            "elapsed_s": distribution(r.elapsed for r in ok),
+        },
+        "sessions": [r.as_dict() for r in results] if args.sessions else None,
+    }
+
+
+def print_report(report):
+    print()
+    print("=" * 78)
+    print("RESULTADOS")
+    print("=" * 78)
+    print(f"Peticiones: {report['requests']}  OK: {report['succeeded']}  "
+          f"Error rate: {report['error_rate'] * 100:.1f}%  Máx. en vuelo: {report['max_in_flight']}")
+    print(f"Duración: {report['wall_seconds']:.1f}s  Throughput: {report['throughput_rps']:.2f} req/s  "
+          f"Audio: {report['audio_seconds_per_second']:.2f} s/s")
+    if report["qos_degraded"]:
+        print(f"Sesiones degradadas por QoS: {report['qos_degraded']}")
+    for error, count in report["errors"].items():
+        print(f"  [ERROR] {error}: {count}")
+    print()
+
+    rows = (
+        ("Primer chunk (cliente)", "ttfc_s", 1000, "ms"),
+        ("Primer chunk (servidor)", "server_first_chunk_s", 1000, "ms"),
+        ("Real-time factor", "rtf", 1, "x"),
+        ("Jitter entre chunks", "jitter_s", 1000, "ms"),
+        ("Gap máximo", "max_gap_s", 1000, "ms"),
+        ("Duración de sesión", "elapsed_s", 1000, "ms"),
+    )
+    print(f"{'Métrica':26s} {'p50':>10s} {'p95':>10s} {'p99':>10s} {'max':>10s}")
+    print("-" * 78)
+    for label, key, scale, unit in rows:
+        dist = report["metrics"][key]
+        if dist is None:
+            print(f"{label:26s} {'-':>10s}")
+            continue
+        values = [f"{dist[k] * scale:.2f}{unit}" if unit == "x" else f"{dist[k] * scale:.0f}{unit}"
+                  for k in ("p50", "p95", "p99", "max")]
+        print(f"{label:26s} " + " ".join(f"{v:>10s}" for v in values))
+
+    if report["codecs"]:
+        print()
+        print(f"{'Codec':10s} {'Sesiones':>9s} {'B/s audio':>12s} {'B/s total':>12s} {'vs PCM16':>9s}")
+        print("-" * 78)
+        for codec, entry in report["codecs"].items():
+            per_audio = entry["wire_bytes_per_audio_s"]
+            ratio = entry["ratio_vs_pcm16"]
+            print(f"{codec:10s} {entry['sessions']:9d} "
+                  f"{per_audio:12.0f} {entry['wire_bytes_per_s']:12.0f} {ratio * 100:8.1f}%"
+                  if per_audio is not None else f"{codec:10s} {entry['sessions']:9d}")
+
+    frames = report["frames"]
+    if frames and frames["frames"]:
+        print()
+        print(f"Frames: {frames['frames']}  {frames['frames_per_s']:.1f} frames/s  "
+              f"{frames['frames_per_audio_s']:.1f} por s de audio  "
+              f"{frames['avg_frame_bytes']:.0f} B/frame")
+        line = f"CPU cliente: {frames['client_cpu_ms_per_audio_s']:.1f} ms por s de audio"
+        if frames["server_cpu_ms_per_audio_s"] is not None:
+            line += f"  CPU servidor: {frames['server_cpu_ms_per_audio_s']:.1f} ms por s de audio"
+        print(line)
+    print("=" * 78)
+
+
+def parse_list(value, cast):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generador de carga para VibeVoice /stream")
+    parser.add_argument("--url", default="ws://localhost:3000")
+    parser.add_argument("--corpus", help="Archivo .txt (una frase por línea) o .jsonl")
+    parser.add_argument("--shuffle", action="store_true", help="Orden aleatorio del corpus")
+    parser.add_argument("--voices", default="sp-Spk1_man", help="Voces por rotación (coma)")
+    parser.add_argument("--cfg", default="1.5", help="Valores de cfg por rotación (coma)")
+    parser.add_argument("--steps", default="2", help="Valores de steps por rotación (coma)")
+    parser.add_argument("--steps-min", type=int, help="Mínimo de steps aceptado (governor QoS)")
+    parser.add_argument("--codecs", help="Codecs de audio por rotación (coma), p. ej. pcm16,adpcm,opus")
+    parser.add_argument("--frame-ms", type=float, help="Duración de frame pedida al servidor (ms)")
+    parser.add_argument("--collect", action="store_true",
+                        help="Guardar el audio de cada sesión (AudioBuffer), como un cliente real")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument("--concurrency", type=int, default=4, help="Clientes (closed-loop)")
+    parser.add_argument("--rate", type=float, default=1.0, help="Peticiones por segundo (open-loop)")
+    parser.add_argument("--poisson", action="store_true", help="Llegadas de Poisson en open-loop")
+    parser.add_argument("--requests", type=int, default=0, help="Total de peticiones (0 = usar --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="Duración en segundos")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Timeout entre mensajes")
+    parser.add_argument("--json", help="Guardar el reporte JSON en este archivo")
+    parser.add_argument("--sessions", action="store_true", help="Incluir cada sesión en el JSON")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not args.requests and not args.duration:
+        args.requests = 32
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    corpus = load_corpus(args.corpus)
+    plan = request_plan(corpus, parse_list(args.voices, str), parse_list(args.cfg, float),
+                        parse_list(args.steps, int), args.shuffle,
+                        parse_list(args.codecs, str) if args.codecs else (None,))
+
+    print("=" * 78)
+    print("CARGA VIBEVOICE TTS")
+    print("=" * 78)
+    print(f"Servidor: {args.url}  Modo: {args.mode}  Corpus: {len(corpus)} textos")
+    if args.mode == "closed":
+        print(f"Concurrencia: {args.concurrency}")
+    else:
+        print(f"Tasa: {args.rate} req/s{' (Poisson)' if args.poisson else ''}")
+
+    runner = LoadRunner(args)
+    server_before = fetch_frame_stats(args.url)
+    wall = asyncio.run(runner.run(plan))
+    frames = frame_report(runner.results, wall, runner.client_cpu, server_before,
+                          fetch_frame_stats(args.url) if server_before else None)
+    report = build_report(args, runner.results, wall, runner.max_in_flight, frames)
+    print_report(report)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"Reporte JSON guardado en: {args.json}")
+
+    return 0 if report["succeeded"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
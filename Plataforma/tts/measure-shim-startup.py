@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Comparación de arranque del pyshim: eager vs lazy
+=================================================
+
+Lanza intérpretes nuevos con `pyshim` en PYTHONPATH y mide, para cada modo:
+- Tiempo de import de `sitecustomize` según `-X importtime` (acumulado, us)
+- Tiempo de pared del intérprete completo
+- RSS máximo del proceso (Linux/macOS)
+
+Modos:
+    eager  - VIBEVOICE_SHIM_EAGER=1 (comportamiento anterior: importa torch al arrancar)
+    lazy   - import hook, torch solo se importa si alguien lo usa
+
+Además verifica que en modo lazy `import torch` sigue dejando `torch.xpu`.
+
+Uso:
+    python measure-shim-startup.py
+    python measure-shim-startup.py --runs 10 --json resultados.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+PYSHIM_DIR = Path(__file__).resolve().parent / "pyshim"
+
+# El hijo reporta su RSS máximo (KB en Linux, bytes en macOS)
+CHILD_CODE = (
+    "import sys\n"
+    "try:\n"
+    "    import resource\n"
+    "    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+    "    if sys.platform == 'darwin':\n"
+    "        rss //= 1024\n"
+    "except ImportError:\n"
+    "    rss = -1\n"
+    "print(rss)\n"
+)
+
+CHECK_CODE = "import torch; print(hasattr(torch, 'xpu'))"
+
+
+def child_env(eager):
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(PYSHIM_DIR), env.get("PYTHONPATH")]))
+    if eager:
+        env["VIBEVOICE_SHIM_EAGER"] = "1"
+    else:
+        env.pop("VIBEVOICE_SHIM_EAGER", None)
+    return env
+
+
+def parse_importtime(stderr, module="sitecustomize"):
+    """Tiempo acumulado (us) del import de `module` en la salida de -X importtime"""
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1])
+    return None
+
+
+def run_once(eager):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD_CODE],
+        env=child_env(eager),
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "error")
+
+    return {
+        "wall_ms": wall * 1000,
+        "sitecustomize_us": parse_importtime(result.stderr),
+        "max_rss_kb": int(result.stdout.strip() or -1),
+    }
+
+
+def summarize(samples):
+    summary = {}
+    for key in ("wall_ms", "sitecustomize_us", "max_rss_kb"):
+        values = [s[key] for s in samples if s[key] is not None and s[key] >= 0]
+        if values:
+            summary[key] = {
+                "first": values[0],  # primer arranque (caché de disco más fría)
+                "median": statistics.median(values),
+                "min": min(values),
+            }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara el arranque del pyshim eager vs lazy")
+    parser.add_argument("--runs", type=int, default=5, help="Intérpretes por modo")
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("ARRANQUE DEL PYSHIM: EAGER vs LAZY")
+    print("=" * 70)
+
+    report = {}
+    for mode in ("eager", "lazy"):
+        samples = [run_once(eager=(mode == "eager")) for _ in range(args.runs)]
+        report[mode] = summarize(samples)
+
+    check = subprocess.run([sys.executable, "-c", CHECK_CODE], env=child_env(eager=False),
+                           capture_output=True, text=True)
+    report["lazy_shim_applies"] = check.stdout.strip() == "True" if check.returncode == 0 else None
+
+    print(f"\n{'Métrica':24s} {'eager':>14s} {'lazy':>14s} {'ahorro':>14s}")
+    print("-" * 70)
+    for key, label, unit in (("wall_ms", "Tiempo de pared", "ms"),
+                             ("sitecustomize_us", "import sitecustomize", "us"),
+                             ("max_rss_kb", "RSS máximo", "KB")):
+        eager = report["eager"].get(key, {}).get("median")
+        lazy = report["lazy"].get(key, {}).get("median")
+        if eager is None or lazy is None:
+            continue
+        print(f"{label:24s} {eager:>11.0f} {unit:2s} {lazy:>11.0f} {unit:2s} {eager - lazy:>11.0f} {unit:2s}")
+
+    print()
+    if report["lazy_shim_applies"] is None:
+        print("torch no está instalado: el modo lazy no se pudo verificar con import torch")
+    else:
+        print(f"torch.xpu disponible tras 'import torch' en modo lazy: {report['lazy_shim_applies']}")
+    print("(valores: mediana de los arranques; 'first' en el JSON es el arranque más frío)")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nResultados guardados en: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Snapshot local del modelo VibeVoice
+===================================
+
+Materializa el modelo en un directorio para arrancar sin el hub de Hugging
+Face: pesos safetensors en el dtype de servicio (lectura por mmap), tokenizer
+y presets de voz dentro del snapshot, y un manifiesto con el hash de cada
+archivo. Detalles en `vibevoice_snapshot.py`.
+
+Uso (desde VibeVoice/demo/, para incluir voices/streaming_model):
+    python prepare-model.py --out /models/vibevoice-0.5b
+    python prepare-model.py --out /models/vibevoice-0.5b-bf16 --device cuda
+    python prepare-model.py --verify /models/vibevoice-0.5b
+
+    VIBEVOICE_MODEL=/models/vibevoice-0.5b python run-vibevoice-server.py
+
+Variables de entorno:
+    VIBEVOICE_MODEL   - Modelo de origen por defecto (default: microsoft/VibeVoice-Realtime-0.5B)
+    VIBEVOICE_DEVICE  - Dispositivo de servicio para --dtype auto (default: cpu)
+"""
+
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import vibevoice_snapshot  # noqa: E402
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    sys.exit(vibevoice_snapshot.main())
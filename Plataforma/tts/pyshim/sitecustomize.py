@@ -6,6 +6,12 @@ Some `diffusers` versions reference `torch.xpu.*` unconditionally, but the
 CPU-only PyTorch wheels often don't expose `torch.xpu`, which crashes imports
 before VibeVoice can start.
 
+The shim is lazy: a meta-path finder waits for the first `import torch` and
+patches `torch.xpu` right after the real module finishes loading. Processes
+that never import torch (helper scripts, subprocesses) pay nothing. Set
+VIBEVOICE_SHIM_EAGER=1 to restore the old behaviour (import torch at startup);
+`measure-shim-startup.py` compares both modes.
+
 Usage (PowerShell):
   $env:PYTHONPATH = "C:\\Users\\Carlos Ivan\\Desktop\\Agente\\Plataforma\\tts\\pyshim"
   python demo\\realtime_model_inference_from_file.py ...
@@ -13,13 +19,11 @@ Usage (PowerShell):
 
 from __future__ import annotations
 
+import os
+import sys
 
-def _install_torch_xpu_shim() -> None:
-    try:
-        import torch
-    except Exception:
-        return
 
+def _install_torch_xpu_shim(torch) -> None:
     if hasattr(torch, "xpu"):
         return
 
@@ -55,5 +59,62 @@ def _install_torch_xpu_shim() -> None:
     torch.xpu = _DummyXPU()  # type: ignore[attr-defined]
 
 
-_install_torch_xpu_shim()
+# Plain duck-typed finder/loader: importing importlib.abc at startup would pull
+# in importlib.resources and pathlib, costing more than the shim saves.
+class _ShimLoader:
+    """Wraps torch's real loader and applies the shim after exec_module."""
+
+    def __init__(self, loader):
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module) -> None:
+        self._loader.exec_module(module)
+        _install_torch_xpu_shim(module)
+
+    def __getattr__(self, name):
+        # is_package, get_resource_reader, get_code, ...
+        return getattr(self._loader, name)
+
+
+class _TorchXPUFinder:
+    """One-shot finder: resolves `torch` with the remaining finders."""
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != "torch":
+            return None
+
+        # Remove ourselves first so the lookup below doesn't recurse
+        try:
+            sys.meta_path.remove(self)
+        except ValueError:
+            pass
+
+        import importlib.util
+
+        spec = importlib.util.find_spec(fullname)
+        if spec is None or spec.loader is None:
+            return None
+        spec.loader = _ShimLoader(spec.loader)
+        return spec
+
+
+def _install() -> None:
+    if os.environ.get("VIBEVOICE_SHIM_EAGER", "").strip().lower() in ("1", "true", "yes", "on"):
+        try:
+            import torch
+        except Exception:
+            return
+        _install_torch_xpu_shim(torch)
+        return
+
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        _install_torch_xpu_shim(torch)
+    elif not any(isinstance(finder, _TorchXPUFinder) for finder in sys.meta_path):
+        sys.meta_path.insert(0, _TorchXPUFinder())
+
 
+_install()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Render offline de VibeVoice (sin servidor)
+==========================================
+
+Sintetiza un manifiesto JSONL de {"id", "text", "voice", "cfg", "steps"} a un
+WAV por id con un pool de procesos, sin uvicorn: cada worker carga el modelo
+con la misma configuración de dispositivo que run-vibevoice-server-directml.py
+y tiene su propio tramo de cores. Es reanudable: si el proceso se corta,
+volver a lanzarlo salta los ids ya renderizados. Detalles en `vibevoice_render.py`.
+
+Uso (desde VibeVoice/demo/):
+    python render-vibevoice.py prompts.jsonl --out audio/
+    python render-vibevoice.py prompts.jsonl --out audio/ --workers 8 --threads-per-worker 2
+    python render-vibevoice.py prompts.jsonl --out audio/ --device cuda --workers 2 --json render.json
+
+Variables de entorno:
+    VIBEVOICE_MODEL     - Modelo a usar (default: microsoft/VibeVoice-Realtime-0.5B)
+    VIBEVOICE_DEVICE    - Dispositivo por defecto de --device (default: cpu)
+    VIBEVOICE_PRECISION - Precisión tras cargar el modelo (default: fp32)
+    VIBEVOICE_COMPILE   - torch.compile del LM y la difusión (default: 0)
+"""
+
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import vibevoice_render  # noqa: E402
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    sys.exit(vibevoice_render.main())
@@ -18,15 +18,38 @@ Uso:
     DIRECTML_DEVICE=1 python run-vibevoice-server-directml.py  # GPU dedicada
 
 Variables de entorno:
-    VIBEVOICE_MODEL   - Modelo a usar (default: microsoft/VibeVoice-Realtime-0.5B)
+    VIBEVOICE_MODEL   - Modelo a usar: id del hub o snapshot de prepare-model.py
+                        (default: microsoft/VibeVoice-Realtime-0.5B)
+    VIBEVOICE_SNAPSHOT_VERIFY - Verificación del snapshot: size, full u off (default: size)
+    VIBEVOICE_MODELS  - Modelos adicionales por sesión con ?model=: nombre=ruta[@device] (default: ninguno)
+    VIBEVOICE_MODEL_BUDGET_MB - Memoria de pesos residentes antes de descargar modelos (default: 0, sin límite)
     VIBEVOICE_PORT    - Puerto del servidor (default: 3000)
     VIBEVOICE_DEVICE  - Dispositivo: directml, cuda, cpu (default: auto)
+    VIBEVOICE_CALIBRATE - Selección automática medida: auto, force, off (default: auto)
+    VIBEVOICE_DEVICE_PROFILE - Perfil de calibración (default: ~/.cache/vibevoice/device-profile.json)
     DIRECTML_DEVICE   - Índice de GPU para DirectML (0, 1, etc.)
+    VIBEVOICE_THREADS - Threads de CPU: auto, un número o tune (default: auto)
+    VIBEVOICE_NUMA_NODE - Fijar el proceso a un nodo NUMA: off, auto o índice (default: off)
+    VIBEVOICE_PRECISION - Precisión tras cargar el modelo: fp32, bf16, int8-dynamic (default: fp32)
+    VIBEVOICE_COMPILE - torch.compile con caché de compilación en disco (default: 0)
+    VIBEVOICE_QOS     - Bajar los steps bajo carga, dentro de límites del cliente (default: 0)
+    VIBEVOICE_PIPELINE - Textos largos por frases, sintetizando la siguiente mientras se envía (default: 0)
+    VIBEVOICE_INCREMENTAL - Texto por frames JSON en /stream?incremental=1 (default: 1)
+    VIBEVOICE_CODECS  - Codecs negociables en /stream?codec=... (default: 1)
+    VIBEVOICE_JOBS - Lotes de textos por HTTP en POST /synthesize/batch (default: 1)
+    VIBEVOICE_FRAMES - Agrupación de chunks de audio en frames de VIBEVOICE_FRAME_MS (default: 1)
+    VIBEVOICE_RESAMPLE - sample_rate/format por sesión en /stream (default: 1)
+    VIBEVOICE_ADMISSION - Cola acotada con plazo y rechazo con retry_after_ms ante ráfagas (default: 1)
+    VIBEVOICE_ADMISSION_MAX_INFLIGHT - Síntesis simultáneas admitidas (default: tamaño de batch o 1)
+    VIBEVOICE_CACHE   - Caché de audio de frases repetidas (default: 1)
+    VIBEVOICE_TRACE   - Trazas por petición y fase en /trace (Chrome trace) (default: 0)
+    VIBEVOICE_TRACE_SAMPLE - Fracción de sesiones trazadas (default: 1)
+    VIBEVOICE_WARMUP  - Calentar modelo y voces antes de abrir el puerto (default: 1)
 """
 
 import os
 import sys
-import types
+import time
 import logging
 from pathlib import Path
 
@@ -46,6 +69,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Módulos auxiliares (vibevoice_*.py) junto a este script
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
 # Suprimir warnings de APEX y transformers
 class ApexWarningFilter(logging.Filter):
     def filter(self, record):
@@ -61,205 +87,38 @@ class ApexWarningFilter(logging.Filter):
 logging.getLogger("transformers").addFilter(ApexWarningFilter())
 logging.getLogger("transformers.modeling_utils").addFilter(ApexWarningFilter())
 
-# =============================================================================
-# Detección y configuración de dispositivo GPU
-# =============================================================================
-
-def detect_and_select_device():
-    """Detectar automáticamente el mejor dispositivo disponible"""
-
-    device_type = os.environ.get("VIBEVOICE_DEVICE", "auto").lower()
-    gpu_index = os.environ.get("DIRECTML_DEVICE", None)
-
-    logger.info("=" * 60)
-    logger.info("Detectando dispositivos disponibles...")
-    logger.info("=" * 60)
-
-    # Si el usuario especificó el tipo de device
-    if device_type in ["cuda", "directml", "cpu"]:
-        logger.info(f"Dispositivo especificado: {device_type}")
-
-        if device_type == "cuda":
-            return setup_cuda()
-        elif device_type == "directml":
-            return setup_directml(gpu_index)
-        else:
-            return setup_cpu()
-
-    # Auto-detección
-    logger.info("Modo auto-detección activado")
-
-    # 1. Intentar CUDA (mejor rendimiento)
-    try:
-        import torch
-        if torch.cuda.is_available():
-            logger.info("✓ CUDA detectado (GPU NVIDIA)")
-            return setup_cuda()
-    except:
-        pass
-
-    # 2. Intentar DirectML (funciona con AMD, Intel, NVIDIA)
-    try:
-        import torch_directml
-        if torch_directml.device_count() > 0:
-            logger.info("✓ DirectML detectado")
-            return setup_directml(gpu_index)
-    except ImportError:
-        logger.info("✗ DirectML no disponible (instala: pip install torch-directml)")
-    except:
-        pass
-
-    # 3. Fallback a CPU
-    logger.info("✓ Usando CPU (sin aceleración GPU)")
-    return setup_cpu()
-
-def setup_cuda():
-    """Configurar dispositivo CUDA"""
-    import torch
-
-    if not torch.cuda.is_available():
-        logger.warning("CUDA solicitado pero no disponible, usando CPU")
-        return setup_cpu()
-
-    device = torch.device("cuda")
-    gpu_name = torch.cuda.get_device_name(0)
-
-    logger.info("=" * 60)
-    logger.info("Configuración CUDA:")
-    logger.info(f"  GPU: {gpu_name}")
-    logger.info(f"  VRAM: {torch.cuda.get_device_properties(0).total_memory / 1e9:.2f} GB")
-    logger.info(f"  Device: {device}")
-    logger.info("=" * 60)
-
-    # Shim torch.xpu para compatibilidad
-    if not hasattr(torch, "xpu"):
-        torch.xpu = types.SimpleNamespace(
-            empty_cache=lambda: None,
-            is_available=lambda: False,
-            device_count=lambda: 0,
-            manual_seed=lambda seed: torch.manual_seed(seed),
-            reset_peak_memory_stats=lambda *args, **kwargs: None,
-            max_memory_allocated=lambda *args, **kwargs: 0,
-            synchronize=lambda *args, **kwargs: None,
-        )
-
-    return device, "cuda"
-
-def setup_directml(gpu_index=None):
-    """Configurar dispositivo DirectML con selección de GPU"""
-    try:
-        import torch_directml
-        import torch
-    except ImportError:
-        logger.error("DirectML solicitado pero torch-directml no está instalado")
-        logger.error("Instala con: pip install torch-directml")
-        return setup_cpu()
-
-    # Detectar GPUs disponibles
-    device_count = torch_directml.device_count()
-
-    if device_count == 0:
-        logger.warning("DirectML instalado pero no se detectaron GPUs")
-        return setup_cpu()
-
-    # Seleccionar GPU
-    if gpu_index is not None:
-        try:
-            selected_gpu = int(gpu_index)
-            if selected_gpu >= device_count:
-                logger.warning(f"GPU {selected_gpu} no existe, usando GPU 0")
-                selected_gpu = 0
-        except ValueError:
-            logger.warning(f"Índice de GPU inválido: {gpu_index}, usando GPU 0")
-            selected_gpu = 0
-    else:
-        # Si hay múltiples GPUs, preferir la dedicada (usualmente índice 1)
-        # Heurística simple: GPU con índice mayor suele ser dedicada
-        selected_gpu = device_count - 1 if device_count > 1 else 0
-
-    device = torch_directml.device(selected_gpu)
-
-    # Intentar obtener nombre de GPU
-    try:
-        if hasattr(torch_directml, 'device_name'):
-            gpu_name = torch_directml.device_name(selected_gpu)
-        else:
-            gpu_name = f"DirectML Device {selected_gpu}"
-    except:
-        gpu_name = f"DirectML Device {selected_gpu}"
-
-    logger.info("=" * 60)
-    logger.info("Configuración DirectML:")
-    logger.info(f"  GPUs disponibles: {device_count}")
-    logger.info(f"  GPU seleccionada: {selected_gpu}")
-    logger.info(f"  Nombre: {gpu_name}")
-    logger.info(f"  Device: {device}")
-
-    if device_count > 1:
-        logger.info("")
-        logger.info("  Tienes múltiples GPUs. Para cambiar, usa:")
-        logger.info("    $env:DIRECTML_DEVICE = \"0\"  # GPU integrada")
-        logger.info("    $env:DIRECTML_DEVICE = \"1\"  # GPU dedicada")
-
-    logger.info("=" * 60)
-
-    # Shim torch.xpu para compatibilidad
-    if not hasattr(torch, "xpu"):
-        torch.xpu = types.SimpleNamespace(
-            empty_cache=lambda: None,
-            is_available=lambda: False,
-            device_count=lambda: 0,
-            manual_seed=lambda seed: torch.manual_seed(seed),
-            reset_peak_memory_stats=lambda *args, **kwargs: None,
-            max_memory_allocated=lambda *args, **kwargs: 0,
-            synchronize=lambda *args, **kwargs: None,
-        )
-
-    return device, f"directml:{selected_gpu}"
-
-def setup_cpu():
-    """Configurar dispositivo CPU"""
-    import torch
-
-    # Optimizar para CPU
-    torch.set_num_threads(os.cpu_count())
-
-    device = torch.device("cpu")
-
-    logger.info("=" * 60)
-    logger.info("Configuración CPU:")
-    logger.info(f"  Threads: {torch.get_num_threads()}")
-    logger.info(f"  Device: {device}")
-    logger.info("=" * 60)
-
-    # Shim torch.xpu para compatibilidad
-    if not hasattr(torch, "xpu"):
-        torch.xpu = types.SimpleNamespace(
-            empty_cache=lambda: None,
-            is_available=lambda: False,
-            device_count=lambda: 0,
-            manual_seed=lambda seed: torch.manual_seed(seed),
-            reset_peak_memory_stats=lambda *args, **kwargs: None,
-            max_memory_allocated=lambda *args, **kwargs: 0,
-            synchronize=lambda *args, **kwargs: None,
-        )
-
-    return device, "cpu"
-
 # =============================================================================
 # Configuración del servidor
 # =============================================================================
 
-# Detectar y configurar dispositivo
+# Detectar y configurar dispositivo (compartido con render-vibevoice.py)
+load_phases = {}
+phase_started = time.perf_counter()
+from vibevoice_device import detect_and_select_device
 device, device_name = detect_and_select_device()
+load_phases["device_setup"] = time.perf_counter() - phase_started
 
 model = os.environ.get("VIBEVOICE_MODEL", "microsoft/VibeVoice-Realtime-0.5B")
 port = int(os.environ.get("VIBEVOICE_PORT", "3000"))
 
+# Snapshot local (prepare-model.py): verificar contra el manifiesto y sin hub
+import vibevoice_snapshot
+phase_started = time.perf_counter()
+try:
+    snapshot = vibevoice_snapshot.activate_snapshot(model)
+except vibevoice_snapshot.SnapshotError as e:
+    logger.error(f"[ERROR] {e}")
+    logger.error("Vuelve a generarlo con: python prepare-model.py --out <dir> --force")
+    sys.exit(1)
+if snapshot is not None:
+    load_phases["snapshot_verify"] = time.perf_counter() - phase_started
+
 logger.info("")
 logger.info("=" * 60)
 logger.info("Configuración del servidor VibeVoice:")
 logger.info(f"  Modelo:  {model}")
+if snapshot is not None:
+    logger.info(f"  Snapshot: {snapshot['source']} {snapshot['dtype']} (hash {snapshot['hash'][:12]}, offline)")
 logger.info(f"  Puerto:  {port}")
 logger.info(f"  Device:  {device_name}")
 logger.info("=" * 60)
@@ -318,21 +177,28 @@ if missing_packages:
 # =============================================================================
 # Iniciar servidor
 # =============================================================================
+# Carga del modelo y hooks: se registran al quedar listo (GET /ready, load_phases)
+vibevoice_snapshot.log_load_phases(load_phases, "Tiempos de carga (lanzador)")
 logger.info("=" * 60)
 logger.info("Iniciando servidor Uvicorn...")
 logger.info(f"  URL:       http://0.0.0.0:{port}")
 logger.info(f"  WebSocket: ws://0.0.0.0:{port}/stream")
 logger.info(f"  Health:    http://0.0.0.0:{port}/config")
+logger.info(f"  Ready:     http://0.0.0.0:{port}/ready")
 logger.info("=" * 60)
 logger.info("Presiona Ctrl+C para detener el servidor")
 logger.info("")
 
 try:
     import uvicorn
+    import vibevoice_app
+
+    # web.app:app envuelta con las capas opcionales (caché, etc.)
+    app = vibevoice_app.build_app()
 
     # Configuración de uvicorn
     uvicorn_config = {
-        "app": "web.app:app",
+        "app": app,
         "host": "0.0.0.0",
         "port": port,
         "reload": False,
@@ -14,13 +14,38 @@ Uso:
     python run-vibevoice-server.py
 
 Variables de entorno:
-    VIBEVOICE_MODEL   - Modelo a usar (default: microsoft/VibeVoice-Realtime-0.5B)
+    VIBEVOICE_MODEL   - Modelo a usar: id del hub o snapshot de prepare-model.py
+                        (default: microsoft/VibeVoice-Realtime-0.5B)
+    VIBEVOICE_SNAPSHOT_VERIFY - Verificación del snapshot: size, full u off (default: size)
+    VIBEVOICE_MODELS  - Modelos adicionales por sesión con ?model=: nombre=ruta[@device] (default: ninguno)
+    VIBEVOICE_MODEL_BUDGET_MB - Memoria de pesos residentes antes de descargar modelos (default: 0, sin límite)
     VIBEVOICE_PORT    - Puerto del servidor (default: 3000)
     VIBEVOICE_DEVICE  - Dispositivo: cuda, cpu, mps (default: cpu)
+    VIBEVOICE_HOST    - Interfaz de escucha (default: 0.0.0.0)
+    VIBEVOICE_WORKERS - Workers de inferencia con cores dedicados (default: 1)
+    VIBEVOICE_WORKER_MODE - spawn (un modelo por worker) o fork (pesos compartidos) (default: spawn)
+    VIBEVOICE_THREADS - Threads de CPU: auto, un número o tune (default: auto)
+    VIBEVOICE_NUMA_NODE - Fijar el proceso a un nodo NUMA: off, auto o índice (default: off)
+    VIBEVOICE_PRECISION - Precisión tras cargar el modelo: fp32, bf16, int8-dynamic (default: fp32)
+    VIBEVOICE_COMPILE - torch.compile con caché de compilación en disco (default: 0)
+    VIBEVOICE_QOS     - Bajar los steps bajo carga, dentro de límites del cliente (default: 0)
+    VIBEVOICE_PIPELINE - Textos largos por frases, sintetizando la siguiente mientras se envía (default: 0)
+    VIBEVOICE_INCREMENTAL - Texto por frames JSON en /stream?incremental=1 (default: 1)
+    VIBEVOICE_CODECS  - Codecs negociables en /stream?codec=... (default: 1)
+    VIBEVOICE_JOBS - Lotes de textos por HTTP en POST /synthesize/batch (default: 1)
+    VIBEVOICE_FRAMES - Agrupación de chunks de audio en frames de VIBEVOICE_FRAME_MS (default: 1)
+    VIBEVOICE_RESAMPLE - sample_rate/format por sesión en /stream (default: 1)
+    VIBEVOICE_ADMISSION - Cola acotada con plazo y rechazo con retry_after_ms ante ráfagas (default: 1)
+    VIBEVOICE_ADMISSION_MAX_INFLIGHT - Síntesis simultáneas admitidas (default: tamaño de batch o 1)
+    VIBEVOICE_CACHE   - Caché de audio de frases repetidas (default: 1)
+    VIBEVOICE_TRACE   - Trazas por petición y fase en /trace (Chrome trace) (default: 0)
+    VIBEVOICE_TRACE_SAMPLE - Fracción de sesiones trazadas (default: 1)
+    VIBEVOICE_WARMUP  - Calentar modelo y voces antes de abrir el puerto (default: 1)
 """
 
 import os
 import sys
+import time
 import types
 import logging
 from pathlib import Path
@@ -34,19 +59,28 @@ if sys.platform == "win32":
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
 
+worker_index = os.environ.get("VIBEVOICE_WORKER_INDEX")
+log_prefix = f"[w{worker_index}] " if worker_index is not None else ""
+
 logging.basicConfig(
     level=logging.INFO,
-    format="[%(levelname)s] %(message)s",
+    format=f"[%(levelname)s] {log_prefix}%(message)s",
     handlers=[logging.StreamHandler(sys.stdout)]
 )
 logger = logging.getLogger(__name__)
 
+# Módulos auxiliares (vibevoice_*.py) junto a este script
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
 # =============================================================================
 # Torch XPU Compatibility Shim
 # =============================================================================
 logger.info("Aplicando shim de compatibilidad torch.xpu...")
+load_phases = {}
+phase_started = time.perf_counter()
 try:
     import torch
+    load_phases["torch_import"] = time.perf_counter() - phase_started
 
     if not hasattr(torch, "xpu"):
         # Crear namespace dummy para torch.xpu
@@ -72,15 +106,50 @@ except ImportError as e:
 # =============================================================================
 model = os.environ.get("VIBEVOICE_MODEL", "microsoft/VibeVoice-Realtime-0.5B")
 port = int(os.environ.get("VIBEVOICE_PORT", "3000"))
+host = os.environ.get("VIBEVOICE_HOST", "0.0.0.0")
 device = os.environ.get("VIBEVOICE_DEVICE", "cpu")
 
+try:
+    workers = max(1, int(os.environ.get("VIBEVOICE_WORKERS", "1")))
+except ValueError:
+    logger.warning(f"VIBEVOICE_WORKERS inválido: {os.environ['VIBEVOICE_WORKERS']}, usando 1")
+    workers = 1
+
+# Snapshot local (prepare-model.py): verificar contra el manifiesto y sin hub
+import vibevoice_snapshot
+phase_started = time.perf_counter()
+try:
+    snapshot = vibevoice_snapshot.activate_snapshot(model)
+except vibevoice_snapshot.SnapshotError as e:
+    logger.error(f"[ERROR] {e}")
+    logger.error("Vuelve a generarlo con: python prepare-model.py --out <dir> --force")
+    sys.exit(1)
+if snapshot is not None:
+    load_phases["snapshot_verify"] = time.perf_counter() - phase_started
+
 logger.info("=" * 60)
 logger.info("Configuración del servidor VibeVoice:")
 logger.info(f"  Modelo:  {model}")
+if snapshot is not None:
+    logger.info(f"  Snapshot: {snapshot['source']} {snapshot['dtype']} (hash {snapshot['hash'][:12]}, offline)")
 logger.info(f"  Puerto:  {port}")
 logger.info(f"  Device:  {device}")
+worker_mode = "spawn"
+if workers > 1 and worker_index is None:
+    import vibevoice_workers
+    worker_mode = vibevoice_workers.worker_mode(device)
+    logger.info(f"  Workers: {workers} ({worker_mode})")
 logger.info("=" * 60)
 
+# Dentro de un worker: limitar a los cores asignados por el supervisor
+if worker_index is not None:
+    import vibevoice_workers
+    vibevoice_workers.apply_worker_affinity(torch)
+elif device == "cpu" and workers == 1:
+    # Threads según cuota del cgroup, afinidad y cores físicos
+    import vibevoice_threads
+    vibevoice_threads.configure_cpu_threads(torch)
+
 # Validar device
 valid_devices = ["cuda", "cpu", "mps"]
 if device not in valid_devices:
@@ -148,11 +217,16 @@ if missing_packages:
 # =============================================================================
 # Iniciar servidor
 # =============================================================================
+# Carga del modelo y hooks: se registran al quedar listo (GET /ready, load_phases)
+vibevoice_snapshot.log_load_phases(load_phases, "Tiempos de carga (lanzador)")
 logger.info("=" * 60)
 logger.info("Iniciando servidor Uvicorn...")
-logger.info(f"  URL:       http://0.0.0.0:{port}")
-logger.info(f"  WebSocket: ws://0.0.0.0:{port}/stream")
-logger.info(f"  Health:    http://0.0.0.0:{port}/config")
+logger.info(f"  URL:       http://{host}:{port}")
+logger.info(f"  WebSocket: ws://{host}:{port}/stream")
+logger.info(f"  Health:    http://{host}:{port}/config")
+logger.info(f"  Ready:     http://{host}:{port}/ready")
+if workers > 1:
+    logger.info(f"  Workers:   http://{host}:{port}/workers")
 logger.info("=" * 60)
 logger.info("Presiona Ctrl+C para detener el servidor")
 logger.info("")
@@ -160,10 +234,24 @@ logger.info("")
 try:
     import uvicorn
 
+    if workers > 1 and worker_mode == "fork":
+        # Modelo cargado aquí una vez; los workers (fork) comparten sus páginas
+        import vibevoice_app
+        import vibevoice_workers
+        app = vibevoice_workers.build_fork_router(workers, port, vibevoice_app.build_app())
+    elif workers > 1:
+        # Router least-loaded en el puerto público, workers en puertos internos
+        import vibevoice_workers
+        app = vibevoice_workers.build_router(workers, port, Path(__file__).resolve())
+    else:
+        # web.app:app envuelta con las capas opcionales (caché, etc.)
+        import vibevoice_app
+        app = vibevoice_app.build_app()
+
     # Configuración de uvicorn
     uvicorn_config = {
-        "app": "web.app:app",
-        "host": "0.0.0.0",
+        "app": app,
+        "host": host,
         "port": port,
         "reload": False,
         "log_level": "info",
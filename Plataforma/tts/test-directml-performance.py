@@ -1,128 +1,158 @@
 #!/usr/bin/env python3
 """
-Test de rendimiento DirectML vs CPU
-Compara la velocidad de ambas GPUs y CPU
+Test de rendimiento DirectML vs CUDA vs CPU
+===========================================
+
+Suite de kernels representativos de VibeVoice (ver `vibevoice_bench.py`):
+- Atención del LM (prefill y decode) con longitudes reales de secuencia
+- MLP del LM, paso de la cabeza de difusión (con CFG) y bloque conv del decoder
+- Paso de síntesis completo (`decoder_step`), usado para el ranking
+- fp32 vs bf16 (los dtypes no soportados se reportan como error)
+- Transferencias host<->device medidas aparte del cómputo
+
+Cada kernel se mide con perf_counter_ns, warmup y sincronización del
+dispositivo, sobre tensores ya residentes en el dispositivo. Se reporta
+mediana, media con IC 95%, p95 y GFLOP/s.
+
+Uso:
+    python test-directml-performance.py
+    python test-directml-performance.py --devices cpu,directml:0 --dtypes float32 --json bench.json
+    python test-directml-performance.py --quick --iterations 10
 """
 
-import time
-import torch
+import argparse
+import json
 import sys
+import time
+from pathlib import Path
 
-def benchmark_device(device, device_name, iterations=10):
-    """Ejecutar benchmark en un dispositivo específico"""
-    print(f"\nBenchmarking: {device_name}")
-    print("-" * 50)
+sys.path.insert(0, str(Path(__file__).resolve().parent))
 
-    # Warm-up
-    x = torch.randn(1000, 1000)
-    x_dev = x.to(device)
-    _ = x_dev @ x_dev.T
+import vibevoice_bench  # noqa: E402
 
-    # Benchmark
-    times = []
-    for i in range(iterations):
-        start = time.time()
+RANKING_KERNEL = "decoder_step"
 
-        # Operación matricial grande
-        x = torch.randn(2000, 2000)
-        x_dev = x.to(device)
-        y = x_dev @ x_dev.T
-        result = y.cpu()
 
-        elapsed = time.time() - start
-        times.append(elapsed)
+def _progress(label, key, stats):
+    if stats is None:
+        print(f"  {key:34s} {'no soportado':>12s}")
+        return
+    half = (stats["ci95_high_ms"] - stats["ci95_low_ms"]) / 2
+    gflops = f"{stats['gflops']:.1f}" if stats.get("gflops") else "-"
+    print(f"  {key:34s} {stats['median_ms']:9.3f} ms  (media {stats['mean_ms']:.3f} ± {half:.3f}, "
+          f"p95 {stats['p95_ms']:.3f})  {gflops:>8s} GFLOP/s")
 
-        if (i + 1) % 5 == 0:
-            print(f"  Iteración {i+1}/{iterations}: {elapsed*1000:.2f} ms")
 
-    avg_time = sum(times) / len(times)
-    print(f"\n  Promedio: {avg_time*1000:.2f} ms")
-    print(f"  Min: {min(times)*1000:.2f} ms")
-    print(f"  Max: {max(times)*1000:.2f} ms")
+def ranking_time(report):
+    """Mejor mediana de `decoder_step` entre los dtypes medidos"""
+    times = [stats["median_ms"] for key, stats in report["kernels"].items()
+             if key.split("/")[0] == RANKING_KERNEL and "median_ms" in stats]
+    return min(times) if times else None
 
-    return avg_time
 
-def main():
-    print("=" * 70)
-    print("TEST DE RENDIMIENTO DIRECTML")
-    print("=" * 70)
+def print_transfers(transfers):
+    if not transfers:
+        return
+    if "error" in transfers:
+        print(f"  Transferencias: error ({transfers['error']})")
+        return
+    print("  Transferencias:")
+    for key, stats in transfers.items():
+        rate = f"{stats['gb_per_s']:.2f} GB/s" if stats.get("gb_per_s") else "-"
+        print(f"    {key:14s} {stats['median_ms']:9.3f} ms  {rate}")
 
-    results = {}
 
-    # Test CPU
-    try:
-        print("\n[1/3] Testing CPU...")
-        cpu_time = benchmark_device(torch.device("cpu"), "CPU", iterations=5)
-        results["CPU"] = cpu_time
-    except Exception as e:
-        print(f"Error en CPU: {e}")
+def print_recommendation(ranked):
+    print("\n" + "=" * 70)
+    print("RECOMENDACIÓN:")
+    print("=" * 70)
 
-    # Test DirectML GPUs
-    try:
-        import torch_directml
+    best = ranked[0]
+    print(f"\nUsa: {best['device']} - {best['name']} (más rápido en {RANKING_KERNEL})")
+    print("\nComando:")
+    if best["device"].startswith("directml"):
+        gpu_idx = best["device"].split(":", 1)[1] if ":" in best["device"] else "0"
+        print(f"  .\\start-vibevoice-server-directml.ps1 -Device directml -GpuIndex {gpu_idx}")
+    elif best["device"].startswith("cuda"):
+        print("  .\\start-vibevoice-server-directml.ps1 -Device cuda")
+    else:
+        print("  .\\start-vibevoice-server-directml.ps1 -Device cpu")
+    print()
 
-        device_count = torch_directml.device_count()
-        print(f"\n\nGPUs DirectML detectadas: {device_count}")
 
-        for i in range(device_count):
-            try:
-                device = torch_directml.device(i)
-                device_name = torch_directml.device_name(i) if hasattr(torch_directml, 'device_name') else f"GPU {i}"
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de dispositivos para VibeVoice")
+    parser.add_argument("--devices", help="Lista separada por comas (cpu,cuda:0,directml:1); "
+                                          "por defecto todos los detectados")
+    parser.add_argument("--dtypes", default="float32,bfloat16", help="dtypes a medir (coma)")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--quick", action="store_true", help="Menos longitudes de secuencia")
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    args = parser.parse_args()
 
-                print(f"\n[{i+2}/{device_count+1}] Testing {device_name}...")
-                gpu_time = benchmark_device(device, device_name, iterations=10)
-                results[f"GPU {i}: {device_name}"] = gpu_time
-            except Exception as e:
-                print(f"Error en GPU {i}: {e}")
+    print("=" * 70)
+    print("TEST DE RENDIMIENTO: KERNELS VIBEVOICE")
+    print("=" * 70)
 
-    except ImportError:
-        print("\n[ERROR] torch-directml no está instalado")
-        print("Instala con: pip install torch-directml")
+    if args.devices:
+        labels = [d.strip() for d in args.devices.split(",") if d.strip()]
+    else:
+        labels = [label for label, _ in vibevoice_bench.available_devices()]
+    dtypes = [d.strip() for d in args.dtypes.split(",") if d.strip()]
+
+    env = vibevoice_bench.environment_info()
+    print(f"torch {env['torch']}  |  {env['platform']}  |  {env['torch_threads']} threads")
+    print(f"Dispositivos: {', '.join(labels)}")
+
+    reports = []
+    for index, label in enumerate(labels, 1):
+        print(f"\n[{index}/{len(labels)}] {label}: {vibevoice_bench.device_name(label)}")
+        print("-" * 70)
+        started = time.perf_counter()
+        try:
+            report = vibevoice_bench.benchmark_device(
+                label, dtypes=dtypes, warmup=args.warmup, iterations=args.iterations,
+                quick=args.quick, progress=_progress,
+            )
+        except Exception as e:
+            print(f"  Error en {label}: {e}")
+            continue
+        report["wall_seconds"] = time.perf_counter() - started
+        print_transfers(report["transfers"])
+        reports.append(report)
 
-    # Resultados finales
     print("\n" + "=" * 70)
     print("RESULTADOS FINALES")
     print("=" * 70)
 
-    if not results:
+    ranked = sorted((r for r in reports if ranking_time(r) is not None), key=ranking_time)
+    if not ranked:
         print("No se pudieron ejecutar benchmarks")
-        return
-
-    # Ordenar por velocidad
-    sorted_results = sorted(results.items(), key=lambda x: x[1])
+        return 1
 
-    print("\nRanking (más rápido primero):")
+    print(f"\nRanking por {RANKING_KERNEL} (más rápido primero):")
     print("-" * 70)
+    baseline = ranking_time(ranked[0])
+    for rank, report in enumerate(ranked, 1):
+        t = ranking_time(report)
+        print(f"{rank}. {report['device'] + ': ' + report['name']:45s} {t:8.3f} ms  ({baseline / t:.2f}x)")
+
+    print_recommendation(ranked)
+
+    if args.json:
+        payload = {
+            "environment": env,
+            "config": {"dtypes": dtypes, "warmup": args.warmup, "iterations": args.iterations,
+                       "quick": args.quick},
+            "ranking_kernel": RANKING_KERNEL,
+            "ranking": [r["device"] for r in ranked],
+            "devices": reports,
+        }
+        Path(args.json).write_text(json.dumps(payload, indent=2), encoding="utf-8")
+        print(f"Resultados guardados en: {args.json}")
+    return 0
 
-    baseline = sorted_results[0][1]
-
-    for rank, (name, time_val) in enumerate(sorted_results, 1):
-        speedup = baseline / time_val if time_val > 0 else 0
-        print(f"{rank}. {name:35s}  {time_val*1000:7.2f} ms  ({speedup:.2f}x)")
-
-    print("\n" + "=" * 70)
-    print("RECOMENDACIÓN:")
-    print("=" * 70)
-
-    best_device = sorted_results[0][0]
-    print(f"\nUsa: {best_device} (más rápido)")
-
-    if "GPU" in best_device:
-        # Extraer índice de GPU
-        if "GPU 0" in best_device:
-            gpu_idx = 0
-        elif "GPU 1" in best_device:
-            gpu_idx = 1
-        else:
-            gpu_idx = 0
-
-        print(f"\nComando:")
-        print(f"  .\\start-vibevoice-server-directml.ps1 -Device directml -GpuIndex {gpu_idx}")
-    else:
-        print(f"\nComando:")
-        print(f"  .\\start-vibevoice-server-directml.ps1 -Device cpu")
-
-    print()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
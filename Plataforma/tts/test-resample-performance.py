@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Benchmark del remuestreo en streaming
+=====================================
+
+Mide el costo del remuestreador polifásico de `vibevoice_resample.py` por
+segundo de audio (CPU y tiempo real), procesando ruido en chunks como los de
+/stream, y su calidad: nivel en paso de banda (tono de 1 kHz) y rechazo de
+aliasing (tono por encima de la Nyquist de salida).
+
+Uso:
+    python test-resample-performance.py
+    python test-resample-performance.py --rates 8000,16000 --formats int16,float32 --taps 8,16,32
+    python test-resample-performance.py --seconds 30 --chunk-ms 40 --json resample.json
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import vibevoice_resample  # noqa: E402
+
+
+def parse_list(value, cast):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del remuestreo en streaming de VibeVoice")
+    parser.add_argument("--rates", default="8000,16000,22050,48000", help="Frecuencias de salida (coma)")
+    parser.add_argument("--formats", default="int16,float32", help="Formatos de salida (coma)")
+    parser.add_argument("--taps", default="16", help="Taps por fase del filtro (coma)")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Segundos de audio por medición")
+    parser.add_argument("--chunk-ms", type=int, default=100, help="Tamaño de chunk de entrada")
+    parser.add_argument("--json", help="Guardar resultados JSON en este archivo")
+    args = parser.parse_args()
+
+    print("=" * 78)
+    print("REMUESTREO EN STREAMING (24 kHz PCM16 -> salida)")
+    print("=" * 78)
+    print(f"{args.seconds:.0f}s de audio por medición, chunks de {args.chunk_ms} ms")
+    print()
+    print(f"{'Salida':>8s} {'Formato':>8s} {'Taps':>5s} {'CPU ms/s':>9s} {'x RT':>8s} "
+          f"{'B/s':>8s} {'1 kHz dB':>9s} {'Alias dB':>9s}")
+    print("-" * 78)
+
+    results = []
+    for rate in parse_list(args.rates, int):
+        for sample_format in parse_list(args.formats, str):
+            for taps in parse_list(args.taps, int):
+                r = vibevoice_resample.benchmark(rate, sample_format, args.seconds, args.chunk_ms, taps)
+                results.append(r)
+                passband = f"{r['passband_1khz_db']:.2f}" if "passband_1khz_db" in r else "-"
+                alias = f"{r['alias_rejection_db']:.1f}" if "alias_rejection_db" in r else "-"
+                print(f"{rate:8d} {sample_format:>8s} {taps:5d} {r['cpu_ms_per_audio_s']:9.2f} "
+                      f"{r['realtime_x']:8.0f} {r['bytes_per_audio_s']:8d} {passband:>9s} {alias:>9s}")
+    print("=" * 78)
+    print("CPU ms/s: milisegundos de CPU por segundo de audio (por sesión)")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Resultados JSON guardados en: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
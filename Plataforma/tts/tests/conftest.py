@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Los módulos de Plataforma/tts se importan por nombre (como hacen los lanzadores)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
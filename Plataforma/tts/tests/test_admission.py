@@ -0,0 +1,187 @@
+import asyncio
+
+import pytest
+
+from vibevoice_admission import AdmissionController, admission_from_env
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_free_slot_is_admitted_immediately():
+    async def scenario():
+        controller = AdmissionController(max_inflight=2)
+        assert await controller.acquire() is None
+        assert await controller.acquire() is None
+        assert controller.inflight == 2
+        controller.release()
+        controller.release()
+        assert controller.inflight == 0
+
+    run(scenario())
+
+
+def test_release_hands_slot_to_waiters_in_fifo_order():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, queue_size=4, deadline_s=5)
+        assert await controller.acquire() is None
+        order = []
+
+        async def waiter(name):
+            assert await controller.acquire() is None
+            order.append(name)
+
+        tasks = [asyncio.ensure_future(waiter(name)) for name in "abc"]
+        await settle()
+        assert controller.queue_depth == 3
+        for _ in "abc":
+            controller.release()
+            await settle()
+            # El slot pasa directo al siguiente: nunca queda libre entre medias
+            assert controller.inflight == 1
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "c"]
+        controller.release()
+        assert controller.inflight == 0
+        assert controller.queue_depth == 0
+
+    run(scenario())
+
+
+def test_new_arrival_does_not_jump_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, queue_size=4, deadline_s=5)
+        await controller.acquire()
+        queued = asyncio.ensure_future(controller.acquire())
+        await settle()
+        controller.release()
+        # El slot ya es del que esperaba: el recién llegado se encola
+        late = asyncio.ensure_future(controller.acquire())
+        await settle()
+        assert queued.done() and queued.result() is None
+        assert not late.done()
+        controller.release()
+        assert await late is None
+        controller.release()
+        assert controller.inflight == 0
+
+    run(scenario())
+
+
+def test_deadline_expiry_rejects_and_keeps_slot_accounting():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, queue_size=4, deadline_s=0.02)
+        await controller.acquire()
+        assert await controller.acquire() == "deadline"
+        assert controller.queue_depth == 0
+        assert controller.rejected["deadline"] == 1
+        assert controller.inflight == 1
+        controller.release()
+        assert controller.inflight == 0
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("offset", [-0.004, -0.001, 0.0, 0.001, 0.004])
+def test_release_racing_deadline_never_leaks_a_slot(offset):
+    async def scenario():
+        deadline = 0.05
+        controller = AdmissionController(max_inflight=1, queue_size=4, deadline_s=deadline)
+        await controller.acquire()
+        loop = asyncio.get_running_loop()
+        loop.call_later(deadline + offset, controller.release)
+        result = await controller.acquire()
+        await asyncio.sleep(0.02)
+        if result is None:
+            # Admitido: el slot es suyo
+            assert controller.inflight == 1
+            controller.release()
+        else:
+            assert result == "deadline"
+        assert controller.inflight == 0
+        assert controller.queue_depth == 0
+
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_queue_without_taking_a_slot():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, queue_size=4, deadline_s=5)
+        await controller.acquire()
+        waiting = asyncio.ensure_future(controller.acquire())
+        await settle()
+        assert controller.queue_depth == 1
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert controller.queue_depth == 0
+        assert sum(controller.rejected.values()) == 0
+        controller.release()
+        assert controller.inflight == 0
+
+    run(scenario())
+
+
+def test_waiter_cancelled_after_hand_off_passes_the_slot_on():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, queue_size=4, deadline_s=5)
+        await controller.acquire()
+        first = asyncio.ensure_future(controller.acquire())
+        second = asyncio.ensure_future(controller.acquire())
+        await settle()
+        # El slot llega a `first` y se cancela antes de que llegue a ejecutarse
+        controller.release()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert await second is None
+        assert controller.inflight == 1
+        controller.release()
+        assert controller.inflight == 0
+        assert controller.queue_depth == 0
+
+    run(scenario())
+
+
+def test_full_queue_is_rejected_immediately():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, queue_size=1, deadline_s=5)
+        await controller.acquire()
+        queued = asyncio.ensure_future(controller.acquire())
+        await settle()
+        assert await controller.acquire() == "queue_full"
+        controller.release()
+        assert await queued is None
+        controller.release()
+        assert controller.inflight == 0
+
+    run(scenario())
+
+
+def test_projected_wait_over_deadline_is_rejected_without_queueing():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, queue_size=8, deadline_s=1.0)
+        controller.record(0.6)
+        await controller.acquire()
+        queued = asyncio.ensure_future(controller.acquire())  # espera proyectada 0.6s
+        await settle()
+        assert await controller.acquire() == "projected_wait"  # 1.2s > 1.0s
+        assert controller.queue_depth == 1
+        assert controller.retry_after() == pytest.approx(1.2)  # en curso + uno en cola
+        controller.release()
+        assert await queued is None
+        controller.release()
+        assert controller.inflight == 0
+
+    run(scenario())
+
+
+def test_default_admits_one_synthesis(monkeypatch):
+    monkeypatch.delenv("VIBEVOICE_ADMISSION_MAX_INFLIGHT", raising=False)
+    assert admission_from_env(object()).controller.max_inflight == 1
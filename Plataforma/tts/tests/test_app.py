@@ -0,0 +1,74 @@
+import asyncio
+
+from vibevoice_app import LifespanHooks
+
+
+async def lifespan_app(scope, receive, send):
+    while True:
+        message = await receive()
+        await send({"type": message["type"] + ".complete"})
+        if message["type"] == "lifespan.shutdown":
+            return
+
+
+def recording_hook(calls, name, runs_inference=False):
+    async def hook(upstream):
+        calls.append(name)
+    hook.__name__ = name
+    hook.runs_inference = runs_inference
+    return hook
+
+
+async def worker_startup(hooks):
+    """Lifespan de un worker tras `preload()`, como lo conduce uvicorn"""
+    inbox = asyncio.Queue()
+    replies = []
+
+    async def send(message):
+        replies.append(message["type"])
+
+    await inbox.put({"type": "lifespan.startup"})
+    await inbox.put({"type": "lifespan.shutdown"})
+    await hooks({"type": "lifespan"}, inbox.get, send)
+    return replies
+
+
+def test_preload_defers_hooks_from_the_first_one_that_runs_inference():
+    calls = []
+    hooks = LifespanHooks(lifespan_app, lifespan_app, [
+        recording_hook(calls, "snapshot"),
+        recording_hook(calls, "precision", runs_inference=True),
+        # Sin inferencia, pero depende del anterior: mantiene el orden en el worker
+        recording_hook(calls, "weights"),
+    ], [recording_hook(calls, "warmup")])
+
+    async def run():
+        await hooks.preload()
+        parent = list(calls)
+        calls.clear()
+        replies = await worker_startup(hooks)
+        return parent, replies
+
+    parent, replies = asyncio.run(run())
+    assert parent == ["snapshot"]
+    assert calls == ["precision", "weights", "warmup"]
+    assert replies == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert hooks.ready is False
+
+
+def test_preload_runs_every_weight_only_hook_before_fork():
+    calls = []
+    hooks = LifespanHooks(lifespan_app, lifespan_app, [
+        recording_hook(calls, "snapshot"),
+        recording_hook(calls, "precision"),
+    ], [recording_hook(calls, "warmup")])
+
+    async def run():
+        await hooks.preload()
+        parent = list(calls)
+        calls.clear()
+        await worker_startup(hooks)
+        return parent
+
+    assert asyncio.run(run()) == ["snapshot", "precision"]
+    assert calls == ["warmup"]
@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+import vibevoice_cache
+from vibevoice_app import current_model
+from vibevoice_cache import AudioCache, AudioCacheMiddleware, cache_key
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(vibevoice_cache, "time", clock)
+    return clock
+
+
+def chunks(size, count=2):
+    return [bytes([index]) * (size // count) for index in range(count)]
+
+
+def test_memory_lru_evicts_least_recently_used():
+    cache = AudioCache(memory_bytes=300, max_entry_bytes=300)
+    for key in ("a", "b", "c"):
+        cache.put(key, chunks(100))
+    assert cache.get_memory("a") is not None  # "a" pasa a ser el más reciente
+    cache.put("d", chunks(100))
+    assert cache.get_memory("b") is None
+    assert [cache.get_memory(k) is not None for k in ("a", "c", "d")] == [True, True, True]
+    stats = cache.stats()
+    assert stats["memory_evictions"] == 1
+    assert stats["memory_entries"] == 3
+
+
+def test_memory_never_exceeds_its_budget():
+    cache = AudioCache(memory_bytes=250, max_entry_bytes=1000)
+    for index in range(10):
+        cache.put(str(index), chunks(100))
+    assert cache._memory_size <= 250
+    assert cache.stats()["memory_entries"] == 2
+    # Más grande que toda la memoria: no desaloja nada
+    cache.put("enorme", chunks(400))
+    assert cache.get_memory("enorme") is None
+    assert cache.stats()["memory_entries"] == 2
+
+
+def test_entries_over_max_entry_bytes_are_rejected():
+    cache = AudioCache(memory_bytes=1000, max_entry_bytes=100)
+    assert cache.put("grande", chunks(200)) is False
+    assert cache.put("vacía", []) is False
+    assert cache.stats()["rejected"] == 2
+    assert cache.stats()["stores"] == 0
+
+
+def test_memory_entries_expire(clock):
+    cache = AudioCache(max_age=60)
+    cache.put("a", chunks(100))
+    clock.now += 61
+    assert cache.get_memory("a") is None
+    assert cache.stats()["expired"] == 1
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_disk_hit_after_memory_eviction_and_counters(tmp_path):
+    cache = AudioCache(directory=tmp_path, memory_bytes=100, disk_bytes=1000, max_entry_bytes=1000)
+    cache.put("a", chunks(100))
+    cache.put("b", chunks(100))  # desaloja "a" de memoria; sigue en disco
+    assert cache.get_memory("a") is None
+    assert [bytes(c) for c in cache.get_disk("a")] == chunks(100)
+    assert cache.get_memory("a") is not None  # el hit de disco la sube a memoria
+    assert cache.get_disk("nunca") is None
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_ratio"] == round(2 / 3, 4)
+
+
+def test_disk_evicts_least_recently_accessed(tmp_path, clock):
+    cache = AudioCache(directory=tmp_path, memory_bytes=0, disk_bytes=250, max_entry_bytes=1000)
+    cache.put("a", chunks(100))
+    clock.now += 1
+    cache.put("b", chunks(100))
+    clock.now += 1
+    assert cache.get_disk("a") is not None  # "b" queda como el acceso más viejo
+    clock.now += 1
+    cache.put("c", chunks(100))
+    assert cache.get_disk("b") is None
+    assert cache.get_disk("a") is not None and cache.get_disk("c") is not None
+    assert cache.stats()["disk_evictions"] == 1
+    assert not list(tmp_path.glob("*/b.pcm"))
+
+
+def test_disk_entries_expire_and_survive_restart(tmp_path, clock):
+    cache = AudioCache(directory=tmp_path, memory_bytes=0, disk_bytes=1000, max_age=60)
+    cache.put("viejo", chunks(100))
+    clock.now += 30
+    cache.put("nuevo", chunks(100))
+    clock.now += 40
+    # Un reinicio relee el índice y descarta lo que superó la edad máxima
+    reopened = AudioCache(directory=tmp_path, memory_bytes=0, disk_bytes=1000, max_age=60)
+    assert reopened.stats()["disk_entries"] == 1
+    assert reopened.get_disk("viejo") is None
+    assert reopened.get_disk("nuevo") is not None
+
+
+def stream_app(pieces, close_code=1000):
+    async def app(scope, receive, send):
+        await receive()
+        await send({"type": "websocket.accept"})
+        for piece in pieces:
+            await send({"type": "websocket.send", "bytes": piece})
+        await send({"type": "websocket.close", "code": close_code})
+    return app
+
+
+async def stream(app, text="hola"):
+    inbox = asyncio.Queue()
+    await inbox.put({"type": "websocket.connect"})
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "websocket", "path": "/stream", "query_string": f"text={text}".encode()}
+    await app(scope, inbox.get, send)
+    return sent
+
+
+def test_middleware_records_then_replays():
+    cache = AudioCache(max_entry_bytes=1000)
+    app = AudioCacheMiddleware(stream_app(chunks(100)), cache)
+    first = asyncio.run(stream(app))
+    second = asyncio.run(stream(app))
+    audio = [[m["bytes"] for m in sent if m.get("bytes")] for sent in (first, second)]
+    assert audio[0] == audio[1] == chunks(100)
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_middleware_stops_recording_past_max_entry_bytes():
+    cache = AudioCache(max_entry_bytes=250)
+    app = AudioCacheMiddleware(stream_app(chunks(400, count=4)), cache)
+    sent = asyncio.run(stream(app))
+    # El cliente recibe todo el audio; la caché no lo guarda
+    assert sum(len(m["bytes"]) for m in sent if m.get("bytes")) == 400
+    assert cache.stats()["rejected"] == 1
+    assert cache.stats()["stores"] == 0
+    assert cache.get_memory(cache_key("hola", None, None, None, current_model())) is None
@@ -0,0 +1,45 @@
+import struct
+import wave
+
+import pytest
+
+from vibevoice_client import StreamingWavWriter
+
+
+def riff_sizes(path):
+    data = path.read_bytes()
+    return struct.unpack_from("<I", data, 4)[0], struct.unpack_from("<I", data, 40)[0], len(data)
+
+
+def test_riff_size_counts_the_pad_byte(tmp_path):
+    path = tmp_path / "impar.wav"
+    with StreamingWavWriter(str(path), sample_rate=8000, bits_per_sample=8) as writer:
+        writer.write(b"\x80" * 3)
+    riff, data, file_size = riff_sizes(path)
+    assert data == 3
+    # RIFF = todo lo que sigue a los 8 bytes de "RIFF" + tamaño, relleno incluido
+    assert riff == 36 + 3 + 1 == file_size - 8
+
+
+def test_even_data_has_no_pad(tmp_path):
+    path = tmp_path / "par.wav"
+    with StreamingWavWriter(str(path)) as writer:
+        writer.write(b"\x00\x01" * 10)
+    riff, data, file_size = riff_sizes(path)
+    assert (riff, data) == (56, 20)
+    assert riff == file_size - 8
+    with wave.open(str(path)) as wav:
+        assert wav.getnframes() == 10
+
+
+@pytest.mark.parametrize("sample_rate, channels, bits, expected", [
+    (24000, 1, 16, 1.0),
+    (16000, 1, 16, 1.5),
+    (8000, 2, 8, 3.0),
+    (48000, 1, 32, 0.25),
+])
+def test_duration_uses_the_writer_format(tmp_path, sample_rate, channels, bits, expected):
+    with StreamingWavWriter(str(tmp_path / "a.wav"), sample_rate=sample_rate, num_channels=channels,
+                            bits_per_sample=bits) as writer:
+        writer.write(bytes(48000))
+    assert writer.duration == expected
@@ -0,0 +1,182 @@
+import math
+import random
+import struct
+import warnings
+
+import pytest
+
+from vibevoice_codecs import (
+    AdpcmDecoder,
+    AdpcmEncoder,
+    G711Decoder,
+    G711Encoder,
+    alaw_to_linear,
+    linear_to_alaw,
+    linear_to_ulaw,
+    ulaw_to_linear,
+)
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    try:
+        import audioop
+    except ImportError:  # Python 3.13+
+        audioop = None
+
+needs_audioop = pytest.mark.skipif(audioop is None, reason="audioop no disponible (Python 3.13+)")
+
+ALL_SAMPLES = struct.pack("<65536h", *range(-32768, 32768))
+
+
+def pcm(samples):
+    return struct.pack(f"<{len(samples)}h", *samples)
+
+
+def unpack(data):
+    return struct.unpack(f"<{len(data) // 2}h", data)
+
+
+def voice_like(n, seed=0):
+    """Senoidales mezcladas con ruido: cambios lentos y rápidos para el predictor"""
+    rng = random.Random(seed)
+    return [max(-32768, min(32767, int(12000 * math.sin(i / 9) + 6000 * math.sin(i / 2.3)
+                                       + rng.randint(-800, 800)))) for i in range(n)]
+
+
+def swap_nibbles(data):
+    return bytes(((b & 0x0F) << 4) | (b >> 4) for b in data)
+
+
+# ------------------------------------------------------------------ G.711
+
+@needs_audioop
+def test_ulaw_matches_audioop_for_every_sample():
+    assert G711Encoder("mulaw").encode(ALL_SAMPLES) == audioop.lin2ulaw(ALL_SAMPLES, 2)
+
+
+@needs_audioop
+def test_alaw_matches_audioop_for_every_sample():
+    assert G711Encoder("alaw").encode(ALL_SAMPLES) == audioop.lin2alaw(ALL_SAMPLES, 2)
+
+
+@needs_audioop
+@pytest.mark.parametrize("law", ["mulaw", "alaw"])
+def test_g711_decode_matches_audioop(law):
+    codes = bytes(range(256))
+    reference = audioop.ulaw2lin(codes, 2) if law == "mulaw" else audioop.alaw2lin(codes, 2)
+    assert G711Decoder(law).decode(codes) == reference
+
+
+@pytest.mark.parametrize("encode,decode", [(linear_to_ulaw, ulaw_to_linear), (linear_to_alaw, alaw_to_linear)])
+def test_g711_decoded_values_are_fixed_points(encode, decode):
+    # Un valor decodificado vuelve a codificarse en un código con el mismo valor
+    for code in range(256):
+        assert decode(encode(decode(code))) == decode(code)
+
+
+@pytest.mark.parametrize("law", ["mulaw", "alaw"])
+def test_g711_round_trip_error_is_bounded(law):
+    samples = voice_like(4000)
+    decoded = unpack(G711Decoder(law).decode(G711Encoder(law).encode(pcm(samples))))
+    assert len(decoded) == len(samples)
+    for original, value in zip(samples, decoded):
+        # Cuantización logarítmica: error relativo ~3%, más un mínimo absoluto
+        assert abs(original - value) <= max(64, abs(original) // 16)
+
+
+# -------------------------------------------------------------- IMA-ADPCM
+
+def adpcm_blocks(samples, chunk_sizes):
+    encoder = AdpcmEncoder()
+    data = pcm(samples)
+    blocks = []
+    position = 0
+    for size in chunk_sizes:
+        blocks.append(encoder.encode(data[position:position + size]))
+        position += size
+    blocks.append(encoder.flush())
+    return [block for block in blocks if block]
+
+
+@needs_audioop
+def test_adpcm_matches_audioop_apart_from_nibble_order():
+    samples = voice_like(2400)
+    encoded = AdpcmEncoder().encode(pcm(samples))
+    predictor, index = struct.unpack_from("<hB", encoded)
+    assert (predictor, index) == (0, 0)
+    reference, state = audioop.lin2adpcm(pcm(samples), 2, None)
+    # audioop pone la primera muestra en el nibble alto; aquí va en el bajo (como IMA en WAV)
+    assert swap_nibbles(encoded[4:]) == reference
+
+
+@needs_audioop
+def test_adpcm_block_headers_carry_the_audioop_state():
+    samples = voice_like(3000, seed=1)
+    blocks = adpcm_blocks(samples, [1000, 1000, 1000, 1000, 1000, 1000])
+    state = None
+    for block in blocks:
+        predictor, index = struct.unpack_from("<hB", block)
+        if state is not None:
+            assert (predictor, index) == state
+        reference_samples, _ = audioop.adpcm2lin(swap_nibbles(block[4:]), 2, (predictor, index))
+        assert AdpcmDecoder().decode(block) == reference_samples
+        _, state = audioop.lin2adpcm(AdpcmDecoder().decode(block), 2, (predictor, index))
+
+
+@pytest.mark.parametrize("chunk_sizes", [
+    [6000],
+    [2, 4, 6, 998, 4990],
+    [1000] * 6,
+])
+def test_adpcm_decodes_each_block_independently(chunk_sizes):
+    samples = voice_like(3000)
+    blocks = adpcm_blocks(samples, chunk_sizes)
+    decoded = b"".join(AdpcmDecoder().decode(block) for block in blocks)
+    assert len(decoded) == len(pcm(samples))
+    one_shot = AdpcmDecoder().decode(AdpcmEncoder().encode(pcm(samples)))
+    # Los bloques llevan el estado con el que empiezan: mismo resultado que de una vez
+    assert decoded == one_shot
+
+
+def test_adpcm_odd_sample_counts_carry_across_chunks():
+    samples = voice_like(1001)
+    data = pcm(samples)
+    # Chunks de 3, 5 y 7 muestras: cada uno deja una muestra impar para el siguiente
+    sizes = []
+    while sum(sizes) < len(data):
+        sizes.append(2 * (3, 5, 7)[len(sizes) % 3])
+    encoder = AdpcmEncoder()
+    blocks = []
+    position = 0
+    encoded_samples = 0
+    for size in sizes:
+        block = encoder.encode(data[position:position + size])
+        blocks.append(block)
+        position += size
+        encoded_samples += 2 * (len(block) - 4) if block else 0
+        # Todo lo recibido está codificado salvo, como mucho, la muestra retenida
+        carried = 1 if encoder.carry is not None else 0
+        assert encoded_samples + carried == min(position, len(data)) // 2
+    tail = encoder.flush()
+    assert tail and encoder.carry is None
+    decoded = unpack(b"".join(AdpcmDecoder().decode(block) for block in blocks + [tail]))
+    # 1001 muestras: la última se duplica en flush() para completar el byte
+    assert len(decoded) == 1002
+    assert encoder.flush() == b""
+    reference = unpack(AdpcmDecoder().decode(AdpcmEncoder().encode(pcm(samples + samples[-1:]))))
+    assert decoded == reference
+
+
+def test_adpcm_flush_without_carry_is_empty():
+    encoder = AdpcmEncoder()
+    assert encoder.encode(pcm([1, 2, 3, 4])) != b""
+    assert encoder.flush() == b""
+
+
+def test_adpcm_round_trip_tracks_the_signal():
+    samples = voice_like(6000)
+    decoded = unpack(AdpcmDecoder().decode(AdpcmEncoder().encode(pcm(samples))))
+    # Tras el arranque del predictor, el error es pequeño frente a la señal
+    error = sum((a - b) ** 2 for a, b in zip(samples[200:], decoded[200:])) / len(samples[200:])
+    power = sum(a * a for a in samples[200:]) / len(samples[200:])
+    assert 10 * math.log10(power / error) > 15
@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import pytest
+
+import vibevoice_jobs
+
+
+def ndjson_lines(body):
+    """Líneas JSON de una respuesta ndjson (saltando el audio de cada resultado)"""
+    lines = []
+    while body:
+        line, _, body = body.partition(b"\n")
+        header = json.loads(line)
+        lines.append(header)
+        if header.get("type") == "result":
+            body = body[header["bytes"]:]
+    return lines
+
+
+def run_job(middleware, payload, send):
+    scope = {"type": "http", "method": "POST", "path": vibevoice_jobs.BATCH_PATH, "query_string": b""}
+    messages = [{"type": "http.request", "body": json.dumps(payload).encode(), "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    asyncio.run(middleware(scope, receive, send))
+
+
+@pytest.fixture
+def middleware(monkeypatch):
+    middleware = vibevoice_jobs.BatchJobMiddleware(app=None)
+
+    async def synthesize(item):
+        return b"\0\0" * 240, {"type": "result", "id": item["id"], "status": "ok", "audio_s": 0.01}
+
+    monkeypatch.setattr(middleware, "_synthesize", synthesize)
+    return middleware
+
+
+def test_ndjson_failure_writes_error_line_before_summary(middleware, monkeypatch):
+    def broken_header(*args):
+        raise RuntimeError("cabecera rota")
+
+    monkeypatch.setattr(vibevoice_jobs, "create_wav_header", broken_header)
+    body = bytearray()
+
+    async def send(message):
+        body.extend(message.get("body", b""))
+
+    run_job(middleware, [{"text": "hola"}, {"text": "adiós"}], send)
+    lines = ndjson_lines(bytes(body))
+    assert [line["type"] for line in lines] == ["job", "error", "summary"]
+    assert "cabecera rota" in lines[1]["error"]
+    assert lines[2]["state"] == "failed"
+
+
+def test_send_failure_stops_without_writing_summary(middleware):
+    sent = []
+
+    async def send(message):
+        if message["type"] == "http.response.body" and len(sent) >= 2:
+            raise ConnectionResetError("cliente desconectado")
+        sent.append(message)
+
+    run_job(middleware, [{"text": "uno"}, {"text": "dos"}, {"text": "tres"}], send)
+    assert len(sent) == 2  # response.start + línea del job
+    job = next(iter(middleware.jobs.values()))
+    assert job.state == "failed"
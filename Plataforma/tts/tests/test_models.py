@@ -0,0 +1,70 @@
+import asyncio
+import types
+
+import vibevoice_models
+
+
+class FakeLifespan:
+    def __init__(self, on_shutdown=None):
+        self.on_shutdown = on_shutdown
+        self.closed = False
+
+    async def shutdown(self):
+        await asyncio.sleep(0)
+        if self.on_shutdown is not None:
+            await self.on_shutdown()
+        self.closed = True
+
+
+class InlineLoader:
+    async def run(self, coro):
+        return await coro
+
+
+def make_registry(budget_mb, *names):
+    app = types.SimpleNamespace(state=types.SimpleNamespace())
+    registry = vibevoice_models.ModelRegistryMiddleware(
+        app, [(name, f"/no/existe/{name}", "cpu") for name in names], budget_mb=budget_mb)
+    registry.primary.resident_mb = 0
+    registry._loader = InlineLoader()
+    return registry
+
+
+def load(entry, mb, last_used, lifespan=None):
+    entry.upstream = object()
+    entry.lifespan = lifespan or FakeLifespan()
+    entry.resident_mb = mb
+    entry.last_used = last_used
+
+
+def test_make_room_evicts_least_recently_used_first():
+    registry = make_registry(250, "a", "b", "c")
+    a, b, c = (registry.entries[n] for n in "abc")
+    load(a, 100, last_used=3)
+    load(b, 100, last_used=1)
+    load(c, 100, last_used=2)
+
+    assert asyncio.run(registry._make_room(0))
+    assert b.upstream is None
+    assert a.upstream is not None and c.upstream is not None
+
+
+def test_make_room_skips_model_acquired_during_previous_eviction():
+    registry = make_registry(100, "a", "b")
+    a, b = registry.entries["a"], registry.entries["b"]
+
+    async def scenario():
+        # Mientras se descarga `a`, una sesión nueva toma `b` (ya cargado)
+        async def take_b():
+            await registry.acquire(b)
+
+        load(a, 100, last_used=1, lifespan=FakeLifespan(on_shutdown=take_b))
+        load(b, 100, last_used=2)
+        fits = await registry._make_room(100)
+        return fits
+
+    fits = asyncio.run(scenario())
+    assert a.upstream is None
+    assert b.sessions == 1
+    assert b.upstream is not None and not b.lifespan.closed
+    assert not fits
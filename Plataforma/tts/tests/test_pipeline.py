@@ -0,0 +1,135 @@
+import pytest
+
+from vibevoice_pipeline import _Joiner, segment_text, split_sentences, take_segments
+
+
+def normalized(text):
+    return " ".join(text.split())
+
+
+# ----------------------------------------------------------------- frases
+
+def test_split_sentences_spanish_punctuation():
+    assert split_sentences("¿Qué tal estás? ¡Muy bien! Gracias.") == ["¿Qué tal estás?", "¡Muy bien!", "Gracias."]
+
+
+@pytest.mark.parametrize("text", [
+    "El Sr. García llegó tarde.",
+    "La Dra. Pérez vive en la Avda. Central.",
+    "Frutas, verduras, etc. y otras cosas.",
+    "Some tools, e.g. hammers, are heavy.",
+    "J. K. Rowling escribió muchos libros.",
+    "El precio es 3.5 euros por unidad.",
+    "Llegó a las 10.30 y se fue.",
+])
+def test_split_sentences_does_not_cut_abbreviations_or_decimals(text):
+    assert split_sentences(text) == [text]
+
+
+def test_split_sentences_ellipsis_and_quotes():
+    assert split_sentences("Bueno… Ya veremos. «Vale.» Dijo ella.") == ["Bueno…", "Ya veremos.", "«Vale.»",
+                                                                       "Dijo ella."]
+
+
+def test_split_sentences_keeps_unfinished_tail():
+    assert split_sentences("Primera frase. Y una sin terminar") == ["Primera frase.", "Y una sin terminar"]
+
+
+# -------------------------------------------------------------- segmentos
+
+LONG_TEXT = ("Hola. " + "Esta es una frase bastante larga, con varias cláusulas; y más texto aquí: sí. " * 6
+             + "¿Funciona bien? ¡Claro que sí! El Sr. Pérez pagó 3.5 euros.")
+
+
+def test_segment_text_respects_limits_and_keeps_text():
+    segments = segment_text(LONG_TEXT, max_chars=80, first_max_chars=40, min_chars=10)
+    assert len(segments[0]) <= 40
+    assert all(len(segment) <= 80 for segment in segments)
+    assert normalized(" ".join(segments)) == normalized(LONG_TEXT)
+
+
+def test_segment_text_cuts_long_sentence_at_clauses():
+    sentence = "Primero esto, luego aquello; después lo otro: y al final algo más para terminar la frase."
+    segments = segment_text(sentence, max_chars=40, first_max_chars=40, min_chars=0)
+    assert len(segments) > 1
+    assert all(len(segment) <= 40 for segment in segments)
+    assert normalized(" ".join(segments)) == normalized(sentence)
+
+
+def test_segment_text_merges_short_sentences():
+    assert segment_text("Sí. No. Quizá.", min_chars=24) == ["Sí. No. Quizá."]
+
+
+def test_take_segments_holds_last_sentence_until_final():
+    ready, pending = take_segments("Hola, ¿qué tal? Yo bien. El Sr.", min_chars=0)
+    assert ready == ["Hola, ¿qué tal?", "Yo bien."]
+    assert pending.strip() == "El Sr."
+    ready, pending = take_segments("Hola, ¿qué tal? Yo bien. El Sr.", min_chars=0, final=True)
+    assert ready[-1] == "El Sr."
+    assert pending == ""
+
+
+def test_take_segments_incremental_feed_keeps_text():
+    segments, buffer, emitted = [], "", 0
+    for i in range(0, len(LONG_TEXT), 7):
+        buffer += LONG_TEXT[i:i + 7]
+        ready, buffer = take_segments(buffer, emitted, max_chars=80, first_max_chars=40)
+        segments += ready
+        emitted += len(ready)
+    ready, buffer = take_segments(buffer, emitted, max_chars=80, first_max_chars=40, final=True)
+    segments += ready
+    assert buffer == ""
+    assert len(segments[0]) <= 40
+    assert all(len(segment) <= 80 for segment in segments)
+    assert normalized(" ".join(segments)) == normalized(LONG_TEXT)
+
+
+# ----------------------------------------------------------------- uniones
+
+def join(segments, fade, chunk):
+    joiner = _Joiner(fade)
+    out = b""
+    for segment in segments:
+        for i in range(0, len(segment), chunk):
+            out += joiner.feed(segment[i:i + chunk])
+        out += joiner.end_segment()
+    return out + joiner.finish()
+
+
+def expected_length(lengths, fade):
+    """Cada unión solapa min(crossfade, audio anterior, segmento nuevo) bytes"""
+    total = 0
+    for length in lengths:
+        if length:
+            total += length - (min(fade, total, length) if total else 0)
+    return total
+
+
+@pytest.mark.parametrize("lengths", [
+    [2000, 2000],
+    [2000, 100, 2000],  # segmento más corto que el crossfade
+    [2000, 100],
+    [100, 2000],
+    [100],
+    [2000, 0, 2000],
+    [2000, 2000, 2000, 2000],
+])
+@pytest.mark.parametrize("chunk", [2, 100, 4096])
+def test_joiner_length_conservation(lengths, chunk):
+    fade = 480
+    segments = [bytes([n % 251, 0]) * (length // 2) for n, length in enumerate(lengths)]
+    assert len(join(segments, fade, chunk)) == expected_length(lengths, fade)
+
+
+def test_joiner_without_crossfade_is_concatenation():
+    segments = [b"\x01\x00" * 300, b"\x02\x00" * 50, b"\x03\x00" * 300]
+    assert join(segments, 0, 64) == b"".join(segments)
+
+
+def test_joiner_short_segment_audio_is_mixed_not_dropped():
+    from array import array
+
+    long_a = b"\x00\x00" * 1000
+    short = array("h", [10000] * 50).tobytes()  # 100 bytes < crossfade de 480
+    samples = array("h", join([long_a, short, long_a], 480, 128))
+    assert max(samples) > 0
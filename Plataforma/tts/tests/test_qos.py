@@ -0,0 +1,70 @@
+import pytest
+
+from vibevoice_app import PCM16_BYTES_PER_SECOND
+from vibevoice_qos import QoSGovernor
+
+
+def decide(governor, **params):
+    return governor.decide({key: str(value) for key, value in params.items()})
+
+
+@pytest.mark.parametrize("inflight", [0, 1])
+def test_up_to_max_inflight_sessions_keep_requested_steps(inflight):
+    governor = QoSGovernor(max_inflight=2)
+    governor.inflight = inflight
+    decision = decide(governor, steps=5, steps_min=1)
+    assert decision["applied"] == {"steps": 5}
+    assert decision["pressure"] == pytest.approx((inflight + 1) / 2)
+
+
+def test_session_beyond_max_inflight_is_degraded():
+    governor = QoSGovernor(max_inflight=2)
+    governor.inflight = 2
+    decision = decide(governor, steps=5, steps_min=1)
+    # Presión 3/2: 5 / 1.5 -> 3 steps
+    assert decision["pressure"] == 1.5
+    assert decision["applied"] == {"steps": 3}
+
+
+def test_steps_never_below_client_minimum():
+    governor = QoSGovernor(max_inflight=1)
+    governor.inflight = 9
+    assert decide(governor, steps=8, steps_min=4)["applied"] == {"steps": 4}
+
+
+def test_client_without_bounds_gets_what_it_asked():
+    governor = QoSGovernor(max_inflight=1)
+    governor.inflight = 9
+    assert decide(governor, steps=6)["applied"] == {"steps": 6}
+
+
+def test_server_floor_applies_over_client_minimum():
+    governor = QoSGovernor(max_inflight=1, min_steps=3)
+    governor.inflight = 9
+    assert decide(governor, steps=8, steps_min=1)["applied"] == {"steps": 3}
+
+
+def test_steps_max_caps_even_without_pressure():
+    governor = QoSGovernor(max_inflight=4)
+    assert decide(governor, steps=10, steps_max=6)["applied"] == {"steps": 6}
+
+
+def test_defaults_when_client_sends_no_steps():
+    governor = QoSGovernor(default_steps=5)
+    decision = decide(governor)
+    assert decision["requested"] == {"steps": 5}
+    assert decision["applied"] == {"steps": 5}
+
+
+def test_slow_rtf_raises_pressure_without_concurrency():
+    governor = QoSGovernor(max_inflight=4, target_rtf=0.8)
+    governor.record(elapsed=2.0, audio_bytes=PCM16_BYTES_PER_SECOND)  # RTF 2.0
+    decision = decide(governor, steps=5, steps_min=1)
+    assert decision["pressure"] == 2.5
+    assert decision["applied"] == {"steps": 2}
+
+
+def test_at_target_rtf_nothing_changes():
+    governor = QoSGovernor(max_inflight=4, target_rtf=0.8)
+    governor.record(elapsed=0.8, audio_bytes=PCM16_BYTES_PER_SECOND)
+    assert decide(governor, steps=5, steps_min=1)["applied"] == {"steps": 5}
@@ -0,0 +1,57 @@
+import pytest
+
+import vibevoice_threads
+from vibevoice_render import summarize, thread_budget
+
+
+def entry(pid, audio_s, seconds):
+    return {"id": f"{pid}-{audio_s}", "status": "ok", "pid": pid, "audio_s": audio_s,
+            "seconds": seconds, "worker_load_s": 1.0}
+
+
+@pytest.fixture
+def smt_host(monkeypatch):
+    # 4 cores con 2 hilos cada uno: CPU n y n + 4 son hermanos
+    topology = {cpu: {"core": (0, cpu % 4), "node": 0} for cpu in range(8)}
+    monkeypatch.setattr(vibevoice_threads, "cpu_topology", lambda cpus=None: {c: topology[c] for c in cpus})
+    monkeypatch.setattr(vibevoice_threads, "cgroup_cpu_limit", lambda: None)
+    for name in ("VIBEVOICE_SMT", "VIBEVOICE_THREADS", "VIBEVOICE_NUMA_NODE"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_thread_budget_counts_physical_cores(smt_host):
+    assert thread_budget([0, 4, 1, 5]) == 2
+    assert thread_budget([2, 6]) == 1
+    assert thread_budget([0, 1, 2]) == 3
+
+
+def test_thread_budget_follows_smt_flag(smt_host, monkeypatch):
+    monkeypatch.setenv("VIBEVOICE_SMT", "1")
+    assert thread_budget([0, 4, 1, 5]) == 4
+
+
+def test_scaling_efficiency_against_single_worker_baseline():
+    # Cada worker rinde 1.5x por su cuenta, pero solo (sin contención) rendía 2x
+    entries = [entry(1, 30.0, 20.0), entry(2, 30.0, 20.0)]
+    summary = summarize(entries, 20.0, baseline_rate=2.0)
+    assert summary["audio_seconds_per_second"] == 3.0
+    assert summary["scaling_efficiency"] == 0.75
+    assert summary["baseline_rate"] == 2.0
+
+
+def test_scaling_efficiency_needs_baseline_with_several_workers():
+    summary = summarize([entry(1, 30.0, 20.0), entry(2, 30.0, 20.0)], 20.0)
+    assert summary["scaling_efficiency"] is None
+    assert summary["baseline_rate"] is None
+
+
+def test_single_worker_run_reports_its_rate_as_baseline():
+    summary = summarize([entry(1, 10.0, 4.0), entry(1, 10.0, 4.0)], 10.0)
+    assert summary["baseline_rate"] == 2.0
+    assert summary["scaling_efficiency"] == 1.0
+
+
+def test_empty_render():
+    summary = summarize([], 0.0, baseline_rate=2.0)
+    assert summary["rendered"] == 0
+    assert summary["scaling_efficiency"] is None
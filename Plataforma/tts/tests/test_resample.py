@@ -0,0 +1,84 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from vibevoice_resample import AudioFormatter, StreamingResampler  # noqa: E402
+
+SOURCE_RATE = 24000
+TARGET_RATES = (8000, 16000, 22050, 44100, 48000)
+
+
+def signal(seconds=0.5, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(SOURCE_RATE * seconds)) / SOURCE_RATE
+    tone = 0.4 * np.sin(2 * np.pi * 440 * t) + 0.2 * np.sin(2 * np.pi * 3100 * t)
+    return (tone + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def resample_whole(samples, rate):
+    resampler = StreamingResampler(SOURCE_RATE, rate)
+    return np.concatenate([resampler.process(samples), resampler.flush()])
+
+
+def resample_chunked(samples, rate, sizes):
+    resampler = StreamingResampler(SOURCE_RATE, rate)
+    out = []
+    position = 0
+    for size in sizes:
+        out.append(resampler.process(samples[position:position + size]))
+        position += size
+    out.append(resampler.process(samples[position:]))
+    out.append(resampler.flush())
+    return np.concatenate(out)
+
+
+def random_sizes(total, seed, largest=3000):
+    rng = np.random.default_rng(seed)
+    sizes = []
+    while sum(sizes) < total:
+        sizes.append(int(rng.integers(0, largest)))
+    return sizes
+
+
+@pytest.mark.parametrize("rate", TARGET_RATES)
+@pytest.mark.parametrize("seed", range(5))
+def test_chunked_output_matches_whole_signal(rate, seed):
+    samples = signal(seed=seed)
+    whole = resample_whole(samples, rate)
+    chunked = resample_chunked(samples, rate, random_sizes(len(samples), seed))
+    assert len(chunked) == len(whole)
+    np.testing.assert_array_equal(chunked, whole)
+
+
+@pytest.mark.parametrize("rate", TARGET_RATES)
+def test_single_sample_chunks_match_whole_signal(rate):
+    samples = signal(seconds=0.05)
+    chunked = resample_chunked(samples, rate, [1] * len(samples))
+    np.testing.assert_allclose(chunked, resample_whole(samples, rate), rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize("rate", TARGET_RATES)
+def test_output_length_follows_the_rate_ratio(rate):
+    samples = signal()
+    expected = -(-len(samples) * rate // SOURCE_RATE)
+    assert len(resample_whole(samples, rate)) == expected
+
+
+def test_same_rate_is_identity():
+    samples = signal()
+    np.testing.assert_array_equal(resample_whole(samples, SOURCE_RATE), samples)
+
+
+@pytest.mark.parametrize("sample_format", ["int16", "float32"])
+def test_formatter_odd_byte_chunks_match_whole(sample_format):
+    pcm = np.clip(np.rint(signal() * 32768), -32768, 32767).astype("<i2").tobytes()
+    whole = AudioFormatter(16000, sample_format)
+    expected = whole.convert(pcm) + whole.flush()
+    chunked = AudioFormatter(16000, sample_format)
+    out = b""
+    for start in range(0, len(pcm), 777):  # chunks impares: la muestra partida pasa al siguiente
+        out += chunked.convert(pcm[start:start + 777])
+    out += chunked.flush()
+    dtype = "<f4" if sample_format == "float32" else "<i2"
+    np.testing.assert_allclose(np.frombuffer(out, dtype).astype(np.float64),
+                               np.frombuffer(expected, dtype).astype(np.float64), rtol=0, atol=1)
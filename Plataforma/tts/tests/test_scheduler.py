@@ -0,0 +1,130 @@
+import asyncio
+import contextvars
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import vibevoice_scheduler
+from vibevoice_scheduler import LengthOrderedScheduler
+
+
+class FakeService:
+    """tts_service.stream del demo: un generador por síntesis, registra el orden de ejecución"""
+
+    def __init__(self):
+        self.started = []
+        self.active = 0
+        self.max_active = 0
+
+    def stream(self, text, **kwargs):
+        self.started.append(text)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            if text == "boom":
+                raise RuntimeError("fallo del modelo")
+            for index in range(3):
+                yield f"{text}:{index}"
+        finally:
+            self.active -= 1
+
+
+@pytest.fixture
+def installed():
+    service = FakeService()
+    upstream = SimpleNamespace(state=SimpleNamespace(tts_service=service, websocket_lock=asyncio.Lock()))
+    # Ventana larga: todas las peticiones del test entran en la misma
+    scheduler = LengthOrderedScheduler(max_window=8, max_wait_ms=200)
+    asyncio.run(scheduler.install(upstream))
+    return scheduler, service, upstream
+
+
+def consume(generators):
+    results = {}
+
+    def run(name, generator):
+        try:
+            results[name] = list(generator)
+        except Exception as e:
+            results[name] = e
+
+    threads = [threading.Thread(target=run, args=item) for item in generators.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_window_runs_serially_shortest_first(installed):
+    scheduler, service, _ = installed
+    texts = ["texto bastante largo", "corto", "mediano ok", "xx"]
+    generators = {text: service.stream(text) for text in texts}
+    results = consume(generators)
+
+    assert service.started == ["xx", "corto", "mediano ok", "texto bastante largo"]
+    assert service.max_active == 1
+    for text in texts:
+        assert results[text] == [f"{text}:{i}" for i in range(3)]
+    stats = scheduler.stats()
+    assert stats["requests"] == stats["executed"] == 4
+    assert stats["windows"] == 1
+    # "corto" y "mediano ok" conservan su puesto
+    assert stats["reordered"] == 2
+
+
+def test_same_length_keeps_arrival_order(installed):
+    _, service, _ = installed
+    generators = {text: service.stream(text) for text in ("bb", "aa", "c")}
+    consume(generators)
+    assert service.started == ["c", "bb", "aa"]
+
+
+def test_cancelled_request_is_skipped(installed):
+    scheduler, service, _ = installed
+    stop = threading.Event()
+    stop.set()
+    generators = {"viva": service.stream("viva"), "cancelada": service.stream("cancelada", stop_event=stop)}
+    results = consume(generators)
+    assert service.started == ["viva"]
+    assert results["cancelada"] == []
+    assert scheduler.stats()["cancelled"] == 1
+
+
+def test_model_error_reaches_only_its_session(installed):
+    scheduler, service, _ = installed
+    results = consume({"boom": service.stream("boom"), "bien": service.stream("bien")})
+    assert isinstance(results["boom"], RuntimeError)
+    assert results["bien"] == ["bien:0", "bien:1", "bien:2"]
+    assert scheduler.stats()["errors"] == 1
+
+
+def test_install_replaces_single_session_lock(installed):
+    _, _, upstream = installed
+    assert isinstance(upstream.state.websocket_lock, vibevoice_scheduler._NoopLock)
+
+
+def test_synthesis_runs_in_the_handler_context(installed):
+    scheduler, _, upstream = installed
+    seen = []
+    marker = contextvars.ContextVar("marker", default=None)
+
+    def stream(text, **kwargs):
+        seen.append(marker.get())
+        yield text
+
+    scheduler._original_stream = stream
+
+    result = []
+
+    def handler():
+        # Thread del handler de web.app: su contexto llega al thread del scheduler
+        marker.set("sesión")
+        result.extend(upstream.state.tts_service.stream("hola"))
+
+    thread = threading.Thread(target=handler)
+    thread.start()
+    thread.join(5)
+    assert result == ["hola"]
+    assert seen == ["sesión"]
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+from vibevoice_app import current_session, hold_model
+from vibevoice_trace import SessionTurn, Tracer
+
+
+def model_span(tracer):
+    tracer.record_shared("lm", 0, 1_000_000, module="language_model")
+
+
+def open_session(tracer, name):
+    trace = tracer.start(name, "/stream", force=True)
+    return trace, SessionTurn(tracer, trace)
+
+
+def test_span_goes_to_the_session_in_the_inference_context():
+    tracer = Tracer()
+    first, turn = open_session(tracer, "a")
+    second, _ = open_session(tracer, "b")
+
+    async def session():
+        current_session.set(turn)
+        # El handler de web.app avanza el generador con asyncio.to_thread
+        await asyncio.to_thread(model_span, tracer)
+
+    asyncio.run(session())
+    assert first.phases == {"lm": 1_000_000}
+    assert second.phases == {}
+
+
+def test_without_context_span_goes_to_the_admitted_session():
+    tracer = Tracer()
+    waiting, _ = open_session(tracer, "en-cola")
+    admitted, turn = open_session(tracer, "admitida")
+    token = current_session.set(turn)
+    hold_model(True)
+    current_session.reset(token)
+
+    thread = threading.Thread(target=model_span, args=(tracer,))
+    thread.start()
+    thread.join()
+    assert admitted.phases == {"lm": 1_000_000}
+    assert waiting.phases == {}
+    turn.hold_model(False)
+    assert tracer.holding == {}
+
+
+def test_unsampled_session_spans_are_not_attributed_to_others():
+    tracer = Tracer()
+    traced, _ = open_session(tracer, "a")
+    untraced = SessionTurn(tracer, tracer.start("b", "/stream", force=False))
+    untraced.hold_model(True)
+    model_span(tracer)
+    assert traced.phases == {}
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import vibevoice_threads
+import vibevoice_workers
+from vibevoice_app import PCM16_BYTES_PER_SECOND, log_event
+from vibevoice_codecs import CodecMiddleware
+from vibevoice_jobs import BATCH_PATH, job_worker, new_job_id
+from vibevoice_workers import (
+    AUDIO_EVENT,
+    Worker,
+    WorkerAudioMiddleware,
+    WorkerRouter,
+    audio_report,
+    partition_cores,
+)
+
+
+def smt_topology(cores, threads_per_core=2, nodes=1):
+    """Numeración Linux habitual: primero un hilo de cada core, luego los hermanos"""
+    topology = {}
+    for thread in range(threads_per_core):
+        for core in range(cores):
+            topology[thread * cores + core] = {"core": (0, core), "node": core * nodes // cores}
+    return topology
+
+
+def core_of(topology, cpu):
+    return topology[cpu]["node"], topology[cpu]["core"]
+
+
+def assert_whole_cores(partitions, topology):
+    owner = {}
+    for index, cpus in enumerate(partitions):
+        for cpu in cpus:
+            assert owner.setdefault(core_of(topology, cpu), index) == index, f"core de la CPU {cpu} repartido"
+
+
+def test_smt_siblings_stay_in_the_same_worker():
+    topology = smt_topology(4)
+    partitions = partition_cores(3, topology=topology)
+    assert partitions == [[0, 4, 1, 5], [2, 6], [3, 7]]
+    assert_whole_cores(partitions, topology)
+
+
+@pytest.mark.parametrize("workers", [1, 2, 3, 4, 5, 8])
+def test_partitions_are_disjoint_balanced_whole_cores(workers):
+    topology = smt_topology(8, nodes=2)
+    partitions = partition_cores(workers, topology=topology)
+    assert len(partitions) == min(workers, 8)
+    cpus = [cpu for part in partitions for cpu in part]
+    assert sorted(cpus) == sorted(topology)
+    core_counts = [len({core_of(topology, cpu) for cpu in part}) for part in partitions]
+    assert max(core_counts) - min(core_counts) <= 1
+    assert_whole_cores(partitions, topology)
+
+
+def test_partitions_follow_numa_nodes():
+    topology = smt_topology(8, nodes=2)
+    for part in partition_cores(2, topology=topology):
+        assert len({topology[cpu]["node"] for cpu in part}) == 1
+
+
+def test_more_workers_than_cores_falls_back_to_logical_cpus():
+    topology = smt_topology(2)
+    partitions = partition_cores(4, topology=topology)
+    assert partitions == [[0], [2], [1], [3]]
+
+
+def test_without_smt_each_cpu_is_a_core():
+    topology = {cpu: {"core": (0, cpu), "node": 0} for cpu in range(5)}
+    assert partition_cores(2, topology=topology) == [[0, 1, 2], [3, 4]]
+
+
+def test_worker_exports_the_planned_threads_for_openmp(monkeypatch):
+    topology = smt_topology(4)
+    monkeypatch.setattr(vibevoice_threads, "cpu_topology", lambda cpus=None: {c: topology[c] for c in cpus})
+    monkeypatch.setattr(vibevoice_threads, "cgroup_cpu_limit", lambda: None)
+    for name in ("VIBEVOICE_SMT", "VIBEVOICE_THREADS", "VIBEVOICE_NUMA_NODE"):
+        monkeypatch.delenv(name, raising=False)
+    launched = {}
+    monkeypatch.setattr(vibevoice_workers.subprocess, "Popen",
+                        lambda args, env, cwd: launched.update(env) or AliveProcess())
+    # 2 cores físicos con sus hermanos SMT: 2 threads, no 4
+    Worker(0, 0, [0, 4, 1, 5]).start("launcher.py")
+    assert (launched["OMP_NUM_THREADS"], launched["MKL_NUM_THREADS"]) == ("2", "2")
+    assert launched["VIBEVOICE_WORKER_CPUS"] == "0,4,1,5"
+
+
+# =============================================================================
+# Proxy HTTP del router
+# =============================================================================
+
+class FakeWorkerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        server = self.server
+        if self.path == BATCH_PATH:
+            self._json({"jobs": [{"job_id": f"w{server.index}-{n}"} for n in range(server.index + 1)]})
+        else:
+            self._json({"job_id": self.path[len(BATCH_PATH) + 1:], "served_by": server.index})
+
+    def do_POST(self):
+        server = self.server
+        server.body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._chunk(b"first\n")
+        # El resto solo sale cuando el cliente del router ya recibió el primer chunk
+        server.streamed = server.release.wait(5)
+        try:
+            for _ in range(25):
+                self._chunk(b"more\n")
+                time.sleep(0.02)
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            server.aborted = True
+
+
+class AliveProcess:
+    returncode = None
+    pid = None
+
+    def poll(self):
+        return None
+
+
+@pytest.fixture
+def router():
+    servers = []
+    workers = []
+    for index in range(2):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FakeWorkerHandler)
+        server.index = index
+        server.release = threading.Event()
+        server.streamed = server.aborted = False
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        servers.append(server)
+        worker = Worker(index, server.server_address[1], [0])
+        worker.process = AliveProcess()
+        worker.ready = True
+        workers.append(worker)
+    router = WorkerRouter(1, 0, None)
+    router.workers = workers
+    router.servers = servers
+    yield router
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+async def asgi_call(app, method, path, body=b"", on_body=None):
+    """Petición HTTP en proceso; `on_body(chunk, inbox)` ve cada chunk al enviarse"""
+    inbox = asyncio.Queue()
+    await inbox.put({"type": "http.request", "body": body, "more_body": False})
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+        if message["type"] == "http.response.body" and on_body is not None:
+            await on_body(message.get("body", b""), inbox)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"",
+             "headers": [(b"host", b"localhost")]}
+    await app(scope, inbox.get, send)
+    return sent
+
+
+def response_json(sent):
+    assert sent[0]["status"] == 200
+    return json.loads(b"".join(m.get("body", b"") for m in sent[1:]))
+
+
+def test_proxy_streams_response_chunks(router):
+    server = None
+
+    async def on_body(chunk, inbox):
+        if chunk == b"first\n":
+            server.release.set()
+
+    async def run():
+        return await asgi_call(router, "POST", BATCH_PATH, b'{"id": "a", "text": "hola"}', on_body)
+
+    router.pick_worker = lambda: router.workers[1]
+    server = router.servers[1]
+    sent = asyncio.run(run())
+    assert server.streamed, "el primer chunk no llegó al cliente antes del final de la respuesta"
+    assert server.body == b'{"id": "a", "text": "hola"}'
+    assert sent[0]["status"] == 200
+    assert (b"transfer-encoding", b"chunked") not in sent[0]["headers"]
+    assert all(m.get("more_body") for m in sent[1:-1]) and not sent[-1].get("more_body")
+    assert b"".join(m["body"] for m in sent[1:]) == b"first\n" + b"more\n" * 25
+
+
+def test_proxy_client_disconnect_closes_upstream(router):
+    server = router.servers[0]
+
+    async def on_body(chunk, inbox):
+        if chunk == b"first\n":
+            await inbox.put({"type": "http.disconnect"})
+
+    async def run():
+        sent = await asgi_call(router, "POST", BATCH_PATH, b"{}", on_body)
+        server.release.set()
+        return sent
+
+    router.pick_worker = lambda: router.workers[0]
+    sent = asyncio.run(run())
+    assert [m.get("body") for m in sent[1:]] == [b"first\n"]
+    for _ in range(100):
+        if server.aborted:
+            break
+        time.sleep(0.05)
+    assert server.aborted
+
+
+def test_job_progress_goes_to_the_worker_in_the_job_id(router):
+    assert response_json(asyncio.run(asgi_call(router, "GET", f"{BATCH_PATH}/w1-abc"))) == {
+        "job_id": "w1-abc", "served_by": 1}
+    assert response_json(asyncio.run(asgi_call(router, "GET", f"{BATCH_PATH}/w0-abc")))["served_by"] == 0
+    for job_id in ("abc", "w7-abc"):
+        sent = asyncio.run(asgi_call(router, "GET", f"{BATCH_PATH}/{job_id}"))
+        assert sent[0]["status"] == 404
+
+
+def test_job_list_merges_all_workers(router):
+    jobs = response_json(asyncio.run(asgi_call(router, "GET", BATCH_PATH)))["jobs"]
+    assert sorted(job["job_id"] for job in jobs) == ["w0-0", "w1-0", "w1-1"]
+
+
+def test_job_ids_carry_the_worker_index(monkeypatch):
+    monkeypatch.delenv("VIBEVOICE_WORKER_INDEX", raising=False)
+    assert job_worker(new_job_id()) is None
+    monkeypatch.setenv("VIBEVOICE_WORKER_INDEX", "3")
+    assert job_worker(new_job_id()) == 3
+
+
+# =============================================================================
+# Segundos de audio reportados por el worker
+# =============================================================================
+
+async def one_second_of_pcm(scope, receive, send):
+    await receive()
+    await send({"type": "websocket.accept"})
+    for _ in range(4):
+        await send({"type": "websocket.send", "bytes": bytes(PCM16_BYTES_PER_SECOND // 4)})
+    await send({"type": "websocket.close", "code": 1000})
+
+
+async def stream_call(app, query):
+    inbox = asyncio.Queue()
+    await inbox.put({"type": "websocket.connect"})
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "websocket", "path": "/stream", "query_string": query.encode()}
+    await app(scope, inbox.get, send)
+    return sent
+
+
+def test_worker_reports_pcm_seconds_whatever_the_codec():
+    app = CodecMiddleware(WorkerAudioMiddleware(one_second_of_pcm))
+    sent = asyncio.run(stream_call(app, "text=hola&codec=mulaw&worker_audio=1"))
+    wire = sum(len(m["bytes"]) for m in sent if m.get("bytes") is not None)
+    reports = [audio_report(m["text"]) for m in sent if m.get("text") is not None]
+    assert wire == PCM16_BYTES_PER_SECOND // 2
+    assert [r for r in reports if r is not None] == [1.0]
+    assert sent[-1]["type"] == "websocket.close"
+
+
+def test_worker_audio_report_only_on_request():
+    sent = asyncio.run(stream_call(WorkerAudioMiddleware(one_second_of_pcm), "text=hola"))
+    assert not [m for m in sent if m.get("text") is not None]
+
+
+def test_audio_report_ignores_other_messages():
+    assert audio_report(log_event(AUDIO_EVENT, {"audio_seconds": 2.5})) == 2.5
+    assert audio_report(log_event("backend_codec", {"codec": "opus"})) is None
+    assert audio_report("no es json") is None
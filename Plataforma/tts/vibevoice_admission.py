@@ -0,0 +1,315 @@
+"""
+VibeVoice Admission Control
+===========================
+
+Control de admisión para las síntesis de /stream: ante una ráfaga de
+conexiones es mejor servir bien a algunas sesiones (y pedir a las demás que
+reintenten) que dejar a todas por debajo del tiempo real.
+
+- Como mucho VIBEVOICE_ADMISSION_MAX_INFLIGHT síntesis en curso (default: 1;
+  web.app sintetiza de a una, también con VIBEVOICE_SCHEDULER: la espera se
+  hace en esta cola, con plazo y rechazo rápido, y no en la del scheduler)
+- Las demás esperan en una cola FIFO de VIBEVOICE_ADMISSION_QUEUE puestos, como
+  mucho VIBEVOICE_ADMISSION_DEADLINE_S segundos
+- Rechazo inmediato si la cola está llena o si la espera proyectada (duración
+  media de una síntesis x sesiones por delante / slots) supera el plazo: el
+  cliente recibe `backend_busy` con `retry_after_ms` y el WebSocket se cierra
+  con 1013 (reintentar más tarde); el pipeline y los lotes ya reintentan ante
+  `backend_busy`
+- Cliente lento: si un envío de audio queda bloqueado más de
+  VIBEVOICE_ADMISSION_SEND_TIMEOUT_S (el cliente no lee su socket y el buffer
+  TCP está lleno), se deja de generar: web.app recibe `websocket.disconnect`,
+  los envíos siguientes fallan y el slot se libera
+
+Va por dentro de la caché: un acierto no ocupa slot, y el pipeline y el texto
+incremental ocupan uno por frase, no mientras esperan texto.
+
+Profundidad de cola, rechazos y clientes lentos en GET /admission/stats (JSON)
+y GET /metrics (formato de texto de Prometheus).
+
+Variables de entorno:
+    VIBEVOICE_ADMISSION_MAX_INFLIGHT  - Síntesis simultáneas (default: 1)
+    VIBEVOICE_ADMISSION_QUEUE         - Sesiones en espera como máximo (default: 16)
+    VIBEVOICE_ADMISSION_DEADLINE_S    - Espera máxima en la cola (default: 3)
+    VIBEVOICE_ADMISSION_SEND_TIMEOUT_S - Envío bloqueado que marca un cliente lento (default: 10, 0 = sin límite)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from vibevoice_app import send_json, send_log_event
+
+logger = logging.getLogger(__name__)
+
+REJECT_REASONS = ("queue_full", "projected_wait", "deadline")
+
+
+class SlowConsumerError(ConnectionError):
+    """El cliente no lee su socket: se deja de enviarle audio"""
+
+
+def _expire(waiter):
+    if not waiter.done():
+        waiter.set_result(False)
+
+
+class AdmissionController:
+    """Slots de síntesis con cola FIFO acotada y estimación de espera"""
+
+    def __init__(self, max_inflight=1, queue_size=16, deadline_s=3.0, ewma_alpha=0.2):
+        self.max_inflight = max(1, max_inflight)
+        self.queue_size = max(0, queue_size)
+        self.deadline_s = deadline_s
+        self.ewma_alpha = ewma_alpha
+        self.inflight = 0
+        self.waiters = deque()
+        self.service_ewma = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = dict.fromkeys(REJECT_REASONS, 0)
+        self.slow_consumers = 0
+        self.wait_seconds_sum = 0.0
+        self.wait_seconds_max = 0.0
+
+    @property
+    def queue_depth(self):
+        return len(self.waiters)
+
+    def projected_wait(self, ahead):
+        """Espera estimada con `ahead` sesiones en cola por delante (None sin mediciones)"""
+        if self.service_ewma is None:
+            return None
+        return self.service_ewma * (ahead + 1) / self.max_inflight
+
+    def retry_after(self):
+        """Sugerencia de reintento: cuándo se habrá vaciado lo que hay ahora"""
+        backlog = self.projected_wait(self.queue_depth + self.inflight - 1)
+        return max(0.1, backlog if backlog is not None else self.deadline_s)
+
+    async def acquire(self):
+        """Esperar un slot; retorna None si se admite o el motivo del rechazo"""
+        if self.inflight < self.max_inflight and not self.waiters:
+            self.inflight += 1
+            self.admitted += 1
+            return None
+        if len(self.waiters) >= self.queue_size:
+            return self._reject("queue_full")
+        projected = self.projected_wait(len(self.waiters))
+        if projected is not None and projected > self.deadline_s:
+            return self._reject("projected_wait")
+
+        # El waiter se resuelve una sola vez: True si `release` le pasa el slot,
+        # False si vence el plazo antes (lo que ocurra primero en el loop)
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        timer = loop.call_later(self.deadline_s, _expire, waiter)
+        self.waiters.append(waiter)
+        self.queued += 1
+        started = time.perf_counter()
+        try:
+            admitted = await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                # Cancelado con el slot ya entregado: pasarlo al siguiente
+                self.release()
+            raise
+        finally:
+            timer.cancel()
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+        if not admitted:
+            return self._reject("deadline")
+        waited = time.perf_counter() - started
+        self.wait_seconds_sum += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self.admitted += 1
+        return None
+
+    def release(self):
+        """Liberar un slot: pasa directamente al primero de la cola"""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.inflight -= 1
+
+    def record(self, seconds):
+        if self.service_ewma is None:
+            self.service_ewma = seconds
+        else:
+            self.service_ewma += self.ewma_alpha * (seconds - self.service_ewma)
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        return reason
+
+    def stats(self):
+        return {
+            "inflight": self.inflight,
+            "queue_depth": self.queue_depth,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": dict(self.rejected),
+            "slow_consumers": self.slow_consumers,
+            "service_seconds_ewma": round(self.service_ewma, 3) if self.service_ewma is not None else None,
+            "queue_wait_seconds_avg": round(self.wait_seconds_sum / self.queued, 3) if self.queued else None,
+            "queue_wait_seconds_max": round(self.wait_seconds_max, 3),
+            "config": {
+                "max_inflight": self.max_inflight,
+                "queue_size": self.queue_size,
+                "deadline_s": self.deadline_s,
+            },
+        }
+
+    def prometheus(self):
+        """Métricas en el formato de texto de Prometheus"""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP vibevoice_admission_{name} {help_text}")
+            lines.append(f"# TYPE vibevoice_admission_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"vibevoice_admission_{name}{labels} {value}")
+
+        metric("inflight", "gauge", "Síntesis en curso", [("", self.inflight)])
+        metric("max_inflight", "gauge", "Síntesis simultáneas permitidas", [("", self.max_inflight)])
+        metric("queue_depth", "gauge", "Sesiones esperando slot", [("", self.queue_depth)])
+        metric("queue_capacity", "gauge", "Puestos de la cola de espera", [("", self.queue_size)])
+        metric("admitted_total", "counter", "Sesiones admitidas", [("", self.admitted)])
+        metric("rejected_total", "counter", "Sesiones rechazadas por motivo",
+               [(f'{{reason="{reason}"}}', count) for reason, count in self.rejected.items()])
+        metric("slow_consumers_total", "counter", "Sesiones cortadas por cliente lento",
+               [("", self.slow_consumers)])
+        metric("queue_wait_seconds", "summary", "Espera en cola de las sesiones encoladas",
+               [("_sum", round(self.wait_seconds_sum, 6)), ("_count", self.queued)])
+        if self.service_ewma is not None:
+            metric("service_seconds_ewma", "gauge", "Duración media de una síntesis",
+                   [("", round(self.service_ewma, 6))])
+        return "\n".join(lines) + "\n"
+
+
+class AdmissionMiddleware:
+    """Admisión, cola con plazo y detección de clientes lentos en /stream"""
+
+    def __init__(self, app, controller, send_timeout_s=10.0):
+        self.app = app
+        self.controller = controller
+        self.send_timeout_s = send_timeout_s
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/admission/stats":
+            await send_json(send, 200, self.controller.stats())
+            return
+        if scope["type"] == "http" and scope["path"] == "/metrics":
+            body = self.controller.prometheus().encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/plain; version=0.0.4; charset=utf-8"),
+                            (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        if scope["type"] != "websocket" or scope["path"] != "/stream":
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        reason = await controller.acquire()
+        if reason is not None:
+            await self._reject(receive, send, reason)
+            return
+        started = time.perf_counter()
+        # Las trazas atribuyen los spans del modelo a quien tiene el slot
+        hold_model(True)
+        try:
+            audio = await self._serve(scope, receive, send)
+        finally:
+            hold_model(False)
+            controller.release()
+        if audio:
+            controller.record(time.perf_counter() - started)
+
+    async def _reject(self, receive, send, reason):
+        retry_after_ms = int(self.controller.retry_after() * 1000)
+        await receive()  # websocket.connect
+        await send({"type": "websocket.accept"})
+        await send_log_event(send, "backend_busy", {
+            "reason": reason,
+            "retry_after_ms": retry_after_ms,
+            "queue_depth": self.controller.queue_depth,
+        })
+        await send({"type": "websocket.close", "code": 1013, "reason": f"retry_after_ms={retry_after_ms}"})
+
+    async def _serve(self, scope, receive, send):
+        """Ejecutar la sesión cortando la generación si el cliente deja de leer
+
+        Retorna True si se envió audio completo (las sesiones cortadas no cuentan
+        para la duración media).
+        """
+        stalled = asyncio.Event()
+        state = {"audio": False, "receive": None}
+        timeout = self.send_timeout_s or None
+
+        async def guarded_send(message):
+            if stalled.is_set():
+                raise SlowConsumerError("cliente lento: sesión cortada")
+            if message["type"] != "websocket.send":
+                await send(message)
+                return
+            try:
+                await asyncio.wait_for(send(message), timeout)
+            except asyncio.TimeoutError:
+                stalled.set()
+                self.controller.slow_consumers += 1
+                logger.warning(f"[WARN] Cliente lento: un envío lleva más de {self.send_timeout_s:g}s "
+                               f"bloqueado, se corta la sesión")
+                raise SlowConsumerError("cliente lento: sesión cortada") from None
+            if message.get("bytes"):
+                state["audio"] = True
+
+        async def guarded_receive():
+            # Un receive pendiente se conserva entre llamadas: no se pierden mensajes
+            if stalled.is_set():
+                return {"type": "websocket.disconnect", "code": 1008}
+            if state["receive"] is None:
+                state["receive"] = asyncio.ensure_future(receive())
+            stop = asyncio.ensure_future(stalled.wait())
+            try:
+                await asyncio.wait({state["receive"], stop}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stop.cancel()
+            if state["receive"].done():
+                task, state["receive"] = state["receive"], None
+                return task.result()
+            return {"type": "websocket.disconnect", "code": 1008}
+
+        try:
+            await self.app(scope, guarded_receive, guarded_send)
+        except SlowConsumerError:
+            pass
+        finally:
+            if state["receive"] is not None:
+                state["receive"].cancel()
+        if stalled.is_set():
+            try:
+                await asyncio.wait_for(send({"type": "websocket.close", "code": 1008}), 1.0)
+            except Exception:
+                pass
+        return state["audio"] and not stalled.is_set()
+
+
+def admission_from_env(app):
+    controller = AdmissionController(
+        max_inflight=int(os.environ.get("VIBEVOICE_ADMISSION_MAX_INFLIGHT", "1")),
+        queue_size=int(os.environ.get("VIBEVOICE_ADMISSION_QUEUE", "16")),
+        deadline_s=float(os.environ.get("VIBEVOICE_ADMISSION_DEADLINE_S", "3")),
+    )
+    logger.info(f"[OK] Admisión: {controller.max_inflight} síntesis simultáneas, cola de "
+                f"{controller.queue_size}, plazo {controller.deadline_s:.1f}s")
+    return AdmissionMiddleware(app, controller,
+                               send_timeout_s=float(os.environ.get("VIBEVOICE_ADMISSION_SEND_TIMEOUT_S", "10")))
@@ -0,0 +1,608 @@
+"""
+VibeVoice App Builder
+=====================
+
+Construye la app ASGI que sirven los lanzadores: importa `web.app:app` del
+demo de VibeVoice y la envuelve con las capas opcionales de este directorio
+(middlewares ASGI puros, sin depender de los internos de FastAPI).
+
+También contiene utilidades compartidas por esas capas: lectura de query
+params, envío de eventos de log con el mismo formato JSON que usa el servidor
+y respuestas JSON simples.
+
+Variables de entorno:
+    VIBEVOICE_MODELS    - Modelos adicionales por sesión con ?model=, nombre=ruta[@device] (default: ninguno)
+    VIBEVOICE_ADMISSION - Límite de síntesis simultáneas con cola acotada y plazo (default: 1)
+    VIBEVOICE_CACHE     - Caché de audio sintetizado (default: 1, desactivar con 0)
+    VIBEVOICE_SCHEDULER - Scheduler que ordena las síntesis concurrentes por longitud (default: 0)
+    VIBEVOICE_PIPELINE  - Síntesis por frases en pipeline para textos largos (default: 0)
+    VIBEVOICE_INCREMENTAL - Texto incremental por frames JSON en /stream?incremental=1 (default: 1)
+    VIBEVOICE_JOBS      - Síntesis por lotes en POST /synthesize/batch (default: 1)
+    VIBEVOICE_FRAMES    - Agrupación de chunks en frames de ?frame_ms= / VIBEVOICE_FRAME_MS (default: 1)
+    VIBEVOICE_RESAMPLE  - sample_rate/format por sesión en /stream (default: 1)
+    VIBEVOICE_CODECS    - Codecs negociables en /stream?codec=... (default: 1)
+    VIBEVOICE_QOS       - Governor de steps según la carga (default: 0)
+    VIBEVOICE_WARMUP    - Warmup de modelo y voces antes de abrir el puerto (default: 1)
+    VIBEVOICE_PRECISION - fp32, bf16 o int8-dynamic aplicado tras cargar el modelo (default: fp32)
+    VIBEVOICE_COMPILE   - torch.compile del LM y la difusión con caché en disco (default: 0)
+    VIBEVOICE_TRACE     - Trazas por petición y fase, exportables como Chrome trace (default: 0)
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+from urllib.parse import parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+# PCM16 mono a 24 kHz (formato de /stream)
+SAMPLE_RATE = 24000
+PCM16_BYTES_PER_SECOND = SAMPLE_RATE * 2
+
+DEFAULT_MODEL = "microsoft/VibeVoice-Realtime-0.5B"
+
+
+# =============================================================================
+# Utilidades ASGI
+# =============================================================================
+
+def env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off", "")
+
+
+def query_params(scope):
+    """Query string de un scope ASGI como dict (último valor gana)"""
+    return dict(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True))
+
+
+def log_event(event, data=None):
+    """Mensaje de log con el formato que envía el servidor por el WebSocket"""
+    return json.dumps({
+        "type": "log",
+        "event": event,
+        "data": data or {},
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+
+
+async def send_log_event(send, event, data=None):
+    await send({"type": "websocket.send", "text": log_event(event, data)})
+
+
+def parse_log_event(text):
+    """Nombre del evento de un mensaje de texto del servidor (o None)"""
+    try:
+        message = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(message, dict):
+        return message.get("event")
+    return None
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+# Modelo fijado para este contexto: el registro multi-modelo cambia MODEL_PATH
+# mientras carga otro modelo en su propio thread
+model_override = contextvars.ContextVar("vibevoice_model", default=None)
+
+
+def current_model():
+    return model_override.get() or os.environ.get("MODEL_PATH", DEFAULT_MODEL)
+
+
+# Sesión de /stream de este contexto (la fija la capa de trazas): llega al
+# thread de inferencia con asyncio.to_thread y con el scheduler
+current_session = contextvars.ContextVar("vibevoice_session", default=None)
+
+
+def hold_model(holding):
+    """Marcar la sesión en curso como dueña del modelo (o soltarlo)"""
+    session = current_session.get()
+    if session is not None:
+        session.hold_model(holding)
+
+
+def get_tts_service(upstream):
+    """Servicio TTS que web.app crea en su evento de startup (o None)"""
+    return getattr(upstream.state, "tts_service", None)
+
+
+# =============================================================================
+# Sesiones en proceso (sin socket)
+# =============================================================================
+
+class StreamResult:
+    """Resultado de una sesión /stream ejecutada en proceso"""
+
+    def __init__(self):
+        self.chunks = []
+        self.audio_bytes = 0
+        self.events = []
+        self.accepted = False
+        self.close_code = None
+        self.started = time.perf_counter()
+        self.first_chunk_at = None
+        self.finished_at = None
+
+    @property
+    def ok(self):
+        return self.accepted and self.audio_bytes > 0 and self.close_code in (None, 1000)
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.perf_counter()) - self.started
+
+    @property
+    def first_chunk_latency(self):
+        return None if self.first_chunk_at is None else self.first_chunk_at - self.started
+
+    @property
+    def audio_seconds(self):
+        return self.audio_bytes / PCM16_BYTES_PER_SECOND
+
+    @property
+    def pcm(self):
+        return b"".join(self.chunks)
+
+
+def _websocket_scope(path, params):
+    return {
+        "type": "websocket",
+        "asgi": {"version": "3.0"},
+        "scheme": "ws",
+        "http_version": "1.1",
+        "path": path,
+        "raw_path": path.encode("latin-1"),
+        "root_path": "",
+        "query_string": urlencode(params).encode("latin-1"),
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 0),
+        "server": ("127.0.0.1", 0),
+        "subprotocols": [],
+        "state": {},
+    }
+
+
+async def run_stream_session(app, params, path="/stream", collect=True, on_chunk=None):
+    """Ejecutar una sesión WebSocket contra `app` sin pasar por la red
+
+    Sirve para warmup, calibraciones y sub-sesiones internas: el handler de
+    web.app no distingue esta sesión de una real.
+    """
+    result = StreamResult()
+    inbox = asyncio.Queue()
+    inbox.put_nowait({"type": "websocket.connect"})
+
+    async def receive():
+        return await inbox.get()
+
+    async def send(message):
+        kind = message["type"]
+        if kind == "websocket.accept":
+            result.accepted = True
+        elif kind == "websocket.send":
+            data = message.get("bytes")
+            if data is not None:
+                if result.first_chunk_at is None:
+                    result.first_chunk_at = time.perf_counter()
+                result.audio_bytes += len(data)
+                if collect:
+                    result.chunks.append(data)
+                if on_chunk is not None:
+                    await on_chunk(data)
+            elif message.get("text") is not None:
+                result.events.append(parse_log_event(message["text"]))
+        elif kind == "websocket.close":
+            result.close_code = message.get("code", 1000)
+            # Desbloquear cualquier receive() pendiente del handler
+            inbox.put_nowait({"type": "websocket.disconnect", "code": result.close_code})
+
+    try:
+        await app(_websocket_scope(path, params), receive, send)
+    finally:
+        result.finished_at = time.perf_counter()
+    return result
+
+
+async def run_stream_session_retrying(app, params, busy_timeout, collect=True, on_chunk=None,
+                                      on_retry=None):
+    """`run_stream_session` reintentando mientras web.app responda `backend_busy`
+
+    Solo reintenta si la sesión no llegó a enviar audio; después de
+    `busy_timeout` segundos retorna el último resultado (ocupado).
+    """
+    deadline = time.perf_counter() + busy_timeout
+    delay = 0.02
+    while True:
+        result = await run_stream_session(app, params, collect=collect, on_chunk=on_chunk)
+        busy = any(e and "busy" in e for e in result.events)
+        if not busy or result.audio_bytes or time.perf_counter() > deadline:
+            return result
+        if on_retry is not None:
+            on_retry()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.25)
+
+
+class InProcessLifespan:
+    """Startup y shutdown de una app ASGI sin servidor (CLI offline)
+
+    web.app carga el modelo en su evento de startup; así un proceso sin
+    uvicorn obtiene la misma app lista para `run_stream_session`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._inbox = None
+        self._outbox = None
+        self._task = None
+
+    async def _expect(self, request, expected):
+        await self._inbox.put({"type": request})
+        reply = asyncio.ensure_future(self._outbox.get())
+        await asyncio.wait([reply, self._task], return_when=asyncio.FIRST_COMPLETED)
+        if not reply.done():
+            reply.cancel()
+            self._task.result()  # propaga la excepción de la app
+            raise RuntimeError(f"La app terminó sin responder a {request}")
+        message = reply.result()
+        if message["type"] != expected:
+            raise RuntimeError(message.get("message") or message["type"])
+
+    async def startup(self):
+        self._inbox = asyncio.Queue()
+        self._outbox = asyncio.Queue()
+        scope = {"type": "lifespan", "asgi": {"version": "3.0", "spec_version": "2.0"}, "state": {}}
+        self._task = asyncio.ensure_future(self.app(scope, self._inbox.get, self._outbox.put))
+        await self._expect("lifespan.startup", "lifespan.startup.complete")
+
+    async def shutdown(self):
+        if self._task is None or self._task.done():
+            return
+        await self._expect("lifespan.shutdown", "lifespan.shutdown.complete")
+
+
+async def asgi_get_json(app, path):
+    """GET en proceso contra una app ASGI; retorna (status, json o None)"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("latin-1"),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 0),
+        "server": ("127.0.0.1", 0),
+        "state": {},
+    }
+    response = {"status": None, "body": b""}
+    sent_request = False
+
+    async def receive():
+        nonlocal sent_request
+        if not sent_request:
+            sent_request = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    try:
+        return response["status"], json.loads(response["body"] or b"null")
+    except ValueError:
+        return response["status"], None
+
+
+# =============================================================================
+# Hooks de arranque
+# =============================================================================
+
+class LifespanHooks:
+    """Ejecuta hooks después del startup de web.app (modelo ya cargado)
+
+    Uvicorn no abre el puerto hasta que la app confirma el startup, así que
+    los hooks corren antes de aceptar tráfico. Cada hook recibe la app FastAPI
+    original para acceder a `app.state`.
+
+    También sirve GET /ready: 503 hasta que el startup de web.app y todos los
+    hooks terminan, 200 después. Los hooks pueden añadir datos al payload con
+    `ready_info`.
+
+    `hooks` modifican el modelo (se comparten si el proceso hace fork después
+    de `preload()`); `process_hooks` crean estado propio de cada proceso
+    (threads, warmup) y corren después, en cada worker. Un hook con
+    `runs_inference` verdadero sintetiza audio: con `preload()` se difiere a
+    los workers.
+    """
+
+    def __init__(self, app, upstream, hooks, process_hooks=None):
+        self.app = app
+        self.upstream = upstream
+        # Sin copiar: build_app agrega los hooks después de crear la instancia
+        self.hooks = hooks
+        self.process_hooks = process_hooks if process_hooks is not None else []
+        self.ready = False
+        self.ready_info = {}
+        self.started = time.perf_counter()
+        self.preloaded = None
+        # Hooks de modelo que `preload()` deja para cada worker
+        self.deferred_hooks = []
+        # Segundos por fase de arranque: carga del modelo y cada hook
+        self.phases = {}
+        self.ready_info["load_phases"] = self.phases
+
+    def _model_loaded(self):
+        self.ready_info["model_load_seconds"] = round(time.perf_counter() - self.started, 3)
+        self.phases["model_load"] = self.ready_info["model_load_seconds"]
+
+    async def _run_hooks(self, hooks):
+        for hook in hooks:
+            name = getattr(hook, "__name__", str(hook))
+            started = time.perf_counter()
+            try:
+                await hook(self.upstream)
+            except Exception:
+                logger.exception(f"[ERROR] Hook de arranque {name} falló")
+                raise
+            self.phases[name] = round(time.perf_counter() - started, 3)
+
+    def _mark_ready(self):
+        self.ready_info["startup_seconds"] = round(time.perf_counter() - self.started, 3)
+        self.ready = True
+        logger.info(f"[OK] Servidor listo en {self.ready_info['startup_seconds']:.2f}s")
+        logger.info("Tiempos de carga: " + ", ".join(f"{name} {seconds:.2f}s"
+                                                    for name, seconds in self.phases.items()))
+
+    async def preload(self):
+        """Startup de web.app y `hooks` sin servidor, antes de hacer fork
+
+        Solo corren aquí los hooks que cambian pesos sin sintetizar: los thread
+        pools de OpenMP/MKL que crea una inferencia no sobreviven al fork. Desde
+        el primer hook con `runs_inference` (A/B de precisión, compilación) el
+        resto se difiere y cada worker lo ejecuta antes de `process_hooks`.
+        """
+        lifespan = InProcessLifespan(self.app)
+        await lifespan.startup()
+        self._model_loaded()
+        index = next((i for i, hook in enumerate(self.hooks) if getattr(hook, "runs_inference", False)),
+                     len(self.hooks))
+        await self._run_hooks(self.hooks[:index])
+        self.deferred_hooks = self.hooks[index:]
+        if self.deferred_hooks:
+            logger.info("Hooks con inferencia diferidos a cada worker: "
+                        + ", ".join(getattr(hook, "__name__", str(hook)) for hook in self.deferred_hooks))
+        self.preloaded = lifespan
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/ready":
+            await send_json(send, 200 if self.ready else 503, {"ready": self.ready, **self.ready_info})
+            return
+        if scope["type"] != "lifespan":
+            await self.app(scope, receive, send)
+            return
+        if self.preloaded is not None:
+            await self._process_lifespan(receive, send)
+            return
+
+        async def hooked_send(message):
+            if message["type"] == "lifespan.startup.complete":
+                self._model_loaded()
+                try:
+                    await self._run_hooks(self.hooks + self.process_hooks)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": f"{type(e).__name__}: {e}"})
+                    return
+                self._mark_ready()
+            elif message["type"] == "lifespan.shutdown.complete":
+                self.ready = False
+            await send(message)
+
+        await self.app(scope, receive, hooked_send)
+
+    async def _process_lifespan(self, receive, send):
+        """Lifespan de un worker tras `preload()`: el modelo ya está cargado"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.started = time.perf_counter()
+                try:
+                    await self._run_hooks(self.deferred_hooks + self.process_hooks)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": f"{type(e).__name__}: {e}"})
+                    return
+                self._mark_ready()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # El modelo pertenece al proceso padre: nada que liberar aquí
+                self.ready = False
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+# =============================================================================
+# Construcción de la app
+# =============================================================================
+
+def load_upstream_app():
+    """Importar la app FastAPI del demo (requiere cwd = VibeVoice/demo en sys.path)"""
+    from web.app import app
+    return app
+
+
+def model_hooks(ready_info):
+    """Hooks que modifican el modelo, en el orden de build_app (snapshot, precisión, compilación)
+
+    Para cargas fuera del lifespan del servidor (render offline, registro de modelos).
+    """
+    import vibevoice_compile
+    import vibevoice_precision
+    import vibevoice_snapshot
+    hooks = (vibevoice_snapshot.snapshot_from_env(ready_info), vibevoice_precision.precision_from_env(ready_info),
+             vibevoice_compile.compile_from_env(ready_info))
+    return [hook for hook in hooks if hook is not None]
+
+
+def build_app():
+    """App ASGI con las capas habilitadas por variables de entorno"""
+    upstream = load_upstream_app()
+    app = upstream
+    layers = []
+    hooks = []
+
+    registry = None
+    if os.environ.get("VIBEVOICE_MODELS", "").strip():
+        # Junto a web.app: las capas de fuera ven `model` en la query (la caché lo usa en la clave)
+        import vibevoice_models
+        registry = vibevoice_models.registry_from_env(app)
+        app = registry
+        layers.append(f"models:{len(registry.entries)}")
+
+    scheduler = None
+    if env_flag("VIBEVOICE_SCHEDULER"):
+        import vibevoice_scheduler
+        scheduler = vibevoice_scheduler.scheduler_from_env()
+        app = vibevoice_scheduler.SchedulerStatsMiddleware(app, scheduler)
+        layers.append("scheduler")
+
+    if env_flag("VIBEVOICE_ADMISSION", default=True):
+        # Dentro de la caché: los aciertos no ocupan slot y el pipeline pide uno por frase
+        import vibevoice_admission
+        app = vibevoice_admission.admission_from_env(app)
+        layers.append("admission")
+
+    if env_flag("VIBEVOICE_CACHE", default=True):
+        import vibevoice_cache
+        app = vibevoice_cache.AudioCacheMiddleware(app, vibevoice_cache.cache_from_env())
+        layers.append("cache")
+
+    pipeline = None
+    if env_flag("VIBEVOICE_PIPELINE"):
+        # Fuera de la caché: cada segmento se cachea por separado
+        import vibevoice_pipeline
+        pipeline = vibevoice_pipeline.pipeline_from_env(app)
+        app = pipeline
+        layers.append("pipeline")
+
+    if env_flag("VIBEVOICE_INCREMENTAL", default=True):
+        # Solo actúa con ?incremental=1; sintetiza frase a frase con el pipeline
+        import vibevoice_incremental
+        app = vibevoice_incremental.incremental_from_env(app, pipeline)
+        layers.append("incremental")
+
+    if env_flag("VIBEVOICE_JOBS", default=True):
+        # Lotes HTTP: sesiones en proceso contra las capas internas (caché, pipeline, scheduler)
+        import vibevoice_jobs
+        app = vibevoice_jobs.jobs_from_env(app)
+        layers.append("jobs")
+
+    if env_flag("VIBEVOICE_QOS"):
+        # Fuera de la caché: la clave usa los steps realmente aplicados
+        import vibevoice_qos
+        app = vibevoice_qos.QoSMiddleware(app, vibevoice_qos.qos_from_env())
+        layers.append("qos")
+
+    if env_flag("VIBEVOICE_FRAMES", default=True):
+        # Agrupa PCM16 a 24 kHz: el remuestreo y los codecs procesan menos mensajes
+        import vibevoice_frames
+        app = vibevoice_frames.frames_from_env(app)
+        layers.append("frames")
+
+    # Solo actúa con ?worker_audio=1 (router y bench): segundos medidos sobre PCM16 a 24 kHz
+    import vibevoice_workers
+    app = vibevoice_workers.WorkerAudioMiddleware(app)
+
+    if env_flag("VIBEVOICE_RESAMPLE", default=True):
+        # Solo actúa con sample_rate/format en /stream; los codecs van por fuera
+        import vibevoice_resample
+        app = vibevoice_resample.resample_from_env(app)
+        layers.append("resample")
+
+    if env_flag("VIBEVOICE_CODECS", default=True):
+        # Capa exterior: las demás trabajan con PCM16 (QoS y pipeline cuentan bytes)
+        import vibevoice_codecs
+        app = vibevoice_codecs.codecs_from_env(app)
+        layers.append("codecs")
+
+    tracing = None
+    if env_flag("VIBEVOICE_TRACE"):
+        # Capa exterior: los envíos medidos son los del socket, ya codificados
+        import vibevoice_trace
+        tracing = vibevoice_trace.trace_from_env(app)
+        app = tracing
+        layers.append("trace")
+
+    process_hooks = []
+    lifespan = LifespanHooks(app, upstream, hooks, process_hooks)
+
+    # Hooks de arranque, en orden: cambios al modelo (snapshot, precisión,
+    # compilación), ajuste de threads, scheduler (su thread de inferencia toma
+    # el valor final) y warmup. Los tres últimos crean estado del proceso: en
+    # modo fork corren en cada worker
+    import vibevoice_snapshot
+    snapshot = vibevoice_snapshot.snapshot_from_env(lifespan.ready_info)
+    if snapshot is not None:
+        # Primero: la precisión y la compilación parten de los pesos sobre el mmap
+        hooks.append(snapshot)
+        layers.append("snapshot")
+
+    import vibevoice_precision
+    precision = vibevoice_precision.precision_from_env(lifespan.ready_info)
+    if precision is not None:
+        hooks.append(precision)
+        layers.append(f"precision:{precision.precision}")
+
+    import vibevoice_compile
+    compiled = vibevoice_compile.compile_from_env(lifespan.ready_info)
+    if compiled is not None:
+        hooks.append(compiled)
+        layers.append("compile")
+
+    import vibevoice_threads
+    tuner = vibevoice_threads.tuner_from_env(lifespan.ready_info)
+    if tuner is not None:
+        process_hooks.append(tuner)
+        layers.append("thread_tune")
+
+    if scheduler is not None:
+        process_hooks.append(scheduler.install)
+
+    if env_flag("VIBEVOICE_WARMUP", default=True):
+        import vibevoice_warmup
+        process_hooks.append(vibevoice_warmup.warmup_from_env(lifespan.ready_info))
+        layers.append("warmup")
+
+    if tracing is not None:
+        # Al final: el warmup corre sin hooks y, en modo fork, cada worker instrumenta su proceso
+        process_hooks.append(vibevoice_trace.TraceHook(tracing.tracer, lifespan.ready_info))
+        if registry is not None:
+            registry.load_hooks.append(vibevoice_trace.TraceHook(tracing.tracer))
+
+    app = lifespan
+
+    logger.info(f"[OK] Capas ASGI: {', '.join(layers) if layers else 'ninguna'}")
+    return app
@@ -0,0 +1,370 @@
+"""
+VibeVoice Device Benchmark
+==========================
+
+Kernels representativos de VibeVoice-Realtime-0.5B y utilidades de medición:
+- Tiempos con `time.perf_counter_ns`, warmup y sincronización del dispositivo
+  (CUDA/MPS: synchronize; DirectML: lectura de un elemento del resultado)
+- Entradas pre-asignadas en el dispositivo: el cómputo se mide sin
+  asignaciones en el host ni copias host<->device
+- Transferencias medidas aparte (host->device y device->host, GB/s)
+- Estadísticas con intervalo de confianza del 95% (t de Student)
+
+Dimensiones tomadas del modelo (Qwen2.5-0.5B como LM y cabeza de difusión):
+    hidden 896, 14 heads de 64, 2 KV heads, MLP 4864, latente acústico 64
+
+Lo usan `test-directml-performance.py` (suite completa) y la calibración de
+dispositivo del lanzador DirectML.
+"""
+
+import math
+import os
+import platform
+import statistics
+import time
+
+# Dimensiones de VibeVoice-Realtime-0.5B
+HIDDEN = 896
+HEADS = 14
+HEAD_DIM = HIDDEN // HEADS
+KV_HEADS = 2
+MLP_HIDDEN = 4864
+LATENT_DIM = 64
+DIFFUSION_LAYERS = 4
+DIFFUSION_FFN = HIDDEN * 3
+
+# Valores críticos t de Student (dos colas, 95%) por grados de libertad
+_T_CRITICAL_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306,
+    9: 2.262, 10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042,
+}
+
+
+def t_critical_95(df):
+    if df <= 0:
+        return float("nan")
+    if df > 30:
+        return 1.96
+    return _T_CRITICAL_95[max(k for k in _T_CRITICAL_95 if k <= df)]
+
+
+def summarize_ns(samples_ns):
+    """Estadísticas en ms de una lista de duraciones en ns"""
+    values = sorted(s / 1e6 for s in samples_ns)
+    n = len(values)
+    mean = statistics.fmean(values)
+    stdev = statistics.stdev(values) if n > 1 else 0.0
+    half_width = t_critical_95(n - 1) * stdev / math.sqrt(n) if n > 1 else float("nan")
+    return {
+        "n": n,
+        "mean_ms": mean,
+        "median_ms": statistics.median(values),
+        "stdev_ms": stdev,
+        "min_ms": values[0],
+        "max_ms": values[-1],
+        "p95_ms": values[min(n - 1, int(round(0.95 * (n - 1))))],
+        "ci95_low_ms": mean - half_width,
+        "ci95_high_ms": mean + half_width,
+    }
+
+
+# =============================================================================
+# Dispositivos
+# =============================================================================
+
+def available_devices():
+    """Lista de (etiqueta, torch.device) disponibles en esta máquina"""
+    import torch
+
+    devices = [("cpu", torch.device("cpu"))]
+    if torch.cuda.is_available():
+        for i in range(torch.cuda.device_count()):
+            devices.append((f"cuda:{i}", torch.device(f"cuda:{i}")))
+    if hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
+        devices.append(("mps", torch.device("mps")))
+    try:
+        import torch_directml
+        for i in range(torch_directml.device_count()):
+            devices.append((f"directml:{i}", torch_directml.device(i)))
+    except ImportError:
+        pass
+    return devices
+
+
+def resolve_device(label):
+    """Convertir 'cpu', 'cuda:0', 'mps' o 'directml:1' en un torch.device"""
+    import torch
+
+    if label.startswith("directml"):
+        import torch_directml
+        index = int(label.split(":", 1)[1]) if ":" in label else 0
+        return torch_directml.device(index)
+    return torch.device(label)
+
+
+def device_name(label):
+    import torch
+
+    if label.startswith("cuda"):
+        return torch.cuda.get_device_name(torch.device(label))
+    if label.startswith("directml"):
+        try:
+            import torch_directml
+            index = int(label.split(":", 1)[1]) if ":" in label else 0
+            if hasattr(torch_directml, "device_name"):
+                return torch_directml.device_name(index)
+        except Exception:
+            pass
+        return f"DirectML Device {label}"
+    if label == "mps":
+        return "Apple MPS"
+    return platform.processor() or platform.machine() or "CPU"
+
+
+def synchronize(device, output=None):
+    """Esperar a que el dispositivo termine el trabajo encolado"""
+    import torch
+
+    kind = device.type if hasattr(device, "type") else str(device)
+    if kind == "cpu":
+        return
+    if kind == "cuda":
+        torch.cuda.synchronize(device)
+    elif kind == "mps":
+        torch.mps.synchronize()
+    elif output is not None:
+        # DirectML no expone synchronize: leer un elemento fuerza la espera
+        output.reshape(-1)[0].item()
+
+
+def environment_info():
+    import torch
+
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+# =============================================================================
+# Medición
+# =============================================================================
+
+def time_kernel(fn, device, warmup=3, iterations=20, min_time_s=0.0):
+    """Ejecutar `fn` (retorna un tensor) con warmup y devolver duraciones en ns"""
+    for _ in range(warmup):
+        synchronize(device, fn())
+
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < iterations or time.perf_counter() - started < min_time_s:
+        synchronize(device)
+        t0 = time.perf_counter_ns()
+        out = fn()
+        synchronize(device, out)
+        samples.append(time.perf_counter_ns() - t0)
+    return samples
+
+
+# =============================================================================
+# Kernels
+# =============================================================================
+
+def _attention(q, k, v):
+    import torch
+
+    if hasattr(torch.nn.functional, "scaled_dot_product_attention"):
+        return torch.nn.functional.scaled_dot_product_attention(q, k, v)
+    scores = torch.matmul(q, k.transpose(-1, -2)) / math.sqrt(q.shape[-1])
+    return torch.matmul(torch.softmax(scores, dim=-1), v)
+
+
+def kernel_matmul(device, dtype, n=2000):
+    """Matmul cuadrado (el benchmark anterior, sin las copias)"""
+    import torch
+
+    x = torch.randn(n, n, device=device, dtype=dtype)
+    return (lambda: x @ x.T), 2 * n ** 3
+
+
+def kernel_attention_prefill(device, dtype, seq_len):
+    """Self-attention causal del LM sobre `seq_len` tokens (prefill del texto)"""
+    import torch
+
+    q = torch.randn(1, HEADS, seq_len, HEAD_DIM, device=device, dtype=dtype)
+    # GQA: las KV heads se repiten para los 14 heads de query
+    k = torch.randn(1, KV_HEADS, seq_len, HEAD_DIM, device=device, dtype=dtype)
+    v = torch.randn(1, KV_HEADS, seq_len, HEAD_DIM, device=device, dtype=dtype)
+    k = k.repeat_interleave(HEADS // KV_HEADS, dim=1)
+    v = v.repeat_interleave(HEADS // KV_HEADS, dim=1)
+    return (lambda: _attention(q, k, v)), 4 * HEADS * seq_len * seq_len * HEAD_DIM
+
+
+def kernel_attention_decode(device, dtype, cache_len):
+    """Un token de query contra una KV cache de `cache_len` (paso de streaming)"""
+    import torch
+
+    q = torch.randn(1, HEADS, 1, HEAD_DIM, device=device, dtype=dtype)
+    k = torch.randn(1, HEADS, cache_len, HEAD_DIM, device=device, dtype=dtype)
+    v = torch.randn(1, HEADS, cache_len, HEAD_DIM, device=device, dtype=dtype)
+    return (lambda: _attention(q, k, v)), 4 * HEADS * cache_len * HEAD_DIM
+
+
+def kernel_lm_mlp(device, dtype, tokens):
+    """MLP SwiGLU de una capa del LM (896 -> 4864 -> 896)"""
+    import torch
+
+    x = torch.randn(tokens, HIDDEN, device=device, dtype=dtype)
+    gate = torch.randn(HIDDEN, MLP_HIDDEN, device=device, dtype=dtype)
+    up = torch.randn(HIDDEN, MLP_HIDDEN, device=device, dtype=dtype)
+    down = torch.randn(MLP_HIDDEN, HIDDEN, device=device, dtype=dtype)
+
+    def fn():
+        return (torch.nn.functional.silu(x @ gate) * (x @ up)) @ down
+
+    return fn, 2 * 3 * tokens * HIDDEN * MLP_HIDDEN
+
+
+def kernel_diffusion_step(device, dtype, batch=2):
+    """Un paso de la cabeza de difusión (batch 2 = condicional + incondicional CFG)"""
+    import torch
+
+    latent = torch.randn(batch, LATENT_DIM, device=device, dtype=dtype)
+    condition = torch.randn(batch, HIDDEN, device=device, dtype=dtype)
+    w_in = torch.randn(LATENT_DIM, HIDDEN, device=device, dtype=dtype)
+    layers = [
+        (torch.randn(HIDDEN, 3 * HIDDEN, device=device, dtype=dtype),       # modulación adaLN
+         torch.randn(HIDDEN, DIFFUSION_FFN, device=device, dtype=dtype),
+         torch.randn(HIDDEN, DIFFUSION_FFN, device=device, dtype=dtype),
+         torch.randn(DIFFUSION_FFN, HIDDEN, device=device, dtype=dtype))
+        for _ in range(DIFFUSION_LAYERS)
+    ]
+    w_out = torch.randn(HIDDEN, LATENT_DIM, device=device, dtype=dtype)
+
+    def fn():
+        h = latent @ w_in
+        c = torch.nn.functional.silu(condition)
+        for w_mod, w_gate, w_up, w_down in layers:
+            shift, scale, gate = (c @ w_mod).chunk(3, dim=-1)
+            x = torch.nn.functional.layer_norm(h, (HIDDEN,)) * (1 + scale) + shift
+            h = h + gate * ((torch.nn.functional.silu(x @ w_gate) * (x @ w_up)) @ w_down)
+        return h @ w_out
+
+    flops = 2 * batch * (LATENT_DIM * HIDDEN + HIDDEN * LATENT_DIM
+                         + DIFFUSION_LAYERS * (3 * HIDDEN * HIDDEN + 3 * HIDDEN * DIFFUSION_FFN))
+    return fn, flops
+
+
+def kernel_conv_decoder(device, dtype, frames=64, channels=256):
+    """Bloque convolucional del decoder acústico (conv1d k=7 + upsample x4)"""
+    import torch
+
+    x = torch.randn(1, channels, frames, device=device, dtype=dtype)
+    conv = torch.randn(channels, channels, 7, device=device, dtype=dtype)
+    up = torch.randn(channels, channels // 2, 8, device=device, dtype=dtype)
+
+    def fn():
+        h = torch.nn.functional.conv1d(x, conv, padding=3)
+        h = torch.nn.functional.elu(h)
+        return torch.nn.functional.conv_transpose1d(h, up, stride=4, padding=2)
+
+    flops = 2 * channels * channels * 7 * frames + 2 * channels * (channels // 2) * 8 * frames
+    return fn, flops
+
+
+def kernel_decoder_step(device, dtype, cache_len=512):
+    """Paso completo de síntesis aproximado: capa del LM + paso de difusión
+
+    Es la unidad que usa la calibración de dispositivo: atención de decode
+    contra la KV cache, MLP del LM para un token y un paso de difusión.
+    """
+    attn, attn_flops = kernel_attention_decode(device, dtype, cache_len)
+    mlp, mlp_flops = kernel_lm_mlp(device, dtype, tokens=1)
+    diffusion, diffusion_flops = kernel_diffusion_step(device, dtype)
+
+    def fn():
+        attn()
+        mlp()
+        return diffusion()
+
+    return fn, attn_flops + mlp_flops + diffusion_flops
+
+
+def suite_kernels(quick=False):
+    """(nombre, factory) de la suite TTS; `quick` reduce tamaños"""
+    seq_lens = (128, 512) if quick else (128, 512, 1024)
+    kernels = [("matmul_2000", kernel_matmul)]
+    for seq_len in seq_lens:
+        kernels.append((f"attention_prefill_{seq_len}",
+                        lambda d, t, s=seq_len: kernel_attention_prefill(d, t, s)))
+        kernels.append((f"attention_decode_{seq_len}",
+                        lambda d, t, s=seq_len: kernel_attention_decode(d, t, s)))
+    kernels += [
+        ("lm_mlp_1tok", lambda d, t: kernel_lm_mlp(d, t, 1)),
+        ("lm_mlp_64tok", lambda d, t: kernel_lm_mlp(d, t, 64)),
+        ("diffusion_step_cfg", kernel_diffusion_step),
+        ("conv_decoder", kernel_conv_decoder),
+        ("decoder_step", kernel_decoder_step),
+    ]
+    return kernels
+
+
+# =============================================================================
+# Transferencias
+# =============================================================================
+
+def benchmark_transfers(device, sizes_mb=(0.25, 4.0), warmup=3, iterations=20):
+    """Host->device y device->host por tamaño; resultados con GB/s"""
+    import torch
+
+    results = {}
+    if getattr(device, "type", str(device)) == "cpu":
+        return results
+
+    for size_mb in sizes_mb:
+        numel = int(size_mb * 1024 * 1024 / 4)
+        host = torch.randn(numel)
+        on_device = host.to(device)
+        synchronize(device, on_device)
+
+        h2d = summarize_ns(time_kernel(lambda: host.to(device), device, warmup, iterations))
+        d2h = summarize_ns(time_kernel(lambda: on_device.cpu(), device, warmup, iterations))
+        for name, stats in (("h2d", h2d), ("d2h", d2h)):
+            stats["gb_per_s"] = (numel * 4 / 1e9) / (stats["median_ms"] / 1000) if stats["median_ms"] else None
+            results[f"{name}_{size_mb:g}mb"] = stats
+    return results
+
+
+def benchmark_device(label, dtypes=("float32", "bfloat16"), warmup=3, iterations=20,
+                     quick=False, progress=None):
+    """Suite completa en un dispositivo; retorna dict serializable a JSON"""
+    import torch
+
+    device = resolve_device(label)
+    report = {"device": label, "name": device_name(label), "kernels": {}, "transfers": {}}
+
+    for dtype_name in dtypes:
+        dtype = getattr(torch, dtype_name)
+        for name, factory in suite_kernels(quick):
+            key = f"{name}/{dtype_name}"
+            try:
+                fn, flops = factory(device, dtype)
+                stats = summarize_ns(time_kernel(fn, device, warmup, iterations))
+            except (RuntimeError, TypeError, NotImplementedError) as e:
+                report["kernels"][key] = {"error": f"{type(e).__name__}: {e}".splitlines()[0]}
+                if progress:
+                    progress(label, key, None)
+                continue
+            stats["gflops"] = flops / (stats["median_ms"] / 1000) / 1e9 if stats["median_ms"] else None
+            report["kernels"][key] = stats
+            if progress:
+                progress(label, key, stats)
+
+    try:
+        report["transfers"] = benchmark_transfers(device, warmup=warmup, iterations=iterations)
+    except RuntimeError as e:
+        report["transfers"] = {"error": str(e)}
+    return report
@@ -0,0 +1,380 @@
+"""
+VibeVoice Audio Cache
+=====================
+
+Caché direccionada por contenido delante de /stream:
+- Clave: hash SHA-256 de (texto, voz, cfg, steps, modelo)
+- Nivel 1: LRU en memoria acotado en bytes
+- Nivel 2: disco, PCM16 crudo + índice de chunks, acotado en bytes y edad
+- En un hit los chunks se reenvían por el WebSocket sin pausas (wire speed)
+- Contadores de hits/misses en GET /cache/stats
+
+Solo se guardan síntesis completas: si el cliente se desconecta a mitad, el
+servidor reporta un error o cierra con código anormal, el resultado se descarta.
+
+Variables de entorno:
+    VIBEVOICE_CACHE_DIR             - Directorio del nivel disco (default: ~/.cache/vibevoice/audio)
+    VIBEVOICE_CACHE_MEMORY_MB       - Tamaño máximo en memoria (default: 64)
+    VIBEVOICE_CACHE_DISK_MB         - Tamaño máximo en disco (default: 1024, 0 = sin disco)
+    VIBEVOICE_CACHE_MAX_AGE_HOURS   - Edad máxima de una entrada (default: 168, 0 = sin límite)
+    VIBEVOICE_CACHE_MAX_ENTRY_MB    - Tamaño máximo de una entrada (default: 8)
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from vibevoice_app import current_model, parse_log_event, query_params, send_json, send_log_event
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def cache_key(text, voice, cfg, steps, model):
+    """Clave estable para una síntesis (normaliza cfg/steps numéricos)"""
+    try:
+        cfg = repr(float(cfg))
+    except (TypeError, ValueError):
+        cfg = str(cfg or "")
+    try:
+        steps = str(int(steps))
+    except (TypeError, ValueError):
+        steps = str(steps or "")
+
+    material = json.dumps([text, voice or "", cfg, steps, model], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """Caché de dos niveles (memoria LRU + disco) de chunks PCM16"""
+
+    def __init__(self, directory=None, memory_bytes=64 * MB, disk_bytes=1024 * MB,
+                 max_age=7 * 24 * 3600, max_entry_bytes=8 * MB):
+        self.directory = Path(directory) if directory else None
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes if self.directory else 0
+        self.max_age = max_age
+        self.max_entry_bytes = max_entry_bytes
+
+        self._memory = OrderedDict()  # key -> (created, chunks)
+        self._memory_size = 0
+        self._disk = {}  # key -> (size, created, last_access)
+        self._disk_size = 0
+        self._lock = threading.Lock()
+
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "rejected": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expired": 0,
+        }
+
+        if self.disk_bytes > 0:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._scan_disk()
+
+    # -- Nivel memoria --------------------------------------------------------
+
+    def _expired(self, created, now):
+        return self.max_age > 0 and now - created > self.max_age
+
+    def get_memory(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            created, chunks = entry
+            if self._expired(created, time.time()):
+                self._drop_memory(key)
+                self.counters["expired"] += 1
+                return None
+            self._memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return chunks
+
+    def _put_memory(self, key, created, chunks, size):
+        if size > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._drop_memory(key)
+        self._memory[key] = (created, chunks)
+        self._memory_size += size
+        while self._memory_size > self.memory_bytes:
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+            self.counters["memory_evictions"] += 1
+
+    def _drop_memory(self, key):
+        _, chunks = self._memory.pop(key)
+        self._memory_size -= sum(len(c) for c in chunks)
+
+    # -- Nivel disco (llamar fuera del event loop) ----------------------------
+
+    def _paths(self, key):
+        folder = self.directory / key[:2]
+        return folder / f"{key}.pcm", folder / f"{key}.json"
+
+    def _scan_disk(self):
+        now = time.time()
+        for index_path in self.directory.glob("*/*.json"):
+            key = index_path.stem
+            pcm_path, _ = self._paths(key)
+            try:
+                size = pcm_path.stat().st_size
+                created = json.loads(index_path.read_text(encoding="utf-8"))["created"]
+                last_access = index_path.stat().st_mtime
+            except (OSError, ValueError, KeyError):
+                continue
+            self._disk[key] = (size, created, last_access)
+            self._disk_size += size
+        with self._lock:
+            self._evict_disk(now)
+        logger.info(f"[OK] Caché de audio en disco: {len(self._disk)} entradas, "
+                    f"{self._disk_size / MB:.1f} MB ({self.directory})")
+
+    def get_disk(self, key):
+        with self._lock:
+            entry = self._disk.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            size, created, _ = entry
+            now = time.time()
+            if self._expired(created, now):
+                self._drop_disk(key)
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+
+        pcm_path, index_path = self._paths(key)
+        try:
+            sizes = json.loads(index_path.read_text(encoding="utf-8"))["chunks"]
+            data = pcm_path.read_bytes()
+            os.utime(index_path, None)
+        except (OSError, ValueError, KeyError):
+            # Otro proceso pudo haber desalojado la entrada
+            with self._lock:
+                if key in self._disk:
+                    self._drop_disk(key)
+                self.counters["misses"] += 1
+            return None
+
+        view = memoryview(data)
+        chunks = []
+        offset = 0
+        for chunk_size in sizes:
+            chunks.append(view[offset:offset + chunk_size])
+            offset += chunk_size
+
+        with self._lock:
+            if key in self._disk:
+                self._disk[key] = (size, created, now)
+            self.counters["disk_hits"] += 1
+            self._put_memory(key, created, chunks, len(data))
+        return chunks
+
+    def _write_disk(self, key, created, chunks, size):
+        pcm_path, index_path = self._paths(key)
+        pcm_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_pcm = pcm_path.with_suffix(f".pcm.{os.getpid()}.tmp")
+        tmp_index = index_path.with_suffix(f".json.{os.getpid()}.tmp")
+        try:
+            with open(tmp_pcm, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            tmp_index.write_text(json.dumps({
+                "created": created,
+                "chunks": [len(c) for c in chunks],
+            }), encoding="utf-8")
+            # El índice se publica último: sin índice la entrada no existe
+            os.replace(tmp_pcm, pcm_path)
+            os.replace(tmp_index, index_path)
+        except OSError as e:
+            logger.warning(f"No se pudo escribir la entrada de caché {key[:12]}: {e}")
+            for tmp in (tmp_pcm, tmp_index):
+                tmp.unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            if key in self._disk:
+                self._drop_disk(key, remove_files=False)
+            self._disk[key] = (size, created, created)
+            self._disk_size += size
+            self._evict_disk(time.time())
+
+    def _drop_disk(self, key, remove_files=True):
+        size, _, _ = self._disk.pop(key)
+        self._disk_size -= size
+        if remove_files:
+            for path in self._paths(key):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def _evict_disk(self, now):
+        if self.max_age > 0:
+            for key in [k for k, (_, created, _) in self._disk.items() if self._expired(created, now)]:
+                self._drop_disk(key)
+                self.counters["expired"] += 1
+
+        if self._disk_size > self.disk_bytes:
+            by_access = sorted(self._disk.items(), key=lambda item: item[1][2])
+            for key, _ in by_access:
+                if self._disk_size <= self.disk_bytes:
+                    break
+                self._drop_disk(key)
+                self.counters["disk_evictions"] += 1
+
+    # -- API ------------------------------------------------------------------
+
+    def put(self, key, chunks):
+        """Guardar una síntesis completa (llamar fuera del event loop)"""
+        size = sum(len(c) for c in chunks)
+        if size == 0 or size > self.max_entry_bytes:
+            self.reject()
+            return False
+
+        created = time.time()
+        with self._lock:
+            self._put_memory(key, created, chunks, size)
+            self.counters["stores"] += 1
+        if self.disk_bytes > 0:
+            self._write_disk(key, created, chunks, size)
+        return True
+
+    def reject(self):
+        """Contar una síntesis que no se guarda (vacía o mayor que max_entry_bytes)"""
+        with self._lock:
+            self.counters["rejected"] += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_mb": round(self._memory_size / MB, 3),
+                "memory_limit_mb": round(self.memory_bytes / MB, 3),
+                "disk_entries": len(self._disk),
+                "disk_mb": round(self._disk_size / MB, 3),
+                "disk_limit_mb": round(self.disk_bytes / MB, 3),
+            }
+
+
+def cache_from_env():
+    directory = os.environ.get("VIBEVOICE_CACHE_DIR",
+                               str(Path.home() / ".cache" / "vibevoice" / "audio"))
+    memory_mb = float(os.environ.get("VIBEVOICE_CACHE_MEMORY_MB", "64"))
+    disk_mb = float(os.environ.get("VIBEVOICE_CACHE_DISK_MB", "1024"))
+    max_age_hours = float(os.environ.get("VIBEVOICE_CACHE_MAX_AGE_HOURS", "168"))
+    max_entry_mb = float(os.environ.get("VIBEVOICE_CACHE_MAX_ENTRY_MB", "8"))
+
+    cache = AudioCache(
+        directory=directory if disk_mb > 0 else None,
+        memory_bytes=int(memory_mb * MB),
+        disk_bytes=int(disk_mb * MB),
+        max_age=max_age_hours * 3600,
+        max_entry_bytes=int(max_entry_mb * MB),
+    )
+    logger.info(f"[OK] Caché de audio: memoria {memory_mb:.0f} MB, disco {disk_mb:.0f} MB, "
+                f"edad máxima {max_age_hours:.0f} h")
+    return cache
+
+
+# =============================================================================
+# Middleware ASGI
+# =============================================================================
+
+class AudioCacheMiddleware:
+    """Sirve /stream desde la caché cuando hay hit y graba los misses"""
+
+    def __init__(self, app, cache):
+        self.app = app
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/cache/stats":
+            await send_json(send, 200, self.cache.stats())
+            return
+        if scope["type"] != "websocket" or scope["path"] != "/stream":
+            await self.app(scope, receive, send)
+            return
+
+        params = query_params(scope)
+        text = params.get("text", "")
+        if not text.strip():
+            await self.app(scope, receive, send)
+            return
+
+        key = cache_key(text, params.get("voice"), params.get("cfg"), params.get("steps"),
+                        params.get("model") or current_model())
+
+        chunks = self.cache.get_memory(key)
+        if chunks is None:
+            chunks = await asyncio.to_thread(self.cache.get_disk, key)
+        if chunks is not None:
+            await self._replay(receive, send, chunks, key)
+            return
+
+        await self._record(scope, receive, send, key)
+
+    async def _replay(self, receive, send, chunks, key):
+        await receive()  # websocket.connect
+        await send({"type": "websocket.accept"})
+        await send_log_event(send, "backend_request_received", {"cache": "hit", "key": key[:16]})
+        for index, chunk in enumerate(chunks):
+            await send({"type": "websocket.send", "bytes": bytes(chunk)})
+            if index == 0:
+                await send_log_event(send, "backend_first_chunk_sent", {"cache": "hit"})
+        await send_log_event(send, "backend_stream_complete", {"cache": "hit", "chunks": len(chunks)})
+        await send({"type": "websocket.close", "code": 1000})
+
+    async def _record(self, scope, receive, send, key):
+        chunks = []
+        state = {"complete": True, "cacheable": True, "size": 0, "close_code": None}
+
+        async def recording_receive():
+            message = await receive()
+            if message["type"] == "websocket.disconnect" and state["close_code"] is None:
+                # El cliente se fue antes de que terminara la síntesis
+                state["complete"] = False
+            return message
+
+        async def recording_send(message):
+            if message["type"] == "websocket.send":
+                data = message.get("bytes")
+                if data is not None and state["cacheable"]:
+                    state["size"] += len(data)
+                    if state["size"] > self.cache.max_entry_bytes:
+                        # No entraría en la caché: no retener el audio de una síntesis larga
+                        state["cacheable"] = False
+                        chunks.clear()
+                        self.cache.reject()
+                    else:
+                        chunks.append(data)
+                elif data is None and message.get("text") is not None:
+                    event = parse_log_event(message["text"])
+                    if event and ("error" in event or "busy" in event):
+                        state["complete"] = False
+            elif message["type"] == "websocket.close":
+                state["close_code"] = message.get("code", 1000)
+            await send(message)
+
+        await self.app(scope, recording_receive, recording_send)
+
+        if state["cacheable"] and state["complete"] and state["close_code"] in (None, 1000) and chunks:
+            await asyncio.to_thread(self.cache.put, key, chunks)
@@ -0,0 +1,582 @@
+"""
+Cliente Python para VibeVoice TTS
+=================================
+
+Equivalente en Python de `vibevoice-client.js`, con el flujo de
+`test-tts-simple.py` (una sesión /stream por texto) instrumentado para medir:
+- Tiempo hasta el primer chunk de audio (visto por el cliente)
+- Tiempo hasta el evento `backend_first_chunk_sent` del servidor
+- Real-time factor (tiempo de síntesis / duración del audio)
+- Jitter entre chunks (desviación estándar y máximo de los gaps)
+
+`stream_tts_incremental` envía el texto por partes (protocolo
+`?incremental=1`) reproduciendo un stream de tokens grabado de un LLM, y mide
+el tiempo desde el primer token hasta el primer audio.
+
+Con `codec` se negocia una codificación comprimida (`vibevoice_codecs.py`):
+el cliente decodifica y entrega PCM16 a `on_chunk`; `wire_bytes` cuenta lo
+recibido por la red. Con `sample_rate` / `audio_format` el servidor entrega el
+audio ya remuestreado (`vibevoice_resample.py`). Con `frame_ms` el servidor
+agrupa el audio en frames de esa duración (`vibevoice_frames.py`), y
+`AudioBuffer` acumula lo recibido en un bytearray preasignado.
+
+`synthesize_batch` envía un lote de textos a POST /synthesize/batch
+(`vibevoice_jobs.py`) y entrega cada resultado al terminar.
+
+Requiere: pip install websockets
+"""
+
+import asyncio
+import json
+import re
+import statistics
+import time
+from urllib.parse import urlencode
+
+# PCM16 mono a 24 kHz (formato de /stream)
+SAMPLE_RATE = 24000
+PCM16_BYTES_PER_SECOND = SAMPLE_RATE * 2
+
+
+class SessionMetrics:
+    """Medidas de una sesión /stream (tiempos en segundos desde el inicio)"""
+
+    def __init__(self, text, voice, cfg, steps, request_id=None):
+        self.request_id = request_id
+        self.text = text
+        self.voice = voice
+        self.cfg = cfg
+        self.steps = steps
+        self.started = time.perf_counter()
+        self.connected_at = None
+        self.first_chunk_at = None
+        self.server_first_chunk_at = None
+        self.finished_at = None
+        self.chunk_times = []
+        self.audio_bytes = 0
+        self.events = []
+        self.close_code = None
+        self.error = None
+        self.qos_applied = None
+        self.text_started_at = None
+        self.text_finished_at = None
+        self.codec = None
+        self.wire_bytes = 0
+        self.wire_frames = 0
+        self.sample_rate = SAMPLE_RATE
+        self.sample_width = 2
+
+    def _now(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def ok(self):
+        return self.error is None and self.audio_bytes > 0
+
+    @property
+    def chunks(self):
+        return len(self.chunk_times)
+
+    @property
+    def audio_seconds(self):
+        return self.audio_bytes / (self.sample_rate * self.sample_width)
+
+    @property
+    def elapsed(self):
+        return self.finished_at if self.finished_at is not None else self._now()
+
+    @property
+    def rtf(self):
+        """Real-time factor: < 1 significa más rápido que tiempo real"""
+        if not self.audio_bytes:
+            return None
+        return self.elapsed / self.audio_seconds
+
+    @property
+    def degraded(self):
+        """True si el governor QoS del servidor bajó steps"""
+        if not self.qos_applied:
+            return False
+        return self.steps is not None and self.qos_applied.get("steps", self.steps) < self.steps
+
+    @property
+    def wire_bytes_per_audio_second(self):
+        """Ancho de banda que necesita la sesión para ir en tiempo real"""
+        if not self.audio_bytes:
+            return None
+        return self.wire_bytes / self.audio_seconds
+
+    @property
+    def first_audio_after_text(self):
+        """Sesiones incrementales: del primer token enviado al primer audio"""
+        if self.text_started_at is None or self.first_chunk_at is None:
+            return None
+        return self.first_chunk_at - self.text_started_at
+
+    @property
+    def gaps(self):
+        times = self.chunk_times
+        return [b - a for a, b in zip(times, times[1:])]
+
+    @property
+    def jitter(self):
+        gaps = self.gaps
+        return statistics.pstdev(gaps) if len(gaps) > 1 else 0.0
+
+    @property
+    def max_gap(self):
+        gaps = self.gaps
+        return max(gaps) if gaps else 0.0
+
+    def as_dict(self):
+        return {
+            "request_id": self.request_id,
+            "voice": self.voice,
+            "cfg": self.cfg,
+            "steps": self.steps,
+            "text_chars": len(self.text),
+            "ok": self.ok,
+            "error": self.error,
+            "close_code": self.close_code,
+            "connect_s": self.connected_at,
+            "first_chunk_s": self.first_chunk_at,
+            "server_first_chunk_s": self.server_first_chunk_at,
+            "elapsed_s": self.elapsed,
+            "chunks": self.chunks,
+            "audio_bytes": self.audio_bytes,
+            "codec": self.codec,
+            "sample_rate": self.sample_rate,
+            "wire_bytes": self.wire_bytes,
+            "wire_frames": self.wire_frames,
+            "wire_bytes_per_audio_s": self.wire_bytes_per_audio_second,
+            "audio_s": self.audio_seconds,
+            "rtf": self.rtf,
+            "jitter_s": self.jitter,
+            "max_gap_s": self.max_gap,
+            "qos_applied": self.qos_applied,
+            "text_started_s": self.text_started_at,
+            "text_finished_s": self.text_finished_at,
+            "first_audio_after_text_s": self.first_audio_after_text,
+        }
+
+
+def build_stream_url(server_url, text, voice=None, cfg=None, steps=None, **extra):
+    params = {} if text is None else {"text": text}
+    if voice is not None:
+        params["voice"] = voice
+    if cfg is not None:
+        params["cfg"] = cfg
+    if steps is not None:
+        params["steps"] = steps
+    params.update({k: v for k, v in extra.items() if v is not None})
+    return f"{server_url.rstrip('/')}/stream?{urlencode(params)}"
+
+
+async def _receive_session(websocket, metrics, on_chunk, on_event, timeout):
+    """Leer audio y eventos de una sesión /stream hasta que el servidor cierre"""
+    import websockets
+
+    metrics.connected_at = metrics._now()
+    decoder = None
+    while True:
+        try:
+            message = await asyncio.wait_for(websocket.recv(), timeout=timeout)
+        except websockets.exceptions.ConnectionClosedOK:
+            break
+
+        if isinstance(message, bytes):
+            now = metrics._now()
+            metrics.wire_bytes += len(message)
+            metrics.wire_frames += 1
+            if decoder is not None:
+                message = decoder.decode(message)
+                if not message:
+                    continue
+            if metrics.first_chunk_at is None:
+                metrics.first_chunk_at = now
+            metrics.chunk_times.append(now)
+            metrics.audio_bytes += len(message)
+            if on_chunk is not None:
+                on_chunk(message)
+            continue
+
+        try:
+            log = json.loads(message)
+        except ValueError:
+            continue
+        event = log.get("event") if isinstance(log, dict) else None
+        if event:
+            metrics.events.append(event)
+            if event == "backend_first_chunk_sent" and metrics.server_first_chunk_at is None:
+                metrics.server_first_chunk_at = metrics._now()
+            if event == "backend_qos_applied":
+                metrics.qos_applied = (log.get("data") or {}).get("applied")
+            if event == "backend_codec":
+                import vibevoice_codecs
+
+                data = log.get("data") or {}
+                metrics.codec = data.get("codec", "pcm16")
+                metrics.sample_rate = data.get("sample_rate", metrics.sample_rate)
+                decoder = vibevoice_codecs.make_decoder(metrics.codec, metrics.sample_rate)
+            if event == "backend_audio_format":
+                data = log.get("data") or {}
+                metrics.sample_rate = data.get("sample_rate", metrics.sample_rate)
+                metrics.sample_width = 4 if data.get("format") == "float32" else 2
+            if "error" in event or "busy" in event:
+                metrics.error = event
+        if on_event is not None:
+            on_event(log)
+    metrics.close_code = websocket.close_code
+
+
+async def _run_session(metrics, url, session, timeout):
+    """Conectar y ejecutar `session(websocket)`, dejando los errores en `metrics`"""
+    import websockets
+
+    try:
+        async with websockets.connect(url, max_size=None) as websocket:
+            await session(websocket)
+    except asyncio.TimeoutError:
+        metrics.error = f"timeout ({timeout:.0f}s sin mensajes)"
+    except websockets.exceptions.ConnectionClosedError as e:
+        metrics.close_code = e.code if hasattr(e, "code") else None
+        metrics.error = f"conexión cerrada: {e}"
+    except Exception as e:
+        metrics.error = f"{type(e).__name__}: {e}"
+
+    metrics.finished_at = metrics._now()
+    if metrics.error is None and metrics.audio_bytes == 0:
+        metrics.error = "sin audio"
+    return metrics
+
+
+async def stream_tts(server_url, text, voice=None, cfg=None, steps=None, on_chunk=None,
+                     on_event=None, timeout=60.0, request_id=None, extra_params=None, codec=None,
+                     sample_rate=None, audio_format=None, frame_ms=None):
+    """Sintetizar `text` por /stream y devolver las métricas de la sesión
+
+    `on_chunk(data)` recibe cada chunk de audio (bytes PCM16) y `on_event(log)`
+    cada evento JSON del servidor. `codec` es una lista de codecs en orden de
+    preferencia ("opus,adpcm"); `sample_rate` y `audio_format` ("int16" o
+    "float32") piden el audio remuestreado y `frame_ms` la duración de cada
+    frame (`on_chunk=AudioBuffer().write` guarda el audio sin crear una
+    lista de chunks). Los errores no se propagan:
+    quedan en `metrics.error`, para que un generador de carga pueda contarlos.
+    """
+    metrics = SessionMetrics(text, voice, cfg, steps, request_id)
+    url = build_stream_url(server_url, text, voice, cfg, steps, codec=codec, sample_rate=sample_rate,
+                           format=audio_format, frame_ms=frame_ms, **(extra_params or {}))
+
+    async def session(websocket):
+        await _receive_session(websocket, metrics, on_chunk, on_event, timeout)
+
+    return await _run_session(metrics, url, session, timeout)
+
+
+async def stream_tts_incremental(server_url, tokens, voice=None, cfg=None, steps=None, on_chunk=None,
+                                 on_event=None, timeout=60.0, request_id=None, extra_params=None,
+                                 codec=None):
+    """Enviar `tokens` [(t, delta)] por /stream?incremental=1 respetando sus tiempos
+
+    Reproduce un stream de tokens como lo generaría el LLM: cada delta sale
+    `t` segundos después del primero, y al final se envía el frame `end`.
+    El audio llega mientras tanto; `metrics.first_audio_after_text` es el
+    tiempo del primer token al primer audio.
+    """
+    text = "".join(delta for _, delta in tokens)
+    metrics = SessionMetrics(text, voice, cfg, steps, request_id)
+    url = build_stream_url(server_url, None, voice, cfg, steps, incremental=1, codec=codec,
+                           **(extra_params or {}))
+
+    async def send_tokens(websocket):
+        started = time.perf_counter()
+        metrics.text_started_at = metrics._now()
+        for t, delta in tokens:
+            wait = started + t - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await websocket.send(json.dumps({"type": "text", "text": delta}))
+        await websocket.send(json.dumps({"type": "end"}))
+        metrics.text_finished_at = metrics._now()
+
+    async def session(websocket):
+        sender = asyncio.ensure_future(send_tokens(websocket))
+        try:
+            await _receive_session(websocket, metrics, on_chunk, on_event, timeout)
+        finally:
+            if not sender.done():
+                sender.cancel()
+        if sender.done() and not sender.cancelled() and sender.exception() is not None:
+            raise sender.exception()
+
+    return await _run_session(metrics, url, session, timeout)
+
+
+def http_url(server_url):
+    """URL HTTP equivalente a la URL WebSocket del servidor"""
+    url = server_url.rstrip("/")
+    if url.startswith("wss://"):
+        return "https://" + url[len("wss://"):]
+    if url.startswith("ws://"):
+        return "http://" + url[len("ws://"):]
+    return url
+
+
+# =============================================================================
+# Lotes (POST /synthesize/batch)
+# =============================================================================
+
+def iter_batch_results(response):
+    """(cabecera, audio) por cada línea de una respuesta `format=ndjson`
+
+    Las líneas `job` y `summary` llegan con audio vacío.
+    """
+    while True:
+        line = response.readline()
+        if not line:
+            return
+        header = json.loads(line)
+        size = header.get("bytes", 0) if header.get("type") == "result" else 0
+        data = response.read(size) if size else b""
+        if len(data) < size:
+            raise EOFError(f"respuesta cortada en el item {header.get('id')}")
+        yield header, data
+
+
+def synthesize_batch(server_url, items, audio="wav", timeout=600.0):
+    """Enviar `items` [{id, text, voice, cfg, steps}] a /synthesize/batch
+
+    Generador de (cabecera, audio) en orden de finalización; `timeout` es
+    la espera máxima entre lecturas.
+    """
+    import urllib.request
+
+    body = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items).encode("utf-8")
+    request = urllib.request.Request(
+        f"{http_url(server_url)}/synthesize/batch?{urlencode({'format': 'ndjson', 'audio': audio})}",
+        data=body, method="POST", headers={"Content-Type": "application/x-ndjson"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        yield from iter_batch_results(response)
+
+
+# =============================================================================
+# Streams de tokens grabados
+# =============================================================================
+
+def _split_tokens(text):
+    """Trocear texto plano en pseudo-tokens (palabra + espacio siguiente)"""
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+def load_token_stream(path, rate=30.0):
+    """Leer un stream de tokens grabado como [(t, delta)], t en segundos
+
+    Formatos:
+    - JSONL con `{"t": 0.12, "text": "Hola"}` por línea
+    - Salida SSE de la API compatible con OpenAI (LM Studio), líneas
+      `data: {"choices": [{"delta": {"content": "..."}}]}`
+    - Texto plano, troceado en palabras
+    Las líneas sin `t` se reparten a `rate` tokens por segundo.
+    """
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+
+    lines = [line.strip() for line in content.splitlines() if line.strip()]
+    structured = bool(lines) and all(line.startswith(("{", "data:")) for line in lines)
+    if not structured:
+        return [(i / rate, token) for i, token in enumerate(_split_tokens(content))]
+
+    tokens = []
+    for line in lines:
+        if line.startswith("data:"):
+            line = line[len("data:"):].strip()
+            if line == "[DONE]":
+                continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "choices" in record:
+            choices = record.get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+        else:
+            delta = record.get("text")
+        if not delta:
+            continue
+        t = record.get("t")
+        tokens.append((float(t) if t is not None else len(tokens) / rate, delta))
+    return tokens
+
+
+# =============================================================================
+# Escritura de audio en streaming
+# =============================================================================
+
+def create_wav_header(data_size, sample_rate=SAMPLE_RATE, num_channels=1, bits_per_sample=16):
+    """Crear header WAV para audio PCM16"""
+    byte_rate = sample_rate * num_channels * bits_per_sample // 8
+    block_align = num_channels * bits_per_sample // 8
+
+    header = bytearray()
+
+    # RIFF header
+    header += b'RIFF'
+    header += (36 + data_size).to_bytes(4, 'little')
+    header += b'WAVE'
+
+    # fmt chunk
+    header += b'fmt '
+    header += (16).to_bytes(4, 'little')  # fmt chunk size
+    header += (1).to_bytes(2, 'little')   # PCM format
+    header += num_channels.to_bytes(2, 'little')
+    header += sample_rate.to_bytes(4, 'little')
+    header += byte_rate.to_bytes(4, 'little')
+    header += block_align.to_bytes(2, 'little')
+    header += bits_per_sample.to_bytes(2, 'little')
+
+    # data chunk
+    header += b'data'
+    header += data_size.to_bytes(4, 'little')
+
+    return bytes(header)
+
+
+# Offsets de los campos de tamaño en el header de 44 bytes
+_RIFF_SIZE_OFFSET = 4
+_DATA_SIZE_OFFSET = 40
+# Par y con sitio para el byte de relleno: el tamaño RIFF cabe en 32 bits
+_WAV_MAX_DATA = 0xFFFFFFFF - 37
+
+
+class AudioBuffer:
+    """Audio recibido en un bytearray preasignado que crece al doble
+
+    Cada chunk se copia a continuación del anterior (sin lista de bytes ni
+    `b"".join` al final); `clear()` conserva la memoria para la siguiente
+    sesión. `view()` es un `memoryview` de lo escrito, válido hasta el
+    próximo `write`.
+    """
+
+    def __init__(self, capacity=PCM16_BYTES_PER_SECOND * 10):
+        self._data = bytearray(capacity)
+        self.size = 0
+
+    def write(self, chunk):
+        end = self.size + len(chunk)
+        if end > len(self._data):
+            grown = bytearray(max(end, len(self._data) * 2))
+            grown[:self.size] = memoryview(self._data)[:self.size]
+            self._data = grown
+        self._data[self.size:end] = chunk
+        self.size = end
+
+    def view(self):
+        return memoryview(self._data)[:self.size]
+
+    def getvalue(self):
+        return bytes(self.view())
+
+    def clear(self):
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+
+class StreamingWavWriter:
+    """Escribe un WAV a medida que llegan los chunks, con memoria constante
+
+    El header se escribe al abrir con tamaños en cero y se corrige en
+    `close()`. Opcionalmente copia el audio a un `.pcm` crudo y entrega cada
+    chunk a consumidores en proceso (p. ej. reproducción) como `memoryview`,
+    sin copiar los bytes. Los consumidores no deben guardar la vista después
+    de retornar.
+
+    Uso:
+        with StreamingWavWriter("salida.wav", pcm_path="salida.pcm") as writer:
+            writer.write(chunk)
+    """
+
+    def __init__(self, path, sample_rate=SAMPLE_RATE, num_channels=1, bits_per_sample=16,
+                 pcm_path=None, consumers=(), buffer_size=256 * 1024):
+        self.path = path
+        self.pcm_path = pcm_path
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.bits_per_sample = bits_per_sample
+        self.consumers = list(consumers)
+        self.data_bytes = 0
+        self.chunks = 0
+        self._file = open(path, "wb", buffering=buffer_size)
+        self._pcm = open(pcm_path, "wb", buffering=buffer_size) if pcm_path else None
+        self._file.write(create_wav_header(0, sample_rate, num_channels, bits_per_sample))
+        self.closed = False
+
+    def write(self, chunk):
+        view = memoryview(chunk)
+        self._file.write(view)
+        if self._pcm is not None:
+            self._pcm.write(view)
+        for consumer in self.consumers:
+            consumer(view)
+        self.data_bytes += view.nbytes
+        self.chunks += 1
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        data_size = min(self.data_bytes, _WAV_MAX_DATA)
+        if self.data_bytes % 2:
+            # Los chunks RIFF se alinean a 2 bytes; el relleno cuenta en el tamaño RIFF
+            self._file.write(b"\x00")
+        self._file.seek(_RIFF_SIZE_OFFSET)
+        self._file.write((36 + data_size + data_size % 2).to_bytes(4, "little"))
+        self._file.seek(_DATA_SIZE_OFFSET)
+        self._file.write(data_size.to_bytes(4, "little"))
+        self._file.close()
+        if self._pcm is not None:
+            self._pcm.close()
+
+    @property
+    def duration(self):
+        return self.data_bytes / (self.sample_rate * self.num_channels * self.bits_per_sample // 8)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+# =============================================================================
+# Estadísticas
+# =============================================================================
+
+def percentile(values, q):
+    """Percentil q (0-100) con interpolación lineal; None si no hay datos"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    position = (len(values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def distribution(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
@@ -0,0 +1,532 @@
+"""
+VibeVoice Audio Codecs
+======================
+
+Codificación del audio de /stream negociada por sesión, para enlaces donde
+el ancho de banda limita más que la CPU (PCM16 a 24 kHz son 48 KB/s):
+
+    ws://localhost:3000/stream?text=Hola&codec=opus,adpcm,pcm16
+
+El cliente envía una lista en orden de preferencia y el servidor usa el
+primero disponible; lo elegido llega en el evento `backend_codec` antes del
+primer audio. Sin `codec` el stream es PCM16 como siempre.
+
+| Codec    | Bytes por segundo a 24 kHz | Requiere          |
+|----------|----------------------------|-------------------|
+| `pcm16`  | 48000                      | -                 |
+| `mulaw`  | 24000 (G.711 μ-law)        | -                 |
+| `alaw`   | 24000 (G.711 A-law)        | -                 |
+| `adpcm`  | ~12000 (IMA-ADPCM 4 bits)  | -                 |
+| `flac`   | sin pérdida, variable      | soundfile + numpy |
+| `opus`   | VIBEVOICE_OPUS_BITRATE / 8 | opuslib (libopus) |
+
+Cada mensaje binario se decodifica por sí solo (salvo Opus, que mantiene
+estado del decodificador): los bloques ADPCM llevan su propio estado inicial
+y cada mensaje FLAC es un stream FLAC completo. Opus envía paquetes de 20 ms
+precedidos por su longitud (uint16 little-endian). Con `format=float32`
+(vibevoice_resample) el audio sale sin comprimir.
+
+La codificación se hace chunk a chunk en un pool de threads, fuera del event
+loop. El mismo módulo decodifica en el cliente (`vibevoice_client.py`).
+
+Variables de entorno:
+    VIBEVOICE_CODEC_THREADS  - Threads para codificar (default: 2)
+    VIBEVOICE_OPUS_BITRATE   - Bitrate de Opus en bits/s (default: 24000)
+"""
+
+import asyncio
+import io
+import logging
+import os
+import struct
+import sys
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urlencode
+
+from vibevoice_app import query_params, send_json, send_log_event
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 24000
+CODECS = ("pcm16", "mulaw", "alaw", "adpcm", "flac", "opus")
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+def _samples(pcm):
+    """PCM16 little-endian como array('h')"""
+    samples = array("h", pcm[:len(pcm) - len(pcm) % 2])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples
+
+
+def _pcm(samples):
+    if sys.byteorder == "big":
+        samples = array("h", samples)
+        samples.byteswap()
+    return samples.tobytes()
+
+
+# =============================================================================
+# G.711 (μ-law / A-law)
+# =============================================================================
+
+_SEG_UEND = (0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF)
+_SEG_AEND = (0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF)
+
+
+def _segment(value, ends):
+    for seg, end in enumerate(ends):
+        if value <= end:
+            return seg
+    return len(ends)
+
+
+def linear_to_ulaw(sample):
+    sample >>= 2
+    if sample < 0:
+        sample, mask = -sample, 0x7F
+    else:
+        mask = 0xFF
+    sample = min(sample, 8159) + 33
+    seg = _segment(sample, _SEG_UEND)
+    if seg >= 8:
+        return 0x7F ^ mask
+    return ((seg << 4) | ((sample >> (seg + 1)) & 0x0F)) ^ mask
+
+
+def ulaw_to_linear(value):
+    value = ~value & 0xFF
+    t = (((value & 0x0F) << 3) + 0x84) << ((value & 0x70) >> 4)
+    return 0x84 - t if value & 0x80 else t - 0x84
+
+
+def linear_to_alaw(sample):
+    sample >>= 3
+    if sample >= 0:
+        mask = 0xD5
+    else:
+        mask = 0x55
+        sample = -sample - 1
+    seg = _segment(sample, _SEG_AEND)
+    if seg >= 8:
+        return 0x7F ^ mask
+    value = seg << 4
+    value |= ((sample >> 1) if seg < 2 else (sample >> seg)) & 0x0F
+    return value ^ mask
+
+
+def alaw_to_linear(value):
+    value ^= 0x55
+    t = (value & 0x0F) << 4
+    seg = (value & 0x70) >> 4
+    if seg == 0:
+        t += 8
+    elif seg == 1:
+        t += 0x108
+    else:
+        t = (t + 0x108) << (seg - 1)
+    return t if value & 0x80 else -t
+
+
+@lru_cache(maxsize=None)
+def _g711_tables(law):
+    """(codificación indexada por muestra sin signo, decodificación por byte)"""
+    to_law, to_linear = (linear_to_ulaw, ulaw_to_linear) if law == "mulaw" else (linear_to_alaw, alaw_to_linear)
+    encode = bytes(to_law(s - 65536 if s >= 32768 else s) for s in range(65536))
+    decode = array("h", (to_linear(v) for v in range(256)))
+    return encode, decode
+
+
+class G711Encoder:
+    offload = True
+
+    def __init__(self, law):
+        self.table = _g711_tables(law)[0]
+
+    def encode(self, pcm):
+        samples = array("H", _pcm(_samples(pcm)))
+        return bytes(map(self.table.__getitem__, samples))
+
+    def flush(self):
+        return b""
+
+
+class G711Decoder:
+    def __init__(self, law):
+        self.table = _g711_tables(law)[1]
+
+    def decode(self, data):
+        return _pcm(array("h", map(self.table.__getitem__, data)))
+
+
+# =============================================================================
+# IMA-ADPCM
+# =============================================================================
+
+_IMA_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+)
+_IMA_INDEX = (-1, -1, -1, -1, 2, 4, 6, 8) * 2
+_ADPCM_HEADER = struct.Struct("<hBx")
+
+
+class AdpcmEncoder:
+    """IMA-ADPCM en bloques: cabecera (predictor int16, índice uint8, 0) y nibbles
+
+    Cada mensaje lleva el estado con el que empieza, así que se decodifica
+    sin depender de los anteriores. Una muestra impar se guarda para el
+    siguiente chunk.
+    """
+
+    offload = True
+
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+        self.carry = None
+
+    def encode(self, pcm):
+        samples = _samples(pcm)
+        if self.carry is not None:
+            samples.insert(0, self.carry)
+            self.carry = None
+        if len(samples) % 2:
+            self.carry = samples.pop()
+        if not samples:
+            return b""
+
+        out = bytearray(_ADPCM_HEADER.pack(self.predictor, self.index))
+        predictor, index = self.predictor, self.index
+        low = None
+        for sample in samples:
+            step = _IMA_STEPS[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            vpdiff = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                vpdiff += step
+            step >>= 1
+            if diff >= step:
+                code |= 2
+                diff -= step
+                vpdiff += step
+            step >>= 1
+            if diff >= step:
+                code |= 1
+                vpdiff += step
+            predictor = predictor - vpdiff if code & 8 else predictor + vpdiff
+            predictor = -32768 if predictor < -32768 else 32767 if predictor > 32767 else predictor
+            index += _IMA_INDEX[code]
+            index = 0 if index < 0 else 88 if index > 88 else index
+            if low is None:
+                low = code
+            else:
+                out.append(low | (code << 4))
+                low = None
+        self.predictor, self.index = predictor, index
+        return bytes(out)
+
+    def flush(self):
+        if self.carry is None:
+            return b""
+        tail = _pcm(array("h", [self.carry, self.carry]))
+        self.carry = None
+        return self.encode(tail)
+
+
+class AdpcmDecoder:
+    def decode(self, data):
+        if len(data) < _ADPCM_HEADER.size:
+            return b""
+        predictor, index = _ADPCM_HEADER.unpack_from(data)
+        out = array("h")
+        for byte in data[_ADPCM_HEADER.size:]:
+            for code in (byte & 0x0F, byte >> 4):
+                step = _IMA_STEPS[index]
+                vpdiff = step >> 3
+                if code & 4:
+                    vpdiff += step
+                if code & 2:
+                    vpdiff += step >> 1
+                if code & 1:
+                    vpdiff += step >> 2
+                predictor = predictor - vpdiff if code & 8 else predictor + vpdiff
+                predictor = -32768 if predictor < -32768 else 32767 if predictor > 32767 else predictor
+                index += _IMA_INDEX[code]
+                index = 0 if index < 0 else 88 if index > 88 else index
+                out.append(predictor)
+        return _pcm(out)
+
+
+# =============================================================================
+# FLAC / Opus (librerías opcionales)
+# =============================================================================
+
+class FlacEncoder:
+    """Cada chunk como un stream FLAC completo (soundfile/libsndfile)"""
+
+    offload = True
+
+    def __init__(self, sample_rate):
+        import numpy  # noqa: F401
+        import soundfile  # noqa: F401
+        self.sample_rate = sample_rate
+
+    def encode(self, pcm):
+        import numpy as np
+        import soundfile as sf
+
+        samples = np.frombuffer(pcm[:len(pcm) - len(pcm) % 2], dtype="<i2")
+        if not len(samples):
+            return b""
+        buffer = io.BytesIO()
+        sf.write(buffer, samples, self.sample_rate, format="FLAC", subtype="PCM_16")
+        return buffer.getvalue()
+
+    def flush(self):
+        return b""
+
+
+class FlacDecoder:
+    def decode(self, data):
+        import soundfile as sf
+
+        samples, _ = sf.read(io.BytesIO(data), dtype="int16")
+        return samples.astype("<i2").tobytes()
+
+
+_OPUS_LENGTH = struct.Struct("<H")
+
+
+class OpusEncoder:
+    """Paquetes Opus de 20 ms, cada uno precedido por su longitud"""
+
+    offload = True
+
+    def __init__(self, sample_rate, bitrate=24000):
+        import opuslib
+
+        self.frame_samples = sample_rate // 50
+        self.frame_bytes = self.frame_samples * 2
+        self.encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_AUDIO)
+        self.encoder.bitrate = bitrate
+        self.pending = b""
+
+    def encode(self, pcm):
+        data = self.pending + pcm
+        out = bytearray()
+        offset = 0
+        while len(data) - offset >= self.frame_bytes:
+            packet = self.encoder.encode(data[offset:offset + self.frame_bytes], self.frame_samples)
+            out += _OPUS_LENGTH.pack(len(packet))
+            out += packet
+            offset += self.frame_bytes
+        self.pending = data[offset:]
+        return bytes(out)
+
+    def flush(self):
+        if not self.pending:
+            return b""
+        return self.encode(bytes(self.frame_bytes - len(self.pending)))
+
+
+class OpusDecoder:
+    def __init__(self, sample_rate):
+        import opuslib
+
+        self.frame_samples = sample_rate // 50
+        self.decoder = opuslib.Decoder(sample_rate, 1)
+
+    def decode(self, data):
+        out = bytearray()
+        offset = 0
+        while offset + _OPUS_LENGTH.size <= len(data):
+            (length,) = _OPUS_LENGTH.unpack_from(data, offset)
+            offset += _OPUS_LENGTH.size
+            out += self.decoder.decode(bytes(data[offset:offset + length]), self.frame_samples)
+            offset += length
+        return bytes(out)
+
+
+# =============================================================================
+# Negociación
+# =============================================================================
+
+class Pcm16Codec:
+    offload = False
+
+    def encode(self, pcm):
+        return pcm
+
+    def flush(self):
+        return b""
+
+    def decode(self, data):
+        return data
+
+
+def codec_available(name, sample_rate=SAMPLE_RATE):
+    if name in ("pcm16", "mulaw", "alaw", "adpcm"):
+        return True
+    try:
+        if name == "flac":
+            import numpy  # noqa: F401
+            import soundfile  # noqa: F401
+            return True
+        if name == "opus":
+            import opuslib  # noqa: F401
+            return sample_rate in OPUS_RATES
+    except Exception:
+        # opuslib lanza Exception si no encuentra libopus
+        return False
+    return False
+
+
+def available_codecs(sample_rate=SAMPLE_RATE):
+    return [name for name in CODECS if codec_available(name, sample_rate)]
+
+
+def negotiate(requested, sample_rate=SAMPLE_RATE):
+    """Primer codec disponible de una lista separada por comas (o pcm16)"""
+    for name in (requested or "").split(","):
+        name = name.strip().lower()
+        if name in CODECS and codec_available(name, sample_rate):
+            return name
+    return "pcm16"
+
+
+def make_encoder(name, sample_rate=SAMPLE_RATE, opus_bitrate=24000):
+    if name in ("mulaw", "alaw"):
+        return G711Encoder(name)
+    if name == "adpcm":
+        return AdpcmEncoder()
+    if name == "flac":
+        return FlacEncoder(sample_rate)
+    if name == "opus":
+        return OpusEncoder(sample_rate, opus_bitrate)
+    return Pcm16Codec()
+
+
+def make_decoder(name, sample_rate=SAMPLE_RATE):
+    if name in ("mulaw", "alaw"):
+        return G711Decoder(name)
+    if name == "adpcm":
+        return AdpcmDecoder()
+    if name == "flac":
+        return FlacDecoder()
+    if name == "opus":
+        return OpusDecoder(sample_rate)
+    return Pcm16Codec()
+
+
+# =============================================================================
+# Middleware
+# =============================================================================
+
+class CodecMiddleware:
+    """Codifica el audio de /stream con el codec negociado por la sesión"""
+
+    def __init__(self, app, threads=2, opus_bitrate=24000):
+        self.app = app
+        self.opus_bitrate = opus_bitrate
+        self.threads = max(1, threads)
+        # Se crea en el primer uso: con VIBEVOICE_WORKER_MODE=fork los threads
+        # del padre no existen en los workers
+        self._executor = None
+        self.stats = {}
+        # Las tablas G.711 tardan ~0.1s en construirse: fuera del primer request
+        # (y antes del fork, compartidas por los workers)
+        for law in ("mulaw", "alaw"):
+            _g711_tables(law)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="codec")
+        return self._executor
+
+    def _stats(self, name):
+        return self.stats.setdefault(name, {"sessions": 0, "pcm_bytes": 0, "wire_bytes": 0})
+
+    def stats_dict(self):
+        codecs = {}
+        for name, entry in self.stats.items():
+            ratio = entry["wire_bytes"] / entry["pcm_bytes"] if entry["pcm_bytes"] else None
+            codecs[name] = dict(entry, ratio=round(ratio, 4) if ratio is not None else None)
+        return {"available": available_codecs(), "sessions": codecs}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/codecs":
+            await send_json(send, 200, self.stats_dict())
+            return
+        if scope["type"] != "websocket" or scope["path"] != "/stream":
+            await self.app(scope, receive, send)
+            return
+        params = query_params(scope)
+        requested = params.pop("codec", None)
+        if requested is None:
+            await self.app(scope, receive, send)
+            return
+        if params.get("format", "int16") != "int16":
+            # Los codecs trabajan sobre PCM16: float32 sale sin comprimir
+            scope = dict(scope, query_string=urlencode(params).encode("latin-1"))
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            sample_rate = int(params.get("sample_rate") or SAMPLE_RATE)
+        except ValueError:
+            sample_rate = SAMPLE_RATE
+        name = negotiate(requested, sample_rate)
+        encoder = make_encoder(name, sample_rate, self.opus_bitrate)
+        stats = self._stats(name)
+        stats["sessions"] += 1
+        scope = dict(scope, query_string=urlencode(params).encode("latin-1"))
+        loop = asyncio.get_running_loop()
+
+        async def run(fn, *args):
+            if not encoder.offload:
+                return fn(*args)
+            return await loop.run_in_executor(self.executor, fn, *args)
+
+        async def wire(data):
+            if data:
+                stats["wire_bytes"] += len(data)
+                await send({"type": "websocket.send", "bytes": data})
+
+        async def encoding_send(message):
+            kind = message["type"]
+            if kind == "websocket.send" and message.get("bytes") is not None:
+                stats["pcm_bytes"] += len(message["bytes"])
+                await wire(await run(encoder.encode, message["bytes"]))
+                return
+            if kind == "websocket.close":
+                await wire(await run(encoder.flush))
+            await send(message)
+            if kind == "websocket.accept":
+                await send_log_event(send, "backend_codec",
+                                     {"codec": name, "requested": requested, "sample_rate": sample_rate})
+
+        await self.app(scope, receive, encoding_send)
+
+
+def codecs_from_env(app):
+    return CodecMiddleware(
+        app,
+        threads=int(os.environ.get("VIBEVOICE_CODEC_THREADS", "2")),
+        opus_bitrate=int(os.environ.get("VIBEVOICE_OPUS_BITRATE", "24000")),
+    )
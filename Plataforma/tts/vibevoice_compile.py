@@ -0,0 +1,269 @@
+"""
+VibeVoice Compiled Mode
+=======================
+
+Hook de arranque opcional (VIBEVOICE_COMPILE=1) que pasa por `torch.compile`
+el forward del LM (`language_model`, `tts_language_model`) y de la cabeza de
+difusión (`prediction_head`), y los compila antes de abrir el puerto para los
+buckets de longitud de texto y los valores de steps que se sirven.
+
+Para que reiniciar no cueste una compilación completa, los artefactos se
+guardan en disco en un directorio indexado por modelo, precisión, dispositivo,
+modo y backend de compilación y versiones de torch/Python:
+- Caché FX/Inductor (TORCHINDUCTOR_CACHE_DIR, TRITON_CACHE_DIR)
+- `torch.compiler.save_cache_artifacts()` cuando la versión de torch lo tiene;
+  se recarga con `load_cache_artifacts()` en el siguiente arranque
+
+Registra el tiempo de compilación y el speedup medido (RTF eager vs
+compilado sobre la misma frase). Si la compilación falla en cualquiera de los
+buckets (p. ej. backend no soportado en DirectML) vuelve al forward eager: un
+bucket roto fallaría también con tráfico real.
+
+Variables de entorno:
+    VIBEVOICE_COMPILE          - Activar el modo compilado (default: 0)
+    VIBEVOICE_COMPILE_CACHE    - Directorio base de la caché (default: ~/.cache/vibevoice/compile)
+    VIBEVOICE_COMPILE_MODE     - Modo de torch.compile (default: default)
+    VIBEVOICE_COMPILE_BACKEND  - Backend de torch.compile (default: inductor)
+    VIBEVOICE_COMPILE_STEPS    - Valores de steps a compilar (default: VIBEVOICE_WARMUP_STEPS o 2,5)
+    VIBEVOICE_COMPILE_BUCKETS  - Longitudes de texto (caracteres) a compilar (default: 32,128,384)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import platform
+import time
+from pathlib import Path
+
+from vibevoice_app import current_model, env_flag, get_tts_service, run_stream_session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE = Path.home() / ".cache" / "vibevoice" / "compile"
+ARTIFACTS_FILE = "cache_artifacts.bin"
+
+COMPILE_MODULES = ("language_model", "tts_language_model", "prediction_head", "diffusion_head")
+
+BUCKET_TEXT = ("Hola, esta es una frase de prueba para preparar el modo compilado del servidor. "
+               "The quick brown fox jumps over the lazy dog. ")
+REFERENCE_TEXT = "Hola, este es un test del sistema de síntesis de voz. ¿Funciona correctamente?"
+
+
+def bucket_text(chars):
+    """Texto de aproximadamente `chars` caracteres"""
+    repeated = BUCKET_TEXT * (chars // len(BUCKET_TEXT) + 1)
+    return repeated[:chars].rsplit(" ", 1)[0] or repeated[:chars]
+
+
+def cache_key(model_id, precision, device, mode="default", backend="inductor"):
+    import torch
+
+    info = {
+        "model": model_id,
+        "precision": precision,
+        "device": str(device),
+        "mode": mode,
+        "backend": backend,
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+    }
+    return hashlib.sha256(json.dumps(info, sort_keys=True).encode("utf-8")).hexdigest()[:16], info
+
+
+def configure_cache(directory):
+    """Apuntar las cachés de Inductor/Triton a `directory` y activar la caché FX"""
+    directory.mkdir(parents=True, exist_ok=True)
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = str(directory / "inductor")
+    os.environ["TRITON_CACHE_DIR"] = str(directory / "triton")
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    os.environ.setdefault("TORCHINDUCTOR_AUTOGRAD_CACHE", "1")
+    try:
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True
+    except (ImportError, AttributeError):
+        pass
+
+
+def load_artifacts(directory):
+    """Cargar artefactos guardados (torch >= 2.6); retorna True si había"""
+    import torch
+
+    path = directory / ARTIFACTS_FILE
+    load = getattr(getattr(torch, "compiler", None), "load_cache_artifacts", None)
+    if load is None or not path.exists():
+        return False
+    try:
+        load(path.read_bytes())
+        return True
+    except Exception as e:
+        logger.warning(f"[WARN] Artefactos de compilación inválidos, se recompila: {e}")
+        return False
+
+
+def save_artifacts(directory):
+    import torch
+
+    save = getattr(getattr(torch, "compiler", None), "save_cache_artifacts", None)
+    if save is None:
+        return None
+    result = save()
+    if not result:
+        return None
+    data = result[0]
+    tmp = directory / (ARTIFACTS_FILE + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, directory / ARTIFACTS_FILE)
+    return len(data)
+
+
+def compile_modules(model, mode="default", backend="inductor"):
+    """Reemplazar el forward de los submódulos objetivo por su versión compilada
+
+    Retorna los nombres compilados; `restore_modules` deshace el cambio.
+    """
+    import torch
+
+    names = []
+    for name, module in model.named_modules():
+        if name.rsplit(".", 1)[-1] not in COMPILE_MODULES:
+            continue
+        if any(name.startswith(n + ".") for n in names):
+            continue
+        # dynamic=None: Dynamo marca dinámicas las dimensiones que cambian
+        # (longitud de la KV cache) en lugar de recompilar por cada valor
+        module.forward = torch.compile(module.forward, mode=None if mode == "default" else mode,
+                                       backend=backend, dynamic=None)
+        names.append(name)
+    return names
+
+
+def restore_modules(model, names):
+    for name in names:
+        module = model.get_submodule(name)
+        if "forward" in module.__dict__:
+            del module.forward
+
+
+class CompileHook:
+    """Hook de arranque: compila, calienta los buckets servidos y guarda la caché"""
+
+    def __init__(self, ready_info, cache_base=DEFAULT_CACHE, mode="default", backend="inductor",
+                 steps=(2, 5), buckets=(32, 128, 384), cfg=1.5):
+        self.ready_info = ready_info
+        self.cache_base = Path(cache_base).expanduser()
+        self.mode = mode
+        self.backend = backend
+        self.steps = list(steps)
+        self.buckets = list(buckets)
+        self.cfg = cfg
+        # El warmup de los buckets sintetiza: en modo fork corre en cada worker
+        self.runs_inference = True
+        self.__name__ = "compile"
+
+    async def _rtf(self, upstream, text, steps):
+        result = await run_stream_session(upstream, {"text": text, "cfg": self.cfg, "steps": steps},
+                                          collect=False)
+        if not result.ok or not result.audio_seconds:
+            return None
+        return result.elapsed / result.audio_seconds
+
+    async def __call__(self, upstream):
+        service = get_tts_service(upstream)
+        model = getattr(service, "model", None)
+        if model is None:
+            logger.warning("[WARN] tts_service.model no disponible, modo compilado desactivado")
+            return
+
+        device = next(model.parameters()).device
+        precision = os.environ.get("VIBEVOICE_PRECISION", "fp32").strip().lower()
+        key, info = cache_key(current_model(), precision, device, self.mode, self.backend)
+        directory = self.cache_base / key
+        configure_cache(directory)
+        cache_hit = load_artifacts(directory)
+
+        logger.info("=" * 60)
+        logger.info(f"Modo compilado ({self.backend}, caché {directory}"
+                    f"{', artefactos reutilizados' if cache_hit else ''})")
+        logger.info("=" * 60)
+
+        # Referencia eager (la primera síntesis se descarta: carga perezosa)
+        reference_steps = self.steps[0]
+        await self._rtf(upstream, REFERENCE_TEXT, reference_steps)
+        eager_rtf = await self._rtf(upstream, REFERENCE_TEXT, reference_steps)
+
+        started = time.perf_counter()
+        names = compile_modules(model, self.mode, self.backend)
+        if not names:
+            logger.warning("[WARN] No se encontraron submódulos del LM/difusión para compilar")
+            return
+
+        failed = []
+        for steps in self.steps:
+            for chars in self.buckets:
+                rtf = await self._rtf(upstream, bucket_text(chars), steps)
+                logger.info(f"  steps={steps} ~{chars} caracteres: "
+                            f"{'OK' if rtf is not None else 'sin audio'}")
+                if rtf is None:
+                    failed.append(f"steps={steps} ~{chars}")
+        # La frase de referencia también se compila antes de medir el speedup
+        if await self._rtf(upstream, REFERENCE_TEXT, reference_steps) is None:
+            failed.append(f"referencia steps={reference_steps}")
+        compile_seconds = time.perf_counter() - started
+
+        if failed:
+            restore_modules(model, names)
+            logger.warning(f"[WARN] La compilación falló en {len(failed)} bucket(s) "
+                           f"({', '.join(failed)}), se vuelve a eager")
+            self.ready_info["compile"] = {"enabled": False, "error": "compilación fallida", "failed": failed}
+            return
+
+        compiled_rtf = await self._rtf(upstream, REFERENCE_TEXT, reference_steps)
+        speedup = eager_rtf / compiled_rtf if eager_rtf and compiled_rtf else None
+
+        artifact_bytes = None
+        try:
+            artifact_bytes = save_artifacts(directory)
+        except Exception as e:
+            logger.warning(f"[WARN] No se pudieron guardar los artefactos de compilación: {e}")
+        (directory / "key.json").write_text(json.dumps(info, indent=2), encoding="utf-8")
+
+        self.ready_info["compile"] = {
+            "enabled": True,
+            "modules": names,
+            "cache_dir": str(directory),
+            "cache_hit": cache_hit,
+            "compile_seconds": round(compile_seconds, 3),
+            "eager_rtf": eager_rtf,
+            "compiled_rtf": compiled_rtf,
+            "speedup": speedup,
+            "artifact_bytes": artifact_bytes,
+        }
+        logger.info(f"[OK] Compilado: {', '.join(names)}")
+        logger.info(f"[METRIC] compile_seconds={compile_seconds:.3f} cache_hit={int(cache_hit)} "
+                    f"eager_rtf={_fmt(eager_rtf)} compiled_rtf={_fmt(compiled_rtf)} "
+                    f"speedup={_fmt(speedup, '.2f')}")
+
+
+def _fmt(value, spec=".3f"):
+    return "-" if value is None else format(value, spec)
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def compile_from_env(ready_info):
+    """CompileHook si VIBEVOICE_COMPILE está activo, si no None"""
+    if not env_flag("VIBEVOICE_COMPILE"):
+        return None
+    steps = os.environ.get("VIBEVOICE_COMPILE_STEPS") or os.environ.get("VIBEVOICE_WARMUP_STEPS", "2,5")
+    return CompileHook(
+        ready_info,
+        cache_base=os.environ.get("VIBEVOICE_COMPILE_CACHE") or DEFAULT_CACHE,
+        mode=os.environ.get("VIBEVOICE_COMPILE_MODE", "default"),
+        backend=os.environ.get("VIBEVOICE_COMPILE_BACKEND", "inductor"),
+        steps=_int_list(steps),
+        buckets=_int_list(os.environ.get("VIBEVOICE_COMPILE_BUCKETS", "32,128,384")),
+    )
@@ -0,0 +1,418 @@
+"""
+Selección de dispositivo calibrada para VibeVoice
+=================================================
+
+En lugar de heurísticas fijas (CUDA > DirectML de mayor índice > CPU), mide
+un paso de síntesis con las dimensiones del modelo (`decoder_step` de
+`vibevoice_bench`: atención de decode + MLP del LM + paso de difusión) en
+cada dispositivo candidato y elige el más rápido.
+
+La decisión se guarda en un perfil JSON indexado por una huella del hardware
+(CPU, nombres de GPU, versión de driver si se puede obtener, versiones de
+torch / torch-directml / CUDA). Los arranques siguientes con la misma huella
+reutilizan la decisión sin medir.
+
+`detect_and_select_device()` configura el dispositivo elegido (CUDA,
+DirectML o CPU con su plan de threads) y el shim de torch.xpu; lo usan el
+lanzador DirectML y el CLI de render offline.
+
+Variables de entorno:
+    VIBEVOICE_CALIBRATE        - auto (usar perfil o medir), force (medir siempre),
+                                 off (heurística anterior) (default: auto)
+    VIBEVOICE_DEVICE_PROFILE   - Archivo del perfil
+                                 (default: ~/.cache/vibevoice/device-profile.json)
+    VIBEVOICE_CALIBRATE_ITERS  - Iteraciones medidas por dispositivo (default: 10)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import types
+from pathlib import Path
+
+import vibevoice_bench
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE = Path.home() / ".cache" / "vibevoice" / "device-profile.json"
+
+
+def calibration_mode():
+    mode = os.environ.get("VIBEVOICE_CALIBRATE", "auto").strip().lower()
+    if mode in ("0", "false", "no", "off"):
+        return "off"
+    if mode in ("force", "always"):
+        return "force"
+    return "auto"
+
+
+def profile_path():
+    return Path(os.environ.get("VIBEVOICE_DEVICE_PROFILE") or DEFAULT_PROFILE).expanduser()
+
+
+def _run_lines(command):
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+
+def _gpu_drivers():
+    """Nombres y versiones de driver de las GPUs (best-effort)"""
+    drivers = _run_lines(["nvidia-smi", "--query-gpu=name,driver_version", "--format=csv,noheader"])
+    if sys.platform == "win32":
+        drivers += _run_lines([
+            "powershell", "-NoProfile", "-Command",
+            "Get-CimInstance Win32_VideoController | ForEach-Object { $_.Name + '|' + $_.DriverVersion }",
+        ])
+    return sorted(drivers)
+
+
+def hardware_fingerprint(candidates):
+    """Huella estable del hardware + drivers + versiones de torch"""
+    import torch
+
+    info = {
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        # La CPU se mide con los threads del plan: otro plan invalida el perfil
+        "cpu_threads": torch.get_num_threads(),
+        "torch": torch.__version__,
+        "cuda": getattr(torch.version, "cuda", None),
+        "devices": [(label, vibevoice_bench.device_name(label)) for label in candidates],
+        "drivers": _gpu_drivers(),
+    }
+    try:
+        import torch_directml
+        info["torch_directml"] = getattr(torch_directml, "__version__", "unknown")
+    except ImportError:
+        info["torch_directml"] = None
+
+    key = hashlib.sha256(json.dumps(info, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return key, info
+
+
+def calibrate(candidates, iterations=None, warmup=2):
+    """Medir `decoder_step` en fp32 en cada candidato; retorna {label: resultado}"""
+    if iterations is None:
+        iterations = int(os.environ.get("VIBEVOICE_CALIBRATE_ITERS", "10"))
+
+    import torch
+
+    results = {}
+    for label in candidates:
+        started = time.perf_counter()
+        try:
+            device = vibevoice_bench.resolve_device(label)
+            fn, _ = vibevoice_bench.kernel_decoder_step(device, torch.float32)
+            stats = vibevoice_bench.summarize_ns(
+                vibevoice_bench.time_kernel(fn, device, warmup=warmup, iterations=iterations)
+            )
+        except Exception as e:
+            logger.warning(f"  {label}: calibración falló ({type(e).__name__}: {e})")
+            results[label] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        results[label] = {
+            "median_ms": stats["median_ms"],
+            "ci95_low_ms": stats["ci95_low_ms"],
+            "ci95_high_ms": stats["ci95_high_ms"],
+            "probe_seconds": time.perf_counter() - started,
+        }
+        logger.info(f"  {label:12s} {stats['median_ms']:8.3f} ms/paso  "
+                    f"({vibevoice_bench.device_name(label)})")
+    return results
+
+
+def _load_profiles(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_profiles(path, profiles):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(profiles, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def select_device(candidates, mode=None):
+    """Elegir el candidato más rápido, reutilizando el perfil si existe
+
+    Retorna la etiqueta elegida (p. ej. "directml:1") o None si no se pudo
+    medir ninguno (el llamador usa su heurística).
+    """
+    mode = mode or calibration_mode()
+    if mode == "off" or not candidates:
+        return None
+    if len(candidates) == 1:
+        return candidates[0]
+
+    key, info = hardware_fingerprint(candidates)
+    path = profile_path()
+    profiles = _load_profiles(path)
+    cached = profiles.get(key)
+    if mode == "auto" and cached and cached.get("selected") in candidates:
+        logger.info(f"Perfil de dispositivo reutilizado ({path}, huella {key}): {cached['selected']}")
+        return cached["selected"]
+
+    logger.info(f"Calibrando {len(candidates)} dispositivos (paso de síntesis sintético)...")
+    results = calibrate(candidates)
+    timed = {label: r["median_ms"] for label, r in results.items() if "median_ms" in r}
+    if not timed:
+        return None
+    selected = min(timed, key=timed.get)
+
+    profiles[key] = {
+        "selected": selected,
+        "created": time.time(),
+        "fingerprint": info,
+        "results": results,
+    }
+    try:
+        _save_profiles(path, profiles)
+        logger.info(f"Perfil guardado en {path}")
+    except OSError as e:
+        logger.warning(f"No se pudo guardar el perfil de dispositivo: {e}")
+
+    logger.info(f"Dispositivo más rápido: {selected} ({timed[selected]:.3f} ms/paso)")
+    return selected
+
+
+# =============================================================================
+# Detección y configuración de dispositivo (lanzadores y CLI)
+# =============================================================================
+
+def install_xpu_shim(torch):
+    """torch.xpu vacío para el código del demo que lo consulta sin comprobar"""
+    if not hasattr(torch, "xpu"):
+        torch.xpu = types.SimpleNamespace(
+            empty_cache=lambda: None,
+            is_available=lambda: False,
+            device_count=lambda: 0,
+            manual_seed=lambda seed: torch.manual_seed(seed),
+            reset_peak_memory_stats=lambda *args, **kwargs: None,
+            max_memory_allocated=lambda *args, **kwargs: 0,
+            synchronize=lambda *args, **kwargs: None,
+        )
+
+
+def detect_and_select_device():
+    """Detectar automáticamente el mejor dispositivo disponible"""
+
+    device_type = os.environ.get("VIBEVOICE_DEVICE", "auto").lower()
+    gpu_index = os.environ.get("DIRECTML_DEVICE", None)
+
+    logger.info("=" * 60)
+    logger.info("Detectando dispositivos disponibles...")
+    logger.info("=" * 60)
+
+    # Si el usuario especificó el tipo de device
+    if device_type in ["cuda", "directml", "cpu"]:
+        logger.info(f"Dispositivo especificado: {device_type}")
+
+        if device_type == "cuda":
+            return setup_cuda()
+        elif device_type == "directml":
+            return setup_directml(gpu_index)
+        else:
+            return setup_cpu()
+
+    # Auto-detección
+    logger.info("Modo auto-detección activado")
+
+    candidates = list_device_candidates()
+    if gpu_index is not None:
+        # DIRECTML_DEVICE fija la GPU: solo se compara contra CUDA/CPU
+        candidates = [c for c in candidates if not c.startswith("directml") or c == f"directml:{gpu_index}"]
+    logger.info(f"Candidatos: {', '.join(candidates)}")
+
+    # Plan de threads antes de calibrar: la CPU se mide con los threads con que va a correr
+    cpu_plan = None
+    if "cpu" in candidates:
+        import torch
+        import vibevoice_threads
+        cpu_plan = vibevoice_threads.configure_cpu_threads(torch)
+
+    # Calibración: medir un paso de síntesis en cada candidato (o reutilizar el perfil)
+    selected = calibrated_choice(candidates)
+    if selected is not None:
+        return setup_from_label(selected, cpu_plan)
+
+    # Heurística fija si la calibración está desactivada o falló
+    # 1. CUDA (mejor rendimiento)
+    if any(c.startswith("cuda") for c in candidates):
+        logger.info("✓ CUDA detectado (GPU NVIDIA)")
+        return setup_cuda()
+
+    # 2. DirectML (funciona con AMD, Intel, NVIDIA)
+    if any(c.startswith("directml") for c in candidates):
+        logger.info("✓ DirectML detectado")
+        return setup_directml(gpu_index)
+
+    # 3. Fallback a CPU
+    logger.info("✓ Usando CPU (sin aceleración GPU)")
+    return setup_cpu(plan=cpu_plan)
+
+def list_device_candidates():
+    """Dispositivos utilizables: cuda, directml:N y cpu"""
+    candidates = []
+    try:
+        import torch
+        if torch.cuda.is_available():
+            candidates.append("cuda")
+    except:
+        pass
+
+    try:
+        import torch_directml
+        candidates += [f"directml:{i}" for i in range(torch_directml.device_count())]
+    except ImportError:
+        logger.info("✗ DirectML no disponible (instala: pip install torch-directml)")
+    except:
+        pass
+
+    candidates.append("cpu")
+    return candidates
+
+def calibrated_choice(candidates):
+    """Etiqueta del candidato más rápido según la calibración, o None"""
+    try:
+        return select_device(candidates)
+    except Exception as e:
+        logger.warning(f"Calibración de dispositivo no disponible: {e}")
+        return None
+
+def setup_from_label(label, cpu_plan=None):
+    if label.startswith("cuda"):
+        return setup_cuda()
+    if label.startswith("directml"):
+        return setup_directml(label.split(":", 1)[1] if ":" in label else None)
+    return setup_cpu(plan=cpu_plan)
+
+def setup_cuda():
+    """Configurar dispositivo CUDA"""
+    import torch
+
+    if not torch.cuda.is_available():
+        logger.warning("CUDA solicitado pero no disponible, usando CPU")
+        return setup_cpu()
+
+    device = torch.device("cuda")
+    gpu_name = torch.cuda.get_device_name(0)
+
+    logger.info("=" * 60)
+    logger.info("Configuración CUDA:")
+    logger.info(f"  GPU: {gpu_name}")
+    logger.info(f"  VRAM: {torch.cuda.get_device_properties(0).total_memory / 1e9:.2f} GB")
+    logger.info(f"  Device: {device}")
+    logger.info("=" * 60)
+
+    # Shim torch.xpu para compatibilidad
+    install_xpu_shim(torch)
+
+    return device, "cuda"
+
+def setup_directml(gpu_index=None):
+    """Configurar dispositivo DirectML con selección de GPU"""
+    try:
+        import torch_directml
+        import torch
+    except ImportError:
+        logger.error("DirectML solicitado pero torch-directml no está instalado")
+        logger.error("Instala con: pip install torch-directml")
+        return setup_cpu()
+
+    # Detectar GPUs disponibles
+    device_count = torch_directml.device_count()
+
+    if device_count == 0:
+        logger.warning("DirectML instalado pero no se detectaron GPUs")
+        return setup_cpu()
+
+    # Seleccionar GPU
+    if gpu_index is not None:
+        try:
+            selected_gpu = int(gpu_index)
+            if selected_gpu >= device_count:
+                logger.warning(f"GPU {selected_gpu} no existe, usando GPU 0")
+                selected_gpu = 0
+        except ValueError:
+            logger.warning(f"Índice de GPU inválido: {gpu_index}, usando GPU 0")
+            selected_gpu = 0
+    else:
+        selected_gpu = None
+        if device_count > 1:
+            # Medir cuál de las GPUs es más rápida (o reutilizar el perfil)
+            label = calibrated_choice([f"directml:{i}" for i in range(device_count)])
+            if label is not None:
+                selected_gpu = int(label.split(":", 1)[1])
+        if selected_gpu is None:
+            # Heurística simple: GPU con índice mayor suele ser dedicada
+            selected_gpu = device_count - 1 if device_count > 1 else 0
+
+    device = torch_directml.device(selected_gpu)
+
+    # Intentar obtener nombre de GPU
+    try:
+        if hasattr(torch_directml, 'device_name'):
+            gpu_name = torch_directml.device_name(selected_gpu)
+        else:
+            gpu_name = f"DirectML Device {selected_gpu}"
+    except:
+        gpu_name = f"DirectML Device {selected_gpu}"
+
+    logger.info("=" * 60)
+    logger.info("Configuración DirectML:")
+    logger.info(f"  GPUs disponibles: {device_count}")
+    logger.info(f"  GPU seleccionada: {selected_gpu}")
+    logger.info(f"  Nombre: {gpu_name}")
+    logger.info(f"  Device: {device}")
+
+    if device_count > 1:
+        logger.info("")
+        logger.info("  Tienes múltiples GPUs. Para cambiar, usa:")
+        logger.info("    $env:DIRECTML_DEVICE = \"0\"  # GPU integrada")
+        logger.info("    $env:DIRECTML_DEVICE = \"1\"  # GPU dedicada")
+
+    logger.info("=" * 60)
+
+    # Shim torch.xpu para compatibilidad
+    install_xpu_shim(torch)
+
+    return device, f"directml:{selected_gpu}"
+
+def setup_cpu(cpus=None, plan=None):
+    """Configurar dispositivo CPU (threads para `cpus`, o la afinidad actual)
+
+    `plan` es el plan de threads ya aplicado antes de calibrar (no se repite).
+    """
+    import torch
+
+    if plan is None:
+        # Threads según cuota del cgroup, afinidad y cores físicos (no os.cpu_count())
+        import vibevoice_threads
+        vibevoice_threads.configure_cpu_threads(torch, cpus)
+
+    device = torch.device("cpu")
+
+    logger.info("=" * 60)
+    logger.info("Configuración CPU:")
+    logger.info(f"  Threads: {torch.get_num_threads()}")
+    logger.info(f"  Device: {device}")
+    logger.info("=" * 60)
+
+    # Shim torch.xpu para compatibilidad
+    install_xpu_shim(torch)
+
+    return device, "cpu"
@@ -0,0 +1,188 @@
+"""
+VibeVoice Frame Coalescing
+==========================
+
+Agrupa los chunks de audio de /stream en frames WebSocket de duración
+objetivo: cada frame cuesta un syscall, una cabecera y un send/recv en
+Python en cada extremo, así que muchos chunks pequeños salen caros.
+
+- `frame_ms`: duración objetivo de cada frame (por sesión con
+  `?frame_ms=80`, o VIBEVOICE_FRAME_MS para todas; 0 = sin agrupar)
+- El primer chunk sale inmediatamente, para no subir el tiempo al primer audio
+- Un frame parcial no espera más de VIBEVOICE_FRAME_MAX_HOLD_MS (default:
+  `frame_ms`): si la síntesis va lenta, el audio sale igual
+- Antes de cada evento de texto se envía el audio pendiente (el orden
+  audio/eventos se mantiene)
+- Los chunks se copian a un bytearray por sesión que se reutiliza
+
+Contadores (chunks, frames, bytes y CPU del proceso) en GET /frames/stats.
+
+Variables de entorno:
+    VIBEVOICE_FRAME_MS           - Duración objetivo de frame en ms (default: 0, sin agrupar)
+    VIBEVOICE_FRAME_MAX_HOLD_MS  - Espera máxima de un frame parcial (default: frame_ms)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from urllib.parse import urlencode
+
+from vibevoice_app import PCM16_BYTES_PER_SECOND, query_params, send_json
+
+logger = logging.getLogger(__name__)
+
+
+class FrameBuffer:
+    """Bytearray reutilizado donde se acumula el frame en curso"""
+
+    def __init__(self, target_bytes):
+        self.target = max(2, target_bytes - target_bytes % 2)
+        self.data = bytearray(self.target * 2)
+        self.size = 0
+        self.since = None
+
+    def add(self, chunk):
+        """Copiar `chunk`; retorna los frames completos (bytes) listos para enviar"""
+        frames = []
+        view = memoryview(chunk)
+        while view.nbytes:
+            take = min(self.target - self.size, view.nbytes)
+            self.data[self.size:self.size + take] = view[:take]
+            if self.size == 0:
+                self.since = time.monotonic()
+            self.size += take
+            view = view[take:]
+            if self.size >= self.target:
+                frames.append(self.take())
+        return frames
+
+    def take(self):
+        frame = bytes(self.data[:self.size])
+        self.size = 0
+        self.since = None
+        return frame
+
+
+class FrameStats:
+    def __init__(self):
+        self.sessions = 0
+        self.chunks_in = 0
+        self.frames_out = 0
+        self.bytes = 0
+        self.timer_flushes = 0
+
+    def as_dict(self):
+        return {
+            "sessions": self.sessions,
+            "chunks_in": self.chunks_in,
+            "frames_out": self.frames_out,
+            "bytes": self.bytes,
+            "avg_chunk_bytes": round(self.bytes / self.chunks_in) if self.chunks_in else None,
+            "avg_frame_bytes": round(self.bytes / self.frames_out) if self.frames_out else None,
+            "timer_flushes": self.timer_flushes,
+            "process_cpu_s": round(time.process_time(), 3),
+        }
+
+
+class FrameMiddleware:
+    """Agrupa el audio de /stream en frames de `frame_ms`"""
+
+    def __init__(self, app, frame_ms=0, max_hold_ms=None):
+        self.app = app
+        self.frame_ms = frame_ms
+        self.max_hold_ms = max_hold_ms
+        self.stats = FrameStats()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/frames/stats":
+            await send_json(send, 200, self.stats.as_dict())
+            return
+        if scope["type"] != "websocket" or scope["path"] != "/stream":
+            await self.app(scope, receive, send)
+            return
+
+        params = query_params(scope)
+        requested = params.pop("frame_ms", None)
+        try:
+            frame_ms = float(requested) if requested is not None else self.frame_ms
+        except ValueError:
+            frame_ms = self.frame_ms
+        if requested is not None:
+            scope = dict(scope, query_string=urlencode(params).encode("latin-1"))
+        if frame_ms <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        stats = self.stats
+        stats.sessions += 1
+        # El audio que llega aquí es PCM16 a 24 kHz (el remuestreo va por fuera)
+        frames = FrameBuffer(int(PCM16_BYTES_PER_SECOND * frame_ms / 1000))
+        hold = (self.max_hold_ms if self.max_hold_ms is not None else frame_ms) / 1000
+        lock = asyncio.Lock()
+        state = {"first": True, "timer": None}
+
+        async def send_frame(frame):
+            stats.frames_out += 1
+            await send({"type": "websocket.send", "bytes": frame})
+
+        async def flush_pending():
+            if frames.size:
+                await send_frame(frames.take())
+
+        async def flush_when_due():
+            await asyncio.sleep(hold)
+            async with lock:
+                state["timer"] = None
+                if frames.size and time.monotonic() - frames.since >= hold * 0.999:
+                    stats.timer_flushes += 1
+                    await flush_pending()
+                elif frames.size:
+                    arm_timer()
+
+        def arm_timer():
+            if state["timer"] is None and frames.size:
+                delay_task = asyncio.ensure_future(flush_when_due())
+                state["timer"] = delay_task
+
+        def cancel_timer():
+            if state["timer"] is not None:
+                state["timer"].cancel()
+                state["timer"] = None
+
+        async def framed_send(message):
+            kind = message["type"]
+            data = message.get("bytes") if kind == "websocket.send" else None
+            async with lock:
+                if data is not None:
+                    stats.chunks_in += 1
+                    stats.bytes += len(data)
+                    if state["first"]:
+                        state["first"] = False
+                        await send_frame(data)
+                        return
+                    for frame in frames.add(data):
+                        await send_frame(frame)
+                    if frames.size:
+                        arm_timer()
+                    else:
+                        cancel_timer()
+                    return
+                # Texto o cierre: primero el audio pendiente
+                cancel_timer()
+                await flush_pending()
+                await send(message)
+
+        try:
+            await self.app(scope, receive, framed_send)
+        finally:
+            cancel_timer()
+
+
+def frames_from_env(app):
+    hold = os.environ.get("VIBEVOICE_FRAME_MAX_HOLD_MS")
+    return FrameMiddleware(
+        app,
+        frame_ms=float(os.environ.get("VIBEVOICE_FRAME_MS", "0")),
+        max_hold_ms=float(hold) if hold else None,
+    )
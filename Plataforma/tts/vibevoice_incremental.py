@@ -0,0 +1,139 @@
+"""
+VibeVoice Incremental Text
+==========================
+
+Protocolo de texto incremental sobre /stream, para hablar la respuesta de un
+LLM mientras todavía se está generando:
+
+    ws://localhost:3000/stream?incremental=1&voice=sp-Spk1_man&cfg=1.5&steps=5
+
+Tras conectar, el cliente envía frames de texto JSON:
+    {"type": "text", "text": "Hola, est"}   fragmento (delta) del texto
+    {"type": "flush"}                        sintetizar ya lo pendiente
+    {"type": "end"}                          fin del texto
+
+Cada frase se sintetiza en cuanto está completa, con el pipeline de
+`vibevoice_pipeline` (orden garantizado, crossfade entre segmentos y la
+siguiente frase sintetizándose mientras se envía la anterior). El audio y los
+eventos son los de /stream; `backend_stream_complete` añade `text_chars`.
+
+Sin frames durante VIBEVOICE_INCREMENTAL_IDLE_TIMEOUT segundos se da el texto
+por terminado.
+
+Variables de entorno:
+    VIBEVOICE_INCREMENTAL_IDLE_TIMEOUT - Segundos sin frames antes de cerrar el texto (default: 30)
+    (segmentación y lookahead: las variables VIBEVOICE_PIPELINE_*)
+"""
+
+import asyncio
+import json
+import logging
+import os
+
+from vibevoice_app import query_params, send_log_event
+from vibevoice_pipeline import pipeline_from_env, take_segments
+
+logger = logging.getLogger(__name__)
+
+FRAME_TYPES = ("text", "flush", "end")
+
+
+def parse_frame(text):
+    """Frame JSON del cliente como dict, o None si no es válido"""
+    try:
+        frame = json.loads(text or "")
+    except ValueError:
+        return None
+    if not isinstance(frame, dict) or frame.get("type") not in FRAME_TYPES:
+        return None
+    return frame
+
+
+async def _drain(queue):
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        yield item
+
+
+class IncrementalTextMiddleware:
+    """Sesiones /stream?incremental=1: texto por frames, audio por frases"""
+
+    def __init__(self, app, pipeline, idle_timeout=30.0):
+        self.app = app
+        self.pipeline = pipeline
+        self.idle_timeout = idle_timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket" or scope["path"] != "/stream":
+            await self.app(scope, receive, send)
+            return
+        params = query_params(scope)
+        if params.pop("incremental", None) != "1":
+            await self.app(scope, receive, send)
+            return
+        params.pop("text", None)
+        params.pop("pipeline", None)
+
+        await receive()  # websocket.connect
+        await send({"type": "websocket.accept"})
+        await send_log_event(send, "backend_request_received", {"incremental": True})
+
+        disconnected = asyncio.Event()
+        info = {"incremental": True, "text_chars": 0, "invalid_frames": 0, "idle_timeout": False}
+        segments = asyncio.Queue()
+        reader = asyncio.ensure_future(self._read(receive, segments, disconnected, info))
+        try:
+            await self.pipeline.stream_segments(params, _drain(segments), send, disconnected, extra=info)
+        finally:
+            reader.cancel()
+
+    async def _read(self, receive, segments, disconnected, info):
+        """Acumular deltas y pasar al pipeline cada frase completa"""
+        pipeline = self.pipeline
+        buffer = ""
+        emitted = 0
+        ended = False
+        while True:
+            try:
+                message = await asyncio.wait_for(receive(), None if ended else self.idle_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"[WARN] Texto incremental sin frames en {self.idle_timeout:.0f}s, "
+                               f"se sintetiza lo recibido")
+                info["idle_timeout"] = True
+                frame = {"type": "end"}
+            else:
+                if message["type"] == "websocket.disconnect":
+                    disconnected.set()
+                    return
+                if message["type"] != "websocket.receive" or ended:
+                    continue
+                frame = parse_frame(message.get("text"))
+                if frame is None:
+                    info["invalid_frames"] += 1
+                    continue
+
+            kind = frame["type"]
+            if kind == "text":
+                delta = str(frame.get("text") or "")
+                buffer += delta
+                info["text_chars"] += len(delta)
+
+            ready, buffer = take_segments(buffer, emitted, pipeline.max_chars, pipeline.first_max_chars,
+                                          final=kind != "text")
+            for segment in ready:
+                await segments.put(segment)
+            emitted += len(ready)
+            if kind == "end":
+                ended = True
+                await segments.put(None)
+
+
+def incremental_from_env(app, pipeline=None):
+    """Middleware incremental; sin pipeline activo crea uno con la config VIBEVOICE_PIPELINE_*"""
+    return IncrementalTextMiddleware(
+        app,
+        pipeline if pipeline is not None else pipeline_from_env(app),
+        idle_timeout=float(os.environ.get("VIBEVOICE_INCREMENTAL_IDLE_TIMEOUT", "30")),
+    )
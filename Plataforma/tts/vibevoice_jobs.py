@@ -0,0 +1,414 @@
+"""
+VibeVoice Batch Jobs
+====================
+
+Síntesis por lotes sobre HTTP para trabajos offline (pre-render de miles de
+prompts), sin abrir un WebSocket por texto:
+
+    POST /synthesize/batch?format=ndjson&audio=wav
+    Body: array JSON o JSONL de {"id": ..., "text": ..., "voice": ..., "cfg": ..., "steps": ...}
+    ("model" elige un modelo de VIBEVOICE_MODELS por texto)
+
+El lote se planifica para throughput, no para latencia:
+- Ordenado por (modelo, voz, cfg, steps) y de mayor a menor longitud: los
+  textos de un mismo modelo van seguidos (menos cargas y descargas) y los
+  textos largos no quedan para el final
+- VIBEVOICE_JOBS_CONCURRENCY sesiones en vuelo (default: 1), compartidas entre
+  todos los lotes. web.app sintetiza una sesión a la vez (también con el
+  scheduler de VIBEVOICE_SCHEDULER, que solo las ordena): más sesiones en vuelo
+  no suben el throughput, solo evitan el hueco entre un texto y el siguiente
+- Si web.app está ocupado con tráfico de /stream, cada texto reintenta
+
+Los resultados salen en orden de finalización:
+- `format=ndjson` (default): por cada texto una línea JSON de cabecera
+  (`{"type": "result", "id", "status", "bytes", ...}`) seguida de `bytes`
+  bytes de audio; la primera línea es `{"type": "job", ...}` y la última
+  `{"type": "summary", ...}`, precedida de `{"type": "error", ...}` si el
+  lote falló
+- `format=tar`: un archivo `<id>.wav` (o `.pcm`) por texto y al final
+  `results.jsonl` con las cabeceras
+
+`audio=wav` (default) o `audio=pcm16` (PCM16 mono a 24 kHz sin cabecera).
+El id del lote llega en la cabecera `x-vibevoice-job-id`; el progreso, en
+GET /synthesize/batch/<job_id> (GET /synthesize/batch lista los lotes).
+Detrás del router multi-worker el id empieza por `w<índice>-`: el router
+envía el GET de progreso al worker que ejecuta el lote.
+
+Variables de entorno:
+    VIBEVOICE_JOBS_CONCURRENCY  - Sesiones en vuelo entre todos los lotes (default: 1)
+    VIBEVOICE_JOBS_MAX_ITEMS    - Textos máximos por lote (default: 10000)
+    VIBEVOICE_JOBS_MAX_BYTES    - Tamaño máximo del body en bytes (default: 33554432)
+    VIBEVOICE_JOBS_BUSY_TIMEOUT - Segundos reintentando si el modelo está ocupado (default: 300)
+    VIBEVOICE_JOBS_HISTORY      - Lotes terminados que se conservan para consulta (default: 32)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import tarfile
+import time
+import uuid
+from collections import OrderedDict
+
+from vibevoice_app import (
+    PCM16_BYTES_PER_SECOND,
+    SAMPLE_RATE,
+    query_params,
+    run_stream_session_retrying,
+    send_json,
+)
+from vibevoice_client import create_wav_header
+
+logger = logging.getLogger(__name__)
+
+BATCH_PATH = "/synthesize/batch"
+FORMATS = ("ndjson", "tar")
+AUDIO_ENCODINGS = ("wav", "pcm16")
+# "model" primero: los textos de un mismo modelo van juntos (menos cargas y descargas)
+ITEM_PARAMS = ("model", "voice", "cfg", "steps")
+
+
+class JobError(Exception):
+    """Lote inválido; el mensaje se devuelve al cliente con `status`"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_items(body, max_items):
+    """Body (array JSON o JSONL) -> lista de items validados con `index` e `id`"""
+    text = body.decode("utf-8-sig").strip()
+    if not text:
+        raise JobError("body vacío")
+    if text.startswith("["):
+        try:
+            raw = json.loads(text)
+        except ValueError as e:
+            raise JobError(f"JSON inválido: {e}")
+    else:
+        raw = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                raw.append(json.loads(line))
+            except ValueError as e:
+                raise JobError(f"línea {number}: JSON inválido: {e}")
+    if len(raw) > max_items:
+        raise JobError(f"demasiados textos ({len(raw)} > {max_items})", status=413)
+
+    items = []
+    seen = set()
+    for index, entry in enumerate(raw):
+        if not isinstance(entry, dict):
+            raise JobError(f"item {index}: se esperaba un objeto")
+        text = entry.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise JobError(f"item {index}: falta `text`")
+        item_id = str(entry.get("id", index))
+        if item_id in seen:
+            raise JobError(f"item {index}: id repetido {item_id!r}")
+        seen.add(item_id)
+        item = {"index": index, "id": item_id, "text": text}
+        for key in ITEM_PARAMS:
+            if entry.get(key) is not None:
+                item[key] = str(entry[key])
+        items.append(item)
+    if not items:
+        raise JobError("el lote no tiene textos")
+    return items
+
+
+def throughput_order(items):
+    """Agrupar por parámetros y, dentro de cada grupo, del texto más largo al más corto"""
+    return sorted(items, key=lambda item: (tuple(item.get(key, "") for key in ITEM_PARAMS),
+                                           -len(item["text"]), item["index"]))
+
+
+def safe_filename(item_id, extension):
+    """Nombre de archivo seguro para el id de un item"""
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", item_id).strip("._") or "item"
+    return f"{name[:100]}.{extension}"
+
+
+def tar_entry(name, data):
+    """Cabecera tar + datos + relleno a 512 bytes (el archivo se escribe en streaming)"""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    padding = -len(data) % tarfile.BLOCKSIZE
+    return info.tobuf(format=tarfile.PAX_FORMAT) + data + b"\0" * padding
+
+
+JOB_WORKER_RE = re.compile(r"w(\d+)-")
+
+
+def new_job_id():
+    """Id de lote; en un worker del router lleva su índice (`w<n>-`)"""
+    job_id = uuid.uuid4().hex[:12]
+    # Se lee al crear el lote: en modo fork el índice se fija después de importar
+    worker = os.environ.get("VIBEVOICE_WORKER_INDEX")
+    return f"w{worker}-{job_id}" if worker else job_id
+
+
+def job_worker(job_id):
+    """Índice del worker que ejecuta `job_id`, o None si el id no lo lleva"""
+    match = JOB_WORKER_RE.match(job_id)
+    return int(match.group(1)) if match else None
+
+
+class Job:
+    def __init__(self, items, output_format, audio):
+        self.id = new_job_id()
+        self.items = items
+        self.format = output_format
+        self.audio = audio
+        self.state = "running"
+        self.done = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+        self.started = time.time()
+        self.finished = None
+        self._started_perf = time.perf_counter()
+        self._elapsed = None
+
+    @property
+    def total(self):
+        return len(self.items)
+
+    @property
+    def elapsed(self):
+        if self._elapsed is not None:
+            return self._elapsed
+        return time.perf_counter() - self._started_perf
+
+    def finish(self, state):
+        self.state = state
+        self.finished = time.time()
+        self._elapsed = time.perf_counter() - self._started_perf
+
+    def progress(self):
+        completed = self.done + self.failed
+        elapsed = self.elapsed
+        eta = None
+        if self.state == "running" and completed:
+            eta = round(elapsed / completed * (self.total - completed), 1)
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "pending": self.total - completed,
+            "audio_seconds": round(self.audio_seconds, 3),
+            "elapsed_s": round(elapsed, 3),
+            "audio_seconds_per_second": round(self.audio_seconds / elapsed, 3) if elapsed > 0 else 0.0,
+            "eta_s": eta,
+            "format": self.format,
+            "audio": self.audio,
+        }
+
+
+class BatchJobMiddleware:
+    """POST /synthesize/batch: lotes de textos sintetizados con sesiones /stream en proceso"""
+
+    def __init__(self, app, concurrency=1, max_items=10000, max_bytes=32 * 1024 * 1024,
+                 busy_timeout=300.0, history=32):
+        self.app = app
+        self.concurrency = max(1, concurrency)
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.busy_timeout = busy_timeout
+        self.history = history
+        self.jobs = OrderedDict()
+        self._slots = None
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not (path == BATCH_PATH or path.startswith(BATCH_PATH + "/")):
+            await self.app(scope, receive, send)
+            return
+
+        method = scope.get("method", "GET")
+        if path == BATCH_PATH and method == "POST":
+            await self._run_job(scope, receive, send)
+        elif path == BATCH_PATH and method == "GET":
+            await send_json(send, 200, {"jobs": [job.progress() for job in self.jobs.values()]})
+        elif method == "GET":
+            job = self.jobs.get(path[len(BATCH_PATH) + 1:])
+            if job is None:
+                await send_json(send, 404, {"error": "lote no encontrado"})
+            else:
+                await send_json(send, 200, job.progress())
+        else:
+            await send_json(send, 405, {"error": "método no permitido"})
+
+    async def _read_body(self, receive):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            body += message.get("body", b"")
+            if len(body) > self.max_bytes:
+                raise JobError(f"body mayor que {self.max_bytes} bytes", status=413)
+            if not message.get("more_body"):
+                return bytes(body)
+
+    def _register(self, job):
+        self.jobs[job.id] = job
+        finished = [key for key, other in self.jobs.items() if other.state != "running"]
+        for key in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[key]
+
+    async def _run_job(self, scope, receive, send):
+        params = query_params(scope)
+        try:
+            output_format = params.get("format", "ndjson")
+            audio = params.get("audio", "wav")
+            if output_format not in FORMATS:
+                raise JobError(f"format debe ser uno de {', '.join(FORMATS)}")
+            if audio not in AUDIO_ENCODINGS:
+                raise JobError(f"audio debe ser uno de {', '.join(AUDIO_ENCODINGS)}")
+            body = await self._read_body(receive)
+            if body is None:
+                return
+            items = parse_items(body, self.max_items)
+        except JobError as e:
+            await send_json(send, e.status, {"error": str(e)})
+            return
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        job = Job(items, output_format, audio)
+        self._register(job)
+        logger.info(f"[INFO] Lote {job.id}: {job.total} textos, {self.concurrency} en vuelo")
+
+        content_type = b"application/x-tar" if output_format == "tar" else b"application/x-ndjson"
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", content_type),
+                        (b"x-vibevoice-job-id", job.id.encode("latin-1")),
+                        (b"cache-control", b"no-store")],
+        })
+
+        broken = False
+
+        async def write(data):
+            nonlocal broken
+            try:
+                await send({"type": "http.response.body", "body": data, "more_body": True})
+            except Exception:
+                broken = True
+                raise
+
+        if output_format == "ndjson":
+            await write(_json_line({"type": "job", **job.progress()}))
+
+        # Cola acotada: si el cliente lee lento, los workers esperan en vez de acumular audio
+        results = asyncio.Queue(maxsize=self.concurrency * 2)
+        pending = asyncio.Queue()
+        for item in throughput_order(items):
+            pending.put_nowait(item)
+        workers = [asyncio.ensure_future(self._worker(pending, results))
+                   for _ in range(min(self.concurrency, job.total))]
+        disconnected = asyncio.ensure_future(receive())
+        headers = []
+        error = None
+        state = "done"
+        try:
+            for _ in range(job.total):
+                getter = asyncio.ensure_future(results.get())
+                await asyncio.wait([getter, disconnected], return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    state = "cancelled"
+                    break
+                item, pcm, header = getter.result()
+                if header["status"] == "ok":
+                    job.done += 1
+                    job.audio_seconds += header["audio_s"]
+                else:
+                    job.failed += 1
+                data = pcm
+                if pcm and audio == "wav":
+                    data = create_wav_header(len(pcm), SAMPLE_RATE) + pcm
+                header["bytes"] = len(data)
+                headers.append(header)
+                if output_format == "tar":
+                    if data:
+                        await write(tar_entry(safe_filename(item["id"], "wav" if audio == "wav" else "pcm"), data))
+                else:
+                    await write(_json_line(header) + data)
+        except Exception as e:
+            state = "failed"
+            if broken:
+                logger.warning(f"[WARN] Lote {job.id}: la conexión se cerró durante el envío ({e})")
+            else:
+                logger.exception(f"[ERROR] Lote {job.id}")
+                error = {"type": "error", "error": f"{type(e).__name__}: {e}"}
+        finally:
+            for worker in workers:
+                worker.cancel()
+            disconnected.cancel()
+            job.finish(state)
+
+        logger.info(f"[OK] Lote {job.id} {state}: {job.done} OK, {job.failed} fallidos, "
+                    f"{job.audio_seconds:.1f}s de audio en {job.elapsed:.1f}s")
+        if state == "cancelled" or broken:
+            # Sin cliente al otro lado: nada más que escribir
+            return
+        summary = {"type": "summary", **job.progress()}
+        trailer = ([error] if error else []) + [summary]
+        if output_format == "tar":
+            manifest = b"".join(_json_line(header) for header in headers + trailer)
+            await write(tar_entry("results.jsonl", manifest) + b"\0" * (tarfile.BLOCKSIZE * 2))
+        else:
+            await write(b"".join(_json_line(line) for line in trailer))
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _worker(self, pending, results):
+        while not pending.empty():
+            item = pending.get_nowait()
+            async with self._slots:
+                pcm, header = await self._synthesize(item)
+            await results.put((item, pcm, header))
+
+    async def _synthesize(self, item):
+        params = {"text": item["text"]}
+        params.update({key: item[key] for key in ITEM_PARAMS if key in item})
+        header = {"type": "result", "id": item["id"], "index": item["index"],
+                  "sample_rate": SAMPLE_RATE, "encoding": "pcm16"}
+        started = time.perf_counter()
+        try:
+            result = await run_stream_session_retrying(self.app, params, self.busy_timeout)
+        except Exception as e:
+            logger.error(f"[ERROR] Lote, item {item['id']}: {e}")
+            return b"", {**header, "status": "error", "error": f"{type(e).__name__}: {e}"}
+        header["seconds"] = round(time.perf_counter() - started, 3)
+        if not result.ok:
+            errors = [e for e in result.events if e and ("error" in e or "busy" in e)]
+            header.update(status="error", error=errors[-1] if errors else f"close {result.close_code}")
+            return b"", header
+        header.update(status="ok", audio_s=round(result.audio_bytes / PCM16_BYTES_PER_SECOND, 3))
+        return result.pcm, header
+
+
+def _json_line(payload):
+    return (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def jobs_from_env(app):
+    return BatchJobMiddleware(
+        app,
+        concurrency=int(os.environ.get("VIBEVOICE_JOBS_CONCURRENCY", "1")),
+        max_items=int(os.environ.get("VIBEVOICE_JOBS_MAX_ITEMS", "10000")),
+        max_bytes=int(os.environ.get("VIBEVOICE_JOBS_MAX_BYTES", str(32 * 1024 * 1024))),
+        busy_timeout=float(os.environ.get("VIBEVOICE_JOBS_BUSY_TIMEOUT", "300")),
+        history=int(os.environ.get("VIBEVOICE_JOBS_HISTORY", "32")),
+    )
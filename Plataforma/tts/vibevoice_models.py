@@ -0,0 +1,416 @@
+"""
+VibeVoice Model Registry
+========================
+
+Varios modelos en el mismo servidor, elegidos por sesión con `?model=<nombre>`
+en /stream (también en las rutas HTTP del demo, p. ej. /config?model=hq):
+
+- El modelo del lanzador (VIBEVOICE_MODEL) es el principal: siempre cargado,
+  atiende las sesiones sin `model`
+- Los de VIBEVOICE_MODELS se cargan en el primer uso, cada uno en una copia
+  propia de web/app.py con su MODEL_PATH/MODEL_DEVICE y los mismos cambios al
+  modelo que el principal (snapshot, precisión, compilación)
+- La carga corre en un thread con su propio event loop: las sesiones de los
+  modelos ya cargados siguen atendiéndose mientras tanto
+- Si los pesos residentes (principal incluido) superan
+  VIBEVOICE_MODEL_BUDGET_MB, se descarga el modelo usado hace más tiempo que
+  no tenga sesiones activas; si aun así no cabe, la sesión se rechaza con
+  1013 (reintentar más tarde)
+
+La memoria residente de cada modelo es el tamaño de sus parámetros y buffers;
+se estima antes de cargar con el tamaño de los pesos en disco (si la ruta es
+local). GET /models devuelve el estado de cada modelo y los últimos eventos
+de carga y descarga, que también van al log.
+
+Variables de entorno:
+    VIBEVOICE_MODELS           - Modelos adicionales: nombre=ruta[@device], separados por comas
+    VIBEVOICE_MODEL_NAME       - Nombre del modelo principal (default: default)
+    VIBEVOICE_MODEL_BUDGET_MB  - Memoria máxima de pesos residentes (default: 0, sin límite)
+"""
+
+import asyncio
+import gc
+import importlib.util
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from urllib.parse import urlencode
+
+from vibevoice_app import (InProcessLifespan, current_model, get_tts_service, model_hooks, model_override,
+                           query_params, send_json, send_log_event)
+
+logger = logging.getLogger(__name__)
+
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+MAX_EVENTS = 50
+
+
+class ModelBudgetError(Exception):
+    pass
+
+
+# =============================================================================
+# Configuración y medición
+# =============================================================================
+
+def parse_models(value, default_device="cpu"):
+    """"hq=/models/vv-1.5b@cuda,rt=microsoft/..." -> [(nombre, ruta, device)]"""
+    models = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, path = entry.partition("=")
+        name, path = name.strip(), path.strip()
+        if not sep or not path or not NAME_PATTERN.match(name):
+            raise ValueError(f"VIBEVOICE_MODELS: entrada inválida {entry!r} (usa nombre=ruta[@device])")
+        device = default_device
+        if "@" in path:
+            path, _, device = path.rpartition("@")
+        if any(name == other for other, _, _ in models):
+            raise ValueError(f"VIBEVOICE_MODELS: modelo repetido {name!r}")
+        models.append((name, path, device))
+    return models
+
+
+def estimate_mb(path):
+    """Tamaño de los pesos en disco (MB) si `path` es un directorio local"""
+    path = Path(path)
+    if not path.is_dir():
+        return None
+    files = list(path.glob("*.safetensors")) or list(path.glob("*.bin"))
+    return round(sum(f.stat().st_size for f in files) / 1024 / 1024, 1) if files else None
+
+
+def weights_mb(model):
+    """Parámetros y buffers de `model` en MB (storages compartidos una vez)"""
+    seen = set()
+    total = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() in seen:
+            continue
+        seen.add(storage.data_ptr())
+        total += storage.nbytes()
+    return round(total / 1024 / 1024, 1)
+
+
+def resident_mb(upstream):
+    model = getattr(get_tts_service(upstream), "model", None)
+    return weights_mb(model) if model is not None else None
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def load_upstream_copy(name):
+    """Otra instancia de web/app.py: módulo aparte, con su propia app y estado"""
+    import web
+
+    path = Path(list(web.__path__)[0]) / "app.py"
+    spec = importlib.util.spec_from_file_location(f"web.app__{name.replace('-', '_').replace('.', '_')}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+# =============================================================================
+# Registro
+# =============================================================================
+
+class ModelEntry:
+    def __init__(self, name, path, device, pinned=False):
+        self.name = name
+        self.path = path
+        self.device = device
+        self.pinned = pinned
+        self.upstream = None
+        self.lifespan = None
+        self.info = {}
+        self.estimate_mb = estimate_mb(path)
+        self.resident_mb = None
+        self.rss_delta_mb = None
+        self.load_seconds = None
+        self.loading = None
+        self.sessions = 0
+        self.last_used = None
+        self.loads = 0
+        self.evictions = 0
+
+    def as_dict(self):
+        return {
+            "path": self.path,
+            "device": self.device,
+            "pinned": self.pinned,
+            "loaded": self.upstream is not None,
+            "loading": self.loading is not None,
+            "resident_mb": self.resident_mb,
+            "estimate_mb": self.estimate_mb,
+            "rss_delta_mb": self.rss_delta_mb,
+            "load_seconds": self.load_seconds,
+            "sessions": self.sessions,
+            "idle_seconds": round(time.time() - self.last_used, 1) if self.last_used else None,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+
+class _LoaderThread:
+    """Event loop en un thread propio donde corren las cargas y descargas"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="vibevoice-models", daemon=True)
+        self.thread.start()
+
+    async def run(self, coro):
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+
+class ModelRegistryMiddleware:
+    """Enruta cada sesión al modelo de `?model=`, cargándolo en el primer uso"""
+
+    def __init__(self, app, models, primary_name="default", budget_mb=0):
+        self.app = app
+        self.primary = ModelEntry(primary_name, current_model(), os.environ.get("MODEL_DEVICE", "cpu"),
+                                  pinned=True)
+        self.primary.upstream = app
+        self.entries = {name: ModelEntry(name, path, device) for name, path, device in models}
+        if primary_name in self.entries:
+            raise ValueError(f"VIBEVOICE_MODELS: {primary_name!r} es el nombre del modelo principal")
+        self.budget_mb = budget_mb
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.rejected = 0
+        # Hooks de proceso para cada modelo cargado (p. ej. instrumentación de trazas)
+        self.load_hooks = []
+        self._lock = None
+        self._loader = None
+        # Fijar el modelo principal en este contexto (las tasks del servidor lo
+        # heredan): MODEL_PATH cambia durante la carga de otro modelo
+        model_override.set(self.primary.path)
+
+    # ---------------------------------------------------------------- memoria
+
+    def _loaded(self):
+        return [e for e in (self.primary, *self.entries.values()) if e.upstream is not None]
+
+    def used_mb(self):
+        if self.primary.resident_mb is None:
+            self.primary.resident_mb = resident_mb(self.primary.upstream)
+        return round(sum(e.resident_mb or 0 for e in self._loaded()), 1)
+
+    def _event(self, event, entry, **data):
+        self.events.append({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "event": event,
+                            "model": entry.name, **data})
+
+    async def _make_room(self, needed_mb, keep=None):
+        """Descargar modelos inactivos (LRU) hasta que `needed_mb` quepa en el presupuesto"""
+        if not self.budget_mb:
+            return True
+        while self.used_mb() + needed_mb > self.budget_mb:
+            # Elegir en cada vuelta: durante la descarga anterior (await) `acquire`
+            # pudo dar sesiones a otro modelo. `_evict` quita `upstream` antes de
+            # su primer await, así que entre esta comprobación y la descarga no
+            # entra ninguna sesión
+            idle = [e for e in self._loaded() if not e.pinned and e is not keep and e.sessions == 0]
+            if not idle:
+                break
+            await self._evict(min(idle, key=lambda e: e.last_used or 0), "lru")
+        return self.used_mb() + needed_mb <= self.budget_mb
+
+    # ------------------------------------------------------- carga y descarga
+
+    async def _load_in_thread(self, entry):
+        """Corre en el thread del cargador: web/app.py con el entorno del modelo"""
+        import vibevoice_snapshot
+
+        model_override.set(entry.path)
+        saved = {key: os.environ.get(key)
+                 for key in ("MODEL_PATH", "MODEL_DEVICE", "HF_HUB_OFFLINE", "TRANSFORMERS_OFFLINE")}
+        try:
+            vibevoice_snapshot.activate_snapshot(entry.path)
+            os.environ.update(MODEL_PATH=entry.path, MODEL_DEVICE=entry.device)
+            upstream = load_upstream_copy(entry.name)
+            lifespan = InProcessLifespan(upstream)
+            await lifespan.startup()
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+        try:
+            for hook in model_hooks(entry.info) + self.load_hooks:
+                await hook(upstream)
+        except Exception:
+            await lifespan.shutdown()
+            raise
+        return upstream, lifespan
+
+    async def _load(self, entry):
+        async with self._lock:
+            if entry.upstream is not None:
+                return
+            if not await self._make_room(entry.estimate_mb or 0):
+                self.rejected += 1
+                self._event("rejected", entry, used_mb=self.used_mb(), estimate_mb=entry.estimate_mb)
+                raise ModelBudgetError(f"el modelo {entry.name} ({entry.estimate_mb} MB) no cabe en "
+                                       f"{self.budget_mb} MB con los modelos en uso")
+            if self._loader is None:
+                self._loader = _LoaderThread()
+
+            logger.info(f"Cargando modelo {entry.name} ({entry.path}, {entry.device})...")
+            before = rss_mb()
+            started = time.perf_counter()
+            try:
+                upstream, lifespan = await self._loader.run(self._load_in_thread(entry))
+            except Exception as e:
+                self._event("load_failed", entry, error=f"{type(e).__name__}: {e}")
+                logger.exception(f"[ERROR] No se pudo cargar el modelo {entry.name}")
+                raise
+            entry.load_seconds = round(time.perf_counter() - started, 3)
+            after = rss_mb()
+            entry.rss_delta_mb = round(after - before, 1) if before is not None and after is not None else None
+            entry.resident_mb = resident_mb(upstream) or entry.rss_delta_mb
+            entry.upstream, entry.lifespan = upstream, lifespan
+            entry.last_used = time.time()
+            entry.loads += 1
+            self._event("load", entry, seconds=entry.load_seconds, resident_mb=entry.resident_mb)
+            logger.info(f"[OK] Modelo {entry.name} cargado en {entry.load_seconds:.1f}s "
+                        f"({entry.resident_mb} MB residentes, total {self.used_mb()} MB)")
+            # La estimación pudo quedarse corta: hacer sitio con lo que ya se midió
+            if not await self._make_room(0, keep=entry):
+                logger.warning(f"[WARN] Modelos residentes: {self.used_mb()} MB, por encima del "
+                               f"presupuesto de {self.budget_mb} MB")
+
+    async def _evict(self, entry, reason):
+        lifespan = entry.lifespan
+        freed = entry.resident_mb
+        entry.upstream = entry.lifespan = None
+        entry.resident_mb = None
+        entry.evictions += 1
+        try:
+            await self._loader.run(lifespan.shutdown())
+        except Exception as e:
+            logger.warning(f"[WARN] Shutdown del modelo {entry.name}: {e}")
+        del lifespan
+        gc.collect()
+        if entry.device.startswith("cuda") and "torch" in sys.modules:
+            sys.modules["torch"].cuda.empty_cache()
+        self._event("evict", entry, reason=reason, freed_mb=freed)
+        logger.info(f"Modelo {entry.name} descargado ({reason}, {freed} MB)")
+
+    async def acquire(self, entry):
+        """Cargar `entry` si hace falta y contar la sesión (no se descarga mientras tanto)"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        while entry.upstream is None:
+            if entry.loading is None:
+                entry.loading = asyncio.ensure_future(self._load(entry))
+                entry.loading.add_done_callback(lambda _: setattr(entry, "loading", None))
+            await asyncio.shield(entry.loading)
+        # Sin await entre la comprobación y el contador: una descarga no puede colarse
+        entry.sessions += 1
+        entry.last_used = time.time()
+
+    def release(self, entry):
+        entry.sessions -= 1
+        entry.last_used = time.time()
+
+    async def close(self):
+        for entry in self.entries.values():
+            if entry.upstream is not None:
+                await self._evict(entry, "shutdown")
+        if self._loader is not None:
+            self._loader.loop.call_soon_threadsafe(self._loader.loop.stop)
+
+    # ------------------------------------------------------------------ ASGI
+
+    def stats(self):
+        return {
+            "primary": self.primary.name,
+            "budget_mb": self.budget_mb or None,
+            "used_mb": self.used_mb(),
+            "rejected": self.rejected,
+            "models": {e.name: e.as_dict() for e in (self.primary, *self.entries.values())},
+            "events": list(self.events),
+        }
+
+    async def _reject(self, scope, receive, send, status, code, message):
+        if scope["type"] == "http":
+            await send_json(send, status, {"error": message})
+            return
+        await receive()  # websocket.connect
+        await send({"type": "websocket.accept"})
+        await send_log_event(send, "backend_error", {"message": message})
+        await send({"type": "websocket.close", "code": code})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/models":
+            await send_json(send, 200, self.stats())
+            return
+        if scope["type"] == "lifespan":
+            await self.app(scope, self._lifespan_receive(receive), send)
+            return
+        params = query_params(scope)
+        name = params.pop("model", None)
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        scope = dict(scope, query_string=urlencode(params).encode("latin-1"))
+        if name in ("", self.primary.name):
+            await self.app(scope, receive, send)
+            return
+
+        entry = self.entries.get(name)
+        if entry is None:
+            names = ", ".join([self.primary.name, *self.entries])
+            await self._reject(scope, receive, send, 404, 1008, f"modelo desconocido: {name} (disponibles: {names})")
+            return
+        try:
+            await self.acquire(entry)
+        except ModelBudgetError as e:
+            await self._reject(scope, receive, send, 503, 1013, str(e))
+            return
+        except Exception as e:
+            await self._reject(scope, receive, send, 500, 1011, f"no se pudo cargar el modelo {name}: {e}")
+            return
+        try:
+            await entry.upstream(scope, receive, send)
+        finally:
+            self.release(entry)
+
+    def _lifespan_receive(self, receive):
+        async def wrapped():
+            message = await receive()
+            if message["type"] == "lifespan.shutdown":
+                await self.close()
+            return message
+        return wrapped
+
+
+def registry_from_env(app):
+    models = parse_models(os.environ.get("VIBEVOICE_MODELS", ""), os.environ.get("MODEL_DEVICE", "cpu"))
+    registry = ModelRegistryMiddleware(
+        app,
+        models,
+        primary_name=os.environ.get("VIBEVOICE_MODEL_NAME", "default").strip() or "default",
+        budget_mb=float(os.environ.get("VIBEVOICE_MODEL_BUDGET_MB", "0")),
+    )
+    budget = f"{registry.budget_mb:.0f} MB" if registry.budget_mb else "sin límite"
+    logger.info(f"[OK] Modelos: {registry.primary.name} (principal), "
+                f"{', '.join(registry.entries)} bajo demanda; presupuesto {budget}")
+    return registry
@@ -0,0 +1,486 @@
+"""
+VibeVoice Sentence Pipeline
+===========================
+
+Síntesis de textos largos por segmentos en /stream:
+- Segmentación en frases y cláusulas (puntuación española e inglesa: ¿? ¡!
+  … ; :, abreviaturas como "Sr." / "Dr." / "e.g." y decimales no cortan)
+- Cada segmento es una sub-sesión en proceso contra la app interna; los
+  siguientes segmentos se sintetizan mientras los anteriores se envían
+- Reensamblado en orden, con un crossfade corto entre segmentos para que no
+  haya clicks en las uniones
+- Métrica de adelanto: cuántos segundos de audio lleva enviados el servidor
+  por delante de la reproducción del cliente (si empezó con el primer chunk);
+  el mínimo de la sesión se reporta en `backend_stream_complete` y en
+  GET /pipeline/stats
+
+Si web.app rechaza una sub-sesión por estar ocupado (`backend_busy`), se
+reintenta hasta que el segmento anterior libera el modelo. Con el scheduler
+de VIBEVOICE_SCHEDULER el segmento siguiente espera turno en su cola y
+arranca en cuanto termina el anterior, sin reintentos.
+
+Se activa para textos de al menos VIBEVOICE_PIPELINE_MIN_CHARS caracteres, o
+por petición con `pipeline=1` / `pipeline=0`.
+
+Variables de entorno:
+    VIBEVOICE_PIPELINE_MIN_CHARS     - Longitud mínima para segmentar (default: 160)
+    VIBEVOICE_PIPELINE_MAX_CHARS     - Longitud máxima de un segmento (default: 220)
+    VIBEVOICE_PIPELINE_FIRST_CHARS   - Longitud máxima del primer segmento (default: 120)
+    VIBEVOICE_PIPELINE_LOOKAHEAD     - Segmentos sintetizándose por delante (default: 1)
+    VIBEVOICE_PIPELINE_CROSSFADE_MS  - Crossfade entre segmentos (default: 10)
+    VIBEVOICE_PIPELINE_BUSY_TIMEOUT  - Segundos máximos reintentando un segmento ocupado (default: 120)
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from array import array
+from urllib.parse import urlencode
+
+from vibevoice_app import (
+    PCM16_BYTES_PER_SECOND,
+    query_params,
+    run_stream_session_retrying,
+    send_json,
+    send_log_event,
+)
+
+logger = logging.getLogger(__name__)
+
+# Palabras tras las que un punto no termina la frase (minúsculas, sin el punto)
+ABBREVIATIONS = {
+    "sr", "sra", "srta", "sres", "dr", "dra", "ud", "uds", "lic", "ing", "prof", "etc", "ej",
+    "pág", "págs", "núm", "aprox", "av", "avda", "cap", "vol", "tel", "mr", "mrs", "ms", "st",
+    "vs", "jr", "inc", "ltd", "co", "no", "fig", "approx", "e.g", "i.e", "a.m", "p.m",
+}
+
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'»”)\]]*(?=\s+|$)")
+_CLAUSE_BREAK = re.compile(r"[;:—–]\s+|,\s+")
+
+
+def _is_abbreviation(text, dot):
+    """True si el punto en `text[dot]` pertenece a una abreviatura o inicial"""
+    start = dot
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    word = text[start:dot].lower().lstrip("¿¡(\"'«")
+    # Inicial ("J. K. Rowling", "p. ej.") o abreviatura conocida ("Sr.", "e.g.")
+    return (len(word) == 1 and word.isalpha()) or word in ABBREVIATIONS
+
+
+def _sentence_spans(text):
+    """(inicio, fin) de cada frase de `text`; la última puede estar incompleta"""
+    spans = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        end = match.end()
+        if match.group() == "." and _is_abbreviation(text, match.start()):
+            continue
+        rest = text[end:].lstrip()
+        if rest and (rest[0].islower() or rest[0].isdigit()):
+            continue
+        if text[start:end].strip():
+            spans.append((start, end))
+        start = end
+    if text[start:].strip():
+        spans.append((start, len(text)))
+    return spans
+
+
+def split_sentences(text):
+    """Dividir en frases respetando abreviaturas y continuaciones en minúscula"""
+    return [text[start:end].strip() for start, end in _sentence_spans(text)]
+
+
+def _split_long(sentence, max_chars):
+    """Cortar una frase larga en cláusulas (; : — antes que comas, luego espacios)"""
+    parts = []
+    while len(sentence) > max_chars:
+        window = sentence[:max_chars + 1]
+        cut = None
+        breaks = list(_CLAUSE_BREAK.finditer(window))
+        strong = [m for m in breaks if not m.group().startswith(",") and m.end() >= max_chars // 3]
+        weak = [m for m in breaks if m.end() >= max_chars // 3]
+        if strong:
+            cut = strong[-1].end()
+        elif weak:
+            cut = weak[-1].end()
+        else:
+            space = window.rfind(" ")
+            cut = space + 1 if space > 0 else max_chars
+        parts.append(sentence[:cut].strip())
+        sentence = sentence[cut:].strip()
+    if sentence:
+        parts.append(sentence)
+    return parts
+
+
+def _merge_short(pieces, max_chars, first_max_chars, min_chars, emitted=0):
+    """Unir piezas cortas con la vecina sin pasar el límite del segmento"""
+    segments = []
+    for piece in pieces:
+        limit = first_max_chars if emitted + len(segments) <= 1 else max_chars
+        if segments and (len(segments[-1]) < min_chars or len(piece) < min_chars) \
+                and len(segments[-1]) + 1 + len(piece) <= limit:
+            segments[-1] = f"{segments[-1]} {piece}"
+        else:
+            segments.append(piece)
+    return segments
+
+
+def segment_text(text, max_chars=220, first_max_chars=120, min_chars=24):
+    """Segmentos para el pipeline: frases, cortadas si son largas, unidas si son cortas
+
+    El primer segmento es más corto para que el primer audio llegue antes.
+    """
+    pieces = []
+    for sentence in split_sentences(text):
+        limit = first_max_chars if not pieces else max_chars
+        pieces.extend(_split_long(sentence, limit))
+    return _merge_short(pieces, max_chars, first_max_chars, min_chars)
+
+
+def take_segments(buffer, emitted=0, max_chars=220, first_max_chars=120, min_chars=24, final=False):
+    """Segmentos listos al principio de `buffer` y el texto que queda pendiente
+
+    Para texto que llega por partes: la última frase puede seguir creciendo
+    (o resultar ser una abreviatura), así que solo sale si `final` o si ya
+    supera el límite, y en ese caso cortada por cláusulas reteniendo la
+    última. `emitted` es el número de segmentos ya sintetizados.
+    """
+    spans = _sentence_spans(buffer)
+    if not final and spans:
+        pending = buffer[spans[-1][0]:]
+        spans = spans[:-1]
+    else:
+        pending = ""
+
+    pieces = []
+    for start, end in spans:
+        limit = first_max_chars if emitted + len(pieces) == 0 else max_chars
+        pieces.extend(_split_long(buffer[start:end].strip(), limit))
+
+    limit = first_max_chars if emitted + len(pieces) == 0 else max_chars
+    if len(pending.strip()) > limit:
+        parts = _split_long(pending.strip(), limit)
+        pieces.extend(parts[:-1])
+        pending = parts[-1] + pending[len(pending.rstrip()):]
+
+    return _merge_short(pieces, max_chars, first_max_chars, min_chars, emitted), pending
+
+
+# =============================================================================
+# Uniones
+# =============================================================================
+
+def crossfade(tail, head):
+    """Mezclar el final de un segmento con el inicio del siguiente (PCM16)"""
+    a = array("h", tail)
+    b = array("h", head)
+    n = min(len(a), len(b))
+    out = array("h", bytes(2 * n))
+    for k in range(n):
+        w = (k + 1) / (n + 1)
+        out[k] = max(-32768, min(32767, int(a[k] * (1 - w) + b[k] * w)))
+    return out.tobytes()
+
+
+class _Joiner:
+    """Retiene los últimos `fade` bytes de cada segmento para el crossfade"""
+
+    def __init__(self, fade_bytes):
+        self.fade = fade_bytes - fade_bytes % 2
+        self.hold = b""
+        self.tail = None
+        self.head = b""
+
+    def _emit(self, data):
+        buffered = self.hold + data
+        if self.fade <= 0:
+            return buffered
+        self.hold = buffered[-self.fade:]
+        return buffered[:-self.fade]
+
+    def feed(self, chunk):
+        if self.tail is None:
+            return self._emit(chunk)
+        self.head += chunk
+        if len(self.head) < len(self.tail):
+            return b""
+        return self._join()
+
+    def _join(self):
+        n = min(len(self.tail), len(self.head))
+        n -= n % 2
+        joined = self.tail[:len(self.tail) - n] + crossfade(self.tail[len(self.tail) - n:], self.head[:n])
+        rest = self.head[n:]
+        self.tail = None
+        self.head = b""
+        return self._emit(joined + rest)
+
+    def end_segment(self):
+        """Fin de un segmento: su cola queda retenida para el crossfade con el siguiente"""
+        out = b""
+        if self.tail is not None:
+            # Segmento más corto que el crossfade
+            out = self._join() if self.head else b""
+            if self.tail is not None:
+                self.hold, self.tail = self.tail, None
+        self.tail, self.hold = self.hold, b""
+        return out
+
+    def finish(self):
+        """Audio retenido tras el último segmento"""
+        out = (self.tail or b"") + self.hold
+        self.tail = None
+        self.hold = b""
+        return out
+
+
+# =============================================================================
+# Middleware
+# =============================================================================
+
+class PipelineStats:
+    def __init__(self):
+        self.sessions = 0
+        self.segments = 0
+        self.busy_retries = 0
+        self.underrun_sessions = 0
+        self.min_leads = []
+
+    def count_busy_retry(self):
+        self.busy_retries += 1
+
+    def as_dict(self):
+        leads = self.min_leads[-200:]
+        return {
+            "sessions": self.sessions,
+            "segments": self.segments,
+            "busy_retries": self.busy_retries,
+            "underrun_sessions": self.underrun_sessions,
+            "min_lead_s_recent_avg": round(sum(leads) / len(leads), 3) if leads else None,
+            "min_lead_s_recent_worst": round(min(leads), 3) if leads else None,
+        }
+
+
+async def watch_disconnect(receive, disconnected):
+    """Consumir mensajes del cliente hasta que se desconecte"""
+    while True:
+        message = await receive()
+        if message["type"] == "websocket.disconnect":
+            disconnected.set()
+            return
+
+
+async def _iterate(items):
+    for item in items:
+        yield item
+
+
+_GONE = object()
+
+
+async def _next(queue, disconnected):
+    """Siguiente elemento de `queue`, o `_GONE` si el cliente se desconecta antes"""
+    get = asyncio.ensure_future(queue.get())
+    stop = asyncio.ensure_future(disconnected.wait())
+    done, _ = await asyncio.wait({get, stop}, return_when=asyncio.FIRST_COMPLETED)
+    if get not in done:
+        get.cancel()
+        return _GONE
+    stop.cancel()
+    return get.result()
+
+
+class PipelineMiddleware:
+    """Segmenta textos largos de /stream y los sintetiza en pipeline"""
+
+    def __init__(self, app, min_chars=160, max_chars=220, first_max_chars=120, lookahead=1,
+                 crossfade_ms=10, busy_timeout=120.0):
+        self.app = app
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.first_max_chars = first_max_chars
+        self.lookahead = max(0, lookahead)
+        self.fade_bytes = int(PCM16_BYTES_PER_SECOND * crossfade_ms / 1000)
+        self.busy_timeout = busy_timeout
+        self.stats = PipelineStats()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/pipeline/stats":
+            await send_json(send, 200, self.stats.as_dict())
+            return
+        if scope["type"] != "websocket" or scope["path"] != "/stream":
+            await self.app(scope, receive, send)
+            return
+
+        params = query_params(scope)
+        text = params.get("text", "")
+        flag = params.pop("pipeline", None)
+        enabled = flag == "1" or (flag != "0" and len(text) >= self.min_chars)
+        segments = segment_text(text, self.max_chars, self.first_max_chars) if enabled else []
+        if len(segments) < 2:
+            if flag is not None:
+                scope = dict(scope, query_string=urlencode(params).encode("latin-1"))
+            await self.app(scope, receive, send)
+            return
+
+        await receive()  # websocket.connect
+        await send({"type": "websocket.accept"})
+        await send_log_event(send, "backend_request_received",
+                             {"pipeline": True, "segments": len(segments)})
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+        try:
+            await self.stream_segments(params, _iterate(segments), send, disconnected)
+        finally:
+            watcher.cancel()
+
+    async def _synthesize(self, params, index, queue, semaphore, turns, timings):
+        """Sub-sesión de un segmento; reintenta mientras el modelo esté ocupado
+
+        `turns[index - 1]` se marca cuando el segmento anterior ya tiene el
+        modelo (o terminó): así un segmento posterior nunca le gana el turno
+        a uno anterior que está reintentando.
+        """
+        turn = turns[index]
+
+        async def on_chunk(data):
+            turn.set()
+            await queue.put(data)
+
+        try:
+            async with semaphore:
+                if index:
+                    await turns[index - 1].wait()
+                started = time.perf_counter()
+                try:
+                    result = await run_stream_session_retrying(self.app, params, self.busy_timeout,
+                                                               collect=False, on_chunk=on_chunk,
+                                                               on_retry=self.stats.count_busy_retry)
+                finally:
+                    turn.set()
+                timings[index] = {
+                    "seconds": round(time.perf_counter() - started, 3),
+                    "audio_s": round(result.audio_seconds, 3),
+                    "ok": result.ok,
+                }
+        except Exception as e:
+            logger.error(f"[ERROR] Segmento {index} del pipeline: {e}")
+            timings[index] = {"ok": False, "error": str(e)}
+        finally:
+            await queue.put(None)
+
+    async def stream_segments(self, params, segments, send, disconnected, extra=None):
+        """Sintetizar `segments` (iterable asíncrono de textos) y enviar el audio en orden
+
+        Cada segmento se lanza en cuanto llega, con hasta `lookahead`
+        sintetizándose por delante del que se envía. Termina con
+        `backend_stream_complete` (más `extra`) y cierra el WebSocket; si el
+        cliente se desconecta antes, cancela lo pendiente.
+        """
+        stats = self.stats
+        stats.sessions += 1
+        entries = asyncio.Queue()
+        turns = []
+        timings = []
+        tasks = []
+        # Semáforo FIFO: los segmentos arrancan en orden, `lookahead` por delante
+        semaphore = asyncio.Semaphore(self.lookahead + 1)
+
+        async def produce():
+            async for text in segments:
+                index = len(turns)
+                queue = asyncio.Queue()
+                turns.append(asyncio.Event())
+                timings.append(None)
+                tasks.append(asyncio.ensure_future(
+                    self._synthesize(dict(params, text=text), index, queue, semaphore, turns, timings)))
+                stats.segments += 1
+                await entries.put((index, text, queue, time.perf_counter()))
+            await entries.put(None)
+
+        producer = asyncio.ensure_future(produce())
+        joiner = _Joiner(self.fade_bytes)
+        lead = {"ready_at": None, "first_at": None, "sent_s": 0.0, "min": None, "underruns": 0,
+                "behind": False}
+
+        async def emit(data):
+            if not data:
+                return
+            now = time.perf_counter()
+            if lead["first_at"] is None:
+                lead["first_at"] = now
+                await send({"type": "websocket.send", "bytes": data})
+                await send_log_event(send, "backend_first_chunk_sent", {"pipeline": True})
+            else:
+                # Adelanto antes de este envío: audio ya enviado - tiempo reproducido
+                ahead = lead["sent_s"] - (now - lead["first_at"])
+                # Un underrun por cada vez que el cliente se queda sin audio
+                if ahead < 0 and not lead["behind"]:
+                    lead["underruns"] += 1
+                lead["behind"] = ahead < 0
+                lead["min"] = ahead if lead["min"] is None else min(lead["min"], ahead)
+                await send({"type": "websocket.send", "bytes": data})
+            lead["sent_s"] += len(data) / PCM16_BYTES_PER_SECOND
+
+        try:
+            while True:
+                entry = await _next(entries, disconnected)
+                if entry is _GONE:
+                    return
+                if entry is None:
+                    break
+                index, text, queue, ready_at = entry
+                if lead["ready_at"] is None:
+                    lead["ready_at"] = ready_at
+                while True:
+                    chunk = await _next(queue, disconnected)
+                    if chunk is _GONE:
+                        return
+                    if chunk is None:
+                        break
+                    await emit(joiner.feed(chunk))
+                await emit(joiner.end_segment())
+                await send_log_event(send, "backend_segment_complete",
+                                     {"index": index, "chars": len(text), **(timings[index] or {})})
+            await emit(joiner.finish())
+
+            min_lead = lead["min"] if lead["min"] is not None else 0.0
+            stats.min_leads.append(min_lead)
+            if lead["underruns"]:
+                stats.underrun_sessions += 1
+            failed = [i for i, t in enumerate(timings) if not (t and t["ok"])]
+            first_audio = None
+            if lead["first_at"] is not None:
+                first_audio = round(lead["first_at"] - lead["ready_at"], 3)
+            await send_log_event(send, "backend_stream_complete", {
+                "pipeline": True,
+                "segments": len(timings),
+                "failed_segments": failed,
+                "audio_s": round(lead["sent_s"], 3),
+                "first_audio_s": first_audio,
+                "min_lead_s": round(min_lead, 3),
+                "underruns": lead["underruns"],
+                **(extra or {}),
+            })
+            await send({"type": "websocket.close", "code": 1000 if not failed else 1011})
+        finally:
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+
+
+def pipeline_from_env(app):
+    return PipelineMiddleware(
+        app,
+        min_chars=int(os.environ.get("VIBEVOICE_PIPELINE_MIN_CHARS", "160")),
+        max_chars=int(os.environ.get("VIBEVOICE_PIPELINE_MAX_CHARS", "220")),
+        first_max_chars=int(os.environ.get("VIBEVOICE_PIPELINE_FIRST_CHARS", "120")),
+        lookahead=int(os.environ.get("VIBEVOICE_PIPELINE_LOOKAHEAD", "1")),
+        crossfade_ms=float(os.environ.get("VIBEVOICE_PIPELINE_CROSSFADE_MS", "10")),
+        busy_timeout=float(os.environ.get("VIBEVOICE_PIPELINE_BUSY_TIMEOUT", "120")),
+    )
@@ -0,0 +1,309 @@
+"""
+VibeVoice Reduced Precision
+===========================
+
+Hook de arranque que, con el modelo ya cargado, cambia la precisión de las
+capas lineales donde es seguro:
+- bf16: pesos en bfloat16; la entrada se convierte al entrar y la salida
+  vuelve al dtype original, así el resto del grafo (embeddings, presets de
+  voz, decoder acústico) sigue en fp32
+- int8-dynamic: `quantize_dynamic` (pesos int8, activaciones cuantizadas al
+  vuelo) sobre los Linear del LM; solo CPU
+
+Se tocan los Linear del LM Qwen2.5 (`language_model`, `tts_language_model`,
+`lm_head`). La cabeza de difusión se incluye en bf16 (mismo rango que fp32) y
+queda en fp32 con int8 salvo VIBEVOICE_PRECISION_DIFFUSION=1. El tokenizer y
+el decoder acústico no se modifican.
+
+Modo A/B (VIBEVOICE_PRECISION_AB=1): antes de convertir sintetiza unas frases
+en fp32 y después las repite con la misma semilla; registra real-time factor,
+RSS y una similitud espectral contra fp32 en el log y en GET /ready.
+
+Variables de entorno:
+    VIBEVOICE_PRECISION            - fp32, bf16 o int8-dynamic (default: fp32)
+    VIBEVOICE_PRECISION_DIFFUSION  - auto, 0 o 1: incluir la cabeza de difusión (default: auto)
+    VIBEVOICE_PRECISION_AB         - Comparar contra fp32 al arrancar (default: 0)
+    VIBEVOICE_PRECISION_AB_TEXTS   - Frases del A/B separadas por "|"
+    VIBEVOICE_PRECISION_AB_VOICE   - Voz del A/B (default: la del servidor)
+    VIBEVOICE_PRECISION_AB_STEPS   - steps del A/B (default: 5)
+"""
+
+import asyncio
+import gc
+import logging
+import os
+
+from vibevoice_app import env_flag, get_tts_service, run_stream_session
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("fp32", "bf16", "int8-dynamic")
+
+LM_MODULES = ("language_model", "tts_language_model", "lm_head")
+DIFFUSION_MODULES = ("prediction_head", "diffusion_head")
+
+DEFAULT_AB_TEXTS = (
+    "Hola, este es un test del sistema de síntesis de voz.",
+    "The quick brown fox jumps over the lazy dog, and then it rests for a while.",
+)
+
+
+# =============================================================================
+# Conversión
+# =============================================================================
+
+def target_modules(model, include_diffusion):
+    """Nombres de los submódulos a convertir (los más externos que coinciden)"""
+    wanted = LM_MODULES + (DIFFUSION_MODULES if include_diffusion else ())
+    names = []
+    for name, _ in model.named_modules():
+        if name.rsplit(".", 1)[-1] in wanted and not any(name.startswith(n + ".") for n in names):
+            names.append(name)
+    return names
+
+
+def _linears(model, names):
+    """(padre, atributo, Linear) de cada nn.Linear bajo los submódulos dados"""
+    import torch
+
+    found = []
+    for name in names:
+        module = model.get_submodule(name)
+        if isinstance(module, torch.nn.Linear):
+            parent_name, _, attr = name.rpartition(".")
+            found.append((model.get_submodule(parent_name), attr, module))
+            continue
+        for child_name, child in module.named_modules():
+            if isinstance(child, torch.nn.Linear):
+                parent_name, _, attr = child_name.rpartition(".")
+                found.append((module.get_submodule(parent_name), attr, child))
+    return found
+
+
+def _cast_input(module, args):
+    module._vibevoice_input_dtype = args[0].dtype
+    return (args[0].to(module.weight.dtype),) + tuple(args[1:])
+
+
+def _restore_output(module, args, output):
+    return output.to(module._vibevoice_input_dtype)
+
+
+def _to_bf16(model, names):
+    import torch
+
+    linears = _linears(model, names)
+    for _, _, linear in linears:
+        linear.to(torch.bfloat16)
+        linear.register_forward_pre_hook(_cast_input)
+        linear.register_forward_hook(_restore_output)
+    return len(linears)
+
+
+def _to_int8_dynamic(model, names):
+    import torch
+
+    quantization = getattr(torch, "ao", torch).quantization
+    engines = torch.backends.quantized.supported_engines
+    if "fbgemm" not in engines and "qnnpack" in engines:
+        # ARM (p. ej. Graviton, Apple Silicon)
+        torch.backends.quantized.engine = "qnnpack"
+
+    count = len(_linears(model, names))
+    for name in names:
+        # quantize_dynamic necesita pesos fp32
+        model.get_submodule(name).float()
+    quantization.quantize_dynamic(model, qconfig_spec=set(names), dtype=torch.qint8, inplace=True)
+    return count
+
+
+def apply_precision(model, precision, include_diffusion=None):
+    """Convertir `model` en su lugar; retorna un resumen de lo convertido"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Precisión desconocida: {precision} (usa {', '.join(PRECISIONS)})")
+    if include_diffusion is None:
+        include_diffusion = precision == "bf16"
+    if precision == "fp32":
+        return {"precision": "fp32", "modules": [], "linears": 0}
+
+    names = target_modules(model, include_diffusion)
+    if not names:
+        raise RuntimeError("No se encontraron submódulos del LM para convertir")
+
+    if precision == "bf16":
+        converted = _to_bf16(model, names)
+    else:
+        device = next(model.parameters()).device
+        if device.type != "cpu":
+            raise RuntimeError(f"int8-dynamic solo está soportado en CPU (modelo en {device})")
+        converted = _to_int8_dynamic(model, names)
+
+    return {"precision": precision, "modules": names, "linears": converted}
+
+
+# =============================================================================
+# Medición A/B
+# =============================================================================
+
+def current_rss_mb():
+    """RSS actual del proceso en MB (None si no se puede medir)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def audio_similarity(pcm_a, pcm_b, frame=1024, hop=256):
+    """Similitud espectral simple entre dos clips PCM16 (1.0 = idénticos)
+
+    - ltas_corr: correlación de los espectros promedio (dB) de ambos clips
+    - frame_corr: correlación media cuadro a cuadro sobre la parte común
+    - duration_ratio: duración de b / duración de a
+    """
+    import numpy as np
+
+    a = np.frombuffer(pcm_a, dtype="<i2").astype(np.float32) / 32768.0
+    b = np.frombuffer(pcm_b, dtype="<i2").astype(np.float32) / 32768.0
+    if len(a) < frame or len(b) < frame:
+        return None
+
+    window = np.hanning(frame).astype(np.float32)
+
+    def log_spec(x):
+        frames = np.lib.stride_tricks.sliding_window_view(x, frame)[::hop]
+        return 20 * np.log10(np.abs(np.fft.rfft(frames * window, axis=1)) + 1e-6)
+
+    def corr(x, y):
+        x = x - x.mean()
+        y = y - y.mean()
+        denom = np.sqrt((x * x).sum() * (y * y).sum())
+        return float((x * y).sum() / denom) if denom > 0 else 0.0
+
+    spec_a, spec_b = log_spec(a), log_spec(b)
+    common = min(len(spec_a), len(spec_b))
+    return {
+        "ltas_corr": corr(spec_a.mean(axis=0), spec_b.mean(axis=0)),
+        "frame_corr": float(np.mean([corr(spec_a[i], spec_b[i]) for i in range(common)])),
+        "duration_ratio": len(b) / len(a),
+    }
+
+
+class PrecisionHook:
+    """Hook de arranque: aplica la precisión y opcionalmente mide el A/B"""
+
+    def __init__(self, ready_info, precision, include_diffusion=None, ab=False,
+                 ab_texts=DEFAULT_AB_TEXTS, voice=None, steps=5, cfg=1.5, seed=1234):
+        self.ready_info = ready_info
+        self.precision = precision
+        self.include_diffusion = include_diffusion
+        self.ab = ab
+        self.ab_texts = list(ab_texts)
+        self.voice = voice
+        self.steps = steps
+        self.cfg = cfg
+        self.seed = seed
+        # El A/B sintetiza: en modo fork corre en cada worker (ver LifespanHooks.preload)
+        self.runs_inference = ab
+        self.__name__ = "precision"
+
+    async def _measure(self, upstream):
+        import torch
+
+        runs = []
+        for index, text in enumerate(self.ab_texts):
+            params = {"text": text, "cfg": self.cfg, "steps": self.steps}
+            if self.voice:
+                params["voice"] = self.voice
+            # Misma semilla en ambas variantes: el muestreo de difusión es aleatorio
+            torch.manual_seed(self.seed + index)
+            result = await run_stream_session(upstream, params)
+            runs.append(result)
+        gc.collect()
+        ok = [r for r in runs if r.ok]
+        elapsed = sum(r.elapsed for r in ok)
+        audio = sum(r.audio_seconds for r in ok)
+        return {
+            "rtf": elapsed / audio if audio else None,
+            "rss_mb": current_rss_mb(),
+            "pcm": [r.pcm if r.ok else None for r in runs],
+        }
+
+    async def __call__(self, upstream):
+        service = get_tts_service(upstream)
+        model = getattr(service, "model", None)
+        if model is None:
+            logger.warning("[WARN] tts_service.model no disponible, precisión sin cambios")
+            return
+
+        baseline = None
+        if self.ab:
+            # Primera síntesis descartada para no medir la carga perezosa
+            await run_stream_session(upstream, {"text": self.ab_texts[0], "steps": self.steps}, collect=False)
+            baseline = await self._measure(upstream)
+
+        summary = await asyncio.to_thread(apply_precision, model, self.precision, self.include_diffusion)
+        logger.info(f"[OK] Precisión {summary['precision']}: {summary['linears']} Linear en "
+                    f"{', '.join(summary['modules']) or '-'}")
+
+        if baseline is not None:
+            candidate = await self._measure(upstream)
+            similarity = [audio_similarity(a, b) for a, b in zip(baseline["pcm"], candidate["pcm"])
+                          if a is not None and b is not None]
+            similarity = [s for s in similarity if s is not None]
+            summary["ab"] = {
+                "fp32_rtf": baseline["rtf"],
+                "rtf": candidate["rtf"],
+                "fp32_rss_mb": baseline["rss_mb"],
+                "rss_mb": candidate["rss_mb"],
+                "ltas_corr": min((s["ltas_corr"] for s in similarity), default=None),
+                "frame_corr": min((s["frame_corr"] for s in similarity), default=None),
+                "duration_ratio": [round(s["duration_ratio"], 3) for s in similarity],
+            }
+            ab = summary["ab"]
+            logger.info("=" * 60)
+            logger.info(f"A/B fp32 vs {self.precision}:")
+            logger.info(f"  RTF:  {_fmt(ab['fp32_rtf'])} -> {_fmt(ab['rtf'])}")
+            logger.info(f"  RSS:  {_fmt(ab['fp32_rss_mb'], '.0f')} MB -> {_fmt(ab['rss_mb'], '.0f')} MB")
+            logger.info(f"  Similitud (peor frase): espectro medio {_fmt(ab['ltas_corr'])}, "
+                        f"cuadro a cuadro {_fmt(ab['frame_corr'])}")
+            logger.info("=" * 60)
+            logger.info(f"[METRIC] precision_ab precision={self.precision} fp32_rtf={_fmt(ab['fp32_rtf'])} "
+                        f"rtf={_fmt(ab['rtf'])} ltas_corr={_fmt(ab['ltas_corr'])}")
+
+        self.ready_info["precision"] = summary
+
+
+def _fmt(value, spec=".3f"):
+    return "-" if value is None else format(value, spec)
+
+
+def precision_from_env(ready_info):
+    """PrecisionHook según VIBEVOICE_PRECISION, o None para fp32 sin A/B"""
+    precision = os.environ.get("VIBEVOICE_PRECISION", "fp32").strip().lower()
+    precision = {"int8": "int8-dynamic", "float32": "fp32", "bfloat16": "bf16"}.get(precision, precision)
+    if precision not in PRECISIONS:
+        raise ValueError(f"VIBEVOICE_PRECISION inválido: {precision} (usa {', '.join(PRECISIONS)})")
+    ab = env_flag("VIBEVOICE_PRECISION_AB")
+    if precision == "fp32" and not ab:
+        return None
+
+    diffusion = os.environ.get("VIBEVOICE_PRECISION_DIFFUSION", "auto").strip().lower()
+    texts = [t.strip() for t in os.environ.get("VIBEVOICE_PRECISION_AB_TEXTS", "").split("|") if t.strip()]
+    return PrecisionHook(
+        ready_info,
+        precision,
+        include_diffusion=None if diffusion == "auto" else env_flag("VIBEVOICE_PRECISION_DIFFUSION"),
+        ab=ab,
+        ab_texts=texts or DEFAULT_AB_TEXTS,
+        voice=os.environ.get("VIBEVOICE_PRECISION_AB_VOICE") or None,
+        steps=int(os.environ.get("VIBEVOICE_PRECISION_AB_STEPS", "5")),
+    )
@@ -0,0 +1,175 @@
+"""
+VibeVoice QoS Governor
+======================
+
+Middleware delante de /stream que adapta `steps` a la carga:
+- Presión = máx(sesiones en curso, contando la nueva, / VIBEVOICE_QOS_MAX_INFLIGHT,
+                RTF reciente (EWMA) / VIBEVOICE_QOS_TARGET_RTF)
+- Con presión <= 1 se respeta lo pedido
+- Con presión > 1 baja `steps` en proporción, sin salir de los límites que
+  declara el cliente (`steps_min`, `steps_max`)
+
+`cfg` no se toca: web.app ejecuta la rama condicional y la incondicional en
+cada paso de difusión sea cual sea `cfg`, así que bajarlo no ahorra cómputo.
+
+Un cliente que no declara límites recibe exactamente lo que pidió. Los
+valores usados se informan con el evento `backend_qos_applied` justo
+después de aceptar la conexión, y hay contadores en GET /qos/stats.
+
+Ejemplo:
+    ws://localhost:3000/stream?text=Hola&steps=5&steps_min=2
+
+Variables de entorno:
+    VIBEVOICE_QOS_MAX_INFLIGHT   - Sesiones simultáneas sin degradar (default: 2)
+    VIBEVOICE_QOS_TARGET_RTF     - RTF objetivo (default: 0.8)
+    VIBEVOICE_QOS_MIN_STEPS      - Piso del servidor para steps (default: 1)
+    VIBEVOICE_QOS_DEFAULT_STEPS  - steps asumidos si el cliente no los envía (default: 5)
+"""
+
+import logging
+import math
+import os
+import time
+from urllib.parse import urlencode
+
+from vibevoice_app import PCM16_BYTES_PER_SECOND, query_params, send_json, send_log_event
+
+logger = logging.getLogger(__name__)
+
+# Parámetros de límites: los consume el governor, no se reenvían a web.app
+BOUND_PARAMS = ("steps_min", "steps_max")
+
+
+def _number(value, cast, default):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class QoSGovernor:
+    """Estado de carga y decisión de steps por sesión"""
+
+    def __init__(self, max_inflight=2, target_rtf=0.8, min_steps=1, default_steps=5, ewma_alpha=0.3):
+        self.max_inflight = max(1, max_inflight)
+        self.target_rtf = target_rtf
+        self.min_steps = max(1, min_steps)
+        self.default_steps = default_steps
+        self.ewma_alpha = ewma_alpha
+        self.inflight = 0
+        self.rtf_ewma = None
+        self.sessions = 0
+        self.degraded = 0
+
+    @property
+    def pressure(self):
+        """Presión que vería una sesión nueva (cuenta ella misma)"""
+        load = (self.inflight + 1) / self.max_inflight
+        if self.rtf_ewma is not None and self.target_rtf > 0:
+            load = max(load, self.rtf_ewma / self.target_rtf)
+        return load
+
+    def decide(self, params):
+        """steps a usar y pedidos, según la presión actual"""
+        steps = _number(params.get("steps"), int, self.default_steps)
+        steps_min = max(self.min_steps, _number(params.get("steps_min"), int, steps))
+        steps_max = _number(params.get("steps_max"), int, steps)
+
+        # Nunca por debajo de lo pedido si el cliente no declaró un mínimo menor
+        lower_steps = min(steps_min, steps)
+        applied_steps = min(steps, steps_max)
+
+        pressure = self.pressure
+        if pressure > 1:
+            applied_steps = max(lower_steps, math.floor(applied_steps / pressure))
+
+        return {
+            "requested": {"steps": steps},
+            "applied": {"steps": applied_steps},
+            "bounds": {"steps_min": steps_min, "steps_max": steps_max},
+            "pressure": round(pressure, 3),
+            "inflight": self.inflight,
+            "rtf": round(self.rtf_ewma, 3) if self.rtf_ewma is not None else None,
+        }
+
+    def record(self, elapsed, audio_bytes):
+        if audio_bytes <= 0:
+            return
+        rtf = elapsed / (audio_bytes / PCM16_BYTES_PER_SECOND)
+        if self.rtf_ewma is None:
+            self.rtf_ewma = rtf
+        else:
+            self.rtf_ewma += self.ewma_alpha * (rtf - self.rtf_ewma)
+
+    def stats(self):
+        return {
+            "inflight": self.inflight,
+            "pressure": round(self.pressure, 3),
+            "rtf_ewma": round(self.rtf_ewma, 4) if self.rtf_ewma is not None else None,
+            "sessions": self.sessions,
+            "degraded": self.degraded,
+            "config": {
+                "max_inflight": self.max_inflight,
+                "target_rtf": self.target_rtf,
+                "min_steps": self.min_steps,
+            },
+        }
+
+
+class QoSMiddleware:
+    """Reescribe los steps de /stream según el governor e informa lo aplicado"""
+
+    def __init__(self, app, governor):
+        self.app = app
+        self.governor = governor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/qos/stats":
+            await send_json(send, 200, self.governor.stats())
+            return
+        if scope["type"] != "websocket" or scope["path"] != "/stream":
+            await self.app(scope, receive, send)
+            return
+
+        governor = self.governor
+        params = query_params(scope)
+        decision = governor.decide(params)
+        applied = decision["applied"]
+
+        forwarded = {k: v for k, v in params.items() if k not in BOUND_PARAMS}
+        if applied != decision["requested"] or "steps" in params:
+            forwarded["steps"] = applied["steps"]
+        scope = dict(scope, query_string=urlencode(forwarded).encode("latin-1"))
+
+        governor.sessions += 1
+        if applied["steps"] < decision["requested"]["steps"]:
+            governor.degraded += 1
+
+        audio = {"bytes": 0}
+
+        async def governed_send(message):
+            if message["type"] == "websocket.send" and message.get("bytes") is not None:
+                audio["bytes"] += len(message["bytes"])
+            await send(message)
+            if message["type"] == "websocket.accept":
+                await send_log_event(send, "backend_qos_applied", decision)
+
+        started = time.perf_counter()
+        governor.inflight += 1
+        try:
+            await self.app(scope, receive, governed_send)
+        finally:
+            governor.inflight -= 1
+        # Una sesión incremental espera al LLM que genera el texto: su
+        # duración no dice nada del RTF del servidor
+        if params.get("incremental") != "1":
+            governor.record(time.perf_counter() - started, audio["bytes"])
+
+
+def qos_from_env():
+    return QoSGovernor(
+        max_inflight=int(os.environ.get("VIBEVOICE_QOS_MAX_INFLIGHT", "2")),
+        target_rtf=float(os.environ.get("VIBEVOICE_QOS_TARGET_RTF", "0.8")),
+        min_steps=int(os.environ.get("VIBEVOICE_QOS_MIN_STEPS", "1")),
+        default_steps=int(os.environ.get("VIBEVOICE_QOS_DEFAULT_STEPS", "5")),
+    )
@@ -0,0 +1,370 @@
+"""
+VibeVoice Offline Render
+========================
+
+Render masivo sin servidor: lee un manifiesto JSONL de
+{"id", "text", "voice", "cfg", "steps"} y escribe un WAV por id.
+
+- Pool de procesos: cada worker carga el modelo una vez (web.app en proceso,
+  con su startup) y recibe un tramo disjunto de cores con su propio
+  presupuesto de threads: sus cores físicos (`vibevoice_workers.partition_cores`)
+- Dispositivo y shim de torch.xpu con la misma configuración que el lanzador
+  DirectML (`vibevoice_device.detect_and_select_device`)
+- Los textos largos se reparten primero, para que no queden al final
+- Cada WAV se escribe en streaming a `<id>.wav.part` y se renombra al
+  terminar; el checkpoint (`render-checkpoint.jsonl` en el directorio de
+  salida) registra cada id terminado. Tras un fallo, volver a lanzar el
+  mismo comando salta los ids ya renderizados
+- Reporta segundos de audio por segundo de reloj, en total y por worker, y
+  la eficiencia de escalado frente a N veces un worker solo (`--baseline-rate`)
+
+Uso (desde VibeVoice/demo/, como el servidor):
+    python render-vibevoice.py prompts.jsonl --out audio/ --workers 4
+"""
+
+import argparse
+import asyncio
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from vibevoice_app import PCM16_BYTES_PER_SECOND, InProcessLifespan, run_stream_session
+from vibevoice_jobs import ITEM_PARAMS, JobError, parse_items, safe_filename
+from vibevoice_snapshot import SnapshotError, activate_snapshot
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = "render-checkpoint.jsonl"
+MAX_ITEMS = 10_000_000
+
+
+# =============================================================================
+# Checkpoint
+# =============================================================================
+
+class Checkpoint:
+    """Ids terminados, una línea JSON por id (append + fsync)"""
+
+    def __init__(self, out_dir):
+        self.path = Path(out_dir) / CHECKPOINT_NAME
+        self._file = None
+
+    def completed(self, out_dir):
+        """Ids con estado ok cuyo WAV sigue en disco"""
+        done = set()
+        if not self.path.exists():
+            return done
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Última línea cortada por un fallo a mitad de escritura
+                    continue
+                if entry.get("status") == "ok" and (Path(out_dir) / entry.get("file", "")).is_file():
+                    done.add(entry["id"])
+        return done
+
+    def record(self, entry):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# =============================================================================
+# Worker (un proceso por tramo de cores)
+# =============================================================================
+
+_worker = {}
+
+
+def _init_worker(slots, device, demo_dir, model):
+    """Inicializador del pool: cores, threads, dispositivo y carga del modelo"""
+    cpus = slots.get()
+    # Antes de importar torch: OpenMP/MKL leen estas variables al cargar
+    threads = str(thread_budget(cpus))
+    os.environ["OMP_NUM_THREADS"] = threads
+    os.environ["MKL_NUM_THREADS"] = threads
+    logging.basicConfig(level=logging.INFO, format=f"[%(levelname)s] [r{os.getpid()}] %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    if hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError as e:
+            logger.warning(f"No se pudo fijar afinidad a CPUs {cpus}: {e}")
+
+    os.chdir(demo_dir)
+    sys.path.insert(0, demo_dir)
+    import vibevoice_device
+
+    if device == "cpu":
+        torch_device, device_name = vibevoice_device.setup_cpu(cpus)
+    else:
+        os.environ["VIBEVOICE_DEVICE"] = device
+        torch_device, device_name = vibevoice_device.detect_and_select_device()
+    os.environ["MODEL_PATH"] = model
+    os.environ["MODEL_DEVICE"] = str(torch_device)
+
+    import vibevoice_app
+
+    started = time.perf_counter()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    upstream = vibevoice_app.load_upstream_app()
+    lifespan = InProcessLifespan(upstream)
+    loop.run_until_complete(lifespan.startup())
+    # Mismos cambios al modelo que el servidor (snapshot, precisión, compilación)
+    for hook in vibevoice_app.model_hooks({}):
+        loop.run_until_complete(hook(upstream))
+
+    _worker.update(loop=loop, upstream=upstream, cpus=cpus, device=device_name,
+                   load_seconds=round(time.perf_counter() - started, 3))
+    atexit.register(_shutdown_worker, lifespan)
+    logger.info(f"[OK] Worker listo en {_worker['load_seconds']:.1f}s (CPUs {cpus}, {device_name})")
+
+
+def _shutdown_worker(lifespan):
+    loop = _worker["loop"]
+    try:
+        loop.run_until_complete(lifespan.shutdown())
+    except Exception as e:
+        logger.warning(f"[WARN] Shutdown del worker: {e}")
+    loop.close()
+
+
+def _render(item, out_dir):
+    """Sintetizar un item a `<id>.wav`; retorna la entrada del checkpoint"""
+    from vibevoice_client import StreamingWavWriter
+
+    name = safe_filename(item["id"], "wav")
+    path = Path(out_dir) / name
+    partial = path.with_name(name + ".part")
+    params = {"text": item["text"]}
+    # Un solo modelo por render (--model): "model" del manifiesto no aplica
+    params.update({key: item[key] for key in ITEM_PARAMS if key in item and key != "model"})
+    entry = {"id": item["id"], "file": name, "pid": os.getpid(),
+             "worker_load_s": _worker["load_seconds"]}
+
+    started = time.perf_counter()
+    try:
+        with StreamingWavWriter(str(partial)) as writer:
+            async def on_chunk(data):
+                writer.write(data)
+
+            result = _worker["loop"].run_until_complete(
+                run_stream_session(_worker["upstream"], params, collect=False, on_chunk=on_chunk))
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    entry["seconds"] = round(time.perf_counter() - started, 3)
+
+    if not result.ok:
+        partial.unlink(missing_ok=True)
+        errors = [e for e in result.events if e and "error" in e]
+        entry.update(status="error", error=errors[-1] if errors else f"close {result.close_code}")
+        return entry
+    os.replace(partial, path)
+    entry.update(status="ok", audio_s=round(result.audio_bytes / PCM16_BYTES_PER_SECOND, 3))
+    return entry
+
+
+# =============================================================================
+# Planificación y reporte
+# =============================================================================
+
+def thread_budget(cpus):
+    """Threads intra-op para un tramo: cores físicos del tramo (mismo plan que `setup_cpu`)"""
+    import vibevoice_threads
+
+    return vibevoice_threads.plan_from_env(cpus)["intra_op_threads"]
+
+
+def plan_workers(workers=None, threads_per_worker=2):
+    """Tramos de cores por worker (por defecto, uno cada `threads_per_worker` cores físicos)"""
+    import vibevoice_threads
+    import vibevoice_workers
+
+    cpus = vibevoice_threads.ordered_cpus()
+    if not workers:
+        topology = vibevoice_threads.cpu_topology(cpus)
+        physical = len({(info["node"], info["core"]) for info in topology.values()})
+        workers = max(1, physical // max(1, threads_per_worker))
+    return vibevoice_workers.partition_cores(workers, cpus)
+
+
+def summarize(entries, wall, baseline_rate=None):
+    """Resumen del render
+
+    La eficiencia de escalado es throughput / (N x `baseline_rate`), con
+    `baseline_rate` los segundos de audio/s de un worker solo en la misma
+    máquina. Sin baseline, un render de un worker usa su propio throughput
+    (y lo reporta como `baseline_rate` para las corridas con N workers);
+    con más workers no se calcula.
+    """
+    ok = [e for e in entries if e["status"] == "ok"]
+    audio = sum(e["audio_s"] for e in ok)
+    per_worker = {}
+    for e in ok:
+        stats = per_worker.setdefault(e["pid"], {"items": 0, "audio_s": 0.0, "busy_s": 0.0,
+                                                 "load_s": e["worker_load_s"]})
+        stats["items"] += 1
+        stats["audio_s"] += e["audio_s"]
+        stats["busy_s"] += e["seconds"]
+    for stats in per_worker.values():
+        stats["audio_s_per_busy_s"] = round(stats["audio_s"] / stats["busy_s"], 3) if stats["busy_s"] else None
+        stats["audio_s"] = round(stats["audio_s"], 3)
+        stats["busy_s"] = round(stats["busy_s"], 3)
+
+    rate = audio / wall if wall > 0 else 0.0
+    # No contra la suma de los workers: cada uno ya rinde menos por la contención
+    # (memoria, caché, turbo) y la eficiencia saldría siempre cerca del 100%
+    if baseline_rate is None and len(per_worker) == 1:
+        baseline_rate = rate
+    ideal = len(per_worker) * baseline_rate if baseline_rate else 0.0
+    return {
+        "rendered": len(ok),
+        "failed": len(entries) - len(ok),
+        "audio_seconds": round(audio, 3),
+        "wall_seconds": round(wall, 3),
+        "audio_seconds_per_second": round(rate, 3),
+        "baseline_rate": round(baseline_rate, 3) if baseline_rate else None,
+        "scaling_efficiency": round(rate / ideal, 3) if ideal else None,
+        "workers": per_worker,
+    }
+
+
+def render(manifest, out_dir, workers=None, threads_per_worker=2, device="cpu", model=None, force=False,
+           demo_dir=None, baseline_rate=None):
+    """Renderizar el manifiesto; retorna el resumen (ver `summarize`)"""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    items = parse_items(Path(manifest).read_bytes(), MAX_ITEMS)
+
+    checkpoint = Checkpoint(out_dir)
+    done = set() if force else checkpoint.completed(out_dir)
+    pending = [item for item in items if item["id"] not in done]
+    logger.info(f"Manifiesto: {len(items)} textos, {len(done)} ya renderizados, {len(pending)} pendientes")
+    if not pending:
+        return summarize([], 0.0, baseline_rate)
+
+    model = model or os.environ.get("VIBEVOICE_MODEL", "microsoft/VibeVoice-Realtime-0.5B")
+    # Snapshot: se verifica una vez aquí; el modo offline del hub lo heredan los workers
+    snapshot = activate_snapshot(model)
+    if snapshot is not None:
+        logger.info(f"Snapshot: {snapshot['source']} {snapshot['dtype']} (hash {snapshot['hash'][:12]})")
+
+    if device == "cpu":
+        partitions = plan_workers(workers, threads_per_worker)
+    else:
+        # GPU compartida: cada worker es una copia del modelo en el mismo dispositivo
+        import vibevoice_workers
+        partitions = vibevoice_workers.partition_cores(max(1, workers or 1))
+    partitions = partitions[:len(pending)]
+    logger.info(f"Workers: {len(partitions)} ({', '.join(str(len(p)) + ' CPUs' for p in partitions)})")
+
+    # spawn: cada worker importa torch de cero con su propio presupuesto de threads
+    context = multiprocessing.get_context("spawn")
+    slots = context.Queue()
+    for cpus in partitions:
+        slots.put(cpus)
+
+    # Más largos primero: el último worker en terminar no arranca un texto largo al final
+    pending.sort(key=lambda item: -len(item["text"]))
+    entries = []
+    started = None
+    finished = None
+    try:
+        with ProcessPoolExecutor(len(partitions), mp_context=context, initializer=_init_worker,
+                                 initargs=(slots, device, demo_dir or os.getcwd(), model)) as pool:
+            futures = {pool.submit(_render, item, str(out_dir)): item for item in pending}
+            for future in as_completed(futures):
+                try:
+                    entry = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    item = futures[future]
+                    entry = {"id": item["id"], "status": "error", "error": f"{type(e).__name__}: {e}",
+                             "seconds": 0.0}
+                if started is None:
+                    # El reloj empieza con el primer resultado: excluye la carga del modelo
+                    started = time.perf_counter() - entry["seconds"]
+                checkpoint.record(entry)
+                entries.append(entry)
+                finished = time.perf_counter()
+                if entry["status"] != "ok":
+                    logger.warning(f"[WARN] {entry['id']}: {entry['error']}")
+                elapsed = time.perf_counter() - started
+                audio = sum(e.get("audio_s", 0.0) for e in entries)
+                logger.info(f"[{len(entries)}/{len(pending)}] {entry['id']} {entry['status']} "
+                            f"({audio / elapsed if elapsed > 0 else 0:.2f} s de audio/s)")
+    finally:
+        checkpoint.close()
+    return summarize(entries, finished - started if started else 0.0, baseline_rate)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render offline de VibeVoice con un pool de procesos")
+    parser.add_argument("manifest", help="JSONL de {id, text, voice, cfg, steps}")
+    parser.add_argument("--out", required=True, help="Directorio de salida (WAV y checkpoint)")
+    parser.add_argument("--workers", type=int, help="Procesos (default: cores físicos / --threads-per-worker)")
+    parser.add_argument("--threads-per-worker", type=int, default=2, help="Cores por worker (default: 2)")
+    parser.add_argument("--device", default=os.environ.get("VIBEVOICE_DEVICE", "cpu"),
+                        help="cpu, cuda, directml o auto (default: VIBEVOICE_DEVICE o cpu)")
+    parser.add_argument("--model", help="Modelo (default: VIBEVOICE_MODEL)")
+    parser.add_argument("--force", action="store_true", help="Ignorar el checkpoint y renderizar todo")
+    parser.add_argument("--baseline-rate", type=float,
+                        help="Segundos de audio/s de un worker solo (baseline_rate de un render con "
+                             "--workers 1), para la eficiencia de escalado")
+    parser.add_argument("--json", help="Guardar el resumen JSON en este archivo")
+    args = parser.parse_args(argv)
+
+    if not (Path.cwd() / "web" / "app.py").exists():
+        logger.error("[ERROR] Este script debe ejecutarse desde el directorio VibeVoice/demo/")
+        return 1
+
+    try:
+        summary = render(args.manifest, args.out, args.workers, args.threads_per_worker, args.device,
+                         args.model, args.force, baseline_rate=args.baseline_rate)
+    except JobError as e:
+        logger.error(f"[ERROR] Manifiesto inválido: {e}")
+        return 1
+    except SnapshotError as e:
+        logger.error(f"[ERROR] {e}")
+        return 1
+    except BrokenProcessPool:
+        logger.error("[ERROR] Un worker terminó inesperadamente; lo renderizado quedó en el checkpoint,")
+        logger.error("        vuelve a lanzar el mismo comando para continuar")
+        return 1
+
+    logger.info("=" * 60)
+    logger.info(f"Renderizados: {summary['rendered']}  Fallidos: {summary['failed']}")
+    logger.info(f"Audio: {summary['audio_seconds']:.1f}s en {summary['wall_seconds']:.1f}s "
+                f"= {summary['audio_seconds_per_second']:.2f} s de audio/s")
+    if summary["scaling_efficiency"] is not None:
+        logger.info(f"Eficiencia de escalado: {summary['scaling_efficiency'] * 100:.0f}% "
+                    f"de {len(summary['workers'])} x {summary['baseline_rate']:.2f} s de audio/s "
+                    f"(un worker solo)")
+    elif len(summary["workers"]) > 1:
+        logger.info("Eficiencia de escalado: sin --baseline-rate (mídelo con --workers 1)")
+    for pid, stats in summary["workers"].items():
+        logger.info(f"  worker {pid}: {stats['items']} textos, {stats['audio_s']:.1f}s de audio, "
+                    f"{stats['audio_s_per_busy_s']}x, carga {stats['load_s']:.1f}s")
+    logger.info("=" * 60)
+    if args.json:
+        Path(args.json).write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding="utf-8")
+    return 0 if not summary["failed"] else 1
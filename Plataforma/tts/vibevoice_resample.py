@@ -0,0 +1,312 @@
+"""
+VibeVoice Streaming Resampler
+=============================
+
+Frecuencia de muestreo y formato de salida elegidos por sesión en /stream,
+para consumidores que necesitan 16 kHz u 8 kHz (telefonía, ASR) sin
+remuestrear en el cliente:
+
+    ws://localhost:3000/stream?text=Hola&sample_rate=16000&format=int16
+
+- `sample_rate`: cualquier frecuencia entera (8000, 16000, 22050, 48000...)
+- `format`: `int16` (PCM16 LE, default) o `float32` (LE, rango [-1, 1])
+
+El remuestreo es un filtro polifásico racional L/M (ventana de Kaiser)
+vectorizado con NumPy. Guarda entre chunks las últimas muestras de entrada y
+la fase, así que el resultado es idéntico a remuestrear el audio completo: no
+hay artefactos en las fronteras de los chunks. Lo aplicado llega en el evento
+`backend_audio_format` tras aceptar la conexión.
+
+Variables de entorno:
+    VIBEVOICE_RESAMPLE_TAPS     - Taps por fase del filtro (calidad/costo, default: 16)
+    VIBEVOICE_RESAMPLE_ROLLOFF  - Corte relativo a la Nyquist de salida (default: 0.9)
+"""
+
+import logging
+import math
+import os
+import time
+from urllib.parse import urlencode
+
+from vibevoice_app import SAMPLE_RATE, query_params, send_log_event
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("int16", "float32")
+MAX_RATE = 192000
+
+
+def design_filter(up, down, taps=16, rolloff=0.9, beta=8.0):
+    """Filtro prototipo polifásico como matriz (up, K): fila p = fase p"""
+    import numpy as np
+
+    per_phase = int(math.ceil(taps * max(1.0, down / up)))
+    length = per_phase * up
+    cutoff = rolloff * 0.5 / max(up, down)
+    # Centro en length // 2 (= StreamingResampler.offset): sin retardo fraccional
+    t = np.arange(length) - length // 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(length, beta) * up
+    # h[p + k*up] -> fila p, columna k
+    return h.reshape(per_phase, up).T.astype(np.float32)
+
+
+class StreamingResampler:
+    """Remuestreo racional por chunks con estado entre llamadas
+
+    La salida n corresponde a la posición u = n*M + c del dominio
+    sobremuestreado (c centra el filtro); usa la fase u % L y las K muestras
+    de entrada que terminan en u // L.
+    """
+
+    def __init__(self, source_rate, target_rate, taps=16, rolloff=0.9):
+        import numpy as np
+
+        g = math.gcd(source_rate, target_rate)
+        self.up = target_rate // g
+        self.down = source_rate // g
+        self.source_rate = source_rate
+        self.target_rate = target_rate
+        self.identity = self.up == self.down
+        if self.identity:
+            return
+        self.phases = design_filter(self.up, self.down, taps, rolloff)
+        self.per_phase = self.phases.shape[1]
+        self.offset = self.per_phase * self.up // 2
+        self.taps_range = np.arange(self.per_phase)
+        # Historia: entrada desde el índice absoluto `buffer_start` (ceros antes del inicio)
+        self.buffer = np.zeros(self.per_phase, dtype=np.float32)
+        self.buffer_start = -self.per_phase
+        self.consumed = 0
+        self.produced = 0
+
+    def _available(self, total):
+        """Salidas calculables con `total` muestras de entrada"""
+        last = total * self.up - 1 - self.offset
+        return last // self.down + 1 if last >= 0 else 0
+
+    def _run(self, limit):
+        import numpy as np
+
+        end = min(self._available(self.buffer_start + len(self.buffer)), limit)
+        if end <= self.produced:
+            return np.zeros(0, dtype=np.float32)
+        n = np.arange(self.produced, end, dtype=np.int64)
+        u = n * self.down + self.offset
+        base = u // self.up
+        window = base[:, None] - self.taps_range[None, :] - self.buffer_start
+        out = np.einsum("nk,nk->n", self.phases[u % self.up], self.buffer[window])
+        self.produced = end
+
+        # Descartar la entrada que ya no necesita ninguna salida futura
+        next_base = (end * self.down + self.offset) // self.up
+        keep_from = next_base - self.per_phase + 1 - self.buffer_start
+        if keep_from > 0:
+            self.buffer = self.buffer[keep_from:]
+            self.buffer_start += keep_from
+        return out
+
+    def process(self, samples):
+        """float32 de entrada (cualquier longitud) -> float32 de salida"""
+        import numpy as np
+
+        if self.identity:
+            return samples
+        self.buffer = np.concatenate([self.buffer, samples.astype(np.float32, copy=False)])
+        self.consumed += len(samples)
+        return self._run(self._expected())
+
+    def _expected(self):
+        return -(-self.consumed * self.up // self.down)
+
+    def flush(self):
+        """Salidas pendientes al terminar (la cola del filtro con ceros)"""
+        import numpy as np
+
+        if self.identity:
+            return np.zeros(0, dtype=np.float32)
+        self.buffer = np.concatenate([self.buffer, np.zeros(self.per_phase, dtype=np.float32)])
+        return self._run(self._expected())
+
+
+class AudioFormatter:
+    """PCM16 a 24 kHz -> frecuencia y formato pedidos, chunk a chunk"""
+
+    def __init__(self, target_rate, sample_format="int16", taps=16, rolloff=0.9):
+        self.resampler = StreamingResampler(SAMPLE_RATE, target_rate, taps, rolloff)
+        self.sample_format = sample_format
+        self.carry = b""
+
+    def _encode(self, samples):
+        import numpy as np
+
+        if self.sample_format == "float32":
+            return samples.astype("<f4").tobytes()
+        return np.clip(np.rint(samples * 32768.0), -32768, 32767).astype("<i2").tobytes()
+
+    def convert(self, pcm):
+        import numpy as np
+
+        data = self.carry + pcm
+        usable = len(data) - len(data) % 2
+        self.carry = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768.0
+        return self._encode(self.resampler.process(samples))
+
+    def flush(self):
+        return self._encode(self.resampler.flush())
+
+
+def parse_audio_format(params):
+    """(sample_rate, format) pedidos, o None si el stream sale como siempre
+
+    Lanza ValueError con un mensaje para el cliente si no son válidos.
+    """
+    rate = params.get("sample_rate")
+    sample_format = (params.get("format") or "int16").strip().lower()
+    if sample_format not in FORMATS:
+        raise ValueError(f"format debe ser uno de {', '.join(FORMATS)}")
+    try:
+        rate = int(rate) if rate else SAMPLE_RATE
+    except ValueError:
+        raise ValueError("sample_rate debe ser un entero")
+    if not 1000 <= rate <= MAX_RATE:
+        raise ValueError(f"sample_rate fuera de rango (1000-{MAX_RATE})")
+    if rate == SAMPLE_RATE and sample_format == "int16":
+        return None
+    return rate, sample_format
+
+
+class ResampleMiddleware:
+    """Aplica `sample_rate` / `format` de /stream al audio que sale de web.app"""
+
+    def __init__(self, app, taps=16, rolloff=0.9):
+        self.app = app
+        self.taps = taps
+        self.rolloff = rolloff
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket" or scope["path"] != "/stream":
+            await self.app(scope, receive, send)
+            return
+        params = query_params(scope)
+        if "sample_rate" not in params and "format" not in params:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            requested = parse_audio_format(params)
+        except ValueError as e:
+            await receive()  # websocket.connect
+            await send({"type": "websocket.accept"})
+            await send_log_event(send, "backend_error", {"message": str(e)})
+            await send({"type": "websocket.close", "code": 1008})
+            return
+
+        params.pop("sample_rate", None)
+        params.pop("format", None)
+        scope = dict(scope, query_string=urlencode(params).encode("latin-1"))
+        if requested is None:
+            await self.app(scope, receive, send)
+            return
+
+        rate, sample_format = requested
+        formatter = AudioFormatter(rate, sample_format, self.taps, self.rolloff)
+
+        async def formatted_send(message):
+            kind = message["type"]
+            if kind == "websocket.send" and message.get("bytes") is not None:
+                data = formatter.convert(message["bytes"])
+                if data:
+                    await send({"type": "websocket.send", "bytes": data})
+                return
+            if kind == "websocket.close":
+                tail = formatter.flush()
+                if tail:
+                    await send({"type": "websocket.send", "bytes": tail})
+            await send(message)
+            if kind == "websocket.accept":
+                await send_log_event(send, "backend_audio_format", {
+                    "sample_rate": rate,
+                    "format": sample_format,
+                    "source_rate": SAMPLE_RATE,
+                })
+
+        await self.app(scope, receive, formatted_send)
+
+
+# =============================================================================
+# Benchmark
+# =============================================================================
+
+def _tone(freq, seconds, rate=SAMPLE_RATE, amplitude=0.5):
+    import numpy as np
+
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def _level_db(samples):
+    import numpy as np
+
+    rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64)))) if len(samples) else 0.0
+    return 20 * math.log10(max(rms, 1e-12))
+
+
+def benchmark(target_rate, sample_format="int16", seconds=10.0, chunk_ms=100, taps=16, rolloff=0.9):
+    """Costo de CPU por segundo de audio y calidad (paso de banda y aliasing)"""
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    audio = np.clip(rng.normal(0, 0.2, int(seconds * SAMPLE_RATE)), -1, 1)
+    pcm = (audio * 32767).astype("<i2").tobytes()
+    chunk = int(SAMPLE_RATE * chunk_ms / 1000) * 2
+
+    formatter = AudioFormatter(target_rate, sample_format, taps, rolloff)
+    out_bytes = 0
+    started = time.process_time()
+    wall = time.perf_counter()
+    for offset in range(0, len(pcm), chunk):
+        out_bytes += len(formatter.convert(pcm[offset:offset + chunk]))
+    out_bytes += len(formatter.flush())
+    cpu = time.process_time() - started
+    wall = time.perf_counter() - wall
+
+    # Calidad: tono a 1 kHz (paso de banda) y tono sobre la Nyquist de salida (aliasing)
+    result = {
+        "target_rate": target_rate,
+        "format": sample_format,
+        "taps": taps,
+        "chunk_ms": chunk_ms,
+        "cpu_ms_per_audio_s": round(cpu * 1000 / seconds, 3),
+        "wall_ms_per_audio_s": round(wall * 1000 / seconds, 3),
+        "realtime_x": round(seconds / wall, 1) if wall > 0 else None,
+        "bytes_per_audio_s": round(out_bytes / seconds),
+        "wire_ratio_vs_24k_pcm16": round(out_bytes / len(pcm), 4),
+    }
+    if target_rate != SAMPLE_RATE:
+        width = 4 if sample_format == "float32" else 2
+        dtype = "<f4" if sample_format == "float32" else "<i2"
+        scale = 1.0 if sample_format == "float32" else 32768.0
+
+        def run(signal):
+            f = AudioFormatter(target_rate, sample_format, taps, rolloff)
+            data = f.convert((signal * 32767).astype("<i2").tobytes()) + f.flush()
+            out = np.frombuffer(data[:len(data) - len(data) % width], dtype=dtype) / scale
+            return out[len(out) // 10:-len(out) // 10 or None]
+
+        reference = _level_db(_tone(1000, 1.0)[2400:-2400])
+        result["passband_1khz_db"] = round(_level_db(run(_tone(1000, 1.0))) - reference, 2)
+        alias_freq = target_rate * 0.5 * 1.3
+        if alias_freq < SAMPLE_RATE * 0.45:
+            # Por encima de la Nyquist de salida: todo lo que pase es aliasing
+            result["alias_test_hz"] = round(alias_freq)
+            result["alias_rejection_db"] = round(reference - _level_db(run(_tone(alias_freq, 1.0))), 1)
+    return result
+
+
+def resample_from_env(app):
+    return ResampleMiddleware(
+        app,
+        taps=int(os.environ.get("VIBEVOICE_RESAMPLE_TAPS", "16")),
+        rolloff=float(os.environ.get("VIBEVOICE_RESAMPLE_ROLLOFF", "0.9")),
+    )
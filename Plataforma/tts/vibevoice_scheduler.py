@@ -0,0 +1,230 @@
+"""
+VibeVoice Length-Ordered Scheduler
+==================================
+
+Scheduler entre el handler de /stream y el modelo:
+- Reemplaza `tts_service.stream` por una versión que encola la petición
+- Un único thread recoge las peticiones que llegan dentro de una ventana
+  (tamaño máximo / espera máxima en ms) y las ejecuta en serie, del texto más
+  corto al más largo: menor latencia media que el orden de llegada y un solo
+  generador activo a la vez (evita que N sesiones peleen por los cores)
+
+No agrupa forward passes: el demo de VibeVoice genera una sesión por
+llamada, y cada petición se sintetiza sola.
+
+El demo rechaza sesiones concurrentes con un lock (`app.state.websocket_lock`);
+con el scheduler activo ese lock se reemplaza, porque la serialización la
+hace el scheduler: las peticiones concurrentes esperan turno en vez de
+recibir `backend_busy`.
+
+Con el control de admisión activo (default: una síntesis admitida a la vez)
+la ventana recibe de a una petición; el orden por longitud aplica con
+VIBEVOICE_ADMISSION_MAX_INFLIGHT > 1 o VIBEVOICE_ADMISSION=0.
+
+Estadísticas en GET /scheduler/stats.
+
+Variables de entorno:
+    VIBEVOICE_SCHEDULER_WINDOW    - Peticiones máximas por ventana (default: 8)
+    VIBEVOICE_SCHEDULER_WAIT_MS   - Espera máxima para completar la ventana en ms (default: 20)
+"""
+
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+
+from vibevoice_app import get_tts_service, send_json
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _Request:
+    """Petición encolada; el handler consume `chunks` desde su propio thread"""
+
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.text = args[0] if args else kwargs.get("text", "")
+        self.stop_event = kwargs.get("stop_event")
+        self.chunks = queue.Queue()
+        self.cancelled = False
+        self.enqueued_at = time.monotonic()
+        # Contexto del handler: la síntesis corre en él (las trazas ven su sesión)
+        self.context = contextvars.copy_context()
+
+    def is_cancelled(self):
+        return self.cancelled or (self.stop_event is not None and self.stop_event.is_set())
+
+    def iterate(self):
+        try:
+            while True:
+                item = self.chunks.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Generador cerrado por el handler (cliente desconectado, error, etc.)
+            self.cancelled = True
+
+
+class _NoopLock:
+    """Sustituto del lock de web.app: nunca reporta ocupado"""
+
+    def locked(self):
+        return False
+
+    async def acquire(self):
+        return True
+
+    def release(self):
+        return None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class LengthOrderedScheduler:
+    """Recoge peticiones concurrentes en ventanas y las ejecuta en serie, las cortas primero"""
+
+    def __init__(self, max_window=8, max_wait_ms=20.0):
+        self.max_window = max(1, max_window)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue = queue.Queue()
+        self._original_stream = None
+        self._service = None
+        self._thread = None
+
+        self.counters = {
+            "requests": 0,
+            "windows": 0,
+            "executed": 0,
+            "reordered": 0,
+            "cancelled": 0,
+            "errors": 0,
+        }
+        self._window_requests = 0
+        self._queue_wait_total = 0.0
+
+    # -- Instalación ----------------------------------------------------------
+
+    async def install(self, upstream):
+        service = get_tts_service(upstream)
+        if service is None or not hasattr(service, "stream"):
+            logger.warning("[WARN] app.state.tts_service no encontrado, scheduler desactivado")
+            return
+
+        self._service = service
+        self._original_stream = service.stream
+        service.stream = self.stream
+
+        if hasattr(upstream.state, "websocket_lock"):
+            upstream.state.websocket_lock = _NoopLock()
+            logger.info("[OK] Lock de sesión única de web.app reemplazado por el scheduler")
+
+        self._thread = threading.Thread(target=self._run, name="vibevoice-scheduler", daemon=True)
+        self._thread.start()
+
+        logger.info(f"[OK] Scheduler por longitud activo: ventana<={self.max_window}, "
+                    f"espera<={self.max_wait * 1000:.0f} ms")
+
+    def stream(self, *args, **kwargs):
+        """Reemplazo de `tts_service.stream`: encola y devuelve un generador de chunks"""
+        request = _Request(args, kwargs)
+        self.counters["requests"] += 1
+        self._queue.put(request)
+        return request.iterate()
+
+    # -- Scheduler ------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            window = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(window) < self.max_window:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    window.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._execute_window(window)
+
+    def _execute_window(self, window):
+        self.counters["windows"] += 1
+        self._window_requests += len(window)
+        # sorted es estable: a igual longitud se respeta el orden de llegada
+        ordered = sorted(window, key=lambda r: len(r.text))
+        self.counters["reordered"] += sum(a is not b for a, b in zip(window, ordered))
+        for request in ordered:
+            self._queue_wait_total += time.monotonic() - request.enqueued_at
+            if request.is_cancelled():
+                self.counters["cancelled"] += 1
+                request.chunks.put(_DONE)
+            else:
+                self._execute_single(request)
+
+    def _execute_single(self, request):
+        self.counters["executed"] += 1
+        run = request.context.run
+        iterator = iter(run(self._original_stream, *request.args, **request.kwargs))
+        try:
+            while True:
+                chunk = run(next, iterator, _DONE)
+                if chunk is _DONE:
+                    break
+                if request.is_cancelled():
+                    self.counters["cancelled"] += 1
+                    break
+                request.chunks.put(chunk)
+        except Exception as e:
+            self.counters["errors"] += 1
+            request.chunks.put(e)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                run(close)
+            request.chunks.put(_DONE)
+
+    def stats(self):
+        windows = self.counters["windows"]
+        return {
+            **self.counters,
+            "queued": self._queue.qsize(),
+            "mean_window_size": round(self._window_requests / windows, 3) if windows else 0.0,
+            "mean_queue_wait_ms": round(self._queue_wait_total / self._window_requests * 1000, 3)
+            if self._window_requests else 0.0,
+            "max_window": self.max_window,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+def scheduler_from_env():
+    return LengthOrderedScheduler(
+        max_window=int(os.environ.get("VIBEVOICE_SCHEDULER_WINDOW", "8")),
+        max_wait_ms=float(os.environ.get("VIBEVOICE_SCHEDULER_WAIT_MS", "20")),
+    )
+
+
+class SchedulerStatsMiddleware:
+    """Expone las estadísticas del scheduler en GET /scheduler/stats"""
+
+    def __init__(self, app, scheduler):
+        self.app = app
+        self.scheduler = scheduler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/scheduler/stats":
+            await send_json(send, 200, self.scheduler.stats())
+            return
+        await self.app(scope, receive, send)
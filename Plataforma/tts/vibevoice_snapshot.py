@@ -0,0 +1,541 @@
+"""
+VibeVoice Model Snapshot
+========================
+
+Snapshot local del modelo para arrancar en frío sin el hub de Hugging Face:
+resolver `microsoft/VibeVoice-Realtime-0.5B` en la caché del hub y
+deserializarlo en cada arranque domina el tiempo de inicio de un contenedor.
+
+`prepare-model.py` materializa un directorio con:
+- Pesos en safetensors ya convertidos al dtype de servicio (los .bin se
+  convierten también): se leen por mmap, sin unpickle ni conversión
+- `config.json` con ese `torch_dtype`
+- El tokenizer de texto (Qwen2.5) copiado dentro del snapshot, con
+  `preprocessor_config.json` apuntando a él
+- Los presets de voz (.pt) con los tensores en el mismo dtype, re-serializados
+  con `torch.save` (formato zip, cargable con mmap)
+- `vibevoice-snapshot.json`: manifiesto con tamaño y SHA-256 de cada archivo
+  y un hash del conjunto; se escribe al final, un directorio sin manifiesto
+  no se considera snapshot
+
+Si VIBEVOICE_MODEL apunta a un snapshot, los lanzadores lo verifican contra el
+manifiesto, activan el modo offline del hub (HF_HUB_OFFLINE, TRANSFORMERS_OFFLINE)
+y, después de que web.app carga el modelo, un hook de arranque:
+- Reemplaza en CPU los pesos por vistas de solo lectura sobre el mmap de los
+  safetensors (copy-on-write): la copia anónima que hizo el loader se libera y
+  los procesos que cargan el mismo snapshot comparten las páginas del page cache
+- Apunta los presets de voz del servicio a los del snapshot
+
+Variables de entorno:
+    VIBEVOICE_SNAPSHOT_VERIFY  - size (tamaños), full (SHA-256) u off (default: size)
+    VIBEVOICE_SNAPSHOT_MMAP    - Pesos sobre el mmap de los safetensors en CPU (default: 1)
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import time
+from pathlib import Path
+
+from vibevoice_app import current_model, env_flag, get_tts_service
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "vibevoice-snapshot.json"
+FORMAT_VERSION = 1
+
+DTYPES = {"fp32": "float32", "bf16": "bfloat16", "fp16": "float16"}
+DEFAULT_TOKENIZER = "Qwen/Qwen2.5-0.5B"
+TOKENIZER_DIR = "tokenizer"
+TOKENIZER_PATTERNS = ["tokenizer*", "vocab.json", "merges.txt", "special_tokens_map.json",
+                      "added_tokens.json"]
+VOICES_DIR = "voices"
+# Se reescribe al mover el snapshot (ruta del tokenizer): solo se comprueba que exista
+MUTABLE_FILES = ("preprocessor_config.json",)
+DEFAULT_VOICES = Path("voices") / "streaming_model"
+
+# Tipos de safetensors -> atributo de torch
+SAFETENSORS_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+# =============================================================================
+# Preparación
+# =============================================================================
+
+def resolve_source(model, revision=None, allow_patterns=None):
+    """Directorio local del modelo: el propio `model` si existe, si no el hub"""
+    if Path(model).is_dir():
+        return Path(model), revision
+    try:
+        from huggingface_hub import snapshot_download
+    except ImportError:
+        raise SnapshotError("huggingface_hub no está instalado (pip install huggingface_hub)")
+    path = Path(snapshot_download(model, revision=revision, allow_patterns=allow_patterns))
+    # La caché del hub guarda cada revisión en snapshots/<commit>
+    return path, path.name
+
+
+def file_sha256(path, block=8 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(block)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _safetensors_name(name):
+    """pytorch_model-00001-of-00002.bin -> model-00001-of-00002.safetensors"""
+    stem = name[:-len(".bin")]
+    if stem.startswith("pytorch_model"):
+        stem = "model" + stem[len("pytorch_model"):]
+    return stem + ".safetensors"
+
+
+def _load_weights(path):
+    import torch
+
+    if path.suffix == ".safetensors":
+        from safetensors import safe_open
+
+        with safe_open(str(path), framework="pt") as f:
+            return {key: f.get_tensor(key) for key in f.keys()}
+    return torch.load(path, map_location="cpu", weights_only=True, mmap=True)
+
+
+def convert_weights(source, target, dtype):
+    """Pesos de `source` a safetensors en `target` con los flotantes en `dtype`
+
+    Retorna {archivo de origen: archivo escrito}. Los tensores con memoria
+    compartida (pesos atados en los .bin) se copian por separado.
+    """
+    import torch
+    from safetensors.torch import save_file
+
+    torch_dtype = getattr(torch, dtype)
+    files = sorted(source.glob("*.safetensors")) or sorted(source.glob("*.bin"))
+    if not files:
+        raise SnapshotError(f"No hay pesos (*.safetensors, *.bin) en {source}")
+    written = {}
+    for path in files:
+        name = path.name if path.suffix == ".safetensors" else _safetensors_name(path.name)
+        tensors = {}
+        for key, tensor in _load_weights(path).items():
+            if tensor.is_floating_point():
+                tensor = tensor.to(torch_dtype)
+            tensors[key] = tensor.contiguous().clone()
+        save_file(tensors, str(target / name), metadata={"format": "pt"})
+        # safetensors crea el archivo con 0600: el servidor puede correr con otro usuario
+        os.chmod(target / name, 0o644)
+        logger.info(f"  [OK] {path.name} -> {name} ({len(tensors)} tensores, {dtype})")
+        written[path.name] = name
+        del tensors
+    return written
+
+
+def _write_index(source, target, written):
+    """Índice de shards con los nombres de los archivos convertidos"""
+    for name in ("model.safetensors.index.json", "pytorch_model.bin.index.json"):
+        path = source / name
+        if not path.exists():
+            continue
+        index = json.loads(path.read_text(encoding="utf-8"))
+        index["weight_map"] = {k: written.get(v, v) for k, v in index.get("weight_map", {}).items()}
+        index.setdefault("metadata", {})["total_size"] = sum(
+            (target / f).stat().st_size for f in set(written.values()))
+        (target / "model.safetensors.index.json").write_text(json.dumps(index, indent=2), encoding="utf-8")
+        return
+
+
+def _set_dtype(config, dtype):
+    """torch_dtype en la config y en las sub-configs que lo declaran"""
+    if isinstance(config, dict):
+        for key, value in config.items():
+            if key == "torch_dtype":
+                config[key] = dtype
+            else:
+                _set_dtype(value, dtype)
+
+
+def copy_metadata(source, target, dtype):
+    """Configs y demás archivos del modelo (todo salvo los pesos)"""
+    for path in sorted(source.rglob("*")):
+        relative = path.relative_to(source)
+        if (path.is_dir() or any(part.startswith(".") for part in relative.parts)
+                or path.suffix in (".safetensors", ".bin") or path.name.endswith(".index.json")):
+            continue
+        destination = target / relative
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        if path.name == "config.json" and len(relative.parts) == 1:
+            config = json.loads(path.read_text(encoding="utf-8"))
+            _set_dtype(config, dtype)
+            config["torch_dtype"] = dtype
+            destination.write_text(json.dumps(config, indent=2), encoding="utf-8")
+        else:
+            shutil.copyfile(path, destination)
+
+
+def tokenizer_source(target):
+    """Tokenizer que el processor carga (`language_model_pretrained_name`)"""
+    path = target / "preprocessor_config.json"
+    if path.exists():
+        config = json.loads(path.read_text(encoding="utf-8"))
+        return config.get("language_model_pretrained_name") or DEFAULT_TOKENIZER
+    return DEFAULT_TOKENIZER
+
+
+def copy_tokenizer(name, target):
+    source, _ = resolve_source(name, allow_patterns=TOKENIZER_PATTERNS)
+    destination = target / TOKENIZER_DIR
+    destination.mkdir(exist_ok=True)
+    copied = 0
+    for pattern in TOKENIZER_PATTERNS:
+        for path in source.glob(pattern):
+            if path.is_file():
+                shutil.copyfile(path, destination / path.name)
+                copied += 1
+    if not copied:
+        raise SnapshotError(f"No se encontraron archivos de tokenizer en {source}")
+    logger.info(f"  [OK] tokenizer {name} ({copied} archivos)")
+
+
+def link_tokenizer(snapshot):
+    """Apuntar el processor al tokenizer del snapshot (ruta absoluta)
+
+    Retorna False si el snapshot se movió y no se pudo reescribir la config.
+    """
+    path = snapshot / "preprocessor_config.json"
+    if not path.exists() or not (snapshot / TOKENIZER_DIR).is_dir():
+        return True
+    config = json.loads(path.read_text(encoding="utf-8"))
+    wanted = str((snapshot / TOKENIZER_DIR).resolve())
+    if config.get("language_model_pretrained_name") == wanted:
+        return True
+    config["language_model_pretrained_name"] = wanted
+    try:
+        path.write_text(json.dumps(config, indent=2), encoding="utf-8")
+    except OSError:
+        return False
+    return True
+
+
+def _cast_tree(value, torch_dtype, seen):
+    """Convertir los tensores flotantes de un preset (dicts, listas, caches)"""
+    import torch
+
+    if isinstance(value, torch.Tensor):
+        return value.to(torch_dtype) if value.is_floating_point() else value
+    if id(value) in seen:
+        return value
+    seen.add(id(value))
+    if isinstance(value, dict):
+        for key in list(value):
+            value[key] = _cast_tree(value[key], torch_dtype, seen)
+        return value
+    if isinstance(value, list):
+        value[:] = [_cast_tree(v, torch_dtype, seen) for v in value]
+        return value
+    if isinstance(value, tuple):
+        items = [_cast_tree(v, torch_dtype, seen) for v in value]
+        return type(value)(*items) if hasattr(value, "_fields") else type(value)(items)
+    if hasattr(value, "__dict__"):
+        # Objetos como DynamicCache (key_cache / value_cache)
+        for key, item in vars(value).items():
+            setattr(value, key, _cast_tree(item, torch_dtype, seen))
+    return value
+
+
+def convert_voices(voices_dir, target, dtype):
+    """Presets .pt con los tensores en `dtype`; retorna los nombres"""
+    import torch
+
+    torch_dtype = getattr(torch, dtype)
+    names = []
+    for path in sorted(Path(voices_dir).rglob("*.pt")):
+        preset = torch.load(path, map_location="cpu", weights_only=False)
+        destination = target / VOICES_DIR / path.relative_to(voices_dir)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        torch.save(_cast_tree(preset, torch_dtype, set()), destination)
+        names.append(path.stem)
+    if names:
+        logger.info(f"  [OK] {len(names)} presets de voz ({dtype})")
+    return names
+
+
+def build_manifest(target, info):
+    files = {}
+    for path in sorted(target.rglob("*")):
+        if path.is_file() and path.name != MANIFEST:
+            files[path.relative_to(target).as_posix()] = {
+                "bytes": path.stat().st_size,
+                "sha256": file_sha256(path),
+            }
+    digest = hashlib.sha256(json.dumps(files, sort_keys=True).encode("utf-8")).hexdigest()
+    return {"format": FORMAT_VERSION, **info, "files": files, "hash": digest}
+
+
+def prepare_snapshot(model, out_dir, dtype="fp32", revision=None, voices_dir=None, tokenizer=None,
+                     force=False):
+    """Materializar el snapshot de `model` en `out_dir`; retorna el manifiesto
+
+    Se construye en `<out_dir>.partial` y se renombra al terminar, así un
+    snapshot a medias nunca queda en `out_dir`.
+    """
+    if dtype not in DTYPES:
+        raise SnapshotError(f"dtype inválido: {dtype} (usa {', '.join(DTYPES)})")
+    out_dir = Path(out_dir).resolve()
+    if out_dir.exists() and not force:
+        raise SnapshotError(f"{out_dir} ya existe (usa --force para reemplazarlo)")
+    partial = out_dir.with_name(out_dir.name + ".partial")
+    shutil.rmtree(partial, ignore_errors=True)
+    partial.mkdir(parents=True)
+
+    started = time.perf_counter()
+    source, resolved_revision = resolve_source(model, revision)
+    logger.info(f"Origen: {source}")
+    torch_dtype = DTYPES[dtype]
+    written = convert_weights(source, partial, torch_dtype)
+    _write_index(source, partial, written)
+    copy_metadata(source, partial, torch_dtype)
+
+    tokenizer = tokenizer or tokenizer_source(partial)
+    copy_tokenizer(tokenizer, partial)
+    voices = []
+    if voices_dir is not None:
+        voices = convert_voices(voices_dir, partial, torch_dtype)
+
+    manifest = build_manifest(partial, {
+        "source": model,
+        "revision": resolved_revision,
+        "dtype": dtype,
+        "tokenizer": tokenizer,
+        "voices": voices,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+    (partial / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    os.replace(partial, out_dir)
+    link_tokenizer(out_dir)
+    logger.info(f"[OK] Snapshot en {out_dir} ({time.perf_counter() - started:.1f}s, "
+                f"hash {manifest['hash'][:12]})")
+    return manifest
+
+
+# =============================================================================
+# Carga
+# =============================================================================
+
+def read_manifest(path):
+    """Manifiesto del snapshot en `path`, o None si no es un snapshot"""
+    manifest = Path(path) / MANIFEST
+    if not manifest.is_file():
+        return None
+    return json.loads(manifest.read_text(encoding="utf-8"))
+
+
+def verify_snapshot(path, manifest, mode="size"):
+    """Comparar los archivos contra el manifiesto; SnapshotError si no coinciden"""
+    if mode == "off":
+        return
+    path = Path(path)
+    problems = []
+    for name, entry in manifest["files"].items():
+        file = path / name
+        if not file.is_file():
+            problems.append(f"falta {name}")
+        elif name in MUTABLE_FILES:
+            continue
+        elif file.stat().st_size != entry["bytes"]:
+            problems.append(f"{name}: {file.stat().st_size} bytes, esperados {entry['bytes']}")
+        elif mode == "full" and file_sha256(file) != entry["sha256"]:
+            problems.append(f"{name}: SHA-256 distinto")
+    if problems:
+        raise SnapshotError(f"Snapshot {path} no coincide con su manifiesto: " + "; ".join(problems[:5]))
+
+
+def activate_snapshot(path):
+    """Verificar el snapshot y activar el modo offline del hub
+
+    Retorna el manifiesto, o None si `path` no es un snapshot.
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+    mode = os.environ.get("VIBEVOICE_SNAPSHOT_VERIFY", "size").strip().lower()
+    verify_snapshot(path, manifest, mode)
+    if not link_tokenizer(Path(path)):
+        logger.warning(f"[WARN] El snapshot se movió y {path} no es escribible: "
+                       f"el tokenizer se buscará en la ruta original")
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    return manifest
+
+
+def log_load_phases(phases, title="Tiempos de carga"):
+    logger.info(f"{title}: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in phases.items()))
+
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    header.pop("__metadata__", None)
+    return header, 8 + length
+
+
+def mmap_weights(model, snapshot):
+    """Reemplazar parámetros y buffers por vistas sobre el mmap de los safetensors
+
+    Solo tensores en CPU con el mismo dtype y forma que en el archivo. El mmap
+    es copy-on-write: escribir en un peso no modifica el snapshot. Retorna
+    (tensores reemplazados, bytes).
+    """
+    import torch
+
+    tensors = dict(model.named_parameters())
+    tensors.update(model.named_buffers())
+    mapped = 0
+    mapped_bytes = 0
+    for path in sorted(Path(snapshot).glob("*.safetensors")):
+        header, data_start = _read_header(path)
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        for name, entry in header.items():
+            tensor = tensors.get(name)
+            dtype = getattr(torch, SAFETENSORS_DTYPES.get(entry["dtype"], ""), None)
+            if (tensor is None or dtype is None or tensor.device.type != "cpu"
+                    or tensor.dtype != dtype or list(tensor.shape) != entry["shape"]):
+                continue
+            begin, end = entry["data_offsets"]
+            if end == begin:
+                continue
+            view = torch.frombuffer(buffer, dtype=dtype, count=tensor.numel(),
+                                    offset=data_start + begin).view(tensor.shape)
+            tensor.data = view
+            mapped += 1
+            mapped_bytes += end - begin
+    return mapped, mapped_bytes
+
+
+class SnapshotHook:
+    """Hook de arranque: pesos sobre el mmap y presets de voz del snapshot"""
+
+    def __init__(self, ready_info, path, manifest, use_mmap=True):
+        self.ready_info = ready_info
+        self.path = Path(path)
+        self.manifest = manifest
+        self.use_mmap = use_mmap
+        self.__name__ = "snapshot"
+
+    def _voices(self, service):
+        presets = getattr(service, "voice_presets", None)
+        if not isinstance(presets, dict):
+            return 0
+        found = {p.stem: p for p in (self.path / VOICES_DIR).rglob("*.pt")}
+        repointed = 0
+        for key in presets:
+            if key in found:
+                presets[key] = found[key]
+                repointed += 1
+        return repointed
+
+    async def __call__(self, upstream):
+        import asyncio
+
+        service = get_tts_service(upstream)
+        model = getattr(service, "model", None)
+        info = {
+            "path": str(self.path),
+            "hash": self.manifest.get("hash"),
+            "dtype": self.manifest.get("dtype"),
+            "revision": self.manifest.get("revision"),
+        }
+        if model is None:
+            logger.warning("[WARN] tts_service.model no disponible, snapshot sin mmap")
+        elif self.use_mmap:
+            # La copia que hizo el loader se libera al reemplazar cada tensor
+            mapped, mapped_bytes = await asyncio.to_thread(mmap_weights, model, self.path)
+            info.update(mmap_tensors=mapped, mmap_mb=round(mapped_bytes / 1024 / 1024, 1))
+            logger.info(f"[OK] Snapshot: {mapped} tensores ({info['mmap_mb']} MB) sobre mmap")
+        info["voices"] = self._voices(service)
+        self.ready_info["snapshot"] = info
+
+
+def snapshot_from_env(ready_info):
+    """SnapshotHook si el modelo configurado es un snapshot, si no None"""
+    path = current_model()
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+    return SnapshotHook(ready_info, path, manifest, use_mmap=env_flag("VIBEVOICE_SNAPSHOT_MMAP", default=True))
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def default_dtype(device):
+    """dtype con el que web.app carga el modelo en cada dispositivo"""
+    return "bf16" if device == "cuda" else "fp32"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshot local del modelo VibeVoice para arranque en frío")
+    parser.add_argument("--model", default=os.environ.get("VIBEVOICE_MODEL", "microsoft/VibeVoice-Realtime-0.5B"),
+                        help="Id del hub o directorio (default: VIBEVOICE_MODEL)")
+    parser.add_argument("--out", help="Directorio del snapshot")
+    parser.add_argument("--dtype", default="auto", help="fp32, bf16, fp16 o auto (según --device)")
+    parser.add_argument("--device", default=os.environ.get("VIBEVOICE_DEVICE", "cpu"),
+                        help="Dispositivo de servicio para --dtype auto (default: VIBEVOICE_DEVICE o cpu)")
+    parser.add_argument("--revision", help="Revisión del hub (default: la última)")
+    parser.add_argument("--voices-dir", help=f"Presets de voz .pt (default: {DEFAULT_VOICES} si existe)")
+    parser.add_argument("--tokenizer", help="Tokenizer de texto (default: el de preprocessor_config.json)")
+    parser.add_argument("--force", action="store_true", help="Reemplazar --out si existe")
+    parser.add_argument("--verify", metavar="DIR", help="Verificar un snapshot (SHA-256) y salir")
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        manifest = read_manifest(args.verify)
+        if manifest is None:
+            logger.error(f"[ERROR] {args.verify} no tiene {MANIFEST}")
+            return 1
+        try:
+            verify_snapshot(args.verify, manifest, "full")
+        except SnapshotError as e:
+            logger.error(f"[ERROR] {e}")
+            return 1
+        logger.info(f"[OK] {len(manifest['files'])} archivos coinciden (hash {manifest['hash'][:12]})")
+        return 0
+    if not args.out:
+        parser.error("--out es obligatorio")
+
+    dtype = default_dtype(args.device) if args.dtype == "auto" else args.dtype
+    voices_dir = args.voices_dir or (DEFAULT_VOICES if DEFAULT_VOICES.is_dir() else None)
+    if voices_dir is None:
+        logger.warning(f"[WARN] Sin presets de voz: no existe {DEFAULT_VOICES} (usa --voices-dir)")
+    logger.info("=" * 60)
+    logger.info(f"Snapshot de {args.model} ({dtype}) en {args.out}")
+    logger.info("=" * 60)
+    try:
+        prepare_snapshot(args.model, args.out, dtype, args.revision, voices_dir, args.tokenizer, args.force)
+    except SnapshotError as e:
+        logger.error(f"[ERROR] {e}")
+        return 1
+    logger.info(f"Usar con: VIBEVOICE_MODEL={Path(args.out).resolve()}")
+    return 0
@@ -0,0 +1,375 @@
+"""
+VibeVoice CPU Thread Planner
+============================
+
+Calcula cuántos threads usar en CPU a partir de lo que el proceso puede usar
+de verdad, en lugar de `os.cpu_count()` (que en contenedores cuenta los cores
+del host):
+- Cuota de CPU del cgroup (v2 `cpu.max`, v1 `cpu.cfs_quota_us`)
+- Máscara de afinidad (`sched_getaffinity`)
+- Topología de sysfs: hermanos SMT, sockets y nodos NUMA
+
+Por defecto usa un thread intra-op por core físico permitido (sin exceder la
+cuota) y 1-2 threads inter-op. Opcionalmente fija el proceso a un nodo NUMA
+antes de cargar el modelo, para que los pesos se asignen en memoria local.
+
+Con VIBEVOICE_THREADS=tune, un hook de arranque barre varios valores con el
+handler real de /stream y se queda con el de menor real-time factor. El valor
+final aplica a los threads de inferencia creados después del barrido.
+
+Variables de entorno:
+    VIBEVOICE_THREADS          - auto, un número, o tune (default: auto)
+    VIBEVOICE_INTEROP_THREADS  - auto o un número (default: auto)
+    VIBEVOICE_SMT              - Usar también los hermanos SMT (default: 0)
+    VIBEVOICE_NUMA_NODE        - off, auto (nodo con más CPUs permitidas) o índice (default: off)
+    VIBEVOICE_THREADS_TUNE     - Valores a probar en modo tune (default: derivados del plan)
+    VIBEVOICE_THREADS_TUNE_TEXT - Frase usada en el barrido
+"""
+
+import logging
+import math
+import os
+import statistics
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SYSFS_CPU = Path("/sys/devices/system/cpu")
+SYSFS_NODE = Path("/sys/devices/system/node")
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+DEFAULT_TUNE_TEXT = "Hola, esta es una frase de calibración para elegir el número de threads."
+
+
+# =============================================================================
+# Descubrimiento
+# =============================================================================
+
+def available_cpus():
+    """CPUs que este proceso puede usar (respeta la máscara de afinidad)"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def format_cpu_list(cpus):
+    return ",".join(str(c) for c in cpus)
+
+
+def parse_cpu_list(value):
+    """Parsear listas tipo "0,1,2" o "0-3,8-11" """
+    cpus = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _read(path):
+    try:
+        return Path(path).read_text().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_paths():
+    """Rutas de cgroup de este proceso: {controlador o "" (v2): ruta}"""
+    paths = {}
+    content = _read("/proc/self/cgroup") or ""
+    for line in content.splitlines():
+        parts = line.split(":", 2)
+        if len(parts) != 3:
+            continue
+        _, controllers, path = parts
+        if not controllers:
+            paths[""] = path
+        for controller in controllers.split(","):
+            paths[controller] = path
+    return paths
+
+
+def _ancestors(base, path):
+    """`base/path` y sus directorios padre hasta `base`"""
+    current = base / path.lstrip("/")
+    while True:
+        yield current
+        if current == base or base not in current.parents:
+            return
+        current = current.parent
+
+
+def cgroup_cpu_limit():
+    """CPUs permitidas por la cuota del cgroup (float) o None si no hay límite"""
+    paths = _cgroup_paths()
+    limits = []
+
+    # cgroup v2: "max 100000" o "<quota> <period>"; el límite efectivo es el
+    # mínimo a lo largo de la jerarquía
+    if "" in paths:
+        for directory in _ancestors(CGROUP_ROOT, paths[""]):
+            value = _read(directory / "cpu.max")
+            if value:
+                quota, _, period = value.partition(" ")
+                if quota != "max" and period:
+                    limits.append(int(quota) / int(period))
+
+    # cgroup v1
+    for mount in ("cpu,cpuacct", "cpu"):
+        base = CGROUP_ROOT / mount
+        if not base.is_dir():
+            continue
+        for directory in _ancestors(base, paths.get("cpu", "/")):
+            quota = _read(directory / "cpu.cfs_quota_us")
+            period = _read(directory / "cpu.cfs_period_us")
+            if quota and period and int(quota) > 0:
+                limits.append(int(quota) / int(period))
+        break
+
+    return min(limits) if limits else None
+
+
+def cpu_topology(cpus=None):
+    """{cpu: {"core": (paquete, core_id), "node": nodo}} para las CPUs dadas
+
+    Sin sysfs (Windows/macOS) cada CPU cuenta como un core en el nodo 0.
+    """
+    cpus = list(cpus) if cpus is not None else available_cpus()
+    node_of = {}
+    if SYSFS_NODE.is_dir():
+        for node_dir in SYSFS_NODE.glob("node[0-9]*"):
+            cpulist = _read(node_dir / "cpulist")
+            if cpulist:
+                for cpu in parse_cpu_list(cpulist):
+                    node_of[cpu] = int(node_dir.name[4:])
+
+    topology = {}
+    for cpu in cpus:
+        base = SYSFS_CPU / f"cpu{cpu}" / "topology"
+        package = _read(base / "physical_package_id")
+        core = _read(base / "core_id")
+        topology[cpu] = {
+            "core": (int(package), int(core)) if package is not None and core is not None else (0, cpu),
+            "node": node_of.get(cpu, 0),
+        }
+    return topology
+
+
+def core_groups(topology):
+    """CPUs agrupadas por core físico (hermanos SMT juntos), en orden de nodo NUMA y core"""
+    groups = {}
+    for cpu in sorted(topology, key=lambda c: (topology[c]["node"], topology[c]["core"], c)):
+        groups.setdefault((topology[cpu]["node"], topology[cpu]["core"]), []).append(cpu)
+    return list(groups.values())
+
+
+def ordered_cpus(cpus=None):
+    """CPUs ordenadas por nodo NUMA y core físico (hermanos SMT juntos)
+
+    Al partir esta lista en tramos contiguos, cada tramo queda en el menor
+    número posible de nodos y no separa hermanos SMT.
+    """
+    topology = cpu_topology(cpus)
+    return sorted(topology, key=lambda c: (topology[c]["node"], topology[c]["core"], c))
+
+
+# =============================================================================
+# Plan
+# =============================================================================
+
+def plan_threads(cpus=None, numa_node=None, smt=False, threads=None, interop_threads=None):
+    """Calcular el plan de threads para este proceso
+
+    `numa_node`: None (no fijar), "auto" o índice de nodo. `threads` e
+    `interop_threads` fuerzan valores concretos.
+    """
+    cpus = list(cpus) if cpus is not None else available_cpus()
+    full_topology = topology = cpu_topology(cpus)
+
+    pin = None
+    if numa_node is not None:
+        by_node = {}
+        for cpu, info in topology.items():
+            by_node.setdefault(info["node"], []).append(cpu)
+        node = max(by_node, key=lambda n: len(by_node[n])) if numa_node == "auto" else int(numa_node)
+        if node in by_node and len(by_node) > 1:
+            pin = sorted(by_node[node])
+            topology = {cpu: topology[cpu] for cpu in pin}
+            numa_node = node
+        else:
+            numa_node = None
+
+    logical = len(topology)
+    physical = len({info["core"] for info in topology.values()})
+    quota = cgroup_cpu_limit()
+
+    intra = logical if smt else physical
+    if quota is not None:
+        intra = min(intra, max(1, math.floor(quota)))
+    if threads:
+        intra = int(threads)
+    intra = max(1, intra)
+
+    if interop_threads:
+        interop = int(interop_threads)
+    else:
+        # La síntesis es un solo grafo secuencial: poco paralelismo inter-op útil
+        interop = 1 if intra <= 4 else 2
+
+    return {
+        "intra_op_threads": intra,
+        "inter_op_threads": interop,
+        "logical_cpus": logical,
+        "physical_cores": physical,
+        "cgroup_cpu_limit": quota,
+        "numa_nodes": sorted({info["node"] for info in full_topology.values()}),
+        "numa_node": numa_node,
+        "pin_cpus": pin,
+        "host_cpu_count": os.cpu_count(),
+    }
+
+
+def apply_plan(torch_module, plan):
+    """Fijar afinidad (si el plan la pide) y threads intra/inter-op de torch"""
+    if plan.get("pin_cpus") and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, plan["pin_cpus"])
+        except OSError as e:
+            logger.warning(f"No se pudo fijar afinidad al nodo NUMA {plan['numa_node']}: {e}")
+
+    torch_module.set_num_threads(plan["intra_op_threads"])
+    try:
+        torch_module.set_num_interop_threads(plan["inter_op_threads"])
+    except RuntimeError:
+        # Solo se puede fijar antes del primer trabajo inter-op
+        plan["inter_op_threads"] = torch_module.get_num_interop_threads()
+    return plan
+
+
+def describe_plan(plan):
+    quota = plan["cgroup_cpu_limit"]
+    parts = [
+        f"intra-op {plan['intra_op_threads']}",
+        f"inter-op {plan['inter_op_threads']}",
+        f"{plan['physical_cores']} cores físicos / {plan['logical_cpus']} lógicos permitidos",
+        f"host {plan['host_cpu_count']}",
+        f"cuota cgroup {quota:g}" if quota is not None else "sin cuota cgroup",
+    ]
+    if plan.get("pin_cpus"):
+        parts.append(f"NUMA nodo {plan['numa_node']} (CPUs {format_cpu_list(plan['pin_cpus'])})")
+    return ", ".join(parts)
+
+
+def _env_count(name):
+    value = os.environ.get(name, "auto").strip().lower()
+    return int(value) if value.isdigit() else None
+
+
+def plan_from_env(cpus=None):
+    # "0" es un índice de nodo válido, no un "desactivado"
+    numa = os.environ.get("VIBEVOICE_NUMA_NODE", "off").strip().lower()
+    return plan_threads(
+        cpus=cpus,
+        numa_node=None if numa in ("", "off", "none", "false", "no") else numa,
+        smt=os.environ.get("VIBEVOICE_SMT", "0").strip().lower() in ("1", "true", "yes", "on"),
+        threads=_env_count("VIBEVOICE_THREADS"),
+        interop_threads=_env_count("VIBEVOICE_INTEROP_THREADS"),
+    )
+
+
+def configure_cpu_threads(torch_module, cpus=None):
+    """Planificar y aplicar los threads de CPU; retorna el plan"""
+    plan = apply_plan(torch_module, plan_from_env(cpus))
+    logger.info(f"[OK] Threads CPU: {describe_plan(plan)}")
+    return plan
+
+
+# =============================================================================
+# Auto-tune
+# =============================================================================
+
+def tune_candidates(plan):
+    """Valores a barrer: cores físicos, lógicos y fracciones del plan"""
+    top = max(plan["logical_cpus"], plan["intra_op_threads"])
+    if plan["cgroup_cpu_limit"] is not None:
+        top = min(top, max(1, math.ceil(plan["cgroup_cpu_limit"])))
+    values = {plan["intra_op_threads"], plan["physical_cores"], top,
+              max(1, plan["intra_op_threads"] // 2), max(1, plan["intra_op_threads"] * 3 // 4)}
+    return sorted(v for v in values if 1 <= v <= top)
+
+
+class ThreadTuner:
+    """Hook de arranque: barre threads intra-op y aplica el de menor RTF"""
+
+    def __init__(self, ready_info, plan, candidates=None, runs=2, text=DEFAULT_TUNE_TEXT,
+                 steps=5, cfg=1.5):
+        self.ready_info = ready_info
+        self.plan = plan
+        self.candidates = list(candidates) if candidates else tune_candidates(plan)
+        self.runs = runs
+        self.text = text
+        self.steps = steps
+        self.cfg = cfg
+        self.__name__ = "thread_tune"
+
+    async def _rtf(self, upstream):
+        from vibevoice_app import run_stream_session
+
+        result = await run_stream_session(upstream, {"text": self.text, "cfg": self.cfg,
+                                                     "steps": self.steps}, collect=False)
+        if not result.ok or not result.audio_seconds:
+            return None
+        return result.elapsed / result.audio_seconds
+
+    async def __call__(self, upstream):
+        import torch
+
+        logger.info("=" * 60)
+        logger.info(f"Auto-tune de threads: {self.candidates}")
+        logger.info("=" * 60)
+
+        started = time.perf_counter()
+        # Primera síntesis descartada: carga perezosa y selección de kernels
+        await self._rtf(upstream)
+
+        results = {}
+        for threads in self.candidates:
+            torch.set_num_threads(threads)
+            samples = [await self._rtf(upstream) for _ in range(self.runs)]
+            samples = [s for s in samples if s is not None]
+            if samples:
+                results[threads] = statistics.median(samples)
+                logger.info(f"  threads={threads:<3d} RTF {results[threads]:.3f}")
+            else:
+                logger.warning(f"  threads={threads:<3d} sin audio")
+
+        best = min(results, key=results.get) if results else self.plan["intra_op_threads"]
+        torch.set_num_threads(best)
+        elapsed = time.perf_counter() - started
+        self.ready_info["thread_tune"] = {
+            "selected": best,
+            "rtf": {str(k): round(v, 4) for k, v in results.items()},
+            "seconds": round(elapsed, 3),
+        }
+        logger.info(f"[METRIC] thread_tune_selected={best} rtf={results.get(best, float('nan')):.3f} "
+                    f"seconds={elapsed:.1f}")
+
+
+def tuner_from_env(ready_info):
+    """ThreadTuner si VIBEVOICE_THREADS=tune, si no None"""
+    if os.environ.get("VIBEVOICE_THREADS", "auto").strip().lower() != "tune":
+        return None
+    value = os.environ.get("VIBEVOICE_THREADS_TUNE", "")
+    candidates = [int(v) for v in value.split(",") if v.strip()] or None
+    return ThreadTuner(
+        ready_info,
+        plan_from_env(),
+        candidates=candidates,
+        text=os.environ.get("VIBEVOICE_THREADS_TUNE_TEXT", DEFAULT_TUNE_TEXT),
+    )
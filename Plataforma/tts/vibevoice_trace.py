@@ -0,0 +1,528 @@
+"""
+VibeVoice Request Tracing
+=========================
+
+Trazas por petición y por fase (VIBEVOICE_TRACE=1): cuando una sesión va
+lenta, permiten ver si el tiempo se fue en la tokenización, los pasos del LM
+Qwen, los pasos de difusión, el decoder acústico o los envíos por WebSocket.
+
+- Cada sesión de /stream recibe un id: `?request_id=` o la cabecera
+  `X-Request-ID` del cliente, o uno generado; se devuelve en la cabecera
+  `X-Request-ID` del handshake
+- Spans del modelo con forward hooks sobre los submódulos (`language_model`,
+  `tts_language_model`, `prediction_head`, `acoustic_tokenizer.decoder`,
+  `semantic_tokenizer.encoder`) y envolviendo la tokenización del processor;
+  spans de cada envío de audio por el WebSocket
+- Buffer circular de spans (VIBEVOICE_TRACE_BUFFER): memoria acotada, los más
+  viejos se descartan. Sin sesiones muestreadas en curso, los hooks retornan
+  sin medir nada
+- Modo muestreado para producción: VIBEVOICE_TRACE_SAMPLE=0.01 traza una
+  sesión de cada cien; `?trace=1` fuerza la traza de una sesión concreta
+
+El modelo corre en el thread de inferencia, no en el de la sesión. Sus spans
+se atribuyen a la sesión del contexto (`current_session`, que llega a ese
+thread con asyncio.to_thread y con el scheduler). Si el contexto no llega, van
+a las sesiones con slot de admisión (las que esperan en la cola no cuentan),
+y sin admisión a todas las muestreadas en curso. El resumen de cada sesión
+lleva `concurrent` para saber si compartió el servidor con otras.
+
+Exportación:
+    GET /trace                - Chrome trace-event JSON (chrome://tracing, Perfetto); ?request_id= filtra
+    GET /trace/requests       - Resumen por sesión: total, primer chunk y ms por fase (?sort=slowest)
+    GET /trace/stats          - Histograma de latencia por fase (ms por sesión) con p50/p95/p99
+    GET /metrics              - Los mismos histogramas en formato Prometheus
+
+Variables de entorno:
+    VIBEVOICE_TRACE         - Activar las trazas (default: 0)
+    VIBEVOICE_TRACE_SAMPLE  - Fracción de sesiones trazadas, 0-1 (default: 1)
+    VIBEVOICE_TRACE_BUFFER  - Spans en el buffer circular (default: 50000)
+"""
+
+import bisect
+import functools
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from urllib.parse import urlencode
+
+from vibevoice_app import current_session, get_tts_service, query_params, send_json
+
+logger = logging.getLogger(__name__)
+
+# Fase -> submódulos del modelo (por sufijo del nombre; se instrumenta el más externo)
+PHASE_MODULES = (
+    ("lm", ("language_model", "tts_language_model")),
+    ("diffusion", ("prediction_head", "diffusion_head")),
+    ("acoustic_decode", ("acoustic_tokenizer.decoder",)),
+    ("semantic_encode", ("semantic_tokenizer.encoder",)),
+)
+# Solo se envuelve el primero que exista: uno puede llamar al otro
+TOKENIZE_METHODS = ("process_input_with_cached_prompt", "__call__")
+
+PHASES = ("request", "first_chunk", "tokenize", "lm", "diffusion", "acoustic_decode", "semantic_encode",
+          "ws_send")
+# Spans de la sesión (envíos, la sesión entera): eventos async por request_id en el trace
+SESSION_PHASES = ("request", "ws_send")
+
+HISTOGRAM_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+TRACE_PATHS = ("/trace", "/trace/requests", "/trace/stats")
+MAX_REQUEST_ID = 64
+
+
+class Histogram:
+    """Histograma de buckets fijos en ms (el último bucket es +Inf)"""
+
+    def __init__(self, bounds=HISTOGRAM_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.sum += ms
+
+    def quantile(self, q):
+        """Estimación interpolando dentro del bucket (None sin muestras)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.bounds[i - 1] if i > 0 else 0.0
+                high = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                return round(low + (high - low) * (rank - seen) / count, 2)
+            seen += count
+        return float(self.bounds[-1])
+
+    def as_dict(self):
+        buckets = {f"le_{bound:g}": count for bound, count in zip(self.bounds, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count, 2) if self.count else None,
+            "p50_ms": self.quantile(0.50),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class RequestTrace:
+    """Estado de una sesión muestreada"""
+
+    __slots__ = ("id", "path", "started_ns", "started_wall", "first_chunk_ns", "phases", "spans",
+                 "concurrent", "audio_bytes", "status")
+
+    def __init__(self, request_id, path, concurrent):
+        self.id = request_id
+        self.path = path
+        self.started_ns = time.perf_counter_ns()
+        self.started_wall = time.time()
+        self.first_chunk_ns = None
+        self.phases = {}
+        self.spans = {}
+        self.concurrent = concurrent
+        self.audio_bytes = 0
+        self.status = None
+
+    def add(self, phase, duration_ns):
+        self.phases[phase] = self.phases.get(phase, 0) + duration_ns
+        self.spans[phase] = self.spans.get(phase, 0) + 1
+
+    def summary(self, finished_ns):
+        return {
+            "request_id": self.id,
+            "path": self.path,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_wall)),
+            "total_ms": round((finished_ns - self.started_ns) / 1e6, 2),
+            "first_chunk_ms": (round((self.first_chunk_ns - self.started_ns) / 1e6, 2)
+                               if self.first_chunk_ns is not None else None),
+            "phases_ms": {phase: round(ns / 1e6, 2) for phase, ns in self.phases.items()},
+            "spans": dict(self.spans),
+            "concurrent": self.concurrent,
+            "audio_bytes": self.audio_bytes,
+            "status": self.status,
+        }
+
+
+class SessionTurn:
+    """Valor de `current_session` para una sesión de /stream (muestreada o no)"""
+
+    __slots__ = ("tracer", "trace")
+
+    def __init__(self, tracer, trace):
+        self.tracer = tracer
+        self.trace = trace
+
+    def hold_model(self, holding):
+        if holding:
+            self.tracer.holding[id(self)] = self.trace
+        else:
+            self.tracer.holding.pop(id(self), None)
+
+
+class Tracer:
+    """Buffer circular de spans, resúmenes por sesión e histogramas por fase
+
+    Un span es (fase, inicio_ns, duración_ns, thread, request_ids, args). Los
+    hooks del modelo corren en el thread de inferencia: `deque.append` y
+    `list(dict.values())` son atómicos con el GIL, no hace falta un lock.
+    """
+
+    def __init__(self, sample=1.0, buffer_size=50000, requests_kept=256):
+        self.sample = min(max(sample, 0.0), 1.0)
+        self.spans = deque(maxlen=max(1, buffer_size))
+        self.requests = deque(maxlen=requests_kept)
+        self.histograms = {phase: Histogram() for phase in PHASES}
+        self.active = {}
+        # Sesiones con slot de admisión (SessionTurn -> RequestTrace o None si no se muestrea)
+        self.holding = {}
+        self.sessions = 0
+        self.traced = 0
+        self.untraced = 0
+        self.recorded = 0
+        self.instrumented = []
+        self.origin_ns = time.perf_counter_ns()
+        self.thread_names = {}
+        self._local = threading.local()
+
+    # ------------------------------------------------------------- sesiones
+
+    def start(self, request_id, path, force=None):
+        """Registrar una sesión; retorna su RequestTrace o None si no se muestrea"""
+        self.sessions += 1
+        sampled = force if force is not None else (self.sample >= 1.0 or random.random() < self.sample)
+        if not sampled:
+            self.untraced += 1
+            return None
+        self.traced += 1
+        trace = RequestTrace(request_id, path, self.sessions)
+        for other in self.active.values():
+            other.concurrent = max(other.concurrent, self.sessions)
+        # Por objeto: dos sesiones pueden traer el mismo request_id
+        self.active[id(trace)] = trace
+        return trace
+
+    def finish(self, trace):
+        self.sessions -= 1
+        if trace is None:
+            return
+        self.active.pop(id(trace), None)
+        finished_ns = time.perf_counter_ns()
+        self.record_session("request", trace, trace.started_ns, finished_ns, status=trace.status)
+        summary = trace.summary(finished_ns)
+        self.requests.append(summary)
+        self.histograms["request"].observe(summary["total_ms"])
+        if summary["first_chunk_ms"] is not None:
+            self.histograms["first_chunk"].observe(summary["first_chunk_ms"])
+        for phase, ms in summary["phases_ms"].items():
+            if phase in self.histograms and phase != "request":
+                self.histograms[phase].observe(ms)
+
+    # ---------------------------------------------------------------- spans
+
+    def _thread(self):
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        return tid
+
+    def record_session(self, phase, trace, start_ns, end_ns, **args):
+        """Span de una sesión concreta (envío por el WebSocket, la sesión entera)"""
+        duration = end_ns - start_ns
+        self.spans.append((phase, start_ns, duration, self._thread(), (trace.id,), args))
+        self.recorded += 1
+        if phase != "request":
+            trace.add(phase, duration)
+
+    def _model_traces(self):
+        """Sesiones a las que se atribuye el span del modelo que termina en este thread"""
+        session = current_session.get()
+        if session is not None and session.tracer is self:
+            return [session.trace] if session.trace is not None else []
+        if self.holding:
+            return [trace for trace in list(self.holding.values()) if trace is not None]
+        return list(self.active.values())
+
+    def record_shared(self, phase, start_ns, end_ns, **args):
+        """Span del modelo: se atribuye a la sesión que ocupa el modelo"""
+        traces = self._model_traces()
+        if not traces:
+            return
+        duration = end_ns - start_ns
+        self.spans.append((phase, start_ns, duration, self._thread(), tuple(t.id for t in traces), args))
+        self.recorded += 1
+        for trace in traces:
+            trace.add(phase, duration)
+
+    # -------------------------------------------------------- instrumentación
+
+    def _pre_hook(self, module, args):
+        if self.active:
+            starts = getattr(self._local, "starts", None)
+            if starts is None:
+                starts = self._local.starts = {}
+            starts[id(module)] = time.perf_counter_ns()
+
+    def _hook(self, phase, name):
+        def post_hook(module, args, output):
+            starts = getattr(self._local, "starts", None)
+            started = starts.pop(id(module), None) if starts else None
+            if started is not None:
+                self.record_shared(phase, started, time.perf_counter_ns(), module=name)
+        return post_hook
+
+    def _wrap(self, func, phase, name):
+        tracer = self
+
+        @functools.wraps(func)
+        def traced(*args, **kwargs):
+            if not tracer.active:
+                return func(*args, **kwargs)
+            started = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                tracer.record_shared(phase, started, time.perf_counter_ns(), module=name)
+        return traced
+
+    def instrument_model(self, model):
+        """Forward hooks en los submódulos de PHASE_MODULES; retorna los nombres"""
+        names = []
+        for name, module in model.named_modules():
+            phase = next((phase for phase, suffixes in PHASE_MODULES
+                          if any(name == s or name.endswith("." + s) for s in suffixes)), None)
+            if phase is None or any(name.startswith(n + ".") for n in names):
+                continue
+            module.register_forward_pre_hook(self._pre_hook)
+            module.register_forward_hook(self._hook(phase, name))
+            names.append(name)
+        return names
+
+    def instrument_processor(self, processor):
+        """Envolver la tokenización del processor; retorna el método o None"""
+        for method in TOKENIZE_METHODS:
+            if method == "__call__":
+                cls = type(processor)
+                if not callable(processor):
+                    continue
+                traced = self._wrap(cls.__call__.__get__(processor), "tokenize", f"processor.{method}")
+
+                def call(_, *args, **kwargs):
+                    return traced(*args, **kwargs)
+
+                # __call__ se busca en la clase: subclase solo para esta instancia
+                processor.__class__ = type(cls.__name__, (cls,), {"__call__": call})
+                return method
+            func = getattr(processor, method, None)
+            if callable(func):
+                setattr(processor, method, self._wrap(func, "tokenize", f"processor.{method}"))
+                return method
+        return None
+
+    def instrument(self, upstream):
+        """Instrumentar el modelo y el processor del servicio TTS de web.app"""
+        service = get_tts_service(upstream)
+        model = getattr(service, "model", None)
+        processor = getattr(service, "processor", None)
+        names = self.instrument_model(model) if model is not None else []
+        method = self.instrument_processor(processor) if processor is not None else None
+        if method is not None:
+            names.append(f"processor.{method}")
+        self.instrumented.extend(names)
+        if not names:
+            logger.warning("[WARN] Trazas: no se encontraron submódulos del modelo ni processor, "
+                           "solo se trazan sesiones y envíos")
+        return names
+
+    # ------------------------------------------------------------ exportación
+
+    def chrome_trace(self, request_id=None):
+        """Spans del buffer como Chrome trace-event JSON
+
+        Los spans del modelo son eventos completos ("X") en la pista de su
+        thread; los de cada sesión, eventos async ("b"/"e") con id = request_id.
+        """
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "vibevoice"}}]
+        threads = set()
+        for phase, start_ns, duration, tid, request_ids, args in list(self.spans):
+            if request_id is not None and request_id not in request_ids:
+                continue
+            ts = (start_ns - self.origin_ns) / 1000
+            if phase in SESSION_PHASES:
+                common = {"name": phase, "cat": "session", "id": request_ids[0], "pid": pid, "tid": tid}
+                events.append({**common, "ph": "b", "ts": ts, "args": {"request_id": request_ids[0], **args}})
+                events.append({**common, "ph": "e", "ts": ts + duration / 1000})
+            else:
+                events.append({"name": phase, "cat": "model", "ph": "X", "ts": ts, "dur": duration / 1000,
+                               "pid": pid, "tid": tid, "args": {"requests": list(request_ids), **args}})
+            threads.add(tid)
+        for tid in threads:
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": self.thread_names.get(tid, str(tid))}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def stats(self):
+        return {
+            "sample": self.sample,
+            "sessions_traced": self.traced,
+            "sessions_untraced": self.untraced,
+            "active": len(self.active),
+            "buffer": {"spans": len(self.spans), "capacity": self.spans.maxlen,
+                       "dropped": max(0, self.recorded - self.spans.maxlen)},
+            "instrumented": self.instrumented,
+            "phases": {phase: histogram.as_dict() for phase, histogram in self.histograms.items()
+                       if histogram.count},
+        }
+
+    def prometheus(self):
+        """Histogramas por fase en el formato de texto de Prometheus (segundos)"""
+        lines = ["# HELP vibevoice_trace_phase_seconds Tiempo por sesión en cada fase (sesiones trazadas)",
+                 "# TYPE vibevoice_trace_phase_seconds histogram"]
+        for phase, histogram in self.histograms.items():
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'vibevoice_trace_phase_seconds_bucket{{phase="{phase}",le="{bound / 1000:g}"}} '
+                             f'{cumulative}')
+            lines.append(f'vibevoice_trace_phase_seconds_bucket{{phase="{phase}",le="+Inf"}} {histogram.count}')
+            lines.append(f'vibevoice_trace_phase_seconds_sum{{phase="{phase}"}} {histogram.sum / 1000:.6f}')
+            lines.append(f'vibevoice_trace_phase_seconds_count{{phase="{phase}"}} {histogram.count}')
+        lines.append("# HELP vibevoice_trace_spans_dropped_total Spans descartados por el buffer circular")
+        lines.append("# TYPE vibevoice_trace_spans_dropped_total counter")
+        lines.append(f"vibevoice_trace_spans_dropped_total {max(0, self.recorded - self.spans.maxlen)}")
+        return "\n".join(lines) + "\n"
+
+
+class TraceHook:
+    """Hook de arranque: instrumenta el modelo ya cargado (después del warmup)"""
+
+    def __init__(self, tracer, ready_info=None):
+        self.tracer = tracer
+        self.ready_info = ready_info if ready_info is not None else {}
+        self.__name__ = "trace"
+
+    async def __call__(self, upstream):
+        names = self.tracer.instrument(upstream)
+        if names:
+            logger.info(f"[OK] Trazas: {len(names)} puntos instrumentados ({', '.join(names)})")
+        self.ready_info["trace"] = {"sample": self.tracer.sample, "instrumented": self.tracer.instrumented}
+
+
+class TraceMiddleware:
+    """Request id y spans de /stream; exportación en /trace y /metrics"""
+
+    def __init__(self, app, tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in TRACE_PATHS:
+            await self._export(scope, send)
+            return
+        if scope["type"] == "http" and scope["path"] == "/metrics":
+            await self._metrics(scope, receive, send)
+            return
+        if scope["type"] != "websocket" or scope["path"] != "/stream":
+            await self.app(scope, receive, send)
+            return
+
+        params = query_params(scope)
+        headers = dict(scope.get("headers") or [])
+        own = {key: params.pop(key) for key in ("request_id", "trace") if key in params}
+        if own:
+            scope = dict(scope, query_string=urlencode(params).encode("latin-1"))
+        request_id = (own.get("request_id") or headers.get(b"x-request-id", b"").decode("latin-1")
+                      or uuid.uuid4().hex[:12])[:MAX_REQUEST_ID]
+        forced = own.get("trace")
+        force = None if forced is None else forced.strip().lower() not in ("0", "false", "no", "off", "")
+
+        tracer = self.tracer
+        trace = tracer.start(request_id, scope["path"], force)
+        turn = SessionTurn(tracer, trace)
+        token = current_session.set(turn)
+
+        async def traced_send(message):
+            kind = message["type"]
+            if kind == "websocket.accept":
+                message = dict(message, headers=list(message.get("headers") or [])
+                               + [(b"x-request-id", request_id.encode("latin-1"))])
+            if trace is None:
+                await send(message)
+                return
+            if kind == "websocket.close":
+                trace.status = message.get("code", 1000)
+            data = message.get("bytes") if kind == "websocket.send" else None
+            if not data:
+                await send(message)
+                return
+            started = time.perf_counter_ns()
+            if trace.first_chunk_ns is None:
+                trace.first_chunk_ns = started
+            await send(message)
+            trace.audio_bytes += len(data)
+            tracer.record_session("ws_send", trace, started, time.perf_counter_ns(), bytes=len(data))
+
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            current_session.reset(token)
+            turn.hold_model(False)
+            tracer.finish(trace)
+
+    async def _export(self, scope, send):
+        params = query_params(scope)
+        if scope["path"] == "/trace":
+            await send_json(send, 200, self.tracer.chrome_trace(params.get("request_id") or None))
+        elif scope["path"] == "/trace/requests":
+            requests = list(self.tracer.requests)
+            if params.get("sort") == "slowest":
+                requests.sort(key=lambda r: r["total_ms"], reverse=True)
+            else:
+                requests.reverse()
+            try:
+                limit = int(params.get("limit") or 50)
+            except ValueError:
+                await send_json(send, 400, {"error": "limit debe ser un entero"})
+                return
+            await send_json(send, 200, {"requests": requests[:max(0, limit)]})
+        else:
+            await send_json(send, 200, self.tracer.stats())
+
+    async def _metrics(self, scope, receive, send):
+        """Histogramas de trazas añadidos a las métricas de las capas internas (admisión)"""
+        inner = {"status": None, "body": b""}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                inner["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                inner["body"] += message.get("body", b"")
+
+        await self.app(scope, receive, capture)
+        body = (inner["body"] if inner["status"] == 200 else b"") + self.tracer.prometheus().encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain; version=0.0.4; charset=utf-8"),
+                        (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def trace_from_env(app):
+    tracer = Tracer(
+        sample=float(os.environ.get("VIBEVOICE_TRACE_SAMPLE", "1")),
+        buffer_size=int(os.environ.get("VIBEVOICE_TRACE_BUFFER", "50000")),
+    )
+    logger.info(f"[OK] Trazas por petición: muestreo {tracer.sample:g}, buffer de {tracer.spans.maxlen} spans")
+    return TraceMiddleware(app, tracer)
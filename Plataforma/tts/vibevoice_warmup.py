@@ -0,0 +1,100 @@
+"""
+VibeVoice Warmup
+================
+
+Pre-calentamiento antes de aceptar tráfico:
+- Sintetiza una frase corta por cada voz configurada y por cada valor de
+  steps que se sirve, a través del handler real de /stream (en proceso)
+- Así la primera petición real no paga la carga perezosa de pesos, la carga
+  de presets de voz ni la selección de kernels de la primera llamada
+- Registra la duración del warmup como métrica de arranque y la publica en
+  GET /ready
+
+Variables de entorno:
+    VIBEVOICE_WARMUP_VOICES  - "all" o lista separada por comas (default: all)
+    VIBEVOICE_WARMUP_STEPS   - Valores de steps a calentar (default: 2,5)
+    VIBEVOICE_WARMUP_CFG     - cfg usado en el warmup (default: 1.5)
+    VIBEVOICE_WARMUP_TEXT    - Frase de warmup (default: "Hola, esto es una prueba.")
+"""
+
+import logging
+import os
+import time
+
+from vibevoice_app import asgi_get_json, run_stream_session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WARMUP_TEXT = "Hola, esto es una prueba."
+
+
+async def configured_voices(upstream, requested="all"):
+    """Voces a calentar: las pedidas o todas las que anuncia /config"""
+    if requested and requested.strip().lower() != "all":
+        return [v.strip() for v in requested.split(",") if v.strip()]
+
+    status, config = await asgi_get_json(upstream, "/config")
+    if status == 200 and isinstance(config, dict) and config.get("voices"):
+        return list(config["voices"])
+
+    logger.warning("[WARN] /config no devolvió voces, warmup solo con la voz por defecto")
+    return [None]
+
+
+class Warmup:
+    """Hook de arranque que ejecuta una síntesis por (voz, steps)"""
+
+    def __init__(self, ready_info, voices="all", steps=(2, 5), cfg=1.5, text=DEFAULT_WARMUP_TEXT):
+        self.ready_info = ready_info
+        self.voices = voices
+        self.steps = list(steps)
+        self.cfg = cfg
+        self.text = text
+        self.__name__ = "warmup"
+
+    async def __call__(self, upstream):
+        voices = await configured_voices(upstream, self.voices)
+        runs = [(voice, steps) for voice in voices for steps in self.steps]
+
+        logger.info("=" * 60)
+        logger.info(f"Warmup: {len(voices)} voces x {len(self.steps)} valores de steps")
+        logger.info("=" * 60)
+
+        started = time.perf_counter()
+        failures = []
+        for voice, steps in runs:
+            params = {"text": self.text, "cfg": self.cfg, "steps": steps}
+            if voice:
+                params["voice"] = voice
+            result = await run_stream_session(upstream, params, collect=False)
+            if result.ok:
+                logger.info(f"  [OK] voz={voice or 'default'} steps={steps}: "
+                            f"{result.elapsed:.2f}s (primer chunk {result.first_chunk_latency:.2f}s)")
+            else:
+                failures.append({"voice": voice, "steps": steps, "close_code": result.close_code})
+                logger.warning(f"  [WARN] voz={voice or 'default'} steps={steps}: sin audio "
+                               f"(close_code={result.close_code})")
+
+        elapsed = time.perf_counter() - started
+        self.ready_info.update({
+            "warmup_seconds": round(elapsed, 3),
+            "warmup_runs": len(runs),
+            "warmup_failures": failures,
+        })
+
+        if runs and len(failures) == len(runs):
+            raise RuntimeError("Todas las síntesis de warmup fallaron")
+
+        # Métrica de arranque en una línea fácil de extraer de los logs
+        logger.info(f"[METRIC] warmup_seconds={elapsed:.3f} runs={len(runs)} failures={len(failures)}")
+
+
+def warmup_from_env(ready_info):
+    steps = [int(s) for s in os.environ.get("VIBEVOICE_WARMUP_STEPS", "2,5").split(",") if s.strip()]
+    return Warmup(
+        ready_info,
+        voices=os.environ.get("VIBEVOICE_WARMUP_VOICES", "all"),
+        steps=steps,
+        cfg=float(os.environ.get("VIBEVOICE_WARMUP_CFG", "1.5")),
+        text=os.environ.get("VIBEVOICE_WARMUP_TEXT", DEFAULT_WARMUP_TEXT),
+    )
@@ -0,0 +1,898 @@
+#!/usr/bin/env python3
+"""
+VibeVoice Multi-Worker
+======================
+
+Modo multi-worker para run-vibevoice-server.py:
+- Lanza N procesos de inferencia (cada uno con su propia instancia del modelo)
+- Reparte los cores disponibles en conjuntos disjuntos, uno por worker
+- Router ASGI en el puerto público que envía cada sesión WebSocket al worker
+  con menos sesiones activas (least-loaded); las respuestas HTTP se reenvían
+  en streaming y el progreso de un lote va al worker que lo ejecuta
+- Estadísticas por worker en /workers (incluye memoria: RSS, PSS y USS) y
+  benchmark de throughput agregado
+- Los segundos de audio se cuentan en cada worker sobre PCM16 a 24 kHz (antes
+  de remuestreo y codecs) y se reportan al cerrar la sesión con el evento
+  `worker_audio`: los bytes del socket no sirven con mulaw, opus o float32
+
+Con VIBEVOICE_WORKER_MODE=fork (Linux/macOS, solo CPU) el modelo se carga una
+vez en el proceso principal y los workers se crean con fork después de
+cargarlo: comparten las páginas de los pesos copy-on-write en vez de tener
+una copia cada uno. Antes del fork se hace `gc.freeze()` (el GC de los workers
+no recorre, y por tanto no ensucia, los objetos ya cargados). Antes del fork
+solo se cargan pesos (snapshot, precisión), con un thread y sin inferencia;
+la compilación, el A/B de precisión, el ajuste de threads, el scheduler y el
+warmup corren en cada worker.
+
+Uso:
+    VIBEVOICE_WORKERS=4 python run-vibevoice-server.py
+    VIBEVOICE_WORKERS=8 VIBEVOICE_WORKER_MODE=fork python run-vibevoice-server.py
+
+    # Memoria única (USS) y proporcional (PSS) de cada worker
+    python vibevoice_workers.py memory --url http://localhost:3000
+
+    # Comparar throughput contra un servidor de un solo worker
+    python vibevoice_workers.py bench --url ws://localhost:3000 \\
+        --baseline-url ws://localhost:3001 --concurrency 8 --requests 32
+
+Variables de entorno:
+    VIBEVOICE_WORKERS               - Número de workers (default: 1, sin router)
+    VIBEVOICE_WORKER_BASE_PORT      - Primer puerto interno (default: VIBEVOICE_PORT + 1)
+    VIBEVOICE_WORKER_START_TIMEOUT  - Segundos máximos de arranque por worker (default: 900)
+    VIBEVOICE_WORKER_MODE           - spawn (un proceso y un modelo por worker) o fork (default: spawn)
+    VIBEVOICE_GC_THRESHOLD          - Umbrales gc.set_threshold en los workers fork, p. ej. "50000,20,20"
+"""
+
+import asyncio
+import gc
+import http.client
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from urllib.parse import urlencode
+
+import vibevoice_threads
+from vibevoice_app import PCM16_BYTES_PER_SECOND, query_params, send_json, send_log_event
+from vibevoice_jobs import BATCH_PATH, job_worker
+from vibevoice_threads import available_cpus, format_cpu_list, parse_cpu_list
+
+logger = logging.getLogger(__name__)
+
+# Cabeceras que no se deben reenviar en el proxy HTTP
+_HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "content-length",
+}
+
+# Lectura máxima por chunk del proxy HTTP
+PROXY_CHUNK_BYTES = 64 * 1024
+
+
+# =============================================================================
+# Particionado de cores
+# =============================================================================
+
+def partition_cores(num_workers, cpus=None, topology=None):
+    """Repartir CPUs en `num_workers` conjuntos disjuntos de cores físicos completos
+
+    Los hermanos SMT de un core van siempre al mismo worker y los cores se
+    reparten contiguos en orden de nodo NUMA; los sobrantes van a los
+    primeros workers, de forma que ningún conjunto difiere en más de un core.
+    Con más workers que cores físicos no queda otra que repartir CPUs lógicas.
+    """
+    if topology is None:
+        topology = vibevoice_threads.cpu_topology(cpus)
+    cores = vibevoice_threads.core_groups(topology)
+    if num_workers > len(cores):
+        cores = [[cpu] for core in cores for cpu in core]
+    num_workers = max(1, min(num_workers, len(cores)))
+
+    base, extra = divmod(len(cores), num_workers)
+    partitions = []
+    start = 0
+    for i in range(num_workers):
+        size = base + (1 if i < extra else 0)
+        partitions.append([cpu for core in cores[start:start + size] for cpu in core])
+        start += size
+    return partitions
+
+
+def apply_worker_affinity(torch_module, cpus=None):
+    """Aplicar dentro de un worker el conjunto de cores asignado por el supervisor"""
+    value = format_cpu_list(cpus) if cpus is not None else os.environ.get("VIBEVOICE_WORKER_CPUS")
+    if not value:
+        return None
+
+    cpus = parse_cpu_list(value)
+    if hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError as e:
+            logger.warning(f"No se pudo fijar afinidad a CPUs {value}: {e}")
+    else:
+        logger.warning("sched_setaffinity no disponible en esta plataforma, solo se limitan los threads")
+
+    # Un thread por core físico del tramo (respetando cuota y VIBEVOICE_THREADS)
+    plan = vibevoice_threads.plan_from_env(cpus)
+    plan["pin_cpus"] = None
+    vibevoice_threads.apply_plan(torch_module, plan)
+    logger.info(f"[OK] Worker {os.environ.get('VIBEVOICE_WORKER_INDEX', '?')}: "
+                f"CPUs {value} ({vibevoice_threads.describe_plan(plan)})")
+    return cpus
+
+
+# =============================================================================
+# Memoria por proceso
+# =============================================================================
+
+_SMAPS_FIELDS = {
+    "Rss": "rss_mb",
+    "Pss": "pss_mb",
+    "Shared_Clean": "shared_clean_mb",
+    "Shared_Dirty": "shared_dirty_mb",
+    "Private_Clean": "private_clean_mb",
+    "Private_Dirty": "private_dirty_mb",
+}
+
+
+def memory_usage(pid):
+    """RSS, PSS y USS (memoria única) de `pid` en MB, de /proc/<pid>/smaps_rollup
+
+    USS es lo que se liberaría al terminar el proceso; PSS reparte las
+    páginas compartidas entre quienes las comparten. None si no hay /proc.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    usage = {}
+    for line in lines:
+        key, _, rest = line.partition(":")
+        if key in _SMAPS_FIELDS:
+            usage[_SMAPS_FIELDS[key]] = round(int(rest.split()[0]) / 1024, 1)
+    if not usage:
+        return None
+    usage["uss_mb"] = round(usage.get("private_clean_mb", 0) + usage.get("private_dirty_mb", 0), 1)
+    usage["shared_mb"] = round(usage.get("shared_clean_mb", 0) + usage.get("shared_dirty_mb", 0), 1)
+    return usage
+
+
+def memory_totals(usages):
+    """Suma de RSS, PSS y USS; `rss - pss` es lo que se ahorra por compartir páginas"""
+    usages = [u for u in usages if u]
+    if not usages:
+        return None
+    totals = {key: round(sum(u.get(key, 0) for u in usages), 1) for key in ("rss_mb", "pss_mb", "uss_mb")}
+    totals["shared_saving_mb"] = round(totals["rss_mb"] - totals["pss_mb"], 1)
+    return totals
+
+
+# =============================================================================
+# Procesos worker
+# =============================================================================
+
+class Worker:
+    """Un proceso de inferencia escuchando en 127.0.0.1:<port>"""
+
+    def __init__(self, index, port, cpus):
+        self.index = index
+        self.port = port
+        self.cpus = cpus
+        self.process = None
+        self.ready = False
+        self.active_sessions = 0
+        self.total_sessions = 0
+        self.failed_sessions = 0
+        self.audio_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    @property
+    def http_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def ws_url(self):
+        return f"ws://127.0.0.1:{self.port}"
+
+    def start(self, launcher_path):
+        env = os.environ.copy()
+        cpu_list = format_cpu_list(self.cpus)
+        # Mismo plan que aplicará el worker: un thread por core físico del tramo
+        threads = str(vibevoice_threads.plan_from_env(self.cpus)["intra_op_threads"])
+        env.update({
+            "VIBEVOICE_WORKERS": "1",
+            "VIBEVOICE_WORKER_INDEX": str(self.index),
+            "VIBEVOICE_WORKER_CPUS": cpu_list,
+            "VIBEVOICE_HOST": "127.0.0.1",
+            "VIBEVOICE_PORT": str(self.port),
+            # Deben fijarse antes de que el worker importe torch
+            "OMP_NUM_THREADS": threads,
+            "MKL_NUM_THREADS": threads,
+        })
+        logger.info(f"Lanzando worker {self.index} en puerto {self.port} (CPUs {cpu_list})")
+        self.process = subprocess.Popen(
+            [sys.executable, str(launcher_path)],
+            env=env,
+            cwd=os.getcwd(),
+        )
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout=10):
+        if not self.is_alive():
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Worker {self.index} no terminó a tiempo, forzando kill")
+            self.process.kill()
+            self.process.wait()
+
+    def stats(self):
+        return {
+            "index": self.index,
+            "port": self.port,
+            "cpus": self.cpus,
+            "pid": self.process.pid if self.process else None,
+            "alive": self.is_alive(),
+            "ready": self.ready,
+            "active_sessions": self.active_sessions,
+            "total_sessions": self.total_sessions,
+            "failed_sessions": self.failed_sessions,
+            "audio_seconds": round(self.audio_seconds, 3),
+            "busy_seconds": round(self.busy_seconds, 3),
+            "memory": memory_usage(self.process.pid) if self.is_alive() else None,
+        }
+
+
+# =============================================================================
+# Segundos de audio reportados por el worker
+# =============================================================================
+
+AUDIO_EVENT = "worker_audio"
+AUDIO_PARAM = "worker_audio"
+
+
+def audio_report(text):
+    """Segundos de un evento `worker_audio` (o None si el texto es otro mensaje)"""
+    try:
+        message = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(message, dict) or message.get("event") != AUDIO_EVENT:
+        return None
+    return float(message.get("data", {}).get("audio_seconds", 0.0))
+
+
+class WorkerAudioMiddleware:
+    """Con ?worker_audio=1 reporta los segundos de PCM16 generados al cerrar /stream
+
+    Va dentro del remuestreo y los codecs: cuenta audio a 24 kHz sea cual sea
+    el formato que viaja por el socket.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket" or scope["path"] != "/stream":
+            await self.app(scope, receive, send)
+            return
+        params = query_params(scope)
+        if params.pop(AUDIO_PARAM, "0") != "1":
+            await self.app(scope, receive, send)
+            return
+        scope = dict(scope, query_string=urlencode(params).encode("latin-1"))
+        audio_bytes = 0
+        accepted = False
+        reported = False
+
+        async def report():
+            nonlocal reported
+            reported = True
+            await send_log_event(send, AUDIO_EVENT,
+                                 {"audio_seconds": round(audio_bytes / PCM16_BYTES_PER_SECOND, 6)})
+
+        async def counting_send(message):
+            nonlocal audio_bytes, accepted
+            kind = message["type"]
+            if kind == "websocket.accept":
+                accepted = True
+            elif kind == "websocket.send" and message.get("bytes") is not None:
+                audio_bytes += len(message["bytes"])
+            elif kind == "websocket.close" and accepted and not reported:
+                await report()
+            await send(message)
+
+        await self.app(scope, receive, counting_send)
+        if accepted and not reported:
+            # La app terminó sin cerrar: el servidor cierra después
+            try:
+                await report()
+            except Exception:
+                pass
+
+
+def _http_get(url, timeout=5.0):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.status, response.read()
+
+
+# =============================================================================
+# Router ASGI (least-loaded)
+# =============================================================================
+
+class WorkerRouter:
+    """App ASGI que reparte sesiones entre workers y gestiona su ciclo de vida"""
+
+    def __init__(self, num_workers, base_port, launcher_path, start_timeout=900.0):
+        self.launcher_path = Path(launcher_path) if launcher_path is not None else None
+        self.start_timeout = start_timeout
+        self.mode = "spawn"
+        self.preload_loop = None
+        self.workers = [
+            Worker(i, base_port + i, cpus)
+            for i, cpus in enumerate(partition_cores(num_workers))
+        ]
+        if len(self.workers) < num_workers:
+            logger.warning(f"Solo hay {len(self.workers)} CPUs disponibles, "
+                           f"se usarán {len(self.workers)} workers")
+        self.started_at = time.monotonic()
+
+    # -- Ciclo de vida ---------------------------------------------------------
+
+    async def startup(self):
+        for worker in self.workers:
+            if worker.process is None:
+                worker.start(self.launcher_path)
+        await asyncio.gather(*(self._wait_ready(w) for w in self.workers))
+
+        ready = [w for w in self.workers if w.ready]
+        if not ready:
+            raise RuntimeError("Ningún worker arrancó correctamente")
+        self.started_at = time.monotonic()
+        logger.info(f"[OK] {len(ready)}/{len(self.workers)} workers listos")
+
+    async def _wait_ready(self, worker):
+        deadline = time.monotonic() + self.start_timeout
+        while time.monotonic() < deadline:
+            if not worker.is_alive():
+                logger.error(f"[ERROR] Worker {worker.index} terminó durante el arranque "
+                             f"(código {worker.process.returncode})")
+                return
+            try:
+                status, _ = await asyncio.to_thread(_http_get, f"{worker.http_url}/ready", 2.0)
+                if status == 200:
+                    worker.ready = True
+                    logger.info(f"[OK] Worker {worker.index} listo en puerto {worker.port}")
+                    return
+            except (urllib.error.URLError, OSError):
+                pass
+            await asyncio.sleep(1.0)
+        logger.error(f"[ERROR] Worker {worker.index} no respondió en {self.start_timeout:.0f}s")
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+        logger.info("Workers detenidos")
+
+    # -- Selección de worker ---------------------------------------------------
+
+    def pick_worker(self):
+        candidates = [w for w in self.workers if w.ready and w.is_alive()]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda w: (w.active_sessions, w.total_sessions, w.index))
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        audio_seconds = sum(w.audio_seconds for w in self.workers)
+        workers = [w.stats() for w in self.workers]
+        supervisor = memory_usage(os.getpid())
+        return {
+            "mode": self.mode,
+            "workers": workers,
+            "memory": {
+                "supervisor": supervisor,
+                "workers": memory_totals(w["memory"] for w in workers),
+                "total": memory_totals([supervisor] + [w["memory"] for w in workers]),
+            },
+            "active_sessions": sum(w.active_sessions for w in self.workers),
+            "total_sessions": sum(w.total_sessions for w in self.workers),
+            "audio_seconds": round(audio_seconds, 3),
+            "uptime_seconds": round(elapsed, 3),
+            "audio_seconds_per_second": round(audio_seconds / elapsed, 4),
+        }
+
+    # -- ASGI -----------------------------------------------------------------
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "websocket":
+            await self._proxy_websocket(scope, receive, send)
+        elif scope["type"] == "http":
+            await self._proxy_http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    self.shutdown()
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _proxy_websocket(self, scope, receive, send):
+        import websockets
+
+        await receive()  # websocket.connect
+
+        worker = self.pick_worker()
+        if worker is None:
+            await send({"type": "websocket.close", "code": 1013, "reason": "No workers available"})
+            return
+
+        params = query_params(scope)
+        # Si el cliente pidió el evento (el bench) se le reenvía; si no, lo consume el router
+        forward_report = params.get(AUDIO_PARAM) == "1"
+        params[AUDIO_PARAM] = "1"
+        url = f"{worker.ws_url}{scope['path']}?{urlencode(params)}"
+
+        worker.active_sessions += 1
+        worker.total_sessions += 1
+        started = time.monotonic()
+        try:
+            try:
+                upstream = await websockets.connect(url, max_size=None, compression=None)
+            except Exception as e:
+                logger.warning(f"Worker {worker.index} rechazó la conexión: {e}")
+                worker.failed_sessions += 1
+                await send({"type": "websocket.close", "code": 1011})
+                return
+
+            await send({"type": "websocket.accept"})
+
+            async def client_to_upstream():
+                while True:
+                    message = await receive()
+                    if message["type"] == "websocket.disconnect":
+                        return
+                    if message.get("bytes") is not None:
+                        await upstream.send(message["bytes"])
+                    elif message.get("text") is not None:
+                        await upstream.send(message["text"])
+
+            async def upstream_to_client():
+                try:
+                    async for data in upstream:
+                        if isinstance(data, bytes):
+                            await send({"type": "websocket.send", "bytes": data})
+                            continue
+                        seconds = audio_report(data)
+                        if seconds is not None:
+                            worker.audio_seconds += seconds
+                            if not forward_report:
+                                continue
+                        await send({"type": "websocket.send", "text": data})
+                except websockets.exceptions.ConnectionClosedError:
+                    worker.failed_sessions += 1
+                await send({
+                    "type": "websocket.close",
+                    "code": upstream.close_code or 1000,
+                    "reason": upstream.close_reason or "",
+                })
+
+            tasks = [asyncio.ensure_future(client_to_upstream()),
+                     asyncio.ensure_future(upstream_to_client())]
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await upstream.close()
+        finally:
+            worker.active_sessions -= 1
+            worker.busy_seconds += time.monotonic() - started
+
+    async def _proxy_http(self, scope, receive, send):
+        if scope["path"] == "/workers":
+            await send_json(send, 200, self.stats())
+            return
+        if scope["path"] == "/ready":
+            ready = sum(1 for w in self.workers if w.ready and w.is_alive())
+            await send_json(send, 200 if ready else 503, {
+                "ready": ready > 0,
+                "workers_ready": ready,
+                "workers": len(self.workers),
+            })
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        path = scope["path"]
+        if path == BATCH_PATH and scope["method"] == "GET":
+            await self._list_jobs(send)
+            return
+        if path.startswith(BATCH_PATH + "/"):
+            # Progreso de un lote: solo lo conoce el worker que lo ejecuta
+            index = job_worker(path[len(BATCH_PATH) + 1:])
+            if index is None or index >= len(self.workers):
+                await send_json(send, 404, {"error": "lote no encontrado"})
+                return
+            worker = self.workers[index]
+            if not (worker.ready and worker.is_alive()):
+                await send_json(send, 503, {"error": f"Worker {index} del lote no disponible"})
+                return
+        else:
+            worker = self.pick_worker()
+            if worker is None:
+                await send_json(send, 503, {"error": "No workers available"})
+                return
+        await self._forward_http(worker, scope, body, receive, send)
+
+    async def _list_jobs(self, send):
+        """GET /synthesize/batch: lotes de todos los workers"""
+        workers = [w for w in self.workers if w.ready and w.is_alive()]
+        replies = await asyncio.gather(*(asyncio.to_thread(_http_get, f"{w.http_url}{BATCH_PATH}")
+                                         for w in workers), return_exceptions=True)
+        jobs = []
+        for worker, reply in zip(workers, replies):
+            if isinstance(reply, BaseException):
+                logger.warning(f"Worker {worker.index}: lista de lotes no disponible ({reply})")
+                continue
+            jobs.extend(json.loads(reply[1]).get("jobs", []))
+        await send_json(send, 200, {"jobs": jobs})
+
+    async def _forward_http(self, worker, scope, body, receive, send):
+        """Reenviar la petición a `worker` y la respuesta al cliente a medida que llega
+
+        Sin timeout total: un lote de /synthesize/batch puede durar horas y su
+        salida se reenvía chunk a chunk (la lectura bloqueante va en un thread).
+        """
+        query = scope.get("query_string", b"").decode("latin-1")
+        target = scope["path"] + (f"?{query}" if query else "")
+        headers = {
+            k.decode("latin-1"): v.decode("latin-1")
+            for k, v in scope.get("headers", [])
+            if k.decode("latin-1").lower() not in _HOP_BY_HOP_HEADERS | {"host"}
+        }
+
+        def open_upstream():
+            connection = http.client.HTTPConnection("127.0.0.1", worker.port)
+            try:
+                connection.request(scope["method"], target, body=body or None, headers=headers)
+                return connection, connection.getresponse()
+            except BaseException:
+                connection.close()
+                raise
+
+        try:
+            connection, response = await asyncio.to_thread(open_upstream)
+        except (http.client.HTTPException, OSError) as e:
+            await send_json(send, 502, {"error": f"Worker {worker.index}: {e}"})
+            return
+
+        disconnected = None
+        try:
+            response_headers = [
+                (k.lower().encode("latin-1"), v.encode("latin-1"))
+                for k, v in response.getheaders()
+                if k.lower() not in _HOP_BY_HOP_HEADERS
+            ]
+            length = response.getheader("content-length")
+            if length is not None:
+                response_headers.append((b"content-length", length.encode("latin-1")))
+            await send({"type": "http.response.start", "status": response.status, "headers": response_headers})
+
+            # El body ya se leyó: el siguiente mensaje solo puede ser la desconexión
+            disconnected = asyncio.ensure_future(receive())
+            while True:
+                read = asyncio.ensure_future(asyncio.to_thread(response.read1, PROXY_CHUNK_BYTES))
+                await asyncio.wait([read, disconnected], return_when=asyncio.FIRST_COMPLETED)
+                if not read.done():
+                    # Cortar el socket desbloquea la lectura y el worker ve la desconexión
+                    _abort_connection(connection)
+                    await asyncio.gather(read, return_exceptions=True)
+                    return
+                try:
+                    chunk = read.result()
+                except (http.client.HTTPException, OSError) as e:
+                    # Sin el body final: el servidor corta la conexión y el cliente ve la respuesta incompleta
+                    logger.warning(f"Worker {worker.index} cortó la respuesta de {scope['path']}: {e}")
+                    return
+                if not chunk:
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if disconnected is not None:
+                disconnected.cancel()
+            connection.close()
+
+
+def _abort_connection(connection):
+    if connection.sock is not None:
+        try:
+            connection.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def build_router(num_workers, port, launcher_path):
+    """Crear el router para `num_workers` workers detrás de `port`"""
+    base_port = int(os.environ.get("VIBEVOICE_WORKER_BASE_PORT", str(port + 1)))
+    start_timeout = float(os.environ.get("VIBEVOICE_WORKER_START_TIMEOUT", "900"))
+    return WorkerRouter(num_workers, base_port, launcher_path, start_timeout)
+
+
+# =============================================================================
+# Fork después de cargar (pesos compartidos copy-on-write)
+# =============================================================================
+
+def worker_mode(device="cpu"):
+    """"fork" si se pidió y es posible, si no "spawn" """
+    mode = os.environ.get("VIBEVOICE_WORKER_MODE", "spawn").strip().lower()
+    if mode != "fork":
+        return "spawn"
+    if not hasattr(os, "fork"):
+        logger.warning("[WARN] VIBEVOICE_WORKER_MODE=fork requiere fork(); usando spawn")
+        return "spawn"
+    if device != "cpu":
+        # CUDA/MPS no sobreviven a un fork después de inicializarse
+        logger.warning(f"[WARN] VIBEVOICE_WORKER_MODE=fork solo con CPU (device={device}); usando spawn")
+        return "spawn"
+    return "fork"
+
+
+class _ForkedProcess:
+    """multiprocessing.Process (fork) con la interfaz de subprocess.Popen que usa Worker"""
+
+    def __init__(self, process):
+        self._process = process
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    @property
+    def returncode(self):
+        return self._process.exitcode
+
+    def poll(self):
+        return self._process.exitcode
+
+    def terminate(self):
+        self._process.terminate()
+
+    def kill(self):
+        self._process.kill()
+
+    def wait(self, timeout=None):
+        self._process.join(timeout)
+        if self._process.exitcode is None:
+            raise subprocess.TimeoutExpired(f"worker {self.pid}", timeout)
+        return self._process.exitcode
+
+
+def _gc_threshold():
+    value = os.environ.get("VIBEVOICE_GC_THRESHOLD", "").strip()
+    return [int(v) for v in value.split(",") if v.strip()] if value else None
+
+
+def _run_forked_worker(app, worker):
+    """Cuerpo del worker tras el fork: cores, threads, GC y uvicorn en su puerto"""
+    os.environ.update({
+        "VIBEVOICE_WORKER_INDEX": str(worker.index),
+        "VIBEVOICE_WORKER_CPUS": format_cpu_list(worker.cpus),
+    })
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(f"[%(levelname)s] [w{worker.index}] %(message)s"))
+
+    # Los objetos del padre siguen congelados: el GC del worker solo recorre los nuevos
+    threshold = _gc_threshold()
+    if threshold:
+        gc.set_threshold(*threshold)
+    gc.enable()
+
+    import torch
+    import uvicorn
+
+    apply_worker_affinity(torch, worker.cpus)
+    uvicorn.run(app, host="127.0.0.1", port=worker.port, log_level="info", access_log=False)
+
+
+def build_fork_router(num_workers, port, app):
+    """Cargar `app` (LifespanHooks de build_app) una vez y hacer fork de los workers
+
+    Se llama antes de arrancar el event loop del router: el proceso principal
+    queda como router y dueño de las páginas compartidas del modelo. Antes del
+    fork solo se cargan pesos (sin inferencia, ver `LifespanHooks.preload`).
+    """
+    import multiprocessing
+
+    router = build_router(num_workers, port, None)
+    router.mode = "fork"
+
+    # Un solo thread hasta el fork: si la carga de web.app ejecuta alguna
+    # operación paralela, OpenMP/MKL no crean un pool que los hijos heredarían
+    # roto. Cada worker fija después sus threads (apply_worker_affinity)
+    import torch
+    torch.set_num_threads(1)
+
+    # Sin GC durante la carga (menos huecos en las páginas) y congelado antes del fork
+    gc.disable()
+    started = time.perf_counter()
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(app.preload())
+    logger.info(f"[OK] Modelo cargado una vez en {time.perf_counter() - started:.1f}s; "
+                f"fork de {len(router.workers)} workers")
+    gc.collect()
+    gc.freeze()
+    usage = memory_usage(os.getpid())
+    if usage:
+        logger.info(f"  Proceso principal antes del fork: RSS {usage['rss_mb']:.0f} MB")
+
+    context = multiprocessing.get_context("fork")
+    for worker in router.workers:
+        process = context.Process(target=_run_forked_worker, args=(app, worker),
+                                  name=f"vibevoice-worker-{worker.index}", daemon=False)
+        process.start()
+        worker.process = _ForkedProcess(process)
+        logger.info(f"Worker {worker.index} (fork, pid {process.pid}) en puerto {worker.port} "
+                    f"(CPUs {format_cpu_list(worker.cpus)})")
+    gc.enable()
+    # El loop de la carga queda abierto: sus objetos están congelados y compartidos
+    router.preload_loop = loop
+    return router
+
+
+# =============================================================================
+# Benchmark de throughput agregado
+# =============================================================================
+
+BENCH_TEXT = "Hola, este es un test del sistema de síntesis de voz. ¿Funciona correctamente?"
+
+
+async def _bench_session(url, params):
+    """Segundos de audio de una síntesis, según el evento `worker_audio` del servidor"""
+    import websockets
+
+    audio_seconds = 0.0
+    ws_url = f"{url}/stream?{urlencode(dict(params, **{AUDIO_PARAM: '1'}))}"
+    async with websockets.connect(ws_url, max_size=None) as websocket:
+        async for message in websocket:
+            if isinstance(message, str):
+                audio_seconds += audio_report(message) or 0.0
+    return audio_seconds
+
+
+async def measure_throughput(url, concurrency, requests, params):
+    """Ejecutar `requests` síntesis con `concurrency` clientes en paralelo
+
+    Retorna segundos de audio generados por segundo de reloj.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            try:
+                return await _bench_session(url, params)
+            except Exception as e:
+                failures += 1
+                logger.warning(f"Sesión fallida: {e}")
+                return 0.0
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(requests)))
+    wall = time.perf_counter() - started
+
+    audio_seconds = sum(results)
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "requests": requests,
+        "failures": failures,
+        "wall_seconds": round(wall, 3),
+        "audio_seconds": round(audio_seconds, 3),
+        "audio_seconds_per_second": round(audio_seconds / wall, 4) if wall > 0 else 0.0,
+    }
+
+
+def _bench_main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Throughput agregado de VibeVoice (multi-worker vs single-worker)")
+    parser.add_argument("--url", default="ws://localhost:3000", help="Servidor a medir (router multi-worker)")
+    parser.add_argument("--baseline-url", default=None, help="Servidor single-worker para comparar")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--text", default=BENCH_TEXT)
+    parser.add_argument("--voice", default="sp-Spk1_man")
+    parser.add_argument("--cfg", type=float, default=1.5)
+    parser.add_argument("--steps", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    params = {"text": args.text, "voice": args.voice, "cfg": args.cfg, "steps": args.steps}
+    report = {"candidate": asyncio.run(measure_throughput(args.url, args.concurrency, args.requests, params))}
+
+    if args.baseline_url:
+        report["baseline"] = asyncio.run(
+            measure_throughput(args.baseline_url, args.concurrency, args.requests, params))
+        baseline_rate = report["baseline"]["audio_seconds_per_second"]
+        if baseline_rate > 0:
+            report["speedup"] = round(report["candidate"]["audio_seconds_per_second"] / baseline_rate, 3)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+def _memory_main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Memoria por worker de VibeVoice (GET /workers)")
+    parser.add_argument("--url", default="http://localhost:3000", help="Router multi-worker")
+    parser.add_argument("--json", action="store_true", help="Imprimir el JSON completo")
+    args = parser.parse_args(argv)
+
+    url = args.url.rstrip("/").replace("ws://", "http://", 1).replace("wss://", "https://", 1)
+    _, body = _http_get(f"{url}/workers")
+    stats = json.loads(body)
+    if args.json:
+        print(json.dumps({"mode": stats.get("mode"), "memory": stats.get("memory"),
+                          "workers": [{"index": w["index"], "pid": w["pid"], "memory": w.get("memory")}
+                                      for w in stats["workers"]]}, indent=2))
+        return
+
+    print(f"Modo: {stats.get('mode', 'spawn')}")
+    print(f"{'Proceso':12s} {'PID':>8s} {'RSS MB':>9s} {'PSS MB':>9s} {'USS MB':>9s} {'Compart. MB':>12s}")
+    print("-" * 64)
+    rows = [("supervisor", None, stats["memory"]["supervisor"])]
+    rows += [(f"worker {w['index']}", w["pid"], w.get("memory")) for w in stats["workers"]]
+    for label, pid, usage in rows:
+        if not usage:
+            print(f"{label:12s} {pid or '-':>8} {'-':>9s}")
+            continue
+        print(f"{label:12s} {pid or '-':>8} {usage['rss_mb']:9.0f} {usage['pss_mb']:9.0f} "
+              f"{usage['uss_mb']:9.0f} {usage['shared_mb']:12.0f}")
+    total = stats["memory"]["total"]
+    if total:
+        print("-" * 64)
+        print(f"{'total':12s} {'':>8s} {total['rss_mb']:9.0f} {total['pss_mb']:9.0f} {total['uss_mb']:9.0f}")
+        print(f"Memoria real (suma de PSS): {total['pss_mb']:.0f} MB; "
+              f"ahorro por páginas compartidas (RSS - PSS): {total['shared_saving_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        _bench_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "memory":
+        _memory_main(sys.argv[2:])
+    else:
+        print(__doc__)
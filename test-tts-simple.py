@@ -3,14 +3,33 @@
 """
 Test simple de VibeVoice TTS Server
 Conecta al servidor y sintetiza una frase de prueba
+
+Con --tokens reproduce un stream de tokens grabado de un LLM por el protocolo
+incremental (/stream?incremental=1) y mide el tiempo del primer token al
+primer audio; con --compare lo compara con esperar la respuesta completa.
+
+Uso:
+    python test-tts-simple.py
+    python test-tts-simple.py --tokens respuesta.jsonl --compare
+    python test-tts-simple.py --tokens respuesta.txt --token-rate 40
 """
 
+import argparse
 import asyncio
-import websockets
-import json
 import sys
 import io
-from urllib.parse import urlencode
+from pathlib import Path
+
+# Cliente Python compartido (Plataforma/tts/vibevoice_client.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent / "Plataforma" / "tts"))
+
+from vibevoice_client import (  # noqa: E402
+    StreamingWavWriter,
+    build_stream_url,
+    load_token_stream,
+    stream_tts,
+    stream_tts_incremental,
+)
 
 # Configurar stdout para UTF-8 en Windows
 if sys.platform == "win32":
@@ -35,98 +54,62 @@ async def test_tts():
     print(f"Configuración: cfg={cfg_scale}, steps={steps}")
     print()
 
-    # Construir URL WebSocket con parámetros
-    params = {
-        'text': text,
-        'voice': voice,
-        'cfg': cfg_scale,
-        'steps': steps
-    }
-    ws_url = f"{server_url}/stream?{urlencode(params)}"
+    ws_url = build_stream_url(server_url, text, voice, cfg_scale, steps)
 
     print(f"Conectando a: {ws_url[:80]}...")
     print()
 
-    audio_chunks = []
+    # El audio se escribe a disco según llega (WAV + PCM crudo), sin
+    # acumular chunks en memoria
+    output_wav = "test_tts_output.wav"
+    output_file = "test_tts_output.pcm"
+    writer = StreamingWavWriter(output_wav, sample_rate=24000, pcm_path=output_file)
+
+    def on_chunk(chunk):
+        writer.write(chunk)
+        if writer.chunks % 10 == 0:
+            print(f"  Recibidos {writer.chunks} chunks de audio...")
+
+    def on_event(log):
+        if isinstance(log, dict) and 'event' in log:
+            print(f"  [Evento] {log['event']}")
 
+    print("Esperando audio...")
+    print()
     try:
-        async with websockets.connect(ws_url) as websocket:
-            print("✓ WebSocket conectado")
-            print("Esperando audio...")
-            print()
-
-            while True:
-                try:
-                    message = await asyncio.wait_for(websocket.recv(), timeout=60.0)
-
-                    # Verificar tipo de mensaje
-                    if isinstance(message, bytes):
-                        # Audio chunk
-                        audio_chunks.append(message)
-                        if len(audio_chunks) % 10 == 0:
-                            print(f"  Recibidos {len(audio_chunks)} chunks de audio...")
-                    else:
-                        # Log message (JSON)
-                        try:
-                            log = json.loads(message)
-                            if 'event' in log:
-                                print(f"  [Evento] {log['event']}")
-                        except:
-                            pass
-
-                except asyncio.TimeoutError:
-                    print("✗ Timeout esperando respuesta del servidor")
-                    break
-                except websockets.exceptions.ConnectionClosed:
-                    print("✓ Conexión cerrada por el servidor (síntesis completa)")
-                    break
-
-    except Exception as e:
-        print(f"✗ Error: {e}")
-        return False
+        metrics = await stream_tts(server_url, text, voice, cfg_scale, steps,
+                                   on_chunk=on_chunk, on_event=on_event, timeout=60.0)
+    finally:
+        writer.close()
+
+    if metrics.error and metrics.audio_bytes == 0:
+        print(f"✗ Error: {metrics.error}")
+    else:
+        print("✓ Conexión cerrada por el servidor (síntesis completa)")
 
     print()
     print("=" * 70)
     print("RESULTADOS:")
     print("=" * 70)
-    print(f"Chunks de audio recibidos: {len(audio_chunks)}")
+    print(f"Chunks de audio recibidos: {writer.chunks}")
 
-    if audio_chunks:
-        # Concatenar audio
-        total_size = sum(len(chunk) for chunk in audio_chunks)
+    if writer.chunks:
+        total_size = writer.data_bytes
         print(f"Tamaño total de audio: {total_size:,} bytes ({total_size/1024:.1f} KB)")
 
         # Calcular duración aproximada (PCM16, 24kHz, mono)
         # 24000 samples/sec * 2 bytes/sample = 48000 bytes/sec
         duration = total_size / 48000
         print(f"Duración estimada: {duration:.2f} segundos")
-
-        # Guardar audio
-        output_file = "test_tts_output.pcm"
-        with open(output_file, 'wb') as f:
-            for chunk in audio_chunks:
-                f.write(chunk)
+        if metrics.first_chunk_at is not None:
+            print(f"Primer chunk: {metrics.first_chunk_at * 1000:.0f} ms  RTF: {metrics.rtf:.2f}")
 
         print(f"✓ Audio guardado en: {output_file}")
-
-        # Convertir a WAV
-        try:
-            output_wav = "test_tts_output.wav"
-            wav_header = create_wav_header(total_size, sample_rate=24000)
-
-            with open(output_wav, 'wb') as f:
-                f.write(wav_header)
-                for chunk in audio_chunks:
-                    f.write(chunk)
-
-            print(f"✓ Audio WAV guardado en: {output_wav}")
-            print()
-            print("Puedes reproducir el audio con:")
-            print(f"  - Windows Media Player: {output_wav}")
-            print(f"  - PowerShell: (New-Object Media.SoundPlayer '{output_wav}').PlaySync()")
-
-        except Exception as e:
-            print(f"⚠ No se pudo crear WAV: {e}")
+        print(f"✓ Audio WAV guardado en: {output_wav}")
+        print()
+        print("Puedes reproducir el audio con:")
+        print(f"  - Windows Media Player: {output_wav}")
+        print(f"  - PowerShell: (New-Object Media.SoundPlayer '{output_wav}').PlaySync()")
 
         print()
         print("=" * 70)
@@ -140,34 +123,87 @@ async def test_tts():
         print("=" * 70)
         return False
 
-def create_wav_header(data_size, sample_rate=24000, num_channels=1, bits_per_sample=16):
-    """Crear header WAV para audio PCM16"""
-    byte_rate = sample_rate * num_channels * bits_per_sample // 8
-    block_align = num_channels * bits_per_sample // 8
+async def test_incremental(tokens_path, token_rate, compare):
+    print("=" * 70)
+    print("TEST DE VIBEVOICE TTS (TEXTO INCREMENTAL)")
+    print("=" * 70)
+    print()
 
-    header = bytearray()
+    server_url = "ws://localhost:3000"
+    voice = "sp-Spk1_man"
+    cfg_scale = 1.5
+    steps = 2
 
-    # RIFF header
-    header += b'RIFF'
-    header += (36 + data_size).to_bytes(4, 'little')
-    header += b'WAVE'
+    tokens = load_token_stream(tokens_path, rate=token_rate)
+    if not tokens:
+        print(f"✗ No hay tokens en {tokens_path}")
+        return False
+    text = "".join(delta for _, delta in tokens)
+    generation_s = tokens[-1][0]
+    print(f"Tokens: {len(tokens)} ({len(text)} caracteres, generados en {generation_s:.2f}s)")
+    print(f"Voz: {voice}")
+    print(f"Configuración: cfg={cfg_scale}, steps={steps}")
+    print()
+
+    output_wav = "test_tts_incremental.wav"
+    writer = StreamingWavWriter(output_wav, sample_rate=24000)
+
+    def on_event(log):
+        if isinstance(log, dict) and 'event' in log:
+            print(f"  [Evento] {log['event']}")
+
+    print("Enviando tokens y esperando audio...")
+    print()
+    try:
+        metrics = await stream_tts_incremental(server_url, tokens, voice, cfg_scale, steps,
+                                               on_chunk=writer.write, on_event=on_event, timeout=60.0)
+    finally:
+        writer.close()
+
+    print()
+    print("=" * 70)
+    print("RESULTADOS:")
+    print("=" * 70)
+    if not metrics.ok:
+        print(f"✗ Error: {metrics.error}")
+        print("✗ TEST FALLIDO")
+        return False
 
-    # fmt chunk
-    header += b'fmt '
-    header += (16).to_bytes(4, 'little')  # fmt chunk size
-    header += (1).to_bytes(2, 'little')   # PCM format
-    header += num_channels.to_bytes(2, 'little')
-    header += sample_rate.to_bytes(4, 'little')
-    header += byte_rate.to_bytes(4, 'little')
-    header += block_align.to_bytes(2, 'little')
-    header += bits_per_sample.to_bytes(2, 'little')
+    print(f"Audio: {metrics.audio_seconds:.2f}s en {metrics.chunks} chunks → {output_wav}")
+    print(f"Primer token → primer audio: {metrics.first_audio_after_text * 1000:.0f} ms")
+    if metrics.text_finished_at is not None:
+        print(f"Último token enviado: {(metrics.text_finished_at - metrics.text_started_at):.2f}s")
+    print(f"Sesión completa: {metrics.elapsed:.2f}s")
+
+    if compare:
+        # Referencia: esperar la respuesta completa del LLM y luego sintetizarla
+        full = await stream_tts(server_url, text, voice, cfg_scale, steps, timeout=60.0)
+        if full.ok:
+            waited = generation_s + full.first_chunk_at
+            print(f"Esperando la respuesta completa: {waited * 1000:.0f} ms hasta el primer audio "
+                  f"({generation_s:.2f}s de generación + {full.first_chunk_at * 1000:.0f} ms de síntesis)")
+            print(f"Ganancia: {(waited - metrics.first_audio_after_text) * 1000:.0f} ms")
+        else:
+            print(f"✗ Referencia sin texto incremental fallida: {full.error}")
 
-    # data chunk
-    header += b'data'
-    header += data_size.to_bytes(4, 'little')
+    print()
+    print("=" * 70)
+    print("✓ TEST EXITOSO")
+    print("=" * 70)
+    return True
 
-    return bytes(header)
 
 if __name__ == "__main__":
-    result = asyncio.run(test_tts())
+    parser = argparse.ArgumentParser(description="Test simple de VibeVoice TTS")
+    parser.add_argument("--tokens", help="Stream de tokens grabado (JSONL, SSE de LM Studio o texto plano)")
+    parser.add_argument("--token-rate", type=float, default=30.0,
+                        help="Tokens/s para streams sin tiempos (default: 30)")
+    parser.add_argument("--compare", action="store_true",
+                        help="Comparar con esperar el texto completo antes de sintetizar")
+    args = parser.parse_args()
+
+    if args.tokens:
+        result = asyncio.run(test_incremental(args.tokens, args.token_rate, args.compare))
+    else:
+        result = asyncio.run(test_tts())
     exit(0 if result else 1)